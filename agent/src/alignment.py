@@ -0,0 +1,65 @@
+from itertools import islice
+from typing import Iterable, Iterator, List, TypeVar
+
+import numpy as np
+
+T = TypeVar("T")
+
+# Slower streams are resampled onto the accelerometer rate by index ratio: row i of
+# an n-row target stream sits at position i * (m - 1) / (n - 1) of an m-row source.
+INTERPOLATE = "interpolate"
+FORWARD_FILL = "ffill"
+
+
+def ratio(source_length: int, target_length: int) -> float:
+    if target_length <= 1 or source_length <= 1:
+        return 0.0
+    return (source_length - 1) / (target_length - 1)
+
+
+def align_stream(rows: Iterable[List[float]], source_length: int, target_length: int,
+                 method: str = FORWARD_FILL) -> Iterator[List[float]]:
+    """
+    Resample a stream of source_length rows to target_length rows, lazily.
+    Only the two source rows around the current position are kept in memory.
+    Parameters:
+        rows (Iterable[List[float]]): The source rows, in order.
+        source_length (int): Number of source rows.
+        target_length (int): Number of rows to yield.
+        method (str): INTERPOLATE for linear interpolation, FORWARD_FILL to repeat the last row.
+    """
+    step = ratio(source_length, target_length)
+    rows = iter(rows)
+    previous = next(rows, None)
+    if previous is None:
+        return
+    following = next(rows, previous)
+    # Index of the source row held in previous
+    position = 0
+    for index in range(target_length):
+        source_position = index * step
+        while source_position >= position + 1 and position + 1 < source_length:
+            previous, following = following, next(rows, following)
+            position += 1
+        fraction = source_position - position
+        if method == INTERPOLATE and fraction > 0:
+            yield [a + (b - a) * fraction for a, b in zip(previous, following)]
+        else:
+            yield previous
+
+
+def resample(data: np.ndarray, start: int, end: int, target_length: int, method: str = FORWARD_FILL) -> np.ndarray:
+    """Vectorized align_stream for target rows start..end of an in-memory array."""
+    positions = np.arange(start, end) * ratio(len(data), target_length)
+    lower = np.floor(positions).astype(np.intp)
+    if method != INTERPOLATE:
+        return data[lower]
+    upper = np.minimum(lower + 1, len(data) - 1)
+    fraction = (positions - lower)[:, np.newaxis]
+    return data[lower] + (data[upper] - data[lower]) * fraction
+
+
+def chunked(items: Iterable[T], size: int) -> Iterator[List[T]]:
+    items = iter(items)
+    while chunk := list(islice(items, size)):
+        yield chunk
@@ -0,0 +1,84 @@
+import struct
+from datetime import datetime
+from typing import List
+
+import msgpack
+import numpy as np
+
+from columnar_datasource import ColumnarBatch
+from domain.accelerometer import Accelerometer
+from domain.aggregated_data import AggregatedData
+from domain.gps import Gps
+from domain.parking import Parking
+from schema.aggregated_data_schema import AggregatedDataSchema
+
+# Schemas are stateless, build them once instead of per datum
+aggregated_data_batch_schema = AggregatedDataSchema(many=True)
+
+# Binary batch layout: magic, record count, then fixed-size little-endian records of
+# accelerometer x, y, z, gps longitude, latitude, parking empty count, longitude, latitude, unix time
+STRUCT_MAGIC = b"RVB1"
+STRUCT_HEADER = struct.Struct("<4sI")
+STRUCT_RECORD = struct.Struct("<iiiddiddd")
+# The same record layout as a NumPy dtype, for packing columnar batches in one pass
+STRUCT_DTYPE = np.dtype([
+    ("x", "<i4"), ("y", "<i4"), ("z", "<i4"),
+    ("longitude", "<f8"), ("latitude", "<f8"),
+    ("empty_count", "<i4"), ("parking_longitude", "<f8"), ("parking_latitude", "<f8"),
+    ("time", "<f8"),
+])
+
+
+def encode_json(batch: List[AggregatedData]) -> str:
+    return aggregated_data_batch_schema.dumps(batch)
+
+
+def encode_msgpack(batch: List[AggregatedData]) -> bytes:
+    return msgpack.packb(aggregated_data_batch_schema.dump(batch))
+
+
+def encode_struct(batch: List[AggregatedData]) -> bytes:
+    if isinstance(batch, ColumnarBatch):
+        return STRUCT_HEADER.pack(STRUCT_MAGIC, len(batch)) + batch.to_records(STRUCT_DTYPE).tobytes()
+    buffer = bytearray(STRUCT_HEADER.size + STRUCT_RECORD.size * len(batch))
+    STRUCT_HEADER.pack_into(buffer, 0, STRUCT_MAGIC, len(batch))
+    offset = STRUCT_HEADER.size
+    for datum in batch:
+        STRUCT_RECORD.pack_into(
+            buffer, offset,
+            int(datum.accelerometer.x), int(datum.accelerometer.y), int(datum.accelerometer.z),
+            datum.gps.longitude, datum.gps.latitude,
+            int(datum.parking.empty_count), datum.parking.gps.longitude, datum.parking.gps.latitude,
+            datum.time.timestamp(),
+        )
+        offset += STRUCT_RECORD.size
+    return bytes(buffer)
+
+
+def decode_struct(payload: bytes) -> List[AggregatedData]:
+    """
+    Inverse of encode_struct, for consumers of the binary format.
+    Raises:
+        ValueError: If the payload is not a struct-encoded batch.
+    """
+    magic, count = STRUCT_HEADER.unpack_from(payload, 0)
+    if magic != STRUCT_MAGIC or len(payload) != STRUCT_HEADER.size + STRUCT_RECORD.size * count:
+        raise ValueError("Not a struct-encoded aggregated data batch")
+    batch = []
+    for x, y, z, longitude, latitude, empty_count, parking_longitude, parking_latitude, timestamp in \
+            STRUCT_RECORD.iter_unpack(payload[STRUCT_HEADER.size:]):
+        time = datetime.fromtimestamp(timestamp)
+        batch.append(AggregatedData(
+            Accelerometer(x, y, z, time),
+            Gps(longitude, latitude, time),
+            Parking(empty_count, Gps(parking_longitude, parking_latitude, time), time),
+            time,
+        ))
+    return batch
+
+
+ENCODERS = {
+    "json": encode_json,
+    "msgpack": encode_msgpack,
+    "struct": encode_struct,
+}
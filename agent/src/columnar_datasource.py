@@ -0,0 +1,141 @@
+import os
+from datetime import datetime
+from typing import Iterator, Optional
+
+import numpy as np
+
+from domain.parking import Parking
+from domain.gps import Gps
+from domain.accelerometer import Accelerometer
+from domain.aggregated_data import AggregatedData
+from alignment import FORWARD_FILL, INTERPOLATE, resample
+from row_clock import ROW_TICK, RowClock
+
+
+class ColumnarBatch:
+    """
+    One batch of sensor rows as views into the datasource arrays.
+    Domain objects are only created when the batch is iterated or indexed.
+    Row i is stamped time + i * ROW_TICK.
+    """
+
+    def __init__(self, accelerometer: np.ndarray, gps: np.ndarray, parking: np.ndarray, time: datetime):
+        # accelerometer: (n, 3) x, y, z; gps: (n, 2) longitude, latitude;
+        # parking: (n, 3) empty_count, longitude, latitude
+        self.accelerometer = accelerometer
+        self.gps = gps
+        self.parking = parking
+        self.time = time
+
+    def __len__(self) -> int:
+        return len(self.accelerometer)
+
+    def __bool__(self) -> bool:
+        return len(self) > 0
+
+    def __getitem__(self, index: int) -> AggregatedData:
+        x, y, z = self.accelerometer[index]
+        longitude, latitude = self.gps[index]
+        empty_count, parking_longitude, parking_latitude = self.parking[index]
+        time = self.time + ROW_TICK * index
+        return AggregatedData(
+            Accelerometer(int(x), int(y), int(z), time),
+            Gps(float(longitude), float(latitude), time),
+            Parking(int(empty_count), Gps(float(parking_longitude), float(parking_latitude), time), time),
+            time,
+        )
+
+    def __iter__(self) -> Iterator[AggregatedData]:
+        for index in range(len(self)):
+            yield self[index]
+
+    def to_records(self, dtype: np.dtype) -> np.ndarray:
+        """
+        Pack the batch into a structured array of the given record dtype, whose
+        fields are x, y, z, longitude, latitude, empty_count, parking_longitude,
+        parking_latitude and time, in that order.
+        """
+        records = np.empty(len(self), dtype=dtype)
+        names = dtype.names
+        for position, column in enumerate(self.accelerometer.T):
+            records[names[position]] = column
+        records[names[3]], records[names[4]] = self.gps.T
+        records[names[5]], records[names[6]], records[names[7]] = self.parking.T
+        records[names[8]] = self.time.timestamp() + np.arange(len(self)) * ROW_TICK.total_seconds()
+        return records
+
+
+class ColumnarFileDatasource:
+    """
+    FileDatasource counterpart that keeps each CSV as one NumPy array.
+    Parsed arrays are cached as .npy sidecars next to the CSV files and
+    memory-mapped on later starts, so replaying large recordings neither
+    re-parses them nor loads them into Python objects. GPS and parking rows are
+    resampled onto the accelerometer rows the same way FileDatasource does.
+    """
+
+    def __init__(self, accelerometer_filename: str, gps_filename: str, parking_filename: str,
+                 use_cache: bool = True, batch_size: int = 10, gps_alignment: str = INTERPOLATE) -> None:
+        self.accelerometer_filename = accelerometer_filename
+        self.gps_filename = gps_filename
+        self.parking_filename = parking_filename
+        self.use_cache = use_cache
+        self.batch_size = batch_size
+        self.gps_alignment = gps_alignment
+        self.clock = RowClock()
+        self.accelerometer_data: Optional[np.ndarray] = None
+        self.gps_data: Optional[np.ndarray] = None
+        self.parking_data: Optional[np.ndarray] = None
+        self.last_read_index = 0
+
+    def read(self) -> Optional[ColumnarBatch]:
+        if self.accelerometer_data is None:
+            print("No data available to read.")
+            return None
+
+        length = len(self)
+        start_index = self.last_read_index
+        end_index = min(start_index + self.batch_size, length)
+        self.last_read_index = 0 if end_index >= length else end_index
+        return self.slice(start_index, end_index, self.clock.span(end_index - start_index))
+
+    def __len__(self) -> int:
+        return len(self.accelerometer_data)
+
+    def slice(self, start: int, end: int, time: datetime) -> ColumnarBatch:
+        """Accelerometer rows start..end with the GPS and parking rows aligned to them, the first one stamped time."""
+        length = len(self)
+        return ColumnarBatch(
+            self.accelerometer_data[start:end],
+            resample(self.gps_data, start, end, length, self.gps_alignment),
+            resample(self.parking_data, start, end, length, FORWARD_FILL),
+            time,
+        )
+
+    def start_reading(self):
+        self.accelerometer_data = self.load(self.accelerometer_filename)
+        self.gps_data = self.load(self.gps_filename)
+        self.parking_data = self.load(self.parking_filename)
+
+    def stop_reading(self):
+        self.accelerometer_data = None
+        self.gps_data = None
+        self.parking_data = None
+        self.last_read_index = 0
+
+    def load(self, filename: str) -> np.ndarray:
+        sidecar = filename + ".npy"
+        if self.use_cache and os.path.exists(sidecar) and os.path.getmtime(sidecar) >= os.path.getmtime(filename):
+            return np.load(sidecar, mmap_mode="r")
+        print(f"Parsing CSV file: {filename}")
+        data = np.loadtxt(filename, delimiter=",", skiprows=1, ndmin=2, dtype=np.float64)
+        if self.use_cache:
+            try:
+                # Write then rename, so a crash never leaves a truncated sidecar behind
+                temporary = sidecar + ".tmp"
+                with open(temporary, "wb") as file:
+                    np.save(file, data)
+                os.replace(temporary, sidecar)
+            except OSError as e:
+                print(f"Could not cache {filename}: {e}")
+        return data
@@ -15,5 +15,42 @@ MQTT_BROKER_PORT = try_parse(int, os.environ.get('MQTT_BROKER_PORT')) or 1883
 MQTT_ACCELEROMETER_TOPIC = os.environ.get('MQTT_ACCELEROMETER_TOPIC') or 'accelerometer'
 MQTT_GPS_TOPIC = os.environ.get('MQTT_GPS_TOPIC') or 'gps'
 MQTT_PARKING_TOPIC = os.environ.get('MQTT_PARKING_TOPIC') or 'parking'
-# Delay for sending data to mqtt in seconds
+# Datasource: "file" parses the CSVs into Python lists, "columnar" keeps them as NumPy arrays
+DATASOURCE = os.environ.get('DATASOURCE') or 'file'
+# Cache parsed CSVs of the columnar datasource as memory-mapped .npy sidecars
+DATASOURCE_CACHE = (os.environ.get('DATASOURCE_CACHE') or 'true').lower() in ('1', 'true', 'yes')
+# Accelerometer rows per datasource read
+BATCH_SIZE = try_parse(int, os.environ.get('BATCH_SIZE')) or 10
+# How GPS rows are resampled onto the accelerometer rate: "interpolate" or "ffill",
+# parking rows are always forward-filled
+GPS_ALIGNMENT = os.environ.get('GPS_ALIGNMENT') or 'interpolate'
+# Delay for sending data to mqtt in seconds, with flow control only the starting pace
 DELAY = try_parse(float, os.environ.get('DELAY')) or 1
+# Publish mode: "sample" sends accelerometer, gps and parking messages per datum,
+# "batch" sends one message per datasource read to MQTT_BATCH_TOPIC
+PUBLISH_MODE = os.environ.get('PUBLISH_MODE') or 'sample'
+MQTT_BATCH_TOPIC = os.environ.get('MQTT_BATCH_TOPIC') or 'aggregated_data'
+# Encoding of batch messages: "json", "msgpack" or "struct"
+PAYLOAD_FORMAT = os.environ.get('PAYLOAD_FORMAT') or 'json'
+# Flow control: QoS 1 publishing through a bounded queue, with reads paced to the broker's ack latency
+# instead of a fixed DELAY. Off by default, the agent then publishes with paho's defaults every DELAY seconds
+FLOW_CONTROL = (os.environ.get('FLOW_CONTROL') or 'false').lower() in ('1', 'true', 'yes')
+# Unacknowledged messages handed to the MQTT client at a time
+MAX_INFLIGHT = try_parse(int, os.environ.get('MAX_INFLIGHT')) or 20
+# Messages waiting for the in-flight window, e.g. during a broker outage
+QUEUE_SIZE = try_parse(int, os.environ.get('QUEUE_SIZE')) or 10000
+# What a full queue does with a new message: "drop_oldest" discards the oldest one, "drop_newest" the new one
+QUEUE_DROP_POLICY = os.environ.get('QUEUE_DROP_POLICY') or 'drop_oldest'
+# Smoothed ack latency in seconds above which the read rate is halved
+TARGET_ACK_LATENCY = try_parse(float, os.environ.get('TARGET_ACK_LATENCY')) or 0.5
+# Rows per second the read rate grows by every second the broker keeps up
+RATE_STEP = try_parse(float, os.environ.get('RATE_STEP')) or 100
+# Largest read in rows and longest pause between reads when paced
+MAX_BATCH_SIZE = try_parse(int, os.environ.get('MAX_BATCH_SIZE')) or 1000
+MAX_DELAY = try_parse(float, os.environ.get('MAX_DELAY')) or 5
+# Seconds between printed publish counters
+LOG_INTERVAL = try_parse(float, os.environ.get('LOG_INTERVAL')) or 10
+# Port of the Prometheus /metrics endpoint, 0 disables it
+METRICS_PORT = try_parse(int, os.environ.get('METRICS_PORT'))
+if METRICS_PORT is None:
+    METRICS_PORT = 8000
@@ -1,86 +1,95 @@
-import random
 from csv import reader
-from datetime import datetime
+from itertools import islice
+from typing import Iterator, List, Optional
 
 from domain.parking import Parking
 from domain.gps import Gps
 from domain.accelerometer import Accelerometer
 from domain.aggregated_data import AggregatedData
+from alignment import FORWARD_FILL, INTERPOLATE, align_stream
+from row_clock import RowClock
 
 
 class FileDatasource:
-    def __init__(self, accelerometer_filename: str, gps_filename: str, parking_filename: str) -> None:
+    """
+    Replays the recorded CSVs at the accelerometer rate.
+    The files are streamed, never loaded whole: GPS and parking rows are
+    resampled onto the accelerometer rows by index ratio (GPS per gps_alignment,
+    parking forward-filled) and read() returns the next batch_size rows,
+    starting over once the accelerometer file is exhausted. Every row is
+    stamped with its own, strictly increasing time.
+    """
+
+    def __init__(self, accelerometer_filename: str, gps_filename: str, parking_filename: str,
+                 batch_size: int = 10, gps_alignment: str = INTERPOLATE) -> None:
         self.accelerometer_filename = accelerometer_filename
         self.gps_filename = gps_filename
         self.parking_filename = parking_filename
-        self.accelerometer_data = []
-        self.gps_data = []
-        self.parking_data = []
-        self.last_read_index = 0
+        self.batch_size = batch_size
+        self.gps_alignment = gps_alignment
+        self.clock = RowClock()
+        self.row_counts = None
+        self.batches: Optional[Iterator[List[AggregatedData]]] = None
 
-    def read(self) -> AggregatedData:
-        if not self.accelerometer_data or not self.gps_data or not self.parking_data:
+    def read(self) -> Optional[List[AggregatedData]]:
+        if self.batches is None:
             print("No data available to read.")
             return None
 
-        batch_size = random.randint(5, 25)
-
-        start_index = self.last_read_index
-        end_index = min(start_index + batch_size, len(self.accelerometer_data))
-        if end_index >= len(self.accelerometer_data):
-            print("Reached end of data, resetting read index.")
-            self.last_read_index = 0  # Reset to start over
-
-        print(f"Reading data from index {start_index} to {end_index}...")
-
-        aggregated_data = []
-        while start_index < len(self.accelerometer_data):
-            accelerometer_rows = self.accelerometer_data[start_index:end_index]
-            gps_rows = self.gps_data[start_index:end_index]
-            parking_rows = self.parking_data[start_index:end_index]
-
-            for accel_row, gps_row, parking_row in zip(accelerometer_rows, gps_rows, parking_rows):
-                accelerometer = Accelerometer(*accel_row, datetime.now())
-                gps = Gps(*gps_row, datetime.now())
-                parking = Parking(parking_row[0], Gps(parking_row[1], parking_row[2], datetime.now()), datetime.now())
-                aggregated_data.append(AggregatedData(accelerometer, gps, parking, datetime.now()))
-
-            start_index = end_index
-            end_index = min(start_index + batch_size, len(self.accelerometer_data))
-
-            if end_index >= len(self.accelerometer_data):
-                print("Reached end of data, resetting read index.")
-                self.last_read_index = 0  # Reset to start over
-            else:
-                self.last_read_index = end_index
-
-        print()
-        print("Data reading completed.")
-        return aggregated_data
+        batch = next(self.batches, None)
+        if batch is None:
+            print("Reached end of data, starting over.")
+            self.batches = self.aligned_batches()
+            batch = next(self.batches, None)
+        return batch
 
     def start_reading(self):
         print("Starting to read files...")
-        self.accelerometer_data = self.read_csv(self.accelerometer_filename)
-        self.gps_data = self.read_csv(self.gps_filename)
-        self.parking_data = self.read_csv(self.parking_filename)
+        self.row_counts = [self.count_rows(filename) for filename in
+                           (self.accelerometer_filename, self.gps_filename, self.parking_filename)]
+        self.batches = self.aligned_batches()
         print("Reading started")
 
     def stop_reading(self):
         print("Stopping reading...")
+        if self.batches is not None:
+            # Closing the generator closes the open CSV files
+            self.batches.close()
+        self.batches = None
         print("Reading stopped")
-        self.accelerometer_data = []
-        self.gps_data = []
-        self.parking_data = []
-        self.last_read_index = 0
 
-    def read_csv(self, filename: str):
-        print(f"Reading CSV file: {filename}")
-        data = []
+    def aligned_batches(self) -> Iterator[List[AggregatedData]]:
+        accelerometer_count, gps_count, parking_count = self.row_counts
+        if not accelerometer_count or not gps_count or not parking_count:
+            return
+        rows = zip(
+            self.read_csv(self.accelerometer_filename),
+            align_stream(self.read_csv(self.gps_filename), gps_count, accelerometer_count, self.gps_alignment),
+            align_stream(self.read_csv(self.parking_filename), parking_count, accelerometer_count, FORWARD_FILL),
+        )
+        # batch_size is read for every chunk, so it can change while reading
+        while chunk := list(islice(rows, self.batch_size)):
+            yield [self.aggregate(accel_row, gps_row, parking_row) for accel_row, gps_row, parking_row in chunk]
+
+    def aggregate(self, accel_row: List[float], gps_row: List[float], parking_row: List[float]) -> AggregatedData:
+        time = self.clock.next()
+        return AggregatedData(
+            Accelerometer(*accel_row, time),
+            Gps(*gps_row, time),
+            Parking(parking_row[0], Gps(parking_row[1], parking_row[2], time), time),
+            time,
+        )
+
+    def read_csv(self, filename: str) -> Iterator[List[float]]:
         with open(filename, 'r') as file:
             csv_reader = reader(file)
             next(csv_reader)
             for row in csv_reader:
-                data.append([float(cell) for cell in row])
-        print(data)
-        print(f"Finished reading CSV file: {filename}")
-        return data
+                if row:
+                    yield [float(cell) for cell in row]
+
+    def count_rows(self, filename: str) -> int:
+        print(f"Reading CSV file: {filename}")
+        with open(filename, 'r') as file:
+            # Skip the header
+            return max(sum(1 for line in file if line.strip()) - 1, 0)
@@ -0,0 +1,191 @@
+import math
+import threading
+import time
+from collections import deque
+
+from paho.mqtt import client as mqtt_client
+
+from instrumentation import ACK_SECONDS, FLOW_DROPPED
+
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+DROP_POLICIES = (DROP_OLDEST, DROP_NEWEST)
+
+# Weight of the newest sample in the smoothed ack latency, as for TCP's round trip time
+LATENCY_SMOOTHING = 0.125
+
+
+class FlowControlledPublisher:
+    """
+    Publishes with QoS 1 through a bounded local queue, handing the MQTT client
+    at most max_inflight unacknowledged messages at a time. A slow or unreachable
+    broker backs messages up here instead of in paho's unbounded queue; once the
+    queue is full, drop_policy discards either its oldest message or the new one.
+    Messages paho accepted while disconnected stay in flight and are resent after
+    it reconnects. Ack latency is measured per message id and smoothed.
+    Has paho's publish(topic, payload) -> (rc, mid) signature, mid is always None.
+    """
+
+    def __init__(self, client, max_inflight, queue_size, drop_policy, qos=1):
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError(f"Unknown drop policy: {drop_policy}")
+        self.client = client
+        self.max_inflight = max_inflight
+        self.queue_size = queue_size
+        self.drop_policy = drop_policy
+        self.qos = qos
+        self.queue = deque()
+        self.in_flight = 0
+        self.latency = None
+        self.acknowledged = 0
+        self.dropped = 0
+        self.failed = 0
+        self._condition = threading.Condition()
+        # Send times by message id, and acks that arrived before publish() returned their id
+        self._sent_at = {}
+        self._early = {}
+        self._stopped = False
+        self._thread = None
+        client.max_inflight_messages_set(max_inflight)
+        client.on_publish = self._on_publish
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='flow-control', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10.0):
+        """Wait up to timeout seconds for queued and in-flight messages to be acknowledged"""
+        with self._condition:
+            self._condition.wait_for(lambda: not self.queue and not self.in_flight, timeout=timeout)
+            self._stopped = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+
+    def publish(self, topic, payload):
+        with self._condition:
+            if len(self.queue) >= self.queue_size:
+                self.dropped += 1
+                FLOW_DROPPED.labels(self.drop_policy).inc()
+                if self.drop_policy == DROP_NEWEST:
+                    return mqtt_client.MQTT_ERR_QUEUE_SIZE, None
+                self.queue.popleft()
+            self.queue.append((topic, payload))
+            self._condition.notify_all()
+        return mqtt_client.MQTT_ERR_SUCCESS, None
+
+    def backlog(self):
+        """Fraction of the queue in use"""
+        return len(self.queue) / self.queue_size
+
+    def oldest_in_flight(self):
+        """Seconds the oldest unacknowledged message has been waiting, 0 if none"""
+        with self._condition:
+            # Dicts keep insertion order, the first send time is the oldest
+            sent = next(iter(self._sent_at.values()), None)
+        return time.monotonic() - sent if sent is not None else 0.0
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._stopped or (self.queue and self.in_flight < self.max_inflight))
+                if self._stopped:
+                    return
+                topic, payload = self.queue.popleft()
+                self.in_flight += 1
+            sent = time.monotonic()
+            # Never hold the condition's lock here, paho calls on_publish while holding its own locks
+            info = self.client.publish(topic, payload, qos=self.qos)
+            if info.rc not in (mqtt_client.MQTT_ERR_SUCCESS, mqtt_client.MQTT_ERR_NO_CONN):
+                # Refused outright, e.g. too large, retrying would not help
+                print(f"Dropping message to {topic}: {mqtt_client.error_string(info.rc)}")
+                with self._condition:
+                    self.failed += 1
+                    self.in_flight -= 1
+                    self._condition.notify_all()
+                continue
+            with self._condition:
+                acknowledged = self._early.pop(info.mid, None)
+                if acknowledged is None:
+                    self._sent_at[info.mid] = sent
+                else:
+                    self._acknowledged(acknowledged - sent)
+
+    def _on_publish(self, client, userdata, mid):
+        now = time.monotonic()
+        with self._condition:
+            sent = self._sent_at.pop(mid, None)
+            if sent is None:
+                self._early[mid] = now
+            else:
+                self._acknowledged(now - sent)
+
+    def _acknowledged(self, latency):
+        # Called with the condition's lock held
+        ACK_SECONDS.observe(latency)
+        self.acknowledged += 1
+        self.in_flight -= 1
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += LATENCY_SMOOTHING * (latency - self.latency)
+        self._condition.notify_all()
+
+
+class AdaptivePacer:
+    """
+    Paces datasource reads to what the broker sustains, without a fixed delay.
+    The read rate in rows per second grows by rate_step every second, AIMD-style,
+    while acks come back within target_latency, none has been waiting longer, the
+    publisher's queue is at most half full and nothing was dropped; otherwise it halves, at most once per ack
+    round trip, since a decrease only shows after that long. Rows are read about
+    once per round trip: long round trips get fewer, bigger batches, short ones
+    smaller batches more often. The rate does not grow while reading and
+    publishing alone take up the whole interval.
+    """
+
+    def __init__(self, publisher, batch_size, interval, rate_step, target_latency, max_batch_size, max_interval,
+                 min_rate=1.0):
+        self.publisher = publisher
+        self.rate_step = rate_step
+        self.target_latency = target_latency
+        self.max_batch_size = max_batch_size
+        self.max_interval = max_interval
+        self.min_rate = min_rate
+        self.rate = max(batch_size / interval if interval > 0 else rate_step, min_rate)
+        self.batch_size = batch_size
+        self.interval = interval
+        self._due = time.monotonic()
+        self._adjusted_at = self._due
+        self._decreased_at = float('-inf')
+        self._dropped = publisher.dropped
+
+    def wait(self):
+        """Sleep until the next read is due, then return the number of rows to read"""
+        now = time.monotonic()
+        # Reading and publishing took the whole interval, a higher rate would not be reached
+        lagging = now >= self._due
+        if not lagging:
+            time.sleep(self._due - now)
+        self._adjust(lagging)
+        self._due = max(self._due, time.monotonic() - self.interval) + self.interval
+        return self.batch_size
+
+    def _adjust(self, lagging):
+        now = time.monotonic()
+        elapsed, self._adjusted_at = now - self._adjusted_at, now
+        latency = self.publisher.latency
+        dropped, self._dropped = self.publisher.dropped - self._dropped, self.publisher.dropped
+        # A broker that stopped acking shows in the oldest message in flight before it shows in the latency
+        stalled = self.publisher.oldest_in_flight() > self.target_latency
+        congested = (latency is not None and latency > self.target_latency) or stalled \
+            or self.publisher.backlog() > 0.5 or dropped > 0
+        if congested:
+            if now - self._decreased_at >= max(latency or 0, self.interval):
+                self.rate = max(self.rate / 2, self.min_rate)
+                self._decreased_at = now
+        elif not lagging:
+            self.rate += self.rate_step * elapsed
+        period = min(latency if latency is not None else self.interval, self.max_interval)
+        self.batch_size = min(max(math.ceil(self.rate * period), 1), self.max_batch_size)
+        self.interval = min(self.batch_size / self.rate, self.max_interval)
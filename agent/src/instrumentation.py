@@ -0,0 +1,23 @@
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+# Encoding one datum takes microseconds, whole columnar batches up to milliseconds
+ENCODE_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05)
+
+PUBLISHED_MESSAGES = Counter("agent_published_messages", "MQTT messages handed to the client", ["topic", "status"])
+PUBLISHED_BYTES = Counter("agent_published_bytes", "Payload bytes handed to the MQTT client", ["topic"])
+ENCODE_SECONDS = Histogram("agent_encode_seconds", "Time spent encoding one message", ["mode"], buckets=ENCODE_BUCKETS)
+READ_BATCH_SIZE = Histogram(
+    "agent_read_batch_size", "Data per datasource read", buckets=(1, 5, 10, 20, 50, 100, 200, 500, 1000)
+)
+# Flow control, gauges are set to read the publisher and the pacer in main.py
+ACK_SECONDS = Histogram("agent_ack_seconds", "Time from publishing a QoS 1 message to the broker's acknowledgement")
+FLOW_DROPPED = Counter("agent_flow_dropped_messages", "Messages dropped from the full publish queue", ["policy"])
+QUEUED_MESSAGES = Gauge("agent_queued_messages", "Messages waiting for the in-flight window")
+INFLIGHT_MESSAGES = Gauge("agent_inflight_messages", "Messages published but not acknowledged yet")
+READ_RATE = Gauge("agent_read_rate", "Rows per second the pacer currently reads")
+
+
+def serve_metrics(port):
+    """Expose the metrics at http://0.0.0.0:<port>/metrics from a background thread, 0 disables it"""
+    if port:
+        start_http_server(port)
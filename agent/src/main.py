@@ -5,18 +5,51 @@ from schema.parking_schema import ParkingSchema
 from schema.gps_schema import GpsSchema
 from schema.accelerometer_schema import AccelerometerSchema
 from file_datasource import FileDatasource
+from columnar_datasource import ColumnarFileDatasource
+from codec import ENCODERS
+from flow_control import AdaptivePacer, FlowControlledPublisher
+from instrumentation import PUBLISHED_MESSAGES, PUBLISHED_BYTES, ENCODE_SECONDS, READ_BATCH_SIZE, QUEUED_MESSAGES, \
+    INFLIGHT_MESSAGES, READ_RATE, serve_metrics
 import config
 
+# Schemas are stateless, build them once instead of per datum
+accelerometer_schema = AccelerometerSchema()
+gps_schema = GpsSchema()
+parking_schema = ParkingSchema()
+
+
+class PublishStats:
+    """Counts publish results and prints a summary at most once per interval."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.sent = 0
+        self.failed = 0
+        self.last_report = time.monotonic()
+
+    def record(self, ok):
+        if ok:
+            self.sent += 1
+        else:
+            self.failed += 1
+        now = time.monotonic()
+        if now - self.last_report >= self.interval:
+            print(f"Published {self.sent} messages, {self.failed} failed")
+            self.last_report = now
+
+
+stats = PublishStats(config.LOG_INTERVAL)
+
 
 def connect_mqtt(broker, port):
     """Create MQTT client"""
     print(f"CONNECT TO {broker}:{port}")
 
-    def on_connect(rc):
+    def on_connect(client, userdata, flags, rc):
         if rc == 0:
             print(f"Connected to MQTT Broker ({broker}:{port})!")
         else:
-            print("Failed to connect {broker}:{port}, return code %d\n", rc)
+            print(f"Failed to connect {broker}:{port}, return code {rc}")
             exit(rc)  # Stop execution
 
     client = mqtt_client.Client()
@@ -26,50 +59,117 @@ def connect_mqtt(broker, port):
     return client
 
 
-def publish(client, accel_topic, gps_topic, parking_topic, datasource, delay):
+def publish(client, accel_topic, gps_topic, parking_topic, datasource, delay, pacer=None):
     datasource.start_reading()
     while True:
-        time.sleep(delay)
+        wait(datasource, delay, pacer)
         data = datasource.read()
+        if not data:
+            continue
+        READ_BATCH_SIZE.observe(len(data))
         for datum in data:
-            accel_msg = AccelerometerSchema().dumps(datum.accelerometer)
+            with ENCODE_SECONDS.labels('sample').time():
+                accel_msg = accelerometer_schema.dumps(datum.accelerometer)
             mqtt_publish(client, accel_topic, accel_msg)
 
-            gps_msg = GpsSchema().dumps(datum.gps)
+            with ENCODE_SECONDS.labels('sample').time():
+                gps_msg = gps_schema.dumps(datum.gps)
             mqtt_publish(client, gps_topic, gps_msg)
 
-            parking_msg = ParkingSchema().dumps(datum.parking)
+            with ENCODE_SECONDS.labels('sample').time():
+                parking_msg = parking_schema.dumps(datum.parking)
             mqtt_publish(client, parking_topic, parking_msg)
 
 
+def publish_batches(client, topic, datasource, delay, payload_format, pacer=None):
+    """Publish every datasource read as a single message in the configured format"""
+    encode = ENCODERS[payload_format]
+    datasource.start_reading()
+    while True:
+        wait(datasource, delay, pacer)
+        data = datasource.read()
+        if data:
+            READ_BATCH_SIZE.observe(len(data))
+            with ENCODE_SECONDS.labels(payload_format).time():
+                payload = encode(data)
+            mqtt_publish(client, topic, payload)
+
+
+def wait(datasource, delay, pacer):
+    """Sleep before the next read, a fixed delay or as long as the pacer says, which also sets the read size"""
+    if pacer is None:
+        time.sleep(delay)
+    else:
+        datasource.batch_size = pacer.wait()
+
+
 def mqtt_publish(client, topic, msg):
     result = client.publish(topic, msg)
     # result: [0, 1]
     status = result[0]
-    if status == 0:
-        print(f"Send `{msg}` to topic `{topic}`")
-    else:
-        print(f"Failed to send message to topic {topic}")
+    stats.record(status == 0)
+    PUBLISHED_MESSAGES.labels(topic, 'ok' if status == 0 else 'failed').inc()
+    PUBLISHED_BYTES.labels(topic).inc(len(msg))
 
 
 def run():
+    # Expose publish metrics
+    serve_metrics(config.METRICS_PORT)
     # Prepare mqtt client
     client = connect_mqtt(config.MQTT_BROKER_HOST, config.MQTT_BROKER_PORT)
+    pacer = None
+    if config.FLOW_CONTROL:
+        # Publish through the flow-controlled queue and let the broker's acks set the pace
+        client = FlowControlledPublisher(
+            client,
+            max_inflight=config.MAX_INFLIGHT,
+            queue_size=config.QUEUE_SIZE,
+            drop_policy=config.QUEUE_DROP_POLICY
+        )
+        client.start()
+        pacer = AdaptivePacer(
+            client,
+            batch_size=config.BATCH_SIZE,
+            interval=config.DELAY,
+            rate_step=config.RATE_STEP,
+            target_latency=config.TARGET_ACK_LATENCY,
+            max_batch_size=config.MAX_BATCH_SIZE,
+            max_interval=config.MAX_DELAY
+        )
+        QUEUED_MESSAGES.set_function(lambda: len(client.queue))
+        INFLIGHT_MESSAGES.set_function(lambda: client.in_flight)
+        READ_RATE.set_function(lambda: pacer.rate)
     # Prepare datasource
-    datasource = FileDatasource(
-        "data/accelerometer.csv",
-        "data/gps.csv",
-        "data/parking.csv"
-    )
+    if config.DATASOURCE == 'columnar':
+        datasource = ColumnarFileDatasource(
+            "data/accelerometer.csv",
+            "data/gps.csv",
+            "data/parking.csv",
+            use_cache=config.DATASOURCE_CACHE,
+            batch_size=config.BATCH_SIZE,
+            gps_alignment=config.GPS_ALIGNMENT
+        )
+    else:
+        datasource = FileDatasource(
+            "data/accelerometer.csv",
+            "data/gps.csv",
+            "data/parking.csv",
+            batch_size=config.BATCH_SIZE,
+            gps_alignment=config.GPS_ALIGNMENT
+        )
     # Infinity publish data
-    publish(
-        client,
-        config.MQTT_ACCELEROMETER_TOPIC,
-        config.MQTT_GPS_TOPIC,
-        config.MQTT_PARKING_TOPIC,
-        datasource,
-        config.DELAY
-    )
+    if config.PUBLISH_MODE == 'batch':
+        publish_batches(client, config.MQTT_BATCH_TOPIC, datasource, config.DELAY, config.PAYLOAD_FORMAT, pacer)
+    else:
+        publish(
+            client,
+            config.MQTT_ACCELEROMETER_TOPIC,
+            config.MQTT_GPS_TOPIC,
+            config.MQTT_PARKING_TOPIC,
+            datasource,
+            config.DELAY,
+            pacer
+        )
 
 
 if __name__ == '__main__':
@@ -0,0 +1,28 @@
+from datetime import datetime, timedelta
+from typing import Callable
+
+# Smallest step between two row timestamps, the resolution of datetime
+ROW_TICK = timedelta(microseconds=1)
+
+
+class RowClock:
+    """
+    Stamps replayed rows with the time they are read, strictly increasing:
+    a row read before the clock moved on gets one tick after the previous
+    one, so no two rows of a vehicle share a timestamp.
+    """
+
+    def __init__(self, now: Callable[[], datetime] = datetime.now) -> None:
+        self.now = now
+        self.last = None
+
+    def next(self) -> datetime:
+        return self.span(1)
+
+    def span(self, count: int) -> datetime:
+        """Reserve count consecutive timestamps, ROW_TICK apart, and return the first one."""
+        time = self.now()
+        if self.last is not None and time <= self.last:
+            time = self.last + ROW_TICK
+        self.last = time + ROW_TICK * max(count - 1, 0)
+        return time
@@ -0,0 +1,273 @@
+"""
+Fleet simulator: replays the bundled recordings as N virtual vehicles for load testing.
+
+Vehicles are spread over worker processes, each with its own MQTT connection.
+Every vehicle starts at its own position in the recording, runs on its own
+clock offset, shifts its GPS track and jitters its send interval, and publishes encoded batches to
+MQTT_BATCH_TOPIC like the agents in batch mode do. The hub does not subscribe to that topic, so this loads
+the broker and whatever consumes agent batches, not the hub and the store behind it.
+
+    python simulator.py --vehicles 200 --processes 4 --rate 2000 --duration 60
+"""
+import argparse
+import heapq
+import json
+import multiprocessing
+import queue
+import random
+import threading
+import time
+import traceback
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+import numpy as np
+from paho.mqtt import client as mqtt_client
+
+from codec import ENCODERS
+from columnar_datasource import ColumnarFileDatasource
+import config
+
+
+@dataclass
+class Vehicle:
+    vehicle_id: int
+    position: int
+    time_offset: timedelta
+    gps_shift: np.ndarray
+    interval: float
+    jitter: float
+
+
+class LatencyTracker:
+    """
+    Matches publish calls with their broker acknowledgements by message id.
+    The acknowledgement may arrive before publish() returns the message id,
+    so whichever side comes second records the latency.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.early = {}
+        self.latencies = []
+        self.acknowledged = 0
+
+    def sent(self, mid, started):
+        with self.lock:
+            acknowledged = self.early.pop(mid, None)
+            if acknowledged is None:
+                self.pending[mid] = started
+            else:
+                self.latencies.append(acknowledged - started)
+
+    def on_publish(self, client, userdata, mid):
+        now = time.perf_counter()
+        with self.lock:
+            self.acknowledged += 1
+            started = self.pending.pop(mid, None)
+            if started is None:
+                self.early[mid] = now
+            else:
+                self.latencies.append(now - started)
+
+
+def make_vehicles(first_id, count, length, interval, args, seed):
+    rng = random.Random(seed)
+    spread = args.gps_spread
+    return [Vehicle(
+        vehicle_id=first_id + number,
+        position=rng.randrange(length),
+        time_offset=timedelta(seconds=rng.uniform(-args.time_offset, args.time_offset)),
+        gps_shift=np.array([rng.uniform(-spread, spread), rng.uniform(-spread, spread)]),
+        interval=interval,
+        jitter=args.jitter,
+    ) for number in range(count)]
+
+
+def next_batch(datasource, vehicle, batch_size, length):
+    start = vehicle.position
+    end = min(start + batch_size, length)
+    vehicle.position = 0 if end >= length else end
+    batch = datasource.slice(start, end, datetime.now() + vehicle.time_offset)
+    # The aligned columns are fresh arrays, shifting them leaves the datasource untouched
+    batch.gps += vehicle.gps_shift
+    batch.parking[:, 1:] += vehicle.gps_shift
+    return batch
+
+
+def run_worker(worker_id, first_id, count, args, results):
+    try:
+        report = simulate(worker_id, first_id, count, args)
+    except BaseException:
+        results.put({"worker": worker_id, "error": traceback.format_exc()})
+        raise
+    results.put(report)
+
+
+def simulate(worker_id, first_id, count, args):
+    datasource = ColumnarFileDatasource("data/accelerometer.csv", "data/gps.csv", "data/parking.csv",
+                                        use_cache=config.DATASOURCE_CACHE)
+    datasource.start_reading()
+    length = len(datasource)
+    encode = ENCODERS[args.format]
+
+    tracker = LatencyTracker()
+    disconnects = []
+    client = mqtt_client.Client(client_id=f"simulator-{worker_id}-{random.getrandbits(32):08x}")
+    client.on_publish = tracker.on_publish
+
+    def on_disconnect(client, userdata, rc):
+        if rc != 0:
+            disconnects.append(rc)
+
+    client.on_disconnect = on_disconnect
+    client.max_queued_messages_set(args.max_queued)
+    client.connect(args.host, args.port)
+    client.loop_start()
+
+    # Split the target rate evenly, each vehicle publishes once per interval
+    worker_rate = args.rate / args.processes
+    interval = count / worker_rate if worker_rate > 0 else args.delay
+    vehicles = make_vehicles(first_id, count, length, interval, args, args.seed + worker_id)
+    started = time.monotonic()
+    schedule = [(started + random.uniform(0, interval), vehicle.vehicle_id, vehicle) for vehicle in vehicles]
+    heapq.heapify(schedule)
+
+    published = errors = 0
+    deadline = started + args.duration
+    while schedule:
+        due, vehicle_id, vehicle = heapq.heappop(schedule)
+        if due >= deadline:
+            break
+        delay = due - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        payload = encode(next_batch(datasource, vehicle, args.batch_size, length))
+        sent = time.perf_counter()
+        # Never hold the tracker lock here, paho calls on_publish while holding its own locks
+        info = client.publish(args.topic, payload, qos=args.qos)
+        if info.rc == mqtt_client.MQTT_ERR_SUCCESS:
+            tracker.sent(info.mid, sent)
+            published += 1
+        else:
+            errors += 1
+        wait = vehicle.interval * (1 + random.uniform(-vehicle.jitter, vehicle.jitter))
+        heapq.heappush(schedule, (due + wait, vehicle_id, vehicle))
+
+    elapsed = time.monotonic() - started
+    # Give outstanding acknowledgements a moment to arrive
+    time.sleep(min(2.0, args.duration / 10))
+    # Disconnect while the network loop still runs, so the DISCONNECT packet is actually sent
+    client.disconnect()
+    client.loop_stop()
+    with tracker.lock:
+        return {
+            "worker": worker_id,
+            "published": published,
+            "acknowledged": tracker.acknowledged,
+            "errors": errors,
+            "disconnects": len(disconnects),
+            "elapsed": elapsed,
+            "latencies": tracker.latencies,
+        }
+
+
+def collect_reports(workers, results, timeout):
+    """
+    Wait for the report of every worker.
+    Raises:
+        RuntimeError: If a worker failed or exited without reporting.
+        TimeoutError: If the reports did not all arrive within timeout seconds.
+    """
+    reports = []
+    deadline = time.monotonic() + timeout
+    while len(reports) < len(workers):
+        try:
+            report = results.get(timeout=1.0)
+        except queue.Empty:
+            # A report put before exiting is already in the queue, so an exited worker without one crashed
+            crashed = [worker for worker in workers if worker.exitcode not in (None, 0)]
+            if crashed:
+                raise RuntimeError(f"{crashed[0].name} exited with code {crashed[0].exitcode}")
+            if time.monotonic() >= deadline:
+                raise TimeoutError(f"{len(workers) - len(reports)} workers did not report within {timeout:.0f}s")
+            continue
+        if "error" in report:
+            raise RuntimeError(f"Worker {report['worker']} failed:\n{report['error']}")
+        reports.append(report)
+    return reports
+
+
+def summarize(reports):
+    latencies = np.array(sorted(latency for report in reports for latency in report["latencies"]))
+    elapsed = max(report["elapsed"] for report in reports)
+    published = sum(report["published"] for report in reports)
+
+    def percentile(q):
+        return round(float(np.percentile(latencies, q)) * 1000, 3) if len(latencies) else None
+
+    return {
+        "published": published,
+        "acknowledged": sum(report["acknowledged"] for report in reports),
+        "errors": sum(report["errors"] for report in reports),
+        "disconnects": sum(report["disconnects"] for report in reports),
+        "msgs_per_sec": round(published / elapsed, 1) if elapsed else 0.0,
+        "publish_latency_ms_p50": percentile(50),
+        "publish_latency_ms_p99": percentile(99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vehicles", type=int, default=10)
+    parser.add_argument("--processes", type=int, default=max(1, multiprocessing.cpu_count()))
+    parser.add_argument("--rate", type=float, default=100, help="Target aggregate messages per second")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds to run")
+    parser.add_argument("--batch-size", type=int, default=10, help="Samples per message")
+    parser.add_argument("--format", choices=sorted(ENCODERS), default=config.PAYLOAD_FORMAT)
+    parser.add_argument("--jitter", type=float, default=0.1, help="Relative send interval jitter")
+    parser.add_argument("--time-offset", type=float, default=3600, help="Max clock offset per vehicle in seconds")
+    parser.add_argument("--gps-spread", type=float, default=0.05, help="Max GPS shift per vehicle in degrees")
+    parser.add_argument("--qos", type=int, choices=(0, 1), default=1)
+    parser.add_argument("--max-queued", type=int, default=10000, help="Per-process paho outgoing queue limit")
+    parser.add_argument("--delay", type=float, default=config.DELAY)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--host", default=config.MQTT_BROKER_HOST)
+    parser.add_argument("--port", type=int, default=config.MQTT_BROKER_PORT)
+    parser.add_argument("--topic", default=config.MQTT_BATCH_TOPIC)
+    parser.add_argument("--report-timeout", type=float, default=60,
+                        help="Seconds past the duration to wait for the workers' reports")
+    args = parser.parse_args()
+    args.processes = max(1, min(args.processes, args.vehicles))
+
+    # Parse the CSVs once up front so workers memory-map the cached arrays
+    ColumnarFileDatasource("data/accelerometer.csv", "data/gps.csv", "data/parking.csv",
+                           use_cache=config.DATASOURCE_CACHE).start_reading()
+
+    # Spawn rather than fork, so workers never inherit locks held by paho or BLAS threads
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    workers = []
+    first_id = 0
+    for worker_id in range(args.processes):
+        count = args.vehicles // args.processes + (1 if worker_id < args.vehicles % args.processes else 0)
+        worker = context.Process(target=run_worker, args=(worker_id, first_id, count, args, results))
+        worker.start()
+        workers.append(worker)
+        first_id += count
+    try:
+        reports = collect_reports(workers, results, args.duration + args.report_timeout)
+    except BaseException:
+        # The other workers' reports are of no use without this one
+        for worker in workers:
+            worker.terminate()
+        raise
+    finally:
+        for worker in workers:
+            worker.join()
+    print(json.dumps(summarize(reports), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,22 @@
+import os
+import sys
+
+import pytest
+
+# The agent's modules are imported from src/, where main.py runs
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+ACCELEROMETER = "x,y,z\n1,2,16000\n3,4,16100\n5,6,16200\n7,8,16300\n9,10,16400\n"
+GPS = "longitude,latitude\n50.0,30.0\n50.2,30.4\n50.4,30.8\n"
+PARKING = "empty_count,longitude,latitude\n10,50.0,30.0\n20,50.4,30.8\n"
+
+
+@pytest.fixture
+def recording(tmp_path):
+    """Paths of a small accelerometer, GPS and parking recording, at three different rates."""
+    paths = []
+    for name, content in (("accelerometer", ACCELEROMETER), ("gps", GPS), ("parking", PARKING)):
+        path = tmp_path / f"{name}.csv"
+        path.write_text(content)
+        paths.append(str(path))
+    return paths
@@ -0,0 +1,21 @@
+"""Rows as the datasources read them, for the tests to encode and publish."""
+
+from datetime import datetime
+
+from domain.accelerometer import Accelerometer
+from domain.aggregated_data import AggregatedData
+from domain.gps import Gps
+from domain.parking import Parking
+from row_clock import ROW_TICK
+
+TIME = datetime(2024, 5, 1, 12, 0, 0, 250000)
+
+
+def datum(index: int) -> AggregatedData:
+    time = TIME + ROW_TICK * index
+    return AggregatedData(
+        Accelerometer(index, -index, 16384 + index, time),
+        Gps(30.52 + index * 1e-4, 50.45, time),
+        Parking(index % 5, Gps(30.5, 50.4, time), time),
+        time,
+    )
@@ -0,0 +1,90 @@
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from alignment import FORWARD_FILL, INTERPOLATE, align_stream, chunked, ratio, resample
+from file_datasource import FileDatasource
+from row_clock import ROW_TICK, RowClock
+
+SOURCE = [[0.0, 10.0], [1.0, 20.0], [2.0, 40.0]]
+
+
+def test_ratio_maps_first_and_last_rows_onto_each_other():
+    assert ratio(3, 5) == 0.5
+    assert ratio(1, 5) == 0.0
+    assert ratio(3, 1) == 0.0
+
+
+def test_interpolated_stream():
+    assert list(align_stream(SOURCE, 3, 5, INTERPOLATE)) == [
+        [0.0, 10.0], [0.5, 15.0], [1.0, 20.0], [1.5, 30.0], [2.0, 40.0],
+    ]
+
+
+def test_forward_filled_stream():
+    assert list(align_stream(SOURCE, 3, 5, FORWARD_FILL)) == [
+        [0.0, 10.0], [0.0, 10.0], [1.0, 20.0], [1.0, 20.0], [2.0, 40.0],
+    ]
+
+
+def test_downsampled_stream_skips_rows():
+    source = [[float(index)] for index in range(5)]
+    assert list(align_stream(source, 5, 3, INTERPOLATE)) == [[0.0], [2.0], [4.0]]
+
+
+def test_single_row_source_is_repeated():
+    assert list(align_stream([[7.0]], 1, 3, INTERPOLATE)) == [[7.0], [7.0], [7.0]]
+    assert list(align_stream([], 0, 3)) == []
+
+
+def test_stream_is_consumed_lazily():
+    consumed = []
+
+    def rows():
+        for row in SOURCE:
+            consumed.append(row)
+            yield row
+
+    aligned = align_stream(rows(), 3, 5, INTERPOLATE)
+    next(aligned)
+    # The first row and the one following it, nothing further ahead
+    assert consumed == SOURCE[:2]
+
+
+@pytest.mark.parametrize("method", [INTERPOLATE, FORWARD_FILL])
+@pytest.mark.parametrize("start, end", [(0, 7), (2, 5), (6, 7)])
+def test_resample_matches_the_stream(method, start, end):
+    data = np.array([[float(index), index * 3.0] for index in range(4)])
+    streamed = list(align_stream(data.tolist(), 4, 7, method))[start:end]
+    assert np.allclose(resample(data, start, end, 7, method), streamed)
+
+
+def test_chunked():
+    assert list(chunked(range(5), 2)) == [[0, 1], [2, 3], [4]]
+
+
+def test_row_clock_never_repeats_a_timestamp():
+    now = datetime(2024, 5, 1, 12, 0)
+    clock = RowClock(now=lambda: now)
+    assert [clock.next() for _ in range(3)] == [now, now + ROW_TICK, now + ROW_TICK * 2]
+    # A span reserves its rows, the next stamp comes after all of them
+    assert clock.span(4) == now + ROW_TICK * 3
+    assert clock.next() == now + ROW_TICK * 7
+
+
+def test_row_clock_follows_the_wall_clock():
+    times = iter([datetime(2024, 5, 1, 12, 0), datetime(2024, 5, 1, 12, 1)])
+    clock = RowClock(now=lambda: next(times))
+    clock.span(10)
+    assert clock.next() == datetime(2024, 5, 1, 12, 1)
+
+
+def test_every_streamed_row_has_its_own_timestamp(recording):
+    datasource = FileDatasource(*recording, batch_size=3)
+    datasource.start_reading()
+    rows = [row for _ in range(4) for row in datasource.read()]
+    datasource.stop_reading()
+    times = [row.time for row in rows]
+    assert times == sorted(set(times))
+    assert all(row.accelerometer.time == row.gps.time == row.parking.time == row.time for row in rows)
@@ -0,0 +1,50 @@
+import json
+
+import msgpack
+import numpy as np
+import pytest
+
+from codec import decode_struct, encode_json, encode_msgpack, encode_struct
+from columnar_datasource import ColumnarBatch
+from readings import TIME, datum
+from row_clock import ROW_TICK
+
+
+def columnar(count: int) -> ColumnarBatch:
+    rows = [datum(index) for index in range(count)]
+    return ColumnarBatch(
+        np.array([[row.accelerometer.x, row.accelerometer.y, row.accelerometer.z] for row in rows], dtype=np.float64),
+        np.array([[row.gps.longitude, row.gps.latitude] for row in rows]),
+        np.array([[row.parking.empty_count, row.parking.gps.longitude, row.parking.gps.latitude] for row in rows],
+                 dtype=np.float64),
+        TIME,
+    )
+
+
+def test_struct_round_trip():
+    batch = [datum(index) for index in range(3)]
+    assert decode_struct(encode_struct(batch)) == batch
+
+
+def test_columnar_batch_packs_like_domain_objects():
+    assert encode_struct(columnar(4)) == encode_struct(list(columnar(4)))
+    assert decode_struct(encode_struct(columnar(4))) == [datum(index) for index in range(4)]
+
+
+def test_empty_batch():
+    assert decode_struct(encode_struct([])) == []
+
+
+@pytest.mark.parametrize("payload", [b"XXXX\x00\x00\x00\x00", encode_struct([datum(0)])[:-1]])
+def test_decode_rejects_other_payloads(payload):
+    with pytest.raises(ValueError):
+        decode_struct(payload)
+
+
+def test_json_and_msgpack_carry_the_same_records():
+    batch = [datum(index) for index in range(2)]
+    records = json.loads(encode_json(batch))
+    assert msgpack.unpackb(encode_msgpack(batch)) == records
+    assert records[1]["accelerometer"]["x"] == 1
+    assert records[1]["time"] == (TIME + ROW_TICK).isoformat()
+
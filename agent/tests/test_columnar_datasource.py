@@ -0,0 +1,67 @@
+import os
+
+import numpy as np
+import pytest
+
+from alignment import FORWARD_FILL
+from columnar_datasource import ColumnarFileDatasource
+from file_datasource import FileDatasource
+
+
+def values(row) -> tuple:
+    return (row.accelerometer.x, row.accelerometer.y, row.accelerometer.z, row.gps.longitude, row.gps.latitude,
+            row.parking.empty_count, row.parking.gps.longitude, row.parking.gps.latitude)
+
+
+@pytest.mark.parametrize("gps_alignment", ["interpolate", FORWARD_FILL])
+def test_rows_match_the_streaming_datasource(recording, gps_alignment):
+    columnar = ColumnarFileDatasource(*recording, use_cache=False, batch_size=2, gps_alignment=gps_alignment)
+    streaming = FileDatasource(*recording, batch_size=2, gps_alignment=gps_alignment)
+    columnar.start_reading()
+    streaming.start_reading()
+    # Two and a half passes, so both start over at the end of the recording
+    for _ in range(8):
+        assert np.allclose([values(row) for row in columnar.read()], [values(row) for row in streaming.read()])
+    streaming.stop_reading()
+
+
+def test_batches_wrap_around(recording):
+    datasource = ColumnarFileDatasource(*recording, use_cache=False, batch_size=2)
+    assert datasource.read() is None
+    datasource.start_reading()
+    sizes = [len(datasource.read()) for _ in range(4)]
+    assert sizes == [2, 2, 1, 2]
+
+
+def test_rows_are_stamped_in_order(recording):
+    datasource = ColumnarFileDatasource(*recording, use_cache=False, batch_size=3)
+    datasource.start_reading()
+    times = [row.time for _ in range(3) for row in datasource.read()]
+    assert times == sorted(set(times))
+
+
+def test_parsed_arrays_are_cached_next_to_the_csv(recording):
+    accelerometer = recording[0]
+    ColumnarFileDatasource(*recording).start_reading()
+    assert os.path.exists(accelerometer + ".npy")
+    datasource = ColumnarFileDatasource(*recording)
+    datasource.start_reading()
+    assert isinstance(datasource.accelerometer_data, np.memmap)
+    assert datasource.accelerometer_data.tolist() == np.loadtxt(accelerometer, delimiter=",", skiprows=1).tolist()
+
+
+def test_stale_cache_is_parsed_again(recording):
+    accelerometer = recording[0]
+    ColumnarFileDatasource(*recording).start_reading()
+    with open(accelerometer, "w") as file:
+        file.write("x,y,z\n0,0,1\n")
+    later = os.path.getmtime(accelerometer + ".npy") + 10
+    os.utime(accelerometer, (later, later))
+    datasource = ColumnarFileDatasource(*recording)
+    datasource.start_reading()
+    assert datasource.accelerometer_data.tolist() == [[0, 0, 1]]
+
+
+def test_cache_can_be_turned_off(recording):
+    ColumnarFileDatasource(*recording, use_cache=False).start_reading()
+    assert not any(os.path.exists(path + ".npy") for path in recording)
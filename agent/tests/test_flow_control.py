@@ -0,0 +1,221 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+from paho.mqtt import client as mqtt_client
+
+import flow_control
+from flow_control import DROP_NEWEST, DROP_OLDEST, AdaptivePacer, FlowControlledPublisher
+
+
+class Broker:
+    """paho client stand-in whose acks the tests send, or that acks before publish returns."""
+
+    def __init__(self, early=False, rc=mqtt_client.MQTT_ERR_SUCCESS):
+        self.early = early
+        self.rc = rc
+        self.published = []
+        self.on_publish = None
+        self.max_inflight = None
+        self._mid = 0
+
+    def max_inflight_messages_set(self, inflight):
+        self.max_inflight = inflight
+
+    def publish(self, topic, payload, qos):
+        self._mid += 1
+        self.published.append((self._mid, payload))
+        if self.early:
+            self.ack(self._mid)
+        return SimpleNamespace(rc=self.rc, mid=self._mid)
+
+    def ack(self, mid):
+        self.on_publish(self, None, mid)
+
+
+class Clock:
+    """Stands in for the time module, sleeping moves it forward."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class Publisher:
+    """What AdaptivePacer reads from FlowControlledPublisher."""
+
+    def __init__(self, latency=None):
+        self.latency = latency
+        self.dropped = 0
+        self.stalled_for = 0.0
+        self.queued = 0.0
+
+    def oldest_in_flight(self):
+        return self.stalled_for
+
+    def backlog(self):
+        return self.queued
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.005)
+    return True
+
+
+def payloads(broker):
+    return [payload for _, payload in broker.published]
+
+
+def test_unknown_drop_policy():
+    with pytest.raises(ValueError):
+        FlowControlledPublisher(Broker(), max_inflight=2, queue_size=3, drop_policy='block')
+
+
+def test_full_queue_drops_its_oldest_message():
+    publisher = FlowControlledPublisher(Broker(), max_inflight=2, queue_size=3, drop_policy=DROP_OLDEST)
+    results = [publisher.publish('t', payload) for payload in range(5)]
+    assert [rc for rc, _ in results] == [mqtt_client.MQTT_ERR_SUCCESS] * 5
+    assert [payload for _, payload in publisher.queue] == [2, 3, 4]
+    assert publisher.dropped == 2
+    assert publisher.backlog() == 1.0
+
+
+def test_full_queue_refuses_new_messages():
+    publisher = FlowControlledPublisher(Broker(), max_inflight=2, queue_size=3, drop_policy=DROP_NEWEST)
+    results = [publisher.publish('t', payload) for payload in range(5)]
+    assert [rc for rc, _ in results][3:] == [mqtt_client.MQTT_ERR_QUEUE_SIZE] * 2
+    assert [payload for _, payload in publisher.queue] == [0, 1, 2]
+
+
+def test_at_most_max_inflight_unacknowledged_messages():
+    broker = Broker()
+    publisher = FlowControlledPublisher(broker, max_inflight=2, queue_size=10, drop_policy=DROP_OLDEST)
+    assert broker.max_inflight == 2
+    publisher.start()
+    for payload in range(5):
+        publisher.publish('t', payload)
+    assert wait_for(lambda: len(broker.published) == 2)
+    time.sleep(0.05)
+    assert payloads(broker) == [0, 1]
+    broker.ack(1)
+    assert wait_for(lambda: payloads(broker) == [0, 1, 2])
+    for mid in (2, 3, 4, 5):
+        assert wait_for(lambda: len(broker.published) >= mid)
+        broker.ack(mid)
+    publisher.stop(timeout=2)
+    assert payloads(broker) == [0, 1, 2, 3, 4]
+    assert (publisher.acknowledged, publisher.in_flight) == (5, 0)
+    assert publisher.latency is not None
+    assert publisher.oldest_in_flight() == 0.0
+
+
+def test_acks_arriving_before_publish_returns_are_counted():
+    broker = Broker(early=True)
+    publisher = FlowControlledPublisher(broker, max_inflight=1, queue_size=10, drop_policy=DROP_OLDEST)
+    publisher.start()
+    for payload in range(5):
+        publisher.publish('t', payload)
+    publisher.stop(timeout=2)
+    assert payloads(broker) == [0, 1, 2, 3, 4]
+    assert (publisher.acknowledged, publisher.in_flight) == (5, 0)
+    assert publisher._early == {} and publisher._sent_at == {}
+
+
+def test_refused_messages_leave_the_window():
+    broker = Broker(rc=mqtt_client.MQTT_ERR_PAYLOAD_SIZE)
+    publisher = FlowControlledPublisher(broker, max_inflight=1, queue_size=10, drop_policy=DROP_OLDEST)
+    publisher.start()
+    for payload in range(3):
+        publisher.publish('t', payload)
+    publisher.stop(timeout=2)
+    assert (publisher.failed, publisher.in_flight) == (3, 0)
+
+
+def test_ack_latency_is_smoothed():
+    publisher = FlowControlledPublisher(Broker(), max_inflight=2, queue_size=10, drop_policy=DROP_OLDEST)
+    publisher.in_flight = 2
+    with publisher._condition:
+        publisher._acknowledged(1.0)
+        publisher._acknowledged(9.0)
+    assert publisher.latency == 1.0 + flow_control.LATENCY_SMOOTHING * 8.0
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(flow_control, 'time', clock)
+    return clock
+
+
+def pacer(publisher, rate_step=5.0, target_latency=0.5, max_batch_size=100, max_interval=2.0):
+    # Starts at 10 rows per second
+    return AdaptivePacer(publisher, batch_size=10, interval=1.0, rate_step=rate_step,
+                         target_latency=target_latency, max_batch_size=max_batch_size, max_interval=max_interval)
+
+
+def test_rate_grows_by_rate_step_every_second(clock):
+    paced = pacer(Publisher(latency=0.2))
+    while clock.now < 10:
+        paced.wait()
+    assert paced.rate == pytest.approx(10 + 5 * clock.now)
+    # About one read per ack round trip
+    assert paced.batch_size == pytest.approx(paced.rate * 0.2, abs=1)
+
+
+def test_rate_does_not_grow_while_reads_lag(clock):
+    paced = pacer(Publisher(latency=0.2))
+    for _ in range(5):
+        paced.wait()
+        # Reading and publishing took longer than the interval
+        clock.now += 10
+    assert paced.rate == 10
+
+
+def test_rate_halves_once_per_round_trip_on_slow_acks(clock):
+    publisher = Publisher(latency=4.0)
+    paced = pacer(publisher)
+    paced.wait()
+    assert paced.rate == 5
+    paced.wait()
+    assert paced.rate == 5
+    paced.wait()
+    assert paced.rate == 2.5
+
+
+@pytest.mark.parametrize('congest', [
+    lambda publisher: setattr(publisher, 'dropped', publisher.dropped + 1),
+    lambda publisher: setattr(publisher, 'stalled_for', 1.0),
+    lambda publisher: setattr(publisher, 'queued', 0.6),
+])
+def test_rate_halves_on_drops_stalls_and_backlog(clock, congest):
+    publisher = Publisher()
+    paced = pacer(publisher)
+    paced.wait()
+    congest(publisher)
+    paced.wait()
+    assert paced.rate == 5
+
+
+def test_rate_stays_above_min_rate(clock):
+    paced = pacer(Publisher(latency=1.0))
+    for _ in range(20):
+        paced.wait()
+    assert paced.rate == 1.0
+    assert paced.batch_size >= 1
+
+
+def test_batches_are_capped(clock):
+    paced = pacer(Publisher(latency=1.0), rate_step=1000.0, target_latency=5.0)
+    while clock.now < 5:
+        paced.wait()
+    assert paced.batch_size == 100
+    assert paced.interval == pytest.approx(100 / paced.rate)
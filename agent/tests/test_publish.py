@@ -0,0 +1,50 @@
+import json
+
+import pytest
+
+import main
+from readings import datum
+
+
+class Replay:
+    """Datasource handing out the given reads, then ending the publish loop."""
+
+    def __init__(self, *reads):
+        self.reads = list(reads)
+        self.batch_size = 10
+
+    def start_reading(self):
+        pass
+
+    def read(self):
+        if not self.reads:
+            raise Finished
+        return self.reads.pop(0)
+
+
+class Finished(Exception):
+    pass
+
+
+class FakeClient:
+    def __init__(self):
+        self.messages = []
+
+    def publish(self, topic, payload):
+        self.messages.append((topic, payload))
+        return 0, None
+
+
+def test_empty_reads_publish_nothing():
+    client = FakeClient()
+    with pytest.raises(Finished):
+        main.publish(client, "accelerometer", "gps", "parking", Replay(None, [], [datum(0)]), delay=0)
+    assert [topic for topic, _ in client.messages] == ["accelerometer", "gps", "parking"]
+
+
+def test_every_read_is_one_batch_message():
+    client = FakeClient()
+    with pytest.raises(Finished):
+        main.publish_batches(client, "aggregated_data", Replay([datum(0), datum(1)], None, [datum(2)]), delay=0,
+                             payload_format="json")
+    assert [len(json.loads(payload)) for _, payload in client.messages] == [2, 1]
@@ -0,0 +1,73 @@
+import queue
+from argparse import Namespace
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from columnar_datasource import ColumnarFileDatasource
+from simulator import LatencyTracker, collect_reports, make_vehicles, next_batch
+
+ARGS = Namespace(gps_spread=0.01, time_offset=60.0, jitter=0.1)
+
+
+def test_vehicles_are_reproducible_from_the_seed():
+    first = make_vehicles(100, 5, length=50, interval=1.0, args=ARGS, seed=7)
+    again = make_vehicles(100, 5, length=50, interval=1.0, args=ARGS, seed=7)
+    assert [vehicle.vehicle_id for vehicle in first] == [100, 101, 102, 103, 104]
+    assert [(vehicle.position, vehicle.time_offset) for vehicle in first] \
+        == [(vehicle.position, vehicle.time_offset) for vehicle in again]
+    for vehicle in first:
+        assert 0 <= vehicle.position < 50
+        assert abs(vehicle.time_offset) <= timedelta(seconds=ARGS.time_offset)
+        assert np.all(np.abs(vehicle.gps_shift) <= ARGS.gps_spread)
+
+
+def test_batches_are_shifted_per_vehicle_and_wrap_around(recording):
+    datasource = ColumnarFileDatasource(*recording, use_cache=False)
+    datasource.start_reading()
+    gps = datasource.gps_data.copy()
+    vehicle, = make_vehicles(1, 1, length=len(datasource), interval=1.0, args=ARGS, seed=1)
+    vehicle.position = 3
+    before = datetime.now()
+    batch = next_batch(datasource, vehicle, batch_size=4, length=len(datasource))
+    assert len(batch) == 2 and vehicle.position == 0
+    assert batch.time - before - vehicle.time_offset < timedelta(seconds=1)
+    unshifted = datasource.slice(3, 5, batch.time)
+    assert np.allclose(batch.gps, unshifted.gps + vehicle.gps_shift)
+    assert np.allclose(batch.parking[:, 1:], unshifted.parking[:, 1:] + vehicle.gps_shift)
+    assert np.array_equal(datasource.gps_data, gps)
+
+
+def test_latency_is_recorded_whichever_side_comes_second():
+    tracker = LatencyTracker()
+    tracker.sent(1, started=0.0)
+    tracker.on_publish(None, None, 1)
+    # Acknowledged before publish() returned its message id
+    tracker.on_publish(None, None, 2)
+    tracker.sent(2, started=0.0)
+    assert tracker.acknowledged == 2
+    assert len(tracker.latencies) == 2 and tracker.pending == {} and tracker.early == {}
+
+
+def test_reports_of_every_worker_are_collected():
+    results = queue.Queue()
+    results.put({"worker": 0})
+    results.put({"worker": 1})
+    workers = [Namespace(name="Process-1", exitcode=0), Namespace(name="Process-2", exitcode=None)]
+    assert collect_reports(workers, results, timeout=1.0) == [{"worker": 0}, {"worker": 1}]
+
+
+def test_worker_errors_are_raised():
+    results = queue.Queue()
+    results.put({"worker": 0, "error": "Traceback ...\nConnectionRefusedError"})
+    with pytest.raises(RuntimeError, match="ConnectionRefusedError"):
+        collect_reports([Namespace(name="Process-1", exitcode=1)], results, timeout=1.0)
+
+
+def test_crashed_and_stuck_workers_are_raised():
+    crashed = [Namespace(name="Process-1", exitcode=-9)]
+    with pytest.raises(RuntimeError, match="exited with code -9"):
+        collect_reports(crashed, queue.Queue(), timeout=60.0)
+    with pytest.raises(TimeoutError):
+        collect_reports([Namespace(name="Process-1", exitcode=None)], queue.Queue(), timeout=0.0)
@@ -0,0 +1,81 @@
+"""
+Agent stage of the pipeline benchmark: runs agent/src/main.py:publish against an MQTT broker
+until the datasource has been read --reads times, and reports publish rate and CPU per message.
+Started by bench_pipeline.py with the agent's interpreter.
+"""
+import argparse
+import time
+
+from common import report, use_service
+
+use_service("agent")
+
+from paho.mqtt import client as mqtt_client  # noqa: E402
+
+import main  # noqa: E402
+from columnar_datasource import ColumnarFileDatasource  # noqa: E402
+from file_datasource import FileDatasource  # noqa: E402
+
+
+class Finished(Exception):
+    pass
+
+
+class LimitedDatasource:
+    """Ends publish's endless loop after a number of reads."""
+
+    def __init__(self, datasource, reads: int):
+        self.datasource = datasource
+        self.remaining = reads
+
+    def start_reading(self):
+        # Parsing the files is not part of the measurement, they are read before publish starts
+        pass
+
+    def read(self):
+        if self.remaining == 0:
+            raise Finished()
+        self.remaining -= 1
+        return self.datasource.read()
+
+
+def main_stage():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--reads", type=int, default=500)
+    parser.add_argument("--batch-size", type=int, default=10)
+    parser.add_argument("--datasource", choices=("file", "columnar"), default="file")
+    parser.add_argument("--topic-prefix", default="bench/agent")
+    args = parser.parse_args()
+
+    source = FileDatasource if args.datasource == "file" else ColumnarFileDatasource
+    datasource = source("data/accelerometer.csv", "data/gps.csv", "data/parking.csv", batch_size=args.batch_size)
+    datasource.start_reading()
+    client = mqtt_client.Client()
+    client.connect(args.host, args.port)
+    client.loop_start()
+
+    cpu_started, started = time.process_time(), time.perf_counter()
+    try:
+        main.publish(client, *(f"{args.topic_prefix}/{name}" for name in ("accelerometer", "gps", "parking")),
+                     LimitedDatasource(datasource, args.reads), delay=0)
+    except Finished:
+        pass
+    # Messages go out in order, once this one is written all others are too
+    client.publish(f"{args.topic_prefix}/done", b"").wait_for_publish()
+    elapsed, cpu = time.perf_counter() - started, time.process_time() - cpu_started
+    client.loop_stop()
+    client.disconnect()
+    messages = main.stats.sent + main.stats.failed
+    report({
+        "messages": messages,
+        "failed": main.stats.failed,
+        "elapsed_s": round(elapsed, 3),
+        "msgs_per_sec": round(messages / elapsed, 1) if elapsed else None,
+        "cpu_ms_per_msg": round(cpu * 1000 / messages, 4) if messages else None,
+    })
+
+
+if __name__ == "__main__":
+    main_stage()
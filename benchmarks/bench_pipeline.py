@@ -0,0 +1,354 @@
+"""
+Benchmark the agent -> MQTT -> hub -> store -> Postgres pipeline on one machine.
+
+Starts the store and the hub with uvicorn against a local MQTT broker (mosquitto from
+agent/docker), a local Postgres set up with store/docker/db/structure.sql and, with
+--spill redis, a local Redis. It then measures three stages and the whole path:
+- agent: agent/src/main.py:publish to the broker, see agent_stage.py;
+- store: StoreApiAdapter.save_data and create_processed_agent_data over HTTP, see store_stage.py;
+- hub and end to end: ProcessedAgentData published to the hub's topic goes through
+  hub/main.py:on_message, the batch buffer and the store until the store's WebSocket
+  broadcasts it; the hub's and the store's /metrics are scraped before and after.
+The agent's sensor topics are not read by the hub, which takes ProcessedAgentData or raw
+AgentData, so the agent is measured up to the broker and the end to end path starts at the
+hub's topic. Readings are written to a box near latitude/longitude 0 and deleted afterwards.
+
+Results are printed and, with --output, written as JSON; --compare prints the change of every
+figure against an earlier result file. Needs paho-mqtt 2, websockets and prometheus_client on
+top of the services' requirements. Run from the repository root:
+    python benchmarks/bench_pipeline.py --messages 5000 --rate 1000 --output pipeline.json
+    python benchmarks/bench_pipeline.py --compare pipeline.json
+"""
+import argparse
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+import paho.mqtt.client as mqtt
+from prometheus_client.parser import text_string_to_metric_families
+from websockets.sync.client import connect
+
+from common import BENCH_AREA, REPOSITORY, latency_summary, process_cpu_seconds, reading, sequence_of
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
+
+
+def start_service(python: str, name: str, port: int, env: Dict[str, str], workdir: str) -> subprocess.Popen:
+    # Each service runs from a scratch directory, so its log and spill files stay out of the tree
+    log = open(os.path.join(workdir, f"{name}.out"), "wb")
+    return subprocess.Popen(
+        [python, "-m", "uvicorn", "main:app", "--app-dir", os.path.join(REPOSITORY, name),
+         "--port", str(port), "--log-level", "warning"],
+        cwd=workdir, env={**os.environ, **env}, stdout=log, stderr=subprocess.STDOUT,
+    )
+
+
+def wait_ready(process: subprocess.Popen, url: str, timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{url} exited with code {process.returncode}")
+        try:
+            with urllib.request.urlopen(url, timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout} seconds")
+
+
+def run_stage(python: str, script: str, *args) -> dict:
+    output = subprocess.run(
+        [python, os.path.join(BENCHMARKS, script), *map(str, args)], check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def scrape(url: str) -> Dict[str, float]:
+    """Every sample of a /metrics page, keyed by name and labels."""
+    with urllib.request.urlopen(url, timeout=5) as response:
+        text = response.read().decode()
+    samples = {}
+    for family in text_string_to_metric_families(text):
+        for sample in family.samples:
+            labels = ",".join(f"{key}={value}" for key, value in sorted(sample.labels.items()))
+            samples[f"{sample.name}{{{labels}}}"] = sample.value
+    return samples
+
+
+def increase(before: Dict[str, float], after: Dict[str, float], name: str) -> float:
+    # Summed over all label values
+    return sum(value - before.get(key, 0.0) for key, value in after.items() if key.startswith(name + "{"))
+
+
+def mean_ms(before: Dict[str, float], after: Dict[str, float], histogram: str) -> Optional[float]:
+    count = increase(before, after, histogram + "_count")
+    return round(increase(before, after, histogram + "_sum") * 1000 / count, 3) if count else None
+
+
+def cpu_ms_per_msg(pid: int, cpu_before: Optional[float], messages: int) -> Optional[float]:
+    cpu_after = process_cpu_seconds(pid)
+    if cpu_before is None or cpu_after is None or not messages:
+        return None
+    return round((cpu_after - cpu_before) * 1000 / messages, 4)
+
+
+class Receiver(threading.Thread):
+    """Records when each benchmark reading is broadcast by the store's WebSocket."""
+
+    def __init__(self, url: str, start: datetime, count: int):
+        super().__init__(name="ws-receiver", daemon=True)
+        self.websocket = connect(url)
+        self.start_time = start
+        self.count = count
+        self.received: Dict[int, float] = {}
+        self.warmed_up = threading.Event()
+        self.done = threading.Event()
+
+    def run(self):
+        try:
+            for message in self.websocket:
+                now = time.perf_counter()
+                for record in json.loads(message):
+                    sequence = sequence_of(record, self.start_time)
+                    if sequence >= self.count:
+                        self.warmed_up.set()
+                    elif sequence >= 0:
+                        self.received.setdefault(sequence, now)
+                if len(self.received) >= self.count:
+                    self.done.set()
+        except Exception:
+            # Closed at the end of the run
+            self.done.set()
+
+
+def end_to_end(args, store_url: str, hub_url: str, topic: str, store: subprocess.Popen,
+               hub: subprocess.Popen) -> dict:
+    start = datetime.now()
+    receiver = Receiver(store_url.replace("http", "ws", 1) + "/ws/", start, args.messages)
+    receiver.start()
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+    client.connect(args.mqtt_host, args.mqtt_port)
+    client.loop_start()
+    # Readings numbered from args.messages on only check that the hub has subscribed
+    warmup = args.messages
+    while not receiver.warmed_up.wait(0.5):
+        client.publish(topic, json.dumps(reading(warmup, start)), qos=args.qos)
+        warmup += 1
+        if warmup - args.messages > 60:
+            raise RuntimeError("Readings published to the hub never reached the store's WebSocket")
+
+    hub_before, store_before = scrape(hub_url + "/metrics"), scrape(store_url + "/metrics")
+    hub_cpu, store_cpu = process_cpu_seconds(hub.pid), process_cpu_seconds(store.pid)
+    payloads = [json.dumps(reading(sequence, start)) for sequence in range(args.messages)]
+    sent: List[float] = []
+    started = time.perf_counter()
+    for sequence, payload in enumerate(payloads):
+        if args.rate:
+            # Paced against the start, so a slow publish call is caught up on
+            delay = started + sequence / args.rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        sent.append(time.perf_counter())
+        client.publish(topic, payload, qos=args.qos)
+    receiver.done.wait(args.timeout)
+    hub_after, store_after = scrape(hub_url + "/metrics"), scrape(store_url + "/metrics")
+    client.loop_stop()
+    client.disconnect()
+    receiver.websocket.close()
+
+    received = dict(receiver.received)
+    delivered = len(received)
+    elapsed = (max(received.values()) - started) if received else None
+    hub_received = int(increase(hub_before, hub_after, "hub_mqtt_messages_received_total"))
+    batches = increase(hub_before, hub_after, "hub_batch_size_count")
+    return {
+        "hub": {
+            "messages_received": hub_received,
+            "msgs_per_sec": round(hub_received / elapsed, 1) if elapsed else None,
+            "validation_ms_mean": mean_ms(hub_before, hub_after, "hub_validation_seconds"),
+            "batches": int(batches),
+            "batch_size_mean": round(increase(hub_before, hub_after, "hub_batch_size_sum") / batches, 2)
+            if batches else None,
+            "store_request_ms_mean": mean_ms(hub_before, hub_after, "hub_store_request_seconds"),
+            "cpu_ms_per_msg": cpu_ms_per_msg(hub.pid, hub_cpu, hub_received),
+        },
+        "store": {
+            "rows_written": int(increase(store_before, store_after, "store_ingest_rows_total")),
+            "ingest_ms_mean": mean_ms(store_before, store_after, "store_ingest_seconds"),
+            "cpu_ms_per_msg": cpu_ms_per_msg(store.pid, store_cpu, delivered),
+        },
+        "end_to_end": {
+            "messages": args.messages,
+            "delivered": delivered,
+            "msgs_per_sec": round(delivered / elapsed, 1) if elapsed else None,
+            **latency_summary([received[sequence] - sent[sequence] for sequence in received]),
+        },
+    }
+
+
+def store_stage(args, store_url: str, store: subprocess.Popen, method: str) -> dict:
+    cpu = process_cpu_seconds(store.pid)
+    result = run_stage(args.hub_python, "store_stage.py", "--url", store_url, "--records", args.store_records,
+                       "--batch-size", args.batch_size, "--method", method)
+    result["store_cpu_ms_per_msg"] = cpu_ms_per_msg(store.pid, cpu, result["records"])
+    return result
+
+
+def clean_up(store_url: str, since: datetime):
+    # Deletes the readings of this run, and of earlier runs that were interrupted
+    query = urllib.parse.urlencode({
+        "start": (since - timedelta(days=30)).isoformat(), "end": (datetime.now() + timedelta(minutes=1)).isoformat(),
+        "min_latitude": BENCH_AREA[0], "min_longitude": BENCH_AREA[1],
+        "max_latitude": BENCH_AREA[2], "max_longitude": BENCH_AREA[3],
+    })
+    request = urllib.request.Request(f"{store_url}/processed_agent_data/?{query}", method="DELETE")
+    with urllib.request.urlopen(request, timeout=60) as response:
+        return json.loads(response.read())["deleted"]
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPOSITORY, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args) -> dict:
+    started_at = datetime.now()
+    store_port, hub_port = free_port(), free_port()
+    store_url, hub_url = f"http://localhost:{store_port}", f"http://localhost:{hub_port}"
+    prefix = f"bench/{os.getpid()}"
+    results = {
+        "benchmark": "pipeline",
+        "started_at": started_at.isoformat(timespec="seconds"),
+        "git_revision": git_revision(),
+        "host": {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()},
+        "parameters": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "stages": {},
+    }
+    with tempfile.TemporaryDirectory() as workdir:
+        store = start_service(args.store_python, "store", store_port, {"LOG_SAMPLE_INTERVAL": "10"}, workdir)
+        hub = None
+        try:
+            wait_ready(store, store_url + "/metrics", args.startup_timeout)
+            print("Agent publish...", file=sys.stderr)
+            results["stages"]["agent_publish"] = run_stage(
+                args.agent_python, "agent_stage.py", "--host", args.mqtt_host, "--port", args.mqtt_port,
+                "--reads", args.agent_reads, "--topic-prefix", f"{prefix}/agent",
+            )
+            for method in ("put", "post"):
+                print(f"Store {method.upper()}...", file=sys.stderr)
+                results["stages"][f"store_{method}"] = store_stage(args, store_url, store, method)
+
+            print("Hub and end to end...", file=sys.stderr)
+            topic = f"{prefix}/processed_agent_data"
+            hub = start_service(args.hub_python, "hub", hub_port, {
+                "STORE_API_HOST": "localhost",
+                "STORE_API_PORT": str(store_port),
+                "MQTT_BROKER_HOST": args.mqtt_host,
+                "MQTT_BROKER_PORT": str(args.mqtt_port),
+                "MQTT_QOS": str(args.qos),
+                "MQTT_TOPIC": topic,
+                "MQTT_AGENT_DATA_TOPIC": f"{prefix}/agent_data",
+                "BATCH_SIZE": str(args.batch_size),
+                "SPILL_BACKEND": args.spill,
+                "SPILL_DIR": os.path.join(workdir, "spill"),
+                "REDIS_HOST": args.redis_host,
+                "REDIS_PORT": str(args.redis_port),
+                "REDIS_SPILL_KEY": f"{prefix}/spill",
+                **dict(setting.split("=", 1) for setting in args.hub_env),
+            }, workdir)
+            wait_ready(hub, hub_url + "/metrics", args.startup_timeout)
+            measured = end_to_end(args, store_url, hub_url, topic, store, hub)
+            results["stages"]["hub"] = measured["hub"]
+            results["stages"]["store_from_hub"] = measured["store"]
+            results["end_to_end"] = measured["end_to_end"]
+            if not args.keep:
+                results["deleted_rows"] = clean_up(store_url, started_at)
+        finally:
+            for process in (hub, store):
+                if process is not None:
+                    process.terminate()
+                    process.wait(30)
+    return results
+
+
+def figures(results: dict, path: str = "") -> Dict[str, float]:
+    # Numeric leaves of the stage and end to end results, by dotted path
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(figures(value, f"{path}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[f"{path}{key}"] = value
+    return flat
+
+
+def print_results(results: dict, previous: Optional[dict]):
+    current = figures({"stages": results["stages"], "end_to_end": results.get("end_to_end", {})})
+    earlier = figures({"stages": previous["stages"], "end_to_end": previous.get("end_to_end", {})}) \
+        if previous else {}
+    width = max(map(len, current))
+    for name, value in current.items():
+        line = f"{name:<{width}} {value:>12}"
+        if earlier.get(name):
+            line += f" {earlier[name]:>12} {(value - earlier[name]) / earlier[name] * 100:>+8.1f}%"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=5000, help="Readings sent end to end")
+    parser.add_argument("--rate", type=float, default=1000.0, help="Messages per second end to end, 0 for no limit")
+    parser.add_argument("--qos", type=int, default=1)
+    parser.add_argument("--batch-size", type=int, default=20, help="Records per batch from the hub to the store")
+    parser.add_argument("--store-records", type=int, default=5000, help="Readings sent in the store stage")
+    parser.add_argument("--agent-reads", type=int, default=500, help="Datasource reads in the agent stage")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Seconds to wait for the last reading")
+    parser.add_argument("--startup-timeout", type=float, default=30.0)
+    parser.add_argument("--mqtt-host", default="localhost")
+    parser.add_argument("--mqtt-port", type=int, default=1883)
+    parser.add_argument("--spill", choices=("file", "redis"), default="file", help="Spill backend of the hub")
+    parser.add_argument("--redis-host", default="localhost")
+    parser.add_argument("--redis-port", type=int, default=6379)
+    parser.add_argument("--hub-env", action="append", default=[], metavar="NAME=VALUE",
+                        help="Extra hub configuration, e.g. BATCH_MAX_LINGER=0.1")
+    # The services pin different paho-mqtt versions and may live in separate environments
+    parser.add_argument("--agent-python", default=sys.executable)
+    parser.add_argument("--hub-python", default=sys.executable)
+    parser.add_argument("--store-python", default=sys.executable)
+    parser.add_argument("--keep", action="store_true", help="Keep the benchmark readings in the database")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--compare", help="Earlier JSON results to compare with")
+    args = parser.parse_args()
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as file:
+            previous = json.load(file)
+    results = run(args)
+    print_results(results, previous)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Helpers shared by the pipeline benchmark and its stage scripts.
+
+Every stage script runs in a process of its own, with its service directory
+on sys.path, because agent, hub and store each have their own config module.
+A stage prints a single JSON object on its last line of output.
+"""
+import json
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+ROAD_STATES = ("smooth", "bumpy", "pothole")
+# Readings are placed in this latitude/longitude box, away from real data, so they can be cleaned up
+BENCH_AREA = (0.0, 0.0, 0.02, 0.02)
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def use_service(name: str):
+    """Make the modules of agent/src, hub or store importable and their relative paths resolve."""
+    directory = os.path.join(REPOSITORY, "agent", "src") if name == "agent" else os.path.join(REPOSITORY, name)
+    sys.path.insert(0, directory)
+    os.chdir(directory)
+
+
+def percentile(samples: List[float], fraction: float) -> Optional[float]:
+    if not samples:
+        return None
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def latency_summary(seconds: List[float]) -> Dict[str, Optional[float]]:
+    to_ms = (lambda value: None if value is None else round(value * 1000, 3))
+    return {
+        "latency_ms_p50": to_ms(percentile(seconds, 0.5)),
+        "latency_ms_p99": to_ms(percentile(seconds, 0.99)),
+        "latency_ms_max": to_ms(max(seconds) if seconds else None),
+    }
+
+
+def reading(sequence: int, start: datetime) -> dict:
+    """
+    A ProcessedAgentData record whose timestamp encodes its sequence number,
+    so a record coming back from the store can be matched to when it was sent.
+    """
+    return {
+        "road_state": random.choice(ROAD_STATES),
+        "agent_data": {
+            "accelerometer": {"x": random.uniform(-100, 100), "y": random.uniform(-100, 100),
+                              "z": random.uniform(16000, 17000)},
+            "gps": {"latitude": random.uniform(BENCH_AREA[0], BENCH_AREA[2]),
+                    "longitude": random.uniform(BENCH_AREA[1], BENCH_AREA[3])},
+            "timestamp": (start + timedelta(microseconds=sequence)).isoformat(),
+        },
+    }
+
+
+def sequence_of(record: dict, start: datetime) -> int:
+    timestamp = datetime.fromisoformat(record["agent_data"]["timestamp"])
+    return (timestamp - start) // timedelta(microseconds=1)
+
+
+def process_cpu_seconds(pid: int) -> Optional[float]:
+    """User and system CPU time of another process so far, from /proc; None where that is unavailable."""
+    try:
+        with open(f"/proc/{pid}/stat") as file:
+            # Fields after the parenthesized command name, utime and stime are the 14th and 15th
+            fields = file.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def report(result: dict):
+    print(json.dumps(result))
@@ -0,0 +1,62 @@
+"""
+Store stage of the pipeline benchmark: sends batches of fresh readings to a running store, either
+through the hub's StoreApiAdapter.save_data (POST to store/main.py:create_processed_agent_data, as the
+hub does) or as PUTs to the upsert, and reports rows per second and batch latency.
+Started by bench_pipeline.py with the hub's interpreter.
+"""
+import argparse
+import json
+import time
+from datetime import datetime
+
+from common import latency_summary, reading, report, use_service
+
+use_service("hub")
+
+import requests  # noqa: E402
+
+from app.adapters.store_api_adapter import StoreApiAdapter  # noqa: E402
+from app.entities.serialization import encode_batch  # noqa: E402
+
+
+def main_stage():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--records", type=int, default=5000)
+    parser.add_argument("--batch-size", type=int, default=20)
+    parser.add_argument("--method", choices=("put", "post"), default="post")
+    args = parser.parse_args()
+
+    start = datetime.now()
+    records = [json.dumps(reading(sequence, start)).encode() for sequence in range(args.records)]
+    batches = [records[i:i + args.batch_size] for i in range(0, len(records), args.batch_size)]
+    if args.method == "post":
+        save = StoreApiAdapter(args.url).save_data
+    else:
+        session = requests.Session()
+
+        def save(batch):
+            response = session.put(f"{args.url}/processed_agent_data/", data=encode_batch(batch),
+                                   headers={"Content-Type": "application/json"})
+            return response.status_code == 200
+
+    latencies, failed = [], 0
+    started = time.perf_counter()
+    for batch in batches:
+        sent = time.perf_counter()
+        if not save(batch):
+            failed += 1
+        latencies.append(time.perf_counter() - sent)
+    elapsed = time.perf_counter() - started
+    report({
+        "records": args.records,
+        "batches": len(batches),
+        "failed_batches": failed,
+        "elapsed_s": round(elapsed, 3),
+        "msgs_per_sec": round(args.records / elapsed, 1) if elapsed else None,
+        **latency_summary(latencies),
+    })
+
+
+if __name__ == "__main__":
+    main_stage()
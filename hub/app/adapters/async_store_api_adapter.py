@@ -0,0 +1,101 @@
+import asyncio
+import gzip
+import logging
+import random
+import threading
+import time
+from typing import Callable, List
+
+import httpx
+
+from app.entities.serialization import encode_batch
+from app.instrumentation import STORE_REQUEST_SECONDS
+from app.interfaces.store_api_gateway import SaveResult, StoreGateway
+
+
+class AsyncStoreApiAdapter(StoreGateway):
+    """
+    Store gateway backed by a pooled keep-alive httpx.AsyncClient.
+    The client lives on a private event loop thread, so it can be used from
+    the MQTT network thread and FastAPI handlers alike. At most max_in_flight
+    batches are sent concurrently; submit blocks the caller beyond that.
+    """
+
+    def __init__(self, api_base_url: str, max_in_flight: int, max_retries: int, retry_backoff: float,
+                 timeout: float, gzip_min_size: int = 0):
+        self.api_base_url = api_base_url
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.gzip_min_size = gzip_min_size
+        self._in_flight = threading.BoundedSemaphore(max_in_flight)
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="store-api", daemon=True)
+        self._thread.start()
+        self._client = httpx.AsyncClient(
+            base_url=api_base_url,
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_in_flight, max_keepalive_connections=max_in_flight),
+        )
+
+    def save_data(self, processed_agent_data_batch: List[bytes]) -> SaveResult:
+        """
+        Save the processed road data to the Store API, retrying transient failures.
+        Parameters:
+            processed_agent_data_batch (List[bytes]): Processed road data to be saved.
+        Returns:
+            SaveResult: SAVED if the data is successfully saved, REJECTED if the store refused it
+                with a client error, FAILED if it could not be saved within max_retries.
+        """
+        with self._in_flight:
+            future = asyncio.run_coroutine_threadsafe(self._send(processed_agent_data_batch), self._loop)
+            return future.result()
+
+    def submit(self, processed_agent_data_batch: List[bytes], on_done: Callable[[SaveResult], None]) -> None:
+        self._in_flight.acquire()
+        future = asyncio.run_coroutine_threadsafe(self._send(processed_agent_data_batch), self._loop)
+
+        def done(completed):
+            self._in_flight.release()
+            if completed.cancelled() or completed.exception() is not None:
+                on_done(SaveResult.FAILED)
+            else:
+                on_done(completed.result())
+
+        future.add_done_callback(done)
+
+    def close(self):
+        asyncio.run_coroutine_threadsafe(self._client.aclose(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    def _encode(self, processed_agent_data_batch: List[bytes]):
+        body = encode_batch(processed_agent_data_batch)
+        headers = {"Content-Type": "application/json"}
+        if self.gzip_min_size and len(body) >= self.gzip_min_size:
+            body = gzip.compress(body, compresslevel=5)
+            headers["Content-Encoding"] = "gzip"
+        return body, headers
+
+    async def _send(self, processed_agent_data_batch: List[bytes]) -> SaveResult:
+        body, headers = self._encode(processed_agent_data_batch)
+        for attempt in range(self.max_retries + 1):
+            started = time.perf_counter()
+            try:
+                # The store skips readings already stored, so a retry of a batch it already wrote adds nothing
+                response = await self._client.post("/processed_agent_data/", content=body, headers=headers)
+                outcome = "saved" if response.status_code == 200 else "rejected"
+                STORE_REQUEST_SECONDS.labels(outcome).observe(time.perf_counter() - started)
+                if response.status_code == 200:
+                    logging.info("Data saved successfully")
+                    return SaveResult.SAVED
+                logging.error(f"Failed to save data: {response.status_code} {response.text}")
+                if response.status_code < 500 and response.status_code != 429:
+                    # The store will reject this batch again, retrying cannot help
+                    return SaveResult.REJECTED
+            except httpx.HTTPError as e:
+                STORE_REQUEST_SECONDS.labels("unreachable").observe(time.perf_counter() - started)
+                logging.error(f"Failed to reach the Store API: {e!r}")
+            if attempt < self.max_retries:
+                # Exponential backoff with full jitter
+                await asyncio.sleep(random.uniform(0, self.retry_backoff * 2 ** attempt))
+        return SaveResult.FAILED
@@ -0,0 +1,234 @@
+import logging
+import mmap
+import os
+import struct
+import threading
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+from app.interfaces.spill_gateway import SpillGateway
+
+# Records are framed by their length and CRC-32; zero bytes after the last record end a segment's data
+RECORD_HEADER = struct.Struct("<II")
+# Sequence number of the segment and offset of the oldest unacknowledged record
+HEAD_RECORD = struct.Struct("<QQ")
+SEGMENT_PREFIX = "segment-"
+SEGMENT_SUFFIX = ".log"
+HEAD_FILE = "head"
+
+
+class FileSpillAdapter(SpillGateway):
+    """
+    Spill kept in a local append-only log of memory-mapped segment files.
+    Segments are preallocated to segment_size bytes; once the tail segment is
+    full the log rotates to a new one, and segments whose records have all
+    been acknowledged are deleted. Written pages and the head position are
+    flushed to disk at most every fsync_interval seconds, 0 flushes on every
+    call. A crash of the process loses nothing, a crash of the machine at
+    most that interval; acknowledged items whose head position was not
+    flushed yet are replayed again after a restart.
+    """
+
+    def __init__(self, directory: str, segment_size: int, fsync_interval: float):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.fsync_interval = fsync_interval
+        self._lock = threading.Lock()
+        self._segments: Dict[int, mmap.mmap] = {}
+        # End offset of the written records of every segment
+        self._ends: Dict[int, int] = {}
+        self._sequences: List[int] = []
+        self._head: Tuple[int, int] = (0, 0)
+        self._count = 0
+        self._dirty = set()
+        self._head_dirty = False
+        self._closed = threading.Event()
+        self._sync_thread: Optional[threading.Thread] = None
+        os.makedirs(directory, exist_ok=True)
+        self._recover()
+        if fsync_interval > 0:
+            self._sync_thread = threading.Thread(target=self._sync_loop, name="spill-sync", daemon=True)
+            self._sync_thread.start()
+
+    def append(self, processed_agent_data_batch: List[bytes]) -> None:
+        if not processed_agent_data_batch:
+            return
+        with self._lock:
+            for record in processed_agent_data_batch:
+                size = RECORD_HEADER.size + len(record)
+                tail = self._sequences[-1]
+                if self._ends[tail] + size > len(self._segments[tail]):
+                    tail = self._rotate(size)
+                segment, offset = self._segments[tail], self._ends[tail]
+                segment[offset + RECORD_HEADER.size:offset + size] = record
+                RECORD_HEADER.pack_into(segment, offset, len(record), zlib.crc32(record))
+                self._ends[tail] = offset + size
+                self._dirty.add(tail)
+            self._count += len(processed_agent_data_batch)
+            if self.fsync_interval <= 0:
+                self._sync()
+
+    def peek(self, count: int) -> List[bytes]:
+        with self._lock:
+            items = []
+            for sequence, offset in self._walk(count):
+                length, _ = RECORD_HEADER.unpack_from(self._segments[sequence], offset)
+                start = offset + RECORD_HEADER.size
+                items.append(self._segments[sequence][start:start + length])
+            return items
+
+    def ack(self, count: int) -> None:
+        with self._lock:
+            acked = 0
+            sequence, offset = self._head
+            for sequence, offset in self._walk(count):
+                length, _ = RECORD_HEADER.unpack_from(self._segments[sequence], offset)
+                offset += RECORD_HEADER.size + length
+                acked += 1
+            self._head = (sequence, offset)
+            self._count -= acked
+            self._head_dirty = True
+            if self._count == 0 and offset > 0:
+                # Everything was delivered, start over in a fresh segment so the used one can go
+                self._rotate(0)
+                self._head = (self._sequences[-1], 0)
+            # Delete the segments the head has moved past
+            while self._sequences[0] < self._head[0]:
+                self._delete(self._sequences.pop(0))
+            if self.fsync_interval <= 0:
+                self._sync()
+
+    def size(self) -> int:
+        return self._count
+
+    def close(self) -> None:
+        self._closed.set()
+        if self._sync_thread is not None:
+            self._sync_thread.join()
+        with self._lock:
+            self._sync()
+            for segment in self._segments.values():
+                segment.close()
+            self._segments.clear()
+
+    def _walk(self, count: int):
+        # Positions of up to count records from the head on
+        sequence, offset = self._head
+        index = self._sequences.index(sequence)
+        while count > 0:
+            if offset >= self._ends[sequence]:
+                if index + 1 >= len(self._sequences):
+                    return
+                index += 1
+                sequence, offset = self._sequences[index], 0
+                continue
+            yield sequence, offset
+            length, _ = RECORD_HEADER.unpack_from(self._segments[sequence], offset)
+            offset += RECORD_HEADER.size + length
+            count -= 1
+
+    def _path(self, sequence: int) -> str:
+        return os.path.join(self.directory, f"{SEGMENT_PREFIX}{sequence:016d}{SEGMENT_SUFFIX}")
+
+    def _open(self, sequence: int, size: int = 0) -> mmap.mmap:
+        # Creates the segment when given its size
+        with open(self._path(sequence), "w+b" if size else "r+b") as file:
+            if size:
+                file.truncate(size)
+            segment = mmap.mmap(file.fileno(), 0)
+        self._segments[sequence] = segment
+        return segment
+
+    def _rotate(self, record_size: int) -> int:
+        # Numbering continues after the head, deleted segments are never reused
+        sequence = self._sequences[-1] + 1 if self._sequences else self._head[0]
+        # Oversized records get a segment of their own
+        self._open(sequence, max(self.segment_size, record_size))
+        self._ends[sequence] = 0
+        self._sequences.append(sequence)
+        self._sync_directory()
+        return sequence
+
+    def _delete(self, sequence: int):
+        self._segments.pop(sequence).close()
+        self._ends.pop(sequence)
+        self._dirty.discard(sequence)
+        os.remove(self._path(sequence))
+
+    def _recover(self):
+        sequences = sorted(
+            int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]) for name in os.listdir(self.directory)
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX)
+        )
+        head = self._read_head()
+        for sequence in sequences:
+            if head is not None and sequence < head[0] or os.path.getsize(self._path(sequence)) == 0:
+                # Acknowledged before the last run could delete it, or never written
+                os.remove(self._path(sequence))
+                continue
+            segment = self._open(sequence)
+            start = head[1] if head is not None and sequence == head[0] else 0
+            self._ends[sequence], records = _scan(segment, start)
+            self._count += records
+            self._sequences.append(sequence)
+        self._head = head or (0, 0)
+        if not self._sequences:
+            self._rotate(0)
+        if self._head[0] != self._sequences[0]:
+            self._head = (self._sequences[0], 0)
+            self._head_dirty = True
+        if self._count:
+            logging.info(f"Recovered {self._count} spilled items from {len(self._sequences)} segments")
+
+    def _read_head(self) -> Optional[Tuple[int, int]]:
+        try:
+            with open(os.path.join(self.directory, HEAD_FILE), "rb") as file:
+                return HEAD_RECORD.unpack(file.read(HEAD_RECORD.size))
+        except (OSError, struct.error):
+            return None
+
+    def _sync(self):
+        for sequence in self._dirty:
+            self._segments[sequence].flush()
+        self._dirty.clear()
+        if self._head_dirty:
+            # Replaced atomically, a crash leaves either the old or the new head
+            path = os.path.join(self.directory, HEAD_FILE)
+            with open(f"{path}.tmp", "wb") as file:
+                file.write(HEAD_RECORD.pack(*self._head))
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(f"{path}.tmp", path)
+            self._head_dirty = False
+
+    def _sync_directory(self):
+        # Makes created segment files survive a crash of the machine
+        descriptor = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(descriptor)
+        finally:
+            os.close(descriptor)
+
+    def _sync_loop(self):
+        while not self._closed.wait(self.fsync_interval):
+            with self._lock:
+                if self._dirty or self._head_dirty:
+                    self._sync()
+
+
+def _scan(segment: mmap.mmap, offset: int) -> Tuple[int, int]:
+    """
+    Find the end of the intact records of a segment.
+    Returns:
+        Tuple[int, int]: End offset of the last intact record and the number of records after offset.
+    """
+    records = 0
+    while offset + RECORD_HEADER.size <= len(segment):
+        length, checksum = RECORD_HEADER.unpack_from(segment, offset)
+        end = offset + RECORD_HEADER.size + length
+        if length == 0 or end > len(segment) or zlib.crc32(segment[offset + RECORD_HEADER.size:end]) != checksum:
+            # Preallocated zeros or a record torn by a crash
+            break
+        offset = end
+        records += 1
+    return offset, records
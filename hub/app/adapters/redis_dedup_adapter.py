@@ -0,0 +1,31 @@
+from typing import List
+
+from redis import Redis
+
+from app.instrumentation import REDIS_OPERATION_SECONDS
+from app.interfaces.dedup_gateway import DedupGateway
+
+
+class RedisDedupAdapter(DedupGateway):
+    """
+    Shared set of seen keys as one Redis key per reading, set with NX and an
+    expiry of window seconds, so memory is bounded by the readings of one window.
+    """
+
+    def __init__(self, redis_client: Redis, prefix: str, window: float):
+        self.redis_client = redis_client
+        self.prefix = prefix.encode()
+        self.window = window
+
+    def claim(self, keys: List[bytes]) -> List[bool]:
+        if not keys:
+            return []
+        with REDIS_OPERATION_SECONDS.labels("dedup_claim").time():
+            with self.redis_client.pipeline(transaction=False) as pipe:
+                for key in keys:
+                    pipe.set(self.prefix + key, b"", nx=True, px=int(self.window * 1000))
+                return [bool(added) for added in pipe.execute()]
+
+    def release(self, keys: List[bytes]) -> None:
+        if keys:
+            self.redis_client.delete(*(self.prefix + key for key in keys))
@@ -0,0 +1,122 @@
+from typing import Dict, List, Optional
+
+from redis import Redis
+from redis.exceptions import WatchError
+
+from app.instrumentation import REDIS_OPERATION_SECONDS
+from app.interfaces.partition_gateway import PartitionEntry, PartitionGateway
+
+# Attempts of a lease check whose key changed in between, e.g. renewed by our own coordinator
+WATCH_ATTEMPTS = 5
+
+
+class RedisPartitionAdapter(PartitionGateway):
+    """
+    Partition logs as Redis streams, leases as keys with an expiry and the
+    group's members as a sorted set scored by the time their heartbeat runs
+    out. Member expiry uses the Redis server's clock, so the hubs' clocks do
+    not need to agree. Lease checks run in WATCH/MULTI transactions.
+    """
+
+    def __init__(self, redis_client: Redis, prefix: str):
+        self.redis_client = redis_client
+        self.prefix = prefix
+
+    def _log(self, partition: int) -> str:
+        return f"{self.prefix}log:{partition}"
+
+    def _lease(self, partition: int) -> str:
+        return f"{self.prefix}lease:{partition}"
+
+    def time(self) -> float:
+        seconds, microseconds = self.redis_client.time()
+        return seconds + microseconds / 1e6
+
+    def heartbeat(self, member: str, ttl: float) -> int:
+        with REDIS_OPERATION_SECONDS.labels("heartbeat").time():
+            now = self.time()
+            with self.redis_client.pipeline(transaction=False) as pipe:
+                pipe.zadd(f"{self.prefix}members", {member: now + ttl})
+                pipe.zremrangebyscore(f"{self.prefix}members", "-inf", now)
+                pipe.zcard(f"{self.prefix}members")
+                return pipe.execute()[-1]
+
+    def leave(self, member: str) -> None:
+        self.redis_client.zrem(f"{self.prefix}members", member)
+
+    def acquire(self, partition: int, member: str, ttl: float) -> bool:
+        with REDIS_OPERATION_SECONDS.labels("acquire").time():
+            return bool(self.redis_client.set(self._lease(partition), member, nx=True, px=int(ttl * 1000)))
+
+    def renew(self, partition: int, member: str, ttl: float) -> bool:
+        with REDIS_OPERATION_SECONDS.labels("renew").time():
+            return self._if_holder(
+                partition, member, lambda pipe: pipe.pexpire(self._lease(partition), int(ttl * 1000))
+            )
+
+    def release(self, partition: int, member: str) -> None:
+        self._if_holder(partition, member, lambda pipe: pipe.delete(self._lease(partition)))
+
+    def append(self, entries: Dict[int, List[PartitionEntry]]) -> None:
+        if not entries:
+            return
+        with REDIS_OPERATION_SECONDS.labels("xadd").time():
+            with self.redis_client.pipeline(transaction=False) as pipe:
+                for partition, partition_entries in entries.items():
+                    for entry in partition_entries:
+                        pipe.xadd(self._log(partition), {
+                            "r": entry.record, "k": b"a" if entry.raw else b"p", "t": repr(entry.time),
+                        })
+                pipe.execute()
+
+    def read(self, partitions: Dict[int, Optional[bytes]], count: int,
+             before: float) -> Dict[int, List[PartitionEntry]]:
+        if not partitions:
+            return {}
+        with REDIS_OPERATION_SECONDS.labels("xrange").time():
+            with self.redis_client.pipeline(transaction=False) as pipe:
+                for partition, last_id in partitions.items():
+                    pipe.xrange(self._log(partition), _after(last_id), int(before * 1000), count=count)
+                results = pipe.execute()
+        return {partition: [PartitionEntry(
+            record=fields[b"r"],
+            raw=fields[b"k"] == b"a",
+            time=float(fields[b"t"]),
+            entry_id=entry_id,
+            added=int(entry_id.split(b"-")[0]) / 1000,
+        ) for entry_id, fields in entries] for partition, entries in zip(partitions, results) if entries}
+
+    def remove(self, partition: int, member: str, entry_ids: List[bytes]) -> bool:
+        if not entry_ids:
+            return True
+        with REDIS_OPERATION_SECONDS.labels("xdel").time():
+            return self._if_holder(partition, member, lambda pipe: pipe.xdel(self._log(partition), *entry_ids))
+
+    def size(self, partition: int) -> int:
+        return self.redis_client.xlen(self._log(partition))
+
+    def _if_holder(self, partition: int, member: str, command) -> bool:
+        # Runs command in a transaction that fails if the lease changed hands after it was checked
+        key = self._lease(partition)
+        with self.redis_client.pipeline() as pipe:
+            for _ in range(WATCH_ATTEMPTS):
+                try:
+                    pipe.watch(key)
+                    if pipe.get(key) != member.encode():
+                        pipe.unwatch()
+                        return False
+                    pipe.multi()
+                    command(pipe)
+                    pipe.execute()
+                    return True
+                except WatchError:
+                    continue
+        return False
+
+
+def _after(entry_id: Optional[bytes]) -> str:
+    # Smallest stream id after entry_id, XRANGE bounds are inclusive
+    if entry_id is None:
+        return "-"
+    milliseconds, sequence = entry_id.split(b"-")
+    return f"{int(milliseconds)}-{int(sequence) + 1}"
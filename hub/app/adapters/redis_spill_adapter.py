@@ -0,0 +1,31 @@
+from typing import List
+
+from redis import Redis
+
+from app.instrumentation import REDIS_OPERATION_SECONDS
+from app.interfaces.spill_gateway import SpillGateway
+
+
+class RedisSpillAdapter(SpillGateway):
+    def __init__(self, redis_client: Redis, key: str):
+        self.redis_client = redis_client
+        self.key = key
+
+    def append(self, processed_agent_data_batch: List[bytes]) -> None:
+        if not processed_agent_data_batch:
+            return
+        # A single RPUSH carries the whole batch
+        with REDIS_OPERATION_SECONDS.labels("rpush").time():
+            self.redis_client.rpush(self.key, *processed_agent_data_batch)
+
+    def peek(self, count: int) -> List[bytes]:
+        with REDIS_OPERATION_SECONDS.labels("lrange").time():
+            return self.redis_client.lrange(self.key, 0, count - 1)
+
+    def ack(self, count: int) -> None:
+        with REDIS_OPERATION_SECONDS.labels("ltrim").time():
+            self.redis_client.ltrim(self.key, count, -1)
+
+    def size(self) -> int:
+        with REDIS_OPERATION_SECONDS.labels("llen").time():
+            return self.redis_client.llen(self.key)
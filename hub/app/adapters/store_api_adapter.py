@@ -1,43 +1,46 @@
-import json
 import logging
+import time
 from typing import List
 import requests
 
-from app.entities.processed_agent_data import ProcessedAgentData
-
-from app.interfaces.store_api_gateway import StoreGateway
+from app.entities.serialization import encode_batch
+from app.instrumentation import STORE_REQUEST_SECONDS
+from app.interfaces.store_api_gateway import SaveResult, StoreGateway
 
 
 class StoreApiAdapter(StoreGateway):
     def __init__(self, api_base_url):
         self.api_base_url = api_base_url
 
-    def save_data(self, processed_agent_data_batch: List[ProcessedAgentData]):
+    def save_data(self, processed_agent_data_batch: List[bytes]) -> SaveResult:
         """
         Save the processed road data to the Store API.
         Parameters:
-            processed_agent_data_batch (dict): Processed road data to be saved.
+            processed_agent_data_batch (List[bytes]): Processed road data to be saved.
         Returns:
-            bool: True if the data is successfully saved, False otherwise.
+            SaveResult: SAVED if the data is successfully saved, REJECTED if the store refused it
+                with a client error, FAILED otherwise.
         """
 
-        # Make a POST request to the Store API endpoint with the processed data
-        url = f"{self.api_base_url}/processed_agent_data"
+        # Make a POST request to the Store API endpoint with the processed data, readings already stored are skipped
+        url = f"{self.api_base_url}/processed_agent_data/"
         headers = {"Content-Type": "application/json"}
-        # Convert datetime objects to strings
-        processed_data_list = [{
-            "road_state": data.road_state,
-            "agent_data": {
-                "accelerometer": data.agent_data.accelerometer.dict(),
-                "gps": data.agent_data.gps.dict(),
-                "timestamp": data.agent_data.timestamp.isoformat()
-            }
-        } for data in processed_agent_data_batch]
-        data = json.dumps(processed_data_list)
-        response = requests.post(url, headers=headers, data=data)
+        # The records are already validated JSON, join them into an array
+        data = encode_batch(processed_agent_data_batch)
+        started = time.perf_counter()
+        try:
+            response = requests.post(url, headers=headers, data=data)
+        except requests.RequestException as e:
+            STORE_REQUEST_SECONDS.labels("unreachable").observe(time.perf_counter() - started)
+            logging.error(f"Failed to reach the Store API: {e}")
+            return SaveResult.FAILED
+        outcome = "saved" if response.status_code == 200 else "rejected"
+        STORE_REQUEST_SECONDS.labels(outcome).observe(time.perf_counter() - started)
         if response.status_code == 200:
             logging.info("Data saved successfully")
-            return True
+            return SaveResult.SAVED
         else:
             logging.error(f"Failed to save data: {response.text}")
-            return False
+            if response.status_code < 500 and response.status_code != 429:
+                return SaveResult.REJECTED
+            return SaveResult.FAILED
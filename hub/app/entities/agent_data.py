@@ -14,6 +14,8 @@ class GpsData(BaseModel):
 
 
 class AgentData(BaseModel):
+    # Vehicle the readings come from, raw streams are classified per vehicle
+    user_id: int = 0
     accelerometer: AccelerometerData
     gps: GpsData
     timestamp: datetime
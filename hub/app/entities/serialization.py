@@ -0,0 +1,88 @@
+import re
+from typing import List, Optional
+
+import orjson
+from pydantic import TypeAdapter
+
+from app.entities.agent_data import AgentData
+from app.entities.processed_agent_data import ProcessedAgentData
+
+# Validators are built once; constructing a TypeAdapter per call is expensive
+processed_agent_data_adapter = TypeAdapter(ProcessedAgentData)
+processed_agent_data_list_adapter = TypeAdapter(List[ProcessedAgentData])
+agent_data_adapter = TypeAdapter(AgentData)
+agent_data_list_adapter = TypeAdapter(List[AgentData])
+# Between two objects of an array, or inside a string or an unknown nested array of one, see _split_array
+OBJECT_SEPARATOR = re.compile(rb"}\s*,\s*{")
+# The first user_id of a payload, searched for without parsing it
+USER_ID = re.compile(rb'"user_id"\s*:\s*(-?\d+)')
+
+
+def validate_payload(payload: bytes) -> List[bytes]:
+    """
+    Validate a payload holding one ProcessedAgentData object or an array of them.
+    The records are not turned into models for the rest of the pipeline: a
+    single object is passed on as the received bytes, and so are the
+    elements of an array, sliced out of it.
+    Parameters:
+        payload (bytes): Raw JSON received over MQTT or HTTP.
+    Returns:
+        List[bytes]: One compact JSON document per validated record.
+    Raises:
+        pydantic.ValidationError: If any record is invalid.
+    """
+    payload = payload.strip()
+    if payload[:1] == b"[":
+        count = len(processed_agent_data_list_adapter.validate_json(payload, strict=True))
+        return _split_array(payload, count)
+    processed_agent_data_adapter.validate_json(payload, strict=True)
+    return [payload]
+
+
+def parse_agent_data(payload: bytes) -> List[dict]:
+    """
+    Validate a payload holding one raw AgentData object or an array of them.
+    Parameters:
+        payload (bytes): Raw JSON received over MQTT or HTTP.
+    Returns:
+        List[dict]: The validated records as parsed JSON objects.
+    Raises:
+        pydantic.ValidationError: If any record is invalid.
+    """
+    payload = payload.strip()
+    if payload[:1] == b"[":
+        agent_data_list_adapter.validate_json(payload, strict=True)
+        return orjson.loads(payload)
+    agent_data_adapter.validate_json(payload, strict=True)
+    return [orjson.loads(payload)]
+
+
+def _split_array(payload: bytes, count: int) -> List[bytes]:
+    # Every boundary between the objects matches the separator; unless something else did too, the matches
+    # are exactly the boundaries. Otherwise the elements are re-encoded, which only odd payloads need
+    inner = payload[1:-1].strip()
+    separators = list(OBJECT_SEPARATOR.finditer(inner))
+    if len(separators) != count - 1:
+        return [orjson.dumps(record) for record in orjson.loads(payload)]
+    starts = [0] + [separator.end() - 1 for separator in separators]
+    ends = [separator.start() + 1 for separator in separators] + [len(inner)]
+    return [inner[start:end] for start, end in zip(starts, ends)]
+
+
+def vehicle_key(payload: bytes) -> Optional[str]:
+    """
+    The user_id of the vehicle a payload comes from, before it is validated.
+    Agents send one vehicle's readings per message, so for an array this is
+    the first record's.
+    Returns:
+        Optional[str]: The user_id as sent, None if the payload names no vehicle.
+    """
+    match = USER_ID.search(payload)
+    return match.group(1).decode() if match else None
+
+
+def encode_batch(records: List[bytes]) -> bytes:
+    """
+    Join validated records into the JSON array body the store expects.
+    """
+    return b"[" + b",".join(records) + b"]"
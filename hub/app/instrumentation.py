@@ -0,0 +1,43 @@
+from prometheus_client import Counter, Gauge, Histogram
+
+# Validation of a single record takes microseconds, arrays of raw readings a few milliseconds
+FAST_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+BATCH_SIZE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+# MQTT intake
+MQTT_MESSAGES_RECEIVED = Counter("hub_mqtt_messages_received", "MQTT messages received", ["kind"])
+MQTT_MESSAGES_INVALID = Counter("hub_mqtt_messages_invalid", "MQTT messages dropped as invalid", ["kind"])
+VALIDATION_SECONDS = Histogram(
+    "hub_validation_seconds", "Time spent validating one MQTT message", ["kind"],
+    buckets=FAST_BUCKETS,
+)
+WORKER_QUEUE_DEPTH = Gauge("hub_worker_queue_depth", "MQTT messages waiting for a worker")
+# Batching, spill and store delivery
+BATCH_SIZE = Histogram("hub_batch_size", "Records per batch handed to the store or the spill", buckets=BATCH_SIZE_BUCKETS)
+BUFFERED_RECORDS = Gauge("hub_buffered_records", "Records waiting in the batch buffer")
+BATCHES_REJECTED = Counter("hub_batches_rejected", "Batches the store did not accept, moved to the spill")
+BATCHES_DEAD_LETTERED = Counter(
+    "hub_batches_dead_lettered", "Batches the store will not accept, moved to the dead-letter sink or dropped"
+)
+SPILLED_RECORDS = Gauge("hub_spilled_records", "Records waiting in the spill")
+DEAD_LETTER_RECORDS = Gauge("hub_dead_letter_records", "Records the store will not accept, kept for inspection")
+STORE_REQUEST_SECONDS = Histogram(
+    "hub_store_request_seconds", "Duration of one request to the store, by outcome", ["outcome"]
+)
+REDIS_OPERATION_SECONDS = Histogram(
+    "hub_redis_operation_seconds", "Duration of Redis spill and partition operations", ["operation"],
+    buckets=FAST_BUCKETS,
+)
+# Duplicate suppression
+DUPLICATES_DROPPED = Counter(
+    "hub_duplicates_dropped", "Readings dropped as already seen, by this hub's filter or the group's shared set",
+    ["source"],
+)
+DEDUP_ESTIMATED_FALSE_POSITIVE_RATE = Gauge(
+    "hub_dedup_false_positive_rate", "Estimated chance that the dedup filter drops a new reading"
+)
+DEDUP_MEMORY_BYTES = Gauge("hub_dedup_memory_bytes", "Memory of the dedup filter")
+# Scale-out group
+PARTITIONS_OWNED = Gauge("hub_partitions_owned", "Partitions this hub delivers for its group")
+PARTITION_MOVES = Counter("hub_partition_moves", "Partitions this hub acquired, released or lost", ["reason"])
+
@@ -0,0 +1,29 @@
+from abc import ABC, abstractmethod
+from typing import List
+
+
+class DedupGateway(ABC):
+    """
+    Abstract class representing a set of recently seen reading keys shared
+    by several hubs. Keys are forgotten once the dedup window has passed.
+    """
+
+    @abstractmethod
+    def claim(self, keys: List[bytes]) -> List[bool]:
+        """
+        Method to add keys to the set, each one only if it is not there yet.
+        Parameters:
+            keys (List[bytes]): Keys of the readings, all distinct.
+        Returns:
+            List[bool]: For every key, True if it was added, False if another call claimed it first.
+        """
+        pass
+
+    @abstractmethod
+    def release(self, keys: List[bytes]) -> None:
+        """
+        Method to remove keys claimed by readings that could not be accepted after all.
+        Parameters:
+            keys (List[bytes]): Keys returned as added by claim.
+        """
+        pass
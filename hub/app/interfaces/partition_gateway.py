@@ -0,0 +1,126 @@
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+
+@dataclass
+class PartitionEntry:
+    """
+    A record kept in a partition log. raw records are AgentData still to be
+    classified, the others ProcessedAgentData; time is the reading's own
+    timestamp in seconds, used to restore per-vehicle order.
+    """
+    record: bytes
+    raw: bool
+    time: float
+    # Set on entries read back from the log
+    entry_id: Optional[bytes] = None
+    # Seconds since the epoch at which the entry was appended
+    added: Optional[float] = None
+
+
+class PartitionGateway(ABC):
+    """
+    Abstract class representing the storage shared by a group of hubs: group
+    membership, one lease per partition and an append-only log per partition.
+    Entries leave a log only when removed by the member holding its lease.
+    """
+
+    @abstractmethod
+    def time(self) -> float:
+        """
+        Method to get the storage's current time, the clock of membership expiry and of entries' added times.
+        Returns:
+            float: Seconds since the epoch.
+        """
+        pass
+
+    @abstractmethod
+    def heartbeat(self, member: str, ttl: float) -> int:
+        """
+        Method to announce that a member is alive for another ttl seconds.
+        Parameters:
+            member (str): Name of the hub.
+            ttl (float): Seconds after which the member counts as gone without another heartbeat.
+        Returns:
+            int: Number of live members, this one included.
+        """
+        pass
+
+    @abstractmethod
+    def leave(self, member: str) -> None:
+        """
+        Method to remove a member from the group right away.
+        Parameters:
+            member (str): Name of the hub.
+        """
+        pass
+
+    @abstractmethod
+    def acquire(self, partition: int, member: str, ttl: float) -> bool:
+        """
+        Method to take the lease of a partition nobody holds.
+        Parameters:
+            partition (int): The partition.
+            member (str): Name of the hub.
+            ttl (float): Seconds the lease lasts unless renewed.
+        Returns:
+            bool: True if the member now holds the lease.
+        """
+        pass
+
+    @abstractmethod
+    def renew(self, partition: int, member: str, ttl: float) -> bool:
+        """
+        Method to extend a lease the member holds.
+        Returns:
+            bool: False if the lease expired and the partition may have moved to another member.
+        """
+        pass
+
+    @abstractmethod
+    def release(self, partition: int, member: str) -> None:
+        """
+        Method to give a lease up, if the member still holds it.
+        """
+        pass
+
+    @abstractmethod
+    def append(self, entries: Dict[int, List[PartitionEntry]]) -> None:
+        """
+        Method to append entries to the tails of partition logs, all in one call.
+        Parameters:
+            entries (Dict[int, List[PartitionEntry]]): Entries by partition, in arrival order.
+        """
+        pass
+
+    @abstractmethod
+    def read(self, partitions: Dict[int, Optional[bytes]], count: int,
+             before: float) -> Dict[int, List[PartitionEntry]]:
+        """
+        Method to read the oldest entries of several partition logs.
+        Parameters:
+            partitions (Dict[int, Optional[bytes]]): Partitions to read, each with the id of the
+                last entry already read, or None to read from the head.
+            count (int): Maximum number of entries per partition.
+            before (float): Only read entries appended up to this time of the storage's clock.
+        Returns:
+            Dict[int, List[PartitionEntry]]: The entries by partition, in log order.
+        """
+        pass
+
+    @abstractmethod
+    def remove(self, partition: int, member: str, entry_ids: List[bytes]) -> bool:
+        """
+        Method to remove delivered entries from a partition log.
+        Returns:
+            bool: False, removing nothing, if the member no longer holds the partition's lease.
+        """
+        pass
+
+    @abstractmethod
+    def size(self, partition: int) -> int:
+        """
+        Method to get the number of entries in a partition log.
+        """
+        pass
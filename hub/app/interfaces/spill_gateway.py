@@ -0,0 +1,54 @@
+from abc import ABC, abstractmethod
+from typing import List
+
+
+class SpillGateway(ABC):
+    """
+    Abstract class representing durable overflow storage for batches that
+    could not be delivered to the store yet. Items are serialized records
+    kept in FIFO order.
+    """
+
+    @abstractmethod
+    def append(self, processed_agent_data_batch: List[bytes]) -> None:
+        """
+        Method to append a batch to the tail of the spill.
+        Parameters:
+            processed_agent_data_batch (List[bytes]): The batch to keep.
+        """
+        pass
+
+    @abstractmethod
+    def peek(self, count: int) -> List[bytes]:
+        """
+        Method to read up to count items from the head without removing them.
+        Parameters:
+            count (int): Maximum number of items to read.
+        Returns:
+            List[bytes]: The oldest spilled items.
+        """
+        pass
+
+    @abstractmethod
+    def ack(self, count: int) -> None:
+        """
+        Method to remove count items from the head once they have been delivered.
+        Parameters:
+            count (int): Number of items to remove.
+        """
+        pass
+
+    def close(self) -> None:
+        """
+        Method to release the spill's resources, called once on shutdown.
+        """
+        pass
+
+    @abstractmethod
+    def size(self) -> int:
+        """
+        Method to get the number of spilled items.
+        Returns:
+            int: Number of items waiting in the spill.
+        """
+        pass
@@ -1,22 +1,48 @@
 from abc import ABC, abstractmethod
-from typing import List
+from enum import Enum
+from typing import Callable, List
 
-from app.entities.processed_agent_data import ProcessedAgentData
+
+class SaveResult(Enum):
+    """
+    Outcome of delivering a batch to the store. Only SAVED is truthy.
+    FAILED batches may be accepted later, e.g. once the store is reachable
+    again; REJECTED ones never will be, as the store refused their content.
+    """
+    SAVED = "saved"
+    FAILED = "failed"
+    REJECTED = "rejected"
+
+    def __bool__(self) -> bool:
+        return self is SaveResult.SAVED
 
 
 class StoreGateway(ABC):
     """
     Abstract class representing the Store Gateway interface.
     All store gateway adapters must implement these methods.
+    Batches are lists of validated ProcessedAgentData records serialized as JSON bytes.
     """
 
     @abstractmethod
-    def save_data(self, processed_agent_data_batch: List[ProcessedAgentData]) -> bool:
+    def save_data(self, processed_agent_data_batch: List[bytes]) -> SaveResult:
         """
         Method to save the processed agent data in the database.
         Parameters:
-            processed_agent_data_batch (ProcessedAgentData): The processed agent data to be saved.
+            processed_agent_data_batch (List[bytes]): The processed agent data to be saved.
         Returns:
-            bool: True if the data is successfully saved, False otherwise.
+            SaveResult: SAVED if the data is successfully saved, REJECTED if the store will never
+                accept it, FAILED otherwise.
         """
         pass
+
+    def submit(self, processed_agent_data_batch: List[bytes], on_done: Callable[[SaveResult], None]) -> None:
+        """
+        Method to hand a batch over for delivery without waiting for the result.
+        Adapters that can keep several batches in flight override this; the
+        default delivers synchronously.
+        Parameters:
+            processed_agent_data_batch (List[bytes]): The processed agent data to be saved.
+            on_done (Callable[[SaveResult], None]): Called with the save_data result once delivery finished.
+        """
+        on_done(self.save_data(processed_agent_data_batch))
@@ -0,0 +1,256 @@
+import logging
+import threading
+import time
+from collections import deque
+from typing import Callable, List, Optional
+
+from app.instrumentation import BATCH_SIZE, BATCHES_DEAD_LETTERED, BATCHES_REJECTED
+from app.interfaces.spill_gateway import SpillGateway
+from app.interfaces.store_api_gateway import SaveResult, StoreGateway
+
+
+class BatchBuffer:
+    """
+    In-process buffer that groups serialized processed agent data records into
+    batches for the store.
+    A batch is flushed when it reaches batch_size items or when its oldest item
+    has waited max_linger seconds. Batches are handed to the store gateway
+    without waiting for the response; those the store could not accept yet
+    are appended to the spill and replayed, in order, before any newer batch.
+    Each item may carry an on_durable callback, called once the item has
+    been accepted by the store or written to the spill or the dead-letter sink.
+    The spill is replayed on a thread of its own, at most replay_rate batches
+    per second (0 for no limit), so a recovering store is not flooded and new
+    batches are never held up behind the replay.
+    Batches the store rejects permanently go to the dead-letter sink, or are
+    dropped without one. A spilled batch the store keeps failing while it
+    accepts others does too, after max_attempts replays (0 retries it
+    forever). While the head of the spill is stuck, new batches bypass the
+    spill once the store is seen accepting them, giving up ordering so that
+    one bad batch does not hold back delivery.
+    """
+
+    def __init__(self, store_gateway: StoreGateway, spill_gateway: SpillGateway, batch_size: int,
+                 max_linger: float, replay_rate: float = 0.0, max_attempts: int = 0,
+                 dead_letter_gateway: Optional[SpillGateway] = None):
+        self.store_gateway = store_gateway
+        self.spill_gateway = spill_gateway
+        self.batch_size = batch_size
+        self.max_linger = max_linger
+        self.replay_rate = replay_rate
+        self.max_attempts = max_attempts
+        self.dead_letter_gateway = dead_letter_gateway
+        self._items: List[bytes] = []
+        self._callbacks: List[Callable[[], None]] = []
+        self._oldest_at: Optional[float] = None
+        self._lock = threading.Lock()
+        # Serializes deliveries so batches reach the store in arrival order
+        self._send_lock = threading.Lock()
+        self._spilled = False
+        # Batches whose delivery failed, moved to the spill off the gateway's thread
+        self._failed = deque()
+        # Batches the store rejected for good, moved to the dead-letter sink off the gateway's thread
+        self._rejected = deque()
+        # Replays of the spill's head that failed while the store accepted other batches
+        self._head_attempts = 0
+        self._head_stuck = False
+        # Whether the store accepted the last batch sent directly, and any batch since the last replay
+        self._store_up = False
+        self._accepted = False
+        # A direct batch sent to find out whether the store is up again while the head is stuck
+        self._probing = False
+        self._in_flight = 0
+        self._in_flight_changed = threading.Condition()
+        self._stopped = threading.Event()
+        self._linger_thread: Optional[threading.Thread] = None
+        self._replay_thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._spilled = self.spill_gateway.size() > 0
+        self._stopped.clear()
+        self._linger_thread = threading.Thread(target=self._linger_loop, name="batch-linger", daemon=True)
+        self._linger_thread.start()
+        self._replay_thread = threading.Thread(target=self._replay_loop, name="spill-replay", daemon=True)
+        self._replay_thread.start()
+
+    def stop(self, timeout: float = 30.0):
+        self._stopped.set()
+        for thread in (self._linger_thread, self._replay_thread):
+            if thread is not None:
+                thread.join()
+        self.flush()
+        with self._in_flight_changed:
+            self._in_flight_changed.wait_for(lambda: self._in_flight == 0, timeout=timeout)
+        with self._send_lock:
+            self._spill_failed()
+            self._dead_letter_rejected()
+
+    def add(self, record: bytes, on_durable: Optional[Callable[[], None]] = None):
+        self.add_many([record], on_durable)
+
+    def add_many(self, records: List[bytes], on_durable: Optional[Callable[[], None]] = None):
+        """
+        Buffer records that arrived together, e.g. one MQTT message.
+        on_durable is called once, after every one of the records is durable.
+        """
+        if on_durable is not None and len(records) > 1:
+            on_durable = _countdown(len(records), on_durable)
+        batches = []
+        with self._lock:
+            for record in records:
+                if not self._items:
+                    self._oldest_at = time.monotonic()
+                self._items.append(record)
+                if on_durable is not None:
+                    self._callbacks.append(on_durable)
+                if len(self._items) >= self.batch_size:
+                    batches.append(self._take())
+        for batch, callbacks in batches:
+            self._deliver(batch, callbacks)
+
+    def flush(self):
+        with self._lock:
+            batch, callbacks = self._take()
+        if batch:
+            self._deliver(batch, callbacks)
+
+    def pending(self) -> int:
+        return len(self._items)
+
+    def _take(self):
+        batch, self._items = self._items, []
+        callbacks, self._callbacks = self._callbacks, []
+        self._oldest_at = None
+        return batch, callbacks
+
+    def _linger_loop(self):
+        while not self._stopped.wait(self.max_linger / 2):
+            oldest_at = self._oldest_at
+            if oldest_at is not None and time.monotonic() - oldest_at >= self.max_linger:
+                self.flush()
+
+    def _replay_loop(self):
+        while not self._stopped.wait(self.max_linger / 2):
+            # Failed batches may be waiting even after the flag was cleared
+            if self._spilled or self._failed or self._rejected:
+                self._drain_spill()
+
+    def _deliver(self, batch: List[bytes], callbacks: List[Callable[[], None]]):
+        BATCH_SIZE.observe(len(batch))
+        with self._send_lock:
+            if (self._spilled or self._failed) and not self._bypass():
+                # Older batches are waiting, keep ordering by queueing behind them
+                self._spill_failed()
+                self.spill_gateway.append(batch)
+                _notify(callbacks)
+                return
+            with self._in_flight_changed:
+                self._in_flight += 1
+            self.store_gateway.submit(batch, lambda result: self._on_delivered(batch, callbacks, result))
+
+    def _bypass(self) -> bool:
+        # Called with the send lock held
+        if not self._head_stuck or self._failed:
+            return False
+        if self._store_up:
+            return True
+        # One batch at a time finds out whether the store is up, the others are spilled meanwhile
+        if self._probing:
+            return False
+        self._probing = True
+        return True
+
+    def _on_delivered(self, batch: List[bytes], callbacks: List[Callable[[], None]], result: SaveResult):
+        # Runs on the gateway's thread, so it must not block on the spill
+        self._probing = False
+        if result is SaveResult.SAVED:
+            self._store_up = True
+            self._accepted = True
+            _notify(callbacks)
+        elif result is SaveResult.REJECTED:
+            self._rejected.append((batch, callbacks))
+        else:
+            logging.info(f"Store rejected batch of {len(batch)}, spilling")
+            BATCHES_REJECTED.inc()
+            self._store_up = False
+            self._failed.append((batch, callbacks))
+            self._spilled = True
+        with self._in_flight_changed:
+            self._in_flight -= 1
+            self._in_flight_changed.notify_all()
+
+    def _spill_failed(self):
+        while self._failed:
+            batch, callbacks = self._failed.popleft()
+            self.spill_gateway.append(batch)
+            _notify(callbacks)
+
+    def _dead_letter_rejected(self):
+        while self._rejected:
+            batch, callbacks = self._rejected.popleft()
+            self._dead_letter(batch)
+            _notify(callbacks)
+
+    def _dead_letter(self, batch: List[bytes]):
+        BATCHES_DEAD_LETTERED.inc()
+        if self.dead_letter_gateway is None:
+            logging.error(f"Store will not accept batch of {len(batch)}, dropping it")
+            return
+        logging.error(f"Store will not accept batch of {len(batch)}, moving it to the dead-letter sink")
+        self.dead_letter_gateway.append(batch)
+
+    def _drain_spill(self):
+        # Only the replay thread drains, so the head batch cannot change between peek and ack
+        while not self._stopped.is_set():
+            with self._send_lock:
+                self._spill_failed()
+                self._dead_letter_rejected()
+                batch = self.spill_gateway.peek(self.batch_size)
+                if not batch:
+                    self._spilled = False
+                    self._head_stuck = False
+                    return
+            # Whether the store accepted anything between this replay and the last one
+            accepted, self._accepted = self._accepted, False
+            # New batches keep going to the spill's tail while this one is sent
+            result = self.store_gateway.save_data(processed_agent_data_batch=batch)
+            if result is SaveResult.SAVED:
+                self._store_up = True
+            elif result is SaveResult.FAILED:
+                self._head_stuck = True
+                if accepted:
+                    self._head_attempts += 1
+                if not self.max_attempts or self._head_attempts < self.max_attempts:
+                    return
+                logging.error(f"Spilled batch failed {self._head_attempts} replays while the store was up")
+            with self._send_lock:
+                if result is not SaveResult.SAVED:
+                    self._dead_letter(batch)
+                self.spill_gateway.ack(len(batch))
+                self._head_attempts = 0
+                self._head_stuck = False
+            if self.replay_rate > 0:
+                self._stopped.wait(1 / self.replay_rate)
+
+
+def _notify(callbacks: List[Callable[[], None]]):
+    for callback in callbacks:
+        try:
+            callback()
+        except Exception as e:
+            logging.info(f"Durability callback failed: {e}")
+
+
+def _countdown(count: int, callback: Callable[[], None]) -> Callable[[], None]:
+    # Wraps callback so it only fires on the count-th call
+    remaining = [count]
+    lock = threading.Lock()
+
+    def tick():
+        with lock:
+            remaining[0] -= 1
+            done = remaining[0] == 0
+        if done:
+            callback()
+
+    return tick
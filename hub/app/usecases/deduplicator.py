@@ -0,0 +1,228 @@
+import hashlib
+import logging
+import math
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Tuple
+
+import numpy as np
+import orjson
+
+from app.instrumentation import DUPLICATES_DROPPED
+from app.interfaces.dedup_gateway import DedupGateway
+
+# Bytes of the hash a reading is known by, in the filter and the shared set
+KEY_SIZE = 16
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+class RotatingBloomFilter:
+    """
+    Bloom filter over the keys of the last window to two windows, in two
+    generations: keys are added to the current one and looked up in both,
+    and every window the older generation is cleared and becomes current.
+    A generation also rotates early once it holds capacity keys, so the
+    false positive rate stays at most false_positive_rate; each generation
+    is sized for half of it, as a lookup tries both.
+    """
+
+    def __init__(self, capacity: int, false_positive_rate: float, window: float):
+        if not 0 < false_positive_rate < 1:
+            raise ValueError("false_positive_rate must be between 0 and 1")
+        self.capacity = capacity
+        self.false_positive_rate = false_positive_rate
+        self.window = window
+        rate = false_positive_rate / 2
+        self.bits = max(math.ceil(-capacity * math.log(rate) / math.log(2) ** 2), 64)
+        self.hashes = max(round(self.bits / capacity * math.log(2)), 1)
+        self._current = np.zeros((self.bits + 7) // 8, dtype=np.uint8)
+        self._previous = np.zeros_like(self._current)
+        self._counts = [0, 0]
+        self._rotated_at = time.monotonic()
+        self.rotations = 0
+
+    def contains(self, digests: np.ndarray) -> np.ndarray:
+        """
+        Parameters:
+            digests (np.ndarray): KEY_SIZE-byte hashes of the keys, as rows of two uint64.
+        Returns:
+            np.ndarray: For every key, True if it may have been added before.
+        """
+        self._expire()
+        positions = self._positions(digests)
+        masks = (1 << (positions & 7)).astype(np.uint8)
+        found = np.zeros(len(digests), dtype=bool)
+        for generation in (self._current, self._previous):
+            found |= np.all(generation[positions >> 3] & masks, axis=1)
+        return found
+
+    def add(self, digests: np.ndarray):
+        self._expire()
+        if self._counts[0] + len(digests) > self.capacity:
+            self._rotate()
+        positions = self._positions(digests).ravel()
+        np.bitwise_or.at(self._current, positions >> 3, (1 << (positions & 7)).astype(np.uint8))
+        self._counts[0] += len(digests)
+
+    def estimated_false_positive_rate(self) -> float:
+        # Chance that every probed bit of a new key is set in either generation, from the number of keys added
+        rates = [(1 - math.exp(-self.hashes * count / self.bits)) ** self.hashes for count in self._counts]
+        return 1 - (1 - rates[0]) * (1 - rates[1])
+
+    def memory(self) -> int:
+        return self._current.nbytes + self._previous.nbytes
+
+    def _positions(self, digests: np.ndarray) -> np.ndarray:
+        # Double hashing, the i-th probe of a key is h1 + i * h2; uint64 arithmetic wraps around
+        probes = np.arange(self.hashes, dtype=np.uint64)
+        return (digests[:, :1] + probes * digests[:, 1:]) % np.uint64(self.bits)
+
+    def _expire(self):
+        if time.monotonic() - self._rotated_at >= self.window:
+            self._rotate()
+
+    def _rotate(self):
+        self._current, self._previous = self._previous, self._current
+        self._current[:] = 0
+        self._counts = [0, self._counts[0]]
+        self._rotated_at = time.monotonic()
+        self.rotations += 1
+
+
+class Deduplicator:
+    """
+    Drops readings the hub has already accepted within the dedup window, as
+    delivered again by MQTT QoS 1, agents reconnecting or clients retrying.
+    A reading is known by a hash of the key the store identifies it by, a
+    vehicle's user_id and the instant of its timestamp, so a second reading
+    of a vehicle at the same timestamp counts as a duplicate whatever its
+    values or timestamp format. Readings are looked up in a rotating Bloom
+    filter, whose false positives drop a new reading now and then, at the
+    configured rate; with a shared gateway, those the filter passes are also
+    claimed in the set all hubs of a group share.
+    claim and remember are separate so that readings which could not be
+    accepted, e.g. with Redis down, are not taken as seen when redelivered.
+    Until then their keys are pending: the check against the filter and the
+    pending keys and the claim happen under one lock, so copies handled by
+    two threads at once are not both passed on.
+    """
+
+    def __init__(self, capacity: int, false_positive_rate: float, window: float,
+                 shared_gateway: Optional[DedupGateway] = None):
+        self.filter = RotatingBloomFilter(capacity, false_positive_rate, window)
+        self.shared_gateway = shared_gateway
+        self._lock = threading.Lock()
+        self._pending = set()
+        self.seen = 0
+        self.dropped_local = 0
+        self.dropped_shared = 0
+
+    def claim(self, records: list, raw: bool) -> Tuple[list, np.ndarray]:
+        """
+        Drop the records that were seen before.
+        Parameters:
+            records (list): AgentData as parsed JSON objects if raw, else ProcessedAgentData JSON documents.
+            raw (bool): Which of the two the records are.
+        Returns:
+            Tuple[list, np.ndarray]: The new records, and their keys to pass to remember once they are
+                accepted, or to release if they are not.
+        """
+        if not records:
+            return records, np.empty((0, 2), dtype=np.uint64)
+        digests = np.frombuffer(b"".join(
+            reading_key(record if raw else orjson.loads(record)["agent_data"]) for record in records
+        ), dtype=np.uint64).reshape(-1, 2)
+        # Copies within one message are duplicates of its first reading
+        firsts = np.zeros(len(records), dtype=bool)
+        firsts[np.unique(digests, axis=0, return_index=True)[1]] = True
+        with self._lock:
+            found = self.filter.contains(digests)
+            for position in np.flatnonzero(firsts & ~found):
+                key = digests[position].tobytes()
+                if key in self._pending:
+                    found[position] = True
+                else:
+                    self._pending.add(key)
+        fresh = firsts & ~found
+        local_duplicates = len(records) - int(fresh.sum())
+        shared_duplicates = 0
+        if self.shared_gateway is not None and local_duplicates < len(records):
+            positions = np.flatnonzero(fresh)
+            try:
+                claimed = np.array(self.shared_gateway.claim([digests[position].tobytes() for position in positions]))
+            except Exception as e:
+                # Without the shared set only this hub's own duplicates are caught
+                logging.error(f"Shared dedup set unavailable: {e!r}")
+                claimed = np.ones(len(positions), dtype=bool)
+            fresh[positions[~claimed]] = False
+            shared_duplicates = int((~claimed).sum())
+        with self._lock:
+            if shared_duplicates:
+                # Claimed by another hub first, this one never accepts them
+                self._pending.difference_update(digests[position].tobytes() for position in positions[~claimed])
+            self.seen += len(records)
+            self.dropped_local += local_duplicates
+            self.dropped_shared += shared_duplicates
+        if local_duplicates:
+            DUPLICATES_DROPPED.labels("local").inc(local_duplicates)
+        if shared_duplicates:
+            DUPLICATES_DROPPED.labels("shared").inc(shared_duplicates)
+        return [record for record, keep in zip(records, fresh) if keep], digests[fresh]
+
+    def remember(self, keys: np.ndarray):
+        if len(keys):
+            with self._lock:
+                self.filter.add(keys)
+                self._pending.difference_update(key.tobytes() for key in keys)
+
+    def release(self, keys: np.ndarray):
+        if len(keys):
+            with self._lock:
+                self._pending.difference_update(key.tobytes() for key in keys)
+        if self.shared_gateway is not None and len(keys):
+            try:
+                self.shared_gateway.release([key.tobytes() for key in keys])
+            except Exception as e:
+                logging.error(f"Could not release shared dedup keys: {e!r}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "seen": self.seen,
+                "dropped_local": self.dropped_local,
+                "dropped_shared": self.dropped_shared,
+                "shared": self.shared_gateway is not None,
+                "window": self.filter.window,
+                "capacity": self.filter.capacity,
+                "false_positive_rate": self.filter.false_positive_rate,
+                "estimated_false_positive_rate": self.filter.estimated_false_positive_rate(),
+                "memory_bytes": self.filter.memory(),
+                "hashes": self.filter.hashes,
+                "rotations": self.filter.rotations,
+            }
+
+
+def reading_key(agent_data: dict) -> bytes:
+    """
+    Hash of the key the store identifies a reading by.
+    Parameters:
+        agent_data (dict): AgentData as a parsed JSON object.
+    Returns:
+        bytes: KEY_SIZE bytes.
+    Raises:
+        ValueError: If the timestamp is not in ISO 8601 format.
+    """
+    identity = (agent_data.get("user_id", 0), timestamp_micros(agent_data["timestamp"]))
+    return hashlib.blake2b(orjson.dumps(identity), digest_size=KEY_SIZE).digest()
+
+
+def timestamp_micros(timestamp: str) -> int:
+    """
+    Microseconds since the epoch of an ISO 8601 timestamp, the same for every way of writing one instant.
+    Timestamps without an offset are taken as UTC.
+    """
+    parsed = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return (parsed - EPOCH) // timedelta(microseconds=1)
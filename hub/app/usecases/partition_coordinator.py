@@ -0,0 +1,90 @@
+import logging
+import math
+import threading
+import zlib
+from typing import Callable, Optional, Set
+
+from app.instrumentation import PARTITION_MOVES
+from app.interfaces.partition_gateway import PartitionGateway
+
+
+class PartitionCoordinator:
+    """
+    Spreads the partitions of a group of hubs over its live members.
+    Every lease_ttl / 3 seconds the coordinator renews its member heartbeat
+    and its leases, gives up partitions beyond its fair share of
+    ceil(partitions / members) and takes free ones up to it. Partitions of
+    a hub that died become free once its leases expire, so they move to the
+    surviving hubs within lease_ttl plus one round.
+    on_assigned is called before a partition is worked on, on_revoked must
+    stop all work on it before returning, for leases given up as well as lost.
+    """
+
+    def __init__(self, gateway: PartitionGateway, member: str, partitions: int, lease_ttl: float,
+                 on_assigned: Callable[[int], None], on_revoked: Callable[[int], None]):
+        self.gateway = gateway
+        self.member = member
+        self.partitions = partitions
+        self.lease_ttl = lease_ttl
+        self.on_assigned = on_assigned
+        self.on_revoked = on_revoked
+        self._owned: Set[int] = set()
+        # Members try free partitions starting at different positions, so they rarely race for the same
+        self._offset = zlib.crc32(member.encode()) % partitions
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="partition-coordinator", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        # Hand everything over right away instead of letting the leases run out
+        for partition in sorted(self._owned):
+            self._give_up(partition)
+        self.gateway.leave(self.member)
+
+    def owned(self) -> Set[int]:
+        return set(self._owned)
+
+    def _run(self):
+        while True:
+            try:
+                self.rebalance()
+            except Exception as e:
+                # Storage unreachable; leases that run out meanwhile are detected on the next round
+                logging.error(f"Partition rebalance failed: {e!r}")
+            if self._stopped.wait(self.lease_ttl / 3):
+                return
+
+    def rebalance(self):
+        members = self.gateway.heartbeat(self.member, self.lease_ttl)
+        share = math.ceil(self.partitions / max(members, 1))
+        for partition in sorted(self._owned):
+            if not self.gateway.renew(partition, self.member, self.lease_ttl):
+                logging.info(f"Lost the lease of partition {partition}")
+                self._owned.discard(partition)
+                PARTITION_MOVES.labels("lost").inc()
+                self.on_revoked(partition)
+        # Give the surplus up, highest partitions first
+        for partition in sorted(self._owned, reverse=True)[:max(len(self._owned) - share, 0)]:
+            self._give_up(partition)
+        for step in range(self.partitions):
+            if len(self._owned) >= share:
+                break
+            partition = (self._offset + step) % self.partitions
+            if partition not in self._owned and self.gateway.acquire(partition, self.member, self.lease_ttl):
+                self._owned.add(partition)
+                PARTITION_MOVES.labels("acquired").inc()
+                self.on_assigned(partition)
+
+    def _give_up(self, partition: int):
+        # Work stops before the lease goes, so the next owner never overlaps with us
+        self._owned.discard(partition)
+        self.on_revoked(partition)
+        self.gateway.release(partition, self.member)
+        PARTITION_MOVES.labels("released").inc()
@@ -0,0 +1,261 @@
+import logging
+import queue
+import struct
+import threading
+import time
+import zlib
+from collections import deque
+from datetime import datetime, timezone
+from typing import Deque, Dict, List, Optional, Tuple
+
+import orjson
+
+from app.instrumentation import BATCH_SIZE, BATCHES_DEAD_LETTERED, BATCHES_REJECTED
+from app.interfaces.partition_gateway import PartitionEntry, PartitionGateway
+from app.interfaces.spill_gateway import SpillGateway
+from app.interfaces.store_api_gateway import SaveResult, StoreGateway
+from app.usecases.road_classifier import RoadStateClassifier
+
+
+class _Partition:
+    def __init__(self):
+        # Id of the last entry taken from the log
+        self.last_id: Optional[bytes] = None
+        # Batches taken from the log, each with the ids of its entries
+        self.batches: Deque[Tuple[List[bytes], List[bytes]]] = deque()
+        self.busy = False
+        self.retry_at = 0.0
+        self.failures = 0
+        # Failures of the head batch while the store accepted other batches, and the hub's count of
+        # accepted batches at the last failure
+        self.attempts = 0
+        self.saved_at_failure = 0
+        self.revoked = False
+
+
+class PartitionedDelivery:
+    """
+    Intake and delivery of a hub that is one of a scale-out group.
+    Intake appends each record to the log of its vehicle's partition,
+    user_id modulo partitions, whichever hub of the group received it.
+    Records without a user_id name no vehicle whose order to keep, so they
+    are spread over the partitions by a hash of their reading time.
+    Delivery works on the partitions assigned to this hub: entries are read
+    once they have been in the log for reorder_delay seconds, so records of
+    one vehicle that reached different hubs out of order are all there, put
+    back in timestamp order, classified if raw, and sent to the store in
+    batches of batch_size; partial batches once their oldest entry waited
+    another max_linger seconds. Every partition has at most one batch in
+    flight, keeping each vehicle's records in order, and a batch leaves the
+    log only after the store accepted it, so the log doubles as the spill.
+    A batch the store rejects permanently leaves the log for the dead-letter
+    sink, or is dropped without one, and so does a batch that failed
+    max_attempts times while the store accepted other batches (0 retries it
+    forever), so one bad batch does not hold back its partition for good.
+    """
+
+    def __init__(self, gateway: PartitionGateway, store_gateway: StoreGateway, classifier: RoadStateClassifier,
+                 member: str, partitions: int, batch_size: int, max_linger: float, reorder_delay: float,
+                 retry_backoff: float, max_read: int = 5000, max_attempts: int = 0,
+                 dead_letter_gateway: Optional[SpillGateway] = None):
+        self.gateway = gateway
+        self.store_gateway = store_gateway
+        self.classifier = classifier
+        self.member = member
+        self.partitions = partitions
+        self.batch_size = batch_size
+        self.max_linger = max_linger
+        self.reorder_delay = reorder_delay
+        self.retry_backoff = retry_backoff
+        self.max_read = max_read
+        self.max_attempts = max_attempts
+        self.dead_letter_gateway = dead_letter_gateway
+        # Batches the store accepted, only touched by the delivery thread
+        self._saved = 0
+        self._assigned: Dict[int, _Partition] = {}
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._completed: queue.SimpleQueue = queue.SimpleQueue()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="partition-delivery", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def append(self, records: list, raw: bool):
+        """
+        Append records that arrived together to their partitions' logs.
+        Parameters:
+            records (list): Validated AgentData as parsed JSON objects if raw, else ProcessedAgentData JSON documents.
+            raw (bool): Whether the records still have to be classified.
+        """
+        entries: Dict[int, List[PartitionEntry]] = {}
+        for record in records:
+            agent_data = record if raw else orjson.loads(record)["agent_data"]
+            reading_time = _seconds(agent_data["timestamp"])
+            entries.setdefault(self._partition(agent_data, reading_time), []).append(PartitionEntry(
+                record=orjson.dumps(record) if raw else record, raw=raw, time=reading_time,
+            ))
+        self.gateway.append(entries)
+
+    def _partition(self, agent_data: dict, reading_time: float) -> int:
+        user_id = agent_data.get("user_id") or 0
+        if user_id:
+            return user_id % self.partitions
+        # Hashed, as readings are often taken at a fixed interval
+        return zlib.crc32(struct.pack("<q", round(reading_time * 1_000_000))) % self.partitions
+
+    def assign(self, partition: int):
+        with self._lock:
+            self._assigned[partition] = _Partition()
+        self._wake.set()
+
+    def revoke(self, partition: int, timeout: float = 60.0):
+        # Waits for the partition's batch in flight, so it is removed from the log while the lease is still ours
+        with self._lock:
+            state = self._assigned.pop(partition, None)
+            if state is None:
+                return
+            state.revoked = True
+            self._idle.wait_for(lambda: not state.busy or self._stopped.is_set(), timeout=timeout)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "partitions": sorted(self._assigned),
+                "queued_batches": sum(len(state.batches) for state in self._assigned.values()),
+            }
+
+    def _run(self):
+        poll_interval = max(min(self.reorder_delay, self.max_linger) / 2, 0.01)
+        while not self._stopped.is_set():
+            try:
+                self._collect()
+                self._fill()
+                self._submit()
+            except Exception as e:
+                # Storage unreachable, entries stay in the logs until it is back
+                logging.error(f"Partition delivery failed: {e!r}")
+            self._wake.wait(poll_interval)
+            self._wake.clear()
+        self._collect()
+
+    def _fill(self):
+        # Entries carry the storage's clock, which may differ from ours
+        now = self.gateway.time()
+        with self._lock:
+            # Partitions still working through earlier entries are not read again yet
+            readable = {partition: state for partition, state in self._assigned.items() if not state.batches}
+        ready = self.gateway.read({partition: state.last_id for partition, state in readable.items()},
+                                  self.max_read, now - self.reorder_delay)
+        for partition, entries in ready.items():
+            if len(entries) < self.batch_size and entries[0].added > now - self.reorder_delay - self.max_linger:
+                # Let a partial batch linger
+                continue
+            batches = self._prepare(entries)
+            with self._lock:
+                state = readable[partition]
+                if not state.revoked:
+                    state.batches.extend(batches)
+                    state.last_id = entries[-1].entry_id
+
+    def _prepare(self, entries: List[PartitionEntry]) -> List[Tuple[List[bytes], List[bytes]]]:
+        # A stable sort by reading time restores each vehicle's order and keeps arrival order for ties
+        entries = sorted(entries, key=lambda entry: entry.time)
+        records = [entry.record for entry in entries]
+        raw = [index for index, entry in enumerate(entries) if entry.raw]
+        if raw:
+            classified = self.classifier.classify_records([orjson.loads(records[index]) for index in raw])
+            for index, record in zip(raw, classified):
+                records[index] = record
+        ids = [entry.entry_id for entry in entries]
+        return [(records[start:start + self.batch_size], ids[start:start + self.batch_size])
+                for start in range(0, len(records), self.batch_size)]
+
+    def _submit(self):
+        now = time.monotonic()
+        with self._lock:
+            due = [(partition, state) for partition, state in self._assigned.items()
+                   if state.batches and not state.busy and state.retry_at <= now]
+            for _, state in due:
+                state.busy = True
+        for partition, state in due:
+            batch, _ = state.batches[0]
+            BATCH_SIZE.observe(len(batch))
+            self.store_gateway.submit(batch, lambda result, partition=partition, state=state: self._done(
+                partition, state, result
+            ))
+
+    def _done(self, partition: int, state: _Partition, result: SaveResult):
+        # Runs on the gateway's thread, the log is updated on the delivery thread
+        self._completed.put((partition, state, result))
+        self._wake.set()
+
+    def _collect(self):
+        while True:
+            try:
+                partition, state, result = self._completed.get_nowait()
+            except queue.Empty:
+                return
+            batch, entry_ids = state.batches[0]
+            if result is SaveResult.SAVED:
+                self._saved += 1
+                self._remove(partition, state, entry_ids)
+            elif result is SaveResult.REJECTED or self._exhausted(state):
+                self._dead_letter(partition, batch)
+                self._remove(partition, state, entry_ids)
+            else:
+                BATCHES_REJECTED.inc()
+                state.failures += 1
+                # Exponential backoff, capped at a minute
+                state.retry_at = time.monotonic() + min(self.retry_backoff * 2 ** state.failures, 60.0)
+                logging.info(f"Store rejected a batch of partition {partition}, retrying")
+            with self._lock:
+                state.busy = False
+                self._idle.notify_all()
+
+    def _exhausted(self, state: _Partition) -> bool:
+        # Failures only count while the store accepts other batches, an outage does not use up the attempts
+        if self._saved != state.saved_at_failure:
+            state.attempts += 1
+        state.saved_at_failure = self._saved
+        return bool(self.max_attempts) and state.attempts >= self.max_attempts
+
+    def _remove(self, partition: int, state: _Partition, entry_ids: List[bytes]):
+        # Fails if the lease was lost meanwhile, the next owner then delivers the batch again
+        if not self.gateway.remove(partition, self.member, entry_ids):
+            logging.info(f"Partition {partition} moved while a batch was in flight")
+        state.batches.popleft()
+        state.failures = 0
+        state.attempts = 0
+
+    def _dead_letter(self, partition: int, batch: List[bytes]):
+        BATCHES_DEAD_LETTERED.inc()
+        if self.dead_letter_gateway is None:
+            logging.error(f"Store will not accept a batch of partition {partition}, dropping it")
+            return
+        logging.error(f"Store will not accept a batch of partition {partition}, moving it to the dead-letter sink")
+        self.dead_letter_gateway.append(batch)
+
+
+def _seconds(timestamp) -> float:
+    # Naive timestamps are UTC, as in the store
+    try:
+        value = datetime.fromisoformat(timestamp)
+    except (TypeError, ValueError):
+        try:
+            return float(timestamp)
+        except (TypeError, ValueError):
+            return time.time()
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
@@ -0,0 +1,155 @@
+import threading
+from collections import OrderedDict
+from typing import List
+
+import numpy as np
+import orjson
+
+SMOOTH = "smooth"
+BUMPY = "bumpy"
+POTHOLE = "pothole"
+ROAD_STATES = np.array([SMOOTH, BUMPY, POTHOLE], dtype=object)
+
+
+class RoadStateClassifier:
+    """
+    Classifies accelerometer z-axis samples as smooth, bumpy or pothole.
+    Every sample is judged on the window of the last window_size samples of
+    its vehicle: a window standard deviation above bumpy_std makes it bumpy,
+    a deviation of the sample itself from the window mean above
+    pothole_deviation makes it a pothole peak.
+    The last window_size - 1 samples of each vehicle live in a ring buffer,
+    one row of a shared matrix per vehicle, so windows span calls and a
+    whole micro-batch is classified with array operations regardless of how
+    many vehicles it mixes. The least recently seen vehicles are forgotten
+    beyond max_vehicles.
+    """
+
+    def __init__(self, window_size: int, bumpy_std: float, pothole_deviation: float, max_vehicles: int = 10000):
+        if window_size < 2:
+            raise ValueError("window_size must be at least 2")
+        self.window_size = window_size
+        self.bumpy_std = bumpy_std
+        self.pothole_deviation = pothole_deviation
+        self.max_vehicles = max_vehicles
+        capacity = window_size - 1
+        # Ring buffer rows with their write position and fill level, rows are reused after eviction
+        self._history = np.empty((min(max_vehicles, 64), capacity), dtype=np.float64)
+        self._positions = np.zeros(len(self._history), dtype=np.intp)
+        self._lengths = np.zeros(len(self._history), dtype=np.intp)
+        self._slots: "OrderedDict[int, int]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def classify(self, vehicle_ids: np.ndarray, z: np.ndarray) -> np.ndarray:
+        """
+        Classify a micro-batch of samples from any number of vehicles.
+        Parameters:
+            vehicle_ids (np.ndarray): Vehicle of every sample.
+            z (np.ndarray): Accelerometer z-axis of every sample, in arrival order per vehicle.
+        Returns:
+            np.ndarray: The road state string of every sample, in input order.
+        """
+        z = np.asarray(z, dtype=np.float64)
+        if len(z) == 0:
+            return ROAD_STATES[:0]
+        # A stable sort groups each vehicle's samples without reordering them
+        order = np.argsort(vehicle_ids, kind="stable")
+        vehicles, starts, counts = np.unique(np.asarray(vehicle_ids)[order], return_index=True, return_counts=True)
+        samples = z[order]
+        with self._lock:
+            slots = self._claim_slots(vehicles.tolist())
+            codes = self._classify_sorted(slots, starts, counts, samples)
+        result = np.empty(len(z), dtype=object)
+        result[order] = ROAD_STATES[codes]
+        return result
+
+    def _claim_slots(self, vehicles: List[int]) -> np.ndarray:
+        slots = np.empty(len(vehicles), dtype=np.intp)
+        for index, vehicle_id in enumerate(vehicles):
+            slot = self._slots.pop(vehicle_id, None)
+            if slot is None:
+                if len(self._slots) >= self.max_vehicles:
+                    # Hand the least recently seen vehicle's row over
+                    _, slot = self._slots.popitem(last=False)
+                else:
+                    slot = len(self._slots)
+                    if slot >= len(self._history):
+                        self._grow(min(self.max_vehicles, 2 * len(self._history)))
+                self._positions[slot] = 0
+                self._lengths[slot] = 0
+            self._slots[vehicle_id] = slot
+            slots[index] = slot
+        return slots
+
+    def _grow(self, rows: int):
+        history = np.empty((rows, self._history.shape[1]), dtype=np.float64)
+        history[:len(self._history)] = self._history
+        self._history = history
+        self._positions = np.resize(self._positions, rows)
+        self._lengths = np.resize(self._lengths, rows)
+
+    def _classify_sorted(self, slots: np.ndarray, starts: np.ndarray, counts: np.ndarray,
+                         samples: np.ndarray) -> np.ndarray:
+        capacity = self._history.shape[1]
+        positions = self._positions[slots]
+        lengths = self._lengths[slots]
+
+        # Lay out every vehicle as its buffered history followed by its new samples
+        totals = lengths + counts
+        offsets = np.cumsum(totals) - totals
+        values = np.empty(totals.sum(), dtype=np.float64)
+        group, within = _segments(lengths)
+        history_columns = (positions[group] - lengths[group] + within) % capacity
+        values[offsets[group] + within] = self._history[slots[group], history_columns]
+        group, within = _segments(counts)
+        targets = offsets[group] + lengths[group] + within
+        values[targets] = samples
+
+        # Windows end at each new sample and never reach into the previous vehicle
+        ends = targets + 1
+        window_starts = np.maximum(ends - self.window_size, offsets[group])
+        sizes = ends - window_starts
+        # Rolling sums over values centred on each vehicle's first one keep the variance numerically stable
+        centred = values - np.repeat(values[offsets], totals)
+        sums = np.concatenate(([0.0], np.cumsum(centred)))
+        squares = np.concatenate(([0.0], np.cumsum(centred * centred)))
+        means = (sums[ends] - sums[window_starts]) / sizes
+        variances = np.maximum((squares[ends] - squares[window_starts]) / sizes - means * means, 0.0)
+
+        codes = np.where(np.sqrt(variances) > self.bumpy_std, 1, 0)
+        codes[np.abs(centred[targets] - means) > self.pothole_deviation] = 2
+
+        # Only the newest capacity samples of each vehicle reach its ring buffer
+        kept = np.minimum(counts, capacity)
+        group, within = _segments(kept)
+        skipped = counts[group] - kept[group]
+        self._history[slots[group], (positions[group] + skipped + within) % capacity] = \
+            samples[starts[group] + skipped + within]
+        self._positions[slots] = (positions + counts) % capacity
+        self._lengths[slots] = np.minimum(lengths + counts, capacity)
+        return codes
+
+    def classify_records(self, records: List[dict]) -> List[bytes]:
+        """
+        Classify validated AgentData records into ProcessedAgentData JSON documents.
+        Parameters:
+            records (List[dict]): AgentData records as parsed JSON objects.
+        Returns:
+            List[bytes]: One ProcessedAgentData document per record, in input order.
+        """
+        count = len(records)
+        vehicle_ids = np.fromiter((record.get("user_id", 0) for record in records), dtype=np.int64, count=count)
+        z = np.fromiter((record["accelerometer"]["z"] for record in records), dtype=np.float64, count=count)
+        states = self.classify(vehicle_ids, z)
+        return [orjson.dumps({"road_state": state, "agent_data": record}) for state, record in zip(states, records)]
+
+    def vehicles(self) -> int:
+        with self._lock:
+            return len(self._slots)
+
+
+def _segments(lengths: np.ndarray):
+    """Group number and index within the group of every element of consecutive groups of the given lengths."""
+    group = np.repeat(np.arange(len(lengths)), lengths)
+    within = np.arange(len(group)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return group, within
@@ -0,0 +1,99 @@
+import logging
+import queue
+import threading
+import time
+import zlib
+from collections import deque
+from typing import Callable, List, Optional
+
+
+def _percentile(samples: List[float], fraction: float) -> Optional[float]:
+    if not samples:
+        return None
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+class WorkerPool:
+    """
+    Bounded hand-off queues drained by a fixed number of worker threads.
+    Producers such as the paho network thread only enqueue raw payloads;
+    once a queue is full they block, which pushes back on the broker
+    instead of growing memory. Every worker has its own queue and work is
+    routed by a hash of its key, e.g. the vehicle, so items with the same
+    key are handled one at a time in the order they were submitted.
+    """
+
+    def __init__(self, handler: Callable, worker_count: int, queue_size: int, latency_samples: int = 1024):
+        self.handler = handler
+        self.worker_count = worker_count
+        # The queue size is shared out between the workers
+        self._queues: List[queue.Queue] = [
+            queue.Queue(maxsize=max(queue_size // worker_count, 1)) for _ in range(worker_count)
+        ]
+        self._threads: List[threading.Thread] = []
+        self._latencies = deque(maxlen=latency_samples)
+        self._stats_lock = threading.Lock()
+        self.processed = 0
+        self.failed = 0
+
+    def start(self):
+        for number in range(self.worker_count):
+            thread = threading.Thread(
+                target=self._work, args=(self._queues[number],), name=f"hub-worker-{number}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        # One sentinel per worker, queued behind the remaining work
+        for work_queue in self._queues[:len(self._threads)]:
+            work_queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def submit(self, key: str, *args):
+        """
+        Queue work for the worker key is routed to, blocking while its queue is full.
+        Parameters:
+            key (str): Items with equal keys are handled in order by the same worker.
+            args: Passed on to the handler.
+        """
+        self._queues[zlib.crc32(key.encode()) % self.worker_count].put((time.monotonic(), args))
+
+    def _work(self, work_queue: queue.Queue):
+        while True:
+            item = work_queue.get()
+            if item is None:
+                return
+            enqueued_at, args = item
+            try:
+                self.handler(*args)
+                succeeded = True
+            except Exception as e:
+                logging.info(f"Error processing message: {e}")
+                succeeded = False
+            latency = time.monotonic() - enqueued_at
+            with self._stats_lock:
+                self._latencies.append(latency)
+                if succeeded:
+                    self.processed += 1
+                else:
+                    self.failed += 1
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            samples = sorted(self._latencies)
+            processed, failed = self.processed, self.failed
+        to_ms = (lambda value: None if value is None else round(value * 1000, 3))
+        return {
+            "workers": self.worker_count,
+            "queue_depth": sum(work_queue.qsize() for work_queue in self._queues),
+            "max_queue_depth": max(work_queue.qsize() for work_queue in self._queues),
+            "queue_capacity": sum(work_queue.maxsize for work_queue in self._queues),
+            "processed": processed,
+            "failed": failed,
+            "latency_ms_p50": to_ms(_percentile(samples, 0.5)),
+            "latency_ms_p99": to_ms(_percentile(samples, 0.99)),
+            "latency_ms_max": to_ms(samples[-1] if samples else None),
+        }
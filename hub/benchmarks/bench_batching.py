@@ -0,0 +1,97 @@
+"""
+Compare the per-message Redis list handling the hub used to do with the in-process BatchBuffer.
+
+Needs fakeredis (pip install fakeredis); no Redis server or store is contacted.
+Run from the hub directory:
+    python -m benchmarks.bench_batching --messages 20000 --batch-size 20
+"""
+import argparse
+import time
+from datetime import datetime
+from typing import List
+
+from fakeredis import FakeRedis
+
+from app.adapters.redis_spill_adapter import RedisSpillAdapter
+from app.entities.processed_agent_data import ProcessedAgentData
+from app.entities.serialization import validate_payload
+from app.interfaces.store_api_gateway import SaveResult, StoreGateway
+from app.usecases.batch_buffer import BatchBuffer
+
+
+class CountingRedis(FakeRedis):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.round_trips = 0
+
+    def execute_command(self, *args, **options):
+        self.round_trips += 1
+        return super().execute_command(*args, **options)
+
+
+class CountingStore(StoreGateway):
+    def __init__(self):
+        self.calls = 0
+        self.empty_calls = 0
+
+    def save_data(self, processed_agent_data_batch: list) -> SaveResult:
+        self.calls += 1
+        if not processed_agent_data_batch:
+            self.empty_calls += 1
+        return SaveResult.SAVED
+
+
+def make_payloads(count: int) -> List[str]:
+    return [ProcessedAgentData.model_validate({
+        "road_state": "smooth",
+        "agent_data": {
+            "accelerometer": {"x": i % 7, "y": i % 5, "z": 16500 + i % 11},
+            "gps": {"latitude": 30.52, "longitude": 50.45},
+            "timestamp": datetime.now(),
+        },
+    }).model_dump_json() for i in range(count)]
+
+
+def run_legacy(payloads: List[str], batch_size: int):
+    # The hub's original on_message body
+    redis_client, store = CountingRedis(), CountingStore()
+    for payload in payloads:
+        processed_agent_data = ProcessedAgentData.model_validate_json(payload, strict=True)
+        redis_client.lpush("processed_agent_data", processed_agent_data.model_dump_json())
+        processed_agent_data_batch = []
+        if redis_client.llen("processed_agent_data") >= batch_size:
+            for _ in range(batch_size):
+                processed_agent_data = ProcessedAgentData.model_validate_json(redis_client.lpop("processed_agent_data"))
+                processed_agent_data_batch.append(processed_agent_data)
+        store.save_data(processed_agent_data_batch=processed_agent_data_batch)
+    return redis_client, store
+
+
+def run_buffered(payloads: List[str], batch_size: int):
+    redis_client, store = CountingRedis(), CountingStore()
+    buffer = BatchBuffer(store, RedisSpillAdapter(redis_client, "processed_agent_data"), batch_size, max_linger=1.0)
+    buffer.start()
+    for payload in payloads:
+        buffer.add_many(validate_payload(payload.encode()))
+    buffer.stop()
+    return redis_client, store
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--batch-size", type=int, default=20)
+    args = parser.parse_args()
+
+    payloads = make_payloads(args.messages)
+    print(f"{'path':>10} {'msgs/sec':>10} {'redis ops/msg':>14} {'store calls':>12} {'empty calls':>12}")
+    for name, run in (("legacy", run_legacy), ("buffered", run_buffered)):
+        started = time.perf_counter()
+        redis_client, store = run(payloads, args.batch_size)
+        elapsed = time.perf_counter() - started
+        print(f"{name:>10} {args.messages / elapsed:>10.0f} {redis_client.round_trips / args.messages:>14.2f} "
+              f"{store.calls:>12} {store.empty_calls:>12}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Samples/sec of the road-state classifier.
+
+"per-sample" is a plain Python classifier updating a deque window per message,
+"classify" is RoadStateClassifier on NumPy arrays and "records" additionally
+extracts the samples from parsed AgentData and serializes ProcessedAgentData.
+Run from the hub directory:
+    python -m benchmarks.bench_classifier --samples 200000 --vehicles 100 --batch-size 2000
+"""
+import argparse
+import math
+import time
+from collections import deque
+
+import numpy as np
+
+from app.usecases.road_classifier import RoadStateClassifier, SMOOTH, BUMPY, POTHOLE
+
+WINDOW_SIZE = 20
+BUMPY_STD = 1500.0
+POTHOLE_DEVIATION = 6000.0
+
+
+def make_samples(count: int, vehicles: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    vehicle_ids = rng.integers(0, vehicles, count)
+    z = 16384 + rng.normal(0, 800, count)
+    # Sprinkle rough stretches and single spikes over the smooth signal
+    rough = rng.random(count) < 0.2
+    z[rough] += rng.normal(0, 3000, rough.sum())
+    spikes = rng.random(count) < 0.01
+    z[spikes] += rng.choice([-1, 1], spikes.sum()) * 9000
+    return vehicle_ids, z
+
+
+def per_sample(vehicle_ids, z):
+    windows = {}
+    states = []
+    for vehicle_id, sample in zip(vehicle_ids.tolist(), z.tolist()):
+        window = windows.setdefault(vehicle_id, deque(maxlen=WINDOW_SIZE))
+        window.append(sample)
+        mean = sum(window) / len(window)
+        std = math.sqrt(sum((value - mean) ** 2 for value in window) / len(window))
+        if abs(sample - mean) > POTHOLE_DEVIATION:
+            states.append(POTHOLE)
+        elif std > BUMPY_STD:
+            states.append(BUMPY)
+        else:
+            states.append(SMOOTH)
+    return states
+
+
+def vectorized(vehicle_ids, z, batch_size):
+    classifier = RoadStateClassifier(WINDOW_SIZE, BUMPY_STD, POTHOLE_DEVIATION)
+    for start in range(0, len(z), batch_size):
+        classifier.classify(vehicle_ids[start:start + batch_size], z[start:start + batch_size])
+
+
+def records(vehicle_ids, z, batch_size):
+    classifier = RoadStateClassifier(WINDOW_SIZE, BUMPY_STD, POTHOLE_DEVIATION)
+    parsed = [{
+        "user_id": vehicle_id,
+        "accelerometer": {"x": 0.0, "y": 0.0, "z": sample},
+        "gps": {"latitude": 30.52, "longitude": 50.45},
+        "timestamp": "2024-03-01T00:00:00",
+    } for vehicle_id, sample in zip(vehicle_ids.tolist(), z.tolist())]
+    started = time.process_time()
+    for start in range(0, len(parsed), batch_size):
+        classifier.classify_records(parsed[start:start + batch_size])
+    return time.process_time() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--samples", type=int, default=200000)
+    parser.add_argument("--vehicles", type=int, default=100)
+    parser.add_argument("--batch-size", type=int, default=2000)
+    args = parser.parse_args()
+
+    vehicle_ids, z = make_samples(args.samples, args.vehicles)
+    print(f"{'path':>10} {'samples/sec':>12}")
+    started = time.process_time()
+    per_sample(vehicle_ids, z)
+    print(f"{'per-sample':>10} {args.samples / (time.process_time() - started):>12.0f}")
+    started = time.process_time()
+    vectorized(vehicle_ids, z, args.batch_size)
+    print(f"{'classify':>10} {args.samples / (time.process_time() - started):>12.0f}")
+    print(f"{'records':>10} {args.samples / records(vehicle_ids, z, args.batch_size):>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
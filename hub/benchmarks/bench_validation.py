@@ -0,0 +1,60 @@
+"""
+Records/sec per core of the hub's validation and serialization path.
+
+"legacy" is the old per-record cycle: model_validate_json on receive, model_dump_json
+into Redis and model_validate_json again on the way out. "single" and "array" use
+validate_payload, which keeps the validated bytes.
+Run from the hub directory:
+    python -m benchmarks.bench_validation --records 50000 --array-size 20
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+
+from app.entities.processed_agent_data import ProcessedAgentData
+from app.entities.serialization import validate_payload, encode_batch
+
+
+def make_records(count: int):
+    start = datetime(2024, 3, 1)
+    return [ProcessedAgentData.model_validate({
+        "road_state": "smooth",
+        "agent_data": {
+            "accelerometer": {"x": i % 7, "y": i % 5, "z": 16500 + i % 11},
+            "gps": {"latitude": 30.52, "longitude": 50.45},
+            "timestamp": start + timedelta(milliseconds=i),
+        },
+    }).model_dump_json().encode() for i in range(count)]
+
+
+def legacy(payloads):
+    for payload in payloads:
+        model = ProcessedAgentData.model_validate_json(payload.decode("utf-8"), strict=True)
+        ProcessedAgentData.model_validate_json(model.model_dump_json())
+
+
+def buffered(payloads):
+    records = []
+    for payload in payloads:
+        records.extend(validate_payload(payload))
+    encode_batch(records)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, default=50000)
+    parser.add_argument("--array-size", type=int, default=20)
+    args = parser.parse_args()
+
+    records = make_records(args.records)
+    arrays = [encode_batch(records[i:i + args.array_size]) for i in range(0, len(records), args.array_size)]
+    print(f"{'path':>8} {'records/sec':>12}")
+    for name, run, payloads in (("legacy", legacy, records), ("single", buffered, records), ("array", buffered, arrays)):
+        started = time.process_time()
+        run(payloads)
+        elapsed = time.process_time() - started
+        print(f"{name:>8} {args.records / elapsed:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
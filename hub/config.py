@@ -1,4 +1,5 @@
 import os
+import socket
 
 
 def try_parse_int(value: str):
@@ -8,16 +9,102 @@ def try_parse_int(value: str):
         return None
 
 
+def try_parse_float(value: str):
+    try:
+        return float(value)
+    except Exception:
+        return None
+
+
 # Configuration for the Store API
 STORE_API_HOST = os.environ.get("STORE_API_HOST") or "localhost"
 STORE_API_PORT = try_parse_int(os.environ.get("STORE_API_PORT")) or 8000
 STORE_API_BASE_URL = f"http://{STORE_API_HOST}:{STORE_API_PORT}"
+# Batches sent to the store concurrently over the keep-alive connection pool
+STORE_MAX_IN_FLIGHT = try_parse_int(os.environ.get("STORE_MAX_IN_FLIGHT")) or 4
+STORE_MAX_RETRIES = try_parse_int(os.environ.get("STORE_MAX_RETRIES")) or 3
+# Base delay in seconds of the exponential retry backoff
+STORE_RETRY_BACKOFF = try_parse_float(os.environ.get("STORE_RETRY_BACKOFF")) or 0.5
+STORE_TIMEOUT = try_parse_float(os.environ.get("STORE_TIMEOUT")) or 10.0
+# Request bodies of at least this many bytes are gzip-compressed, 0 disables compression
+STORE_GZIP_MIN_SIZE = try_parse_int(os.environ.get("STORE_GZIP_MIN_SIZE")) or 0
 # Configure for Redis
 REDIS_HOST = os.environ.get("REDIS_HOST") or "localhost"
 REDIS_PORT = try_parse_int(os.environ.get("REDIS_PORT")) or 6379
 # Configure for hub logic
 BATCH_SIZE = try_parse_int(os.environ.get("BATCH_SIZE")) or 20
+# Seconds a partial batch may wait before it is flushed anyway
+BATCH_MAX_LINGER = try_parse_float(os.environ.get("BATCH_MAX_LINGER")) or 1.0
+# Raw AgentData is classified over sliding windows of this many z-axis samples per vehicle
+ROAD_WINDOW_SIZE = try_parse_int(os.environ.get("ROAD_WINDOW_SIZE")) or 20
+# Window standard deviation of the z axis above which the road is bumpy
+ROAD_BUMPY_STD = try_parse_float(os.environ.get("ROAD_BUMPY_STD")) or 1500.0
+# Deviation of a single z sample from its window mean that marks a pothole
+ROAD_POTHOLE_DEVIATION = try_parse_float(os.environ.get("ROAD_POTHOLE_DEVIATION")) or 6000.0
+# Vehicles whose window history is kept, least recently seen ones are dropped first
+ROAD_MAX_VEHICLES = try_parse_int(os.environ.get("ROAD_MAX_VEHICLES")) or 10000
+# Where batches the store could not accept yet are kept: "file" for the local segment log, or "redis"
+SPILL_BACKEND = os.environ.get("SPILL_BACKEND") or "file"
+# Directory and segment file size in bytes of the local segment log
+SPILL_DIR = os.environ.get("SPILL_DIR") or "spill"
+SPILL_SEGMENT_SIZE = try_parse_int(os.environ.get("SPILL_SEGMENT_SIZE")) or 64 * 1024 * 1024
+# Seconds between flushes of the segment log to disk, 0 flushes on every write
+SPILL_FSYNC_INTERVAL = try_parse_float(os.environ.get("SPILL_FSYNC_INTERVAL"))
+if SPILL_FSYNC_INTERVAL is None:
+    SPILL_FSYNC_INTERVAL = 0.1
+# Spilled batches replayed per second once the store accepts data again
+SPILL_REPLAY_RATE = try_parse_float(os.environ.get("SPILL_REPLAY_RATE")) or 50.0
+# Redis list holding batches the store could not accept yet, with the redis backend
+REDIS_SPILL_KEY = os.environ.get("REDIS_SPILL_KEY") or "processed_agent_data"
+# Replays of a spilled batch, or of a partition's batch in a hub group, that fail while the store accepts
+# other batches before it is dead-lettered, 0 retries it forever
+SPILL_MAX_ATTEMPTS = try_parse_int(os.environ.get("SPILL_MAX_ATTEMPTS"))
+if SPILL_MAX_ATTEMPTS is None:
+    SPILL_MAX_ATTEMPTS = 10
+# Where batches the store will never accept are kept for inspection, with the spill's backend; a hub group
+# keeps them in Redis
+DEAD_LETTER_DIR = os.environ.get("DEAD_LETTER_DIR") or os.path.join(SPILL_DIR, "dead_letter")
+REDIS_DEAD_LETTER_KEY = os.environ.get("REDIS_DEAD_LETTER_KEY") or f"{REDIS_SPILL_KEY}:dead_letter"
 # MQTT
 MQTT_BROKER_HOST = os.environ.get("MQTT_BROKER_HOST") or "localhost"
 MQTT_BROKER_PORT = try_parse_int(os.environ.get("MQTT_BROKER_PORT")) or 1883
 MQTT_TOPIC = os.environ.get("MQTT_TOPIC") or "processed_agent_data_topic"
+# Topic of raw AgentData the hub classifies itself
+MQTT_AGENT_DATA_TOPIC = os.environ.get("MQTT_AGENT_DATA_TOPIC") or "agent_data_topic"
+# QoS 1 messages are acknowledged only after they reached the store or the spill
+MQTT_QOS = try_parse_int(os.environ.get("MQTT_QOS"))
+if MQTT_QOS is None:
+    MQTT_QOS = 1
+# Scale-out group of hubs sharing the MQTT subscriptions, empty runs a standalone hub
+HUB_GROUP = os.environ.get("HUB_GROUP") or ""
+# Name of this hub within the group, unique per process
+HUB_ID = os.environ.get("HUB_ID") or f"{socket.gethostname()}-{os.getpid()}"
+# Vehicles are spread over this many partitions, each delivered by one hub of the group at a time
+HUB_PARTITIONS = try_parse_int(os.environ.get("HUB_PARTITIONS")) or 64
+# Seconds a hub keeps its partitions without renewing them; a dead hub's partitions move after this long
+HUB_LEASE_TTL = try_parse_float(os.environ.get("HUB_LEASE_TTL")) or 10.0
+# Seconds records wait in their partition log, so those of one vehicle received by different hubs get in order
+HUB_REORDER_DELAY = try_parse_float(os.environ.get("HUB_REORDER_DELAY"))
+if HUB_REORDER_DELAY is None:
+    HUB_REORDER_DELAY = 0.2
+# Seconds a reading is remembered to drop copies delivered again, up to twice that unless more than DEDUP_CAPACITY
+# readings arrive within one window; 0 disables duplicate suppression
+DEDUP_WINDOW = try_parse_float(os.environ.get("DEDUP_WINDOW"))
+if DEDUP_WINDOW is None:
+    DEDUP_WINDOW = 600.0
+# Readings expected per window; the dedup filter takes about capacity * 1.44 * log2(2 / rate) / 4 bytes
+DEDUP_CAPACITY = try_parse_int(os.environ.get("DEDUP_CAPACITY")) or 1000000
+# Chance that a new reading is taken for a duplicate and dropped
+DEDUP_FALSE_POSITIVE_RATE = try_parse_float(os.environ.get("DEDUP_FALSE_POSITIVE_RATE")) or 1e-6
+# Also check readings against a set in Redis shared by all hubs, on by default for a scale-out group
+DEDUP_SHARED = (os.environ.get("DEDUP_SHARED") or ("true" if HUB_GROUP else "false")).lower() in ("1", "true", "yes")
+REDIS_DEDUP_PREFIX = os.environ.get("REDIS_DEDUP_PREFIX") or "hub:dedup:"
+# Seconds between log lines from the same place in the code, repeats in between are counted; 0 logs everything
+LOG_SAMPLE_INTERVAL = try_parse_float(os.environ.get("LOG_SAMPLE_INTERVAL"))
+if LOG_SAMPLE_INTERVAL is None:
+    LOG_SAMPLE_INTERVAL = 10.0
+# Worker threads processing MQTT payloads off the paho network thread, each one handles the messages of
+# the vehicles hashed to it by user_id in order; they share one core, run a scale-out group of hubs to use more
+WORKER_COUNT = try_parse_int(os.environ.get("WORKER_COUNT")) or os.cpu_count() or 4
+# Payloads waiting for the workers before the MQTT thread blocks, split evenly between them
+WORKER_QUEUE_SIZE = try_parse_int(os.environ.get("WORKER_QUEUE_SIZE")) or 1000
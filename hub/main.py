@@ -1,12 +1,34 @@
 import logging
-from typing import List
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from pydantic import ValidationError
 from redis import Redis
 import paho.mqtt.client as mqtt
-from app.adapters.store_api_adapter import StoreApiAdapter
-from app.entities.processed_agent_data import ProcessedAgentData
+from app.adapters.file_spill_adapter import FileSpillAdapter
+from app.adapters.redis_dedup_adapter import RedisDedupAdapter
+from app.adapters.redis_partition_adapter import RedisPartitionAdapter
+from app.adapters.redis_spill_adapter import RedisSpillAdapter
+from app.adapters.async_store_api_adapter import AsyncStoreApiAdapter
+from app.entities.serialization import validate_payload, parse_agent_data, vehicle_key
+from app.instrumentation import MQTT_MESSAGES_RECEIVED, MQTT_MESSAGES_INVALID, VALIDATION_SECONDS, \
+    WORKER_QUEUE_DEPTH, BUFFERED_RECORDS, SPILLED_RECORDS, DEAD_LETTER_RECORDS, PARTITIONS_OWNED, \
+    DEDUP_ESTIMATED_FALSE_POSITIVE_RATE, DEDUP_MEMORY_BYTES
+from app.log_sampling import RateLimitFilter
+from app.usecases.batch_buffer import BatchBuffer
+from app.usecases.deduplicator import Deduplicator
+from app.usecases.partition_coordinator import PartitionCoordinator
+from app.usecases.partitioned_delivery import PartitionedDelivery
+from app.usecases.road_classifier import RoadStateClassifier
+from app.usecases.worker_pool import WorkerPool
 from config import STORE_API_BASE_URL, REDIS_HOST, REDIS_PORT, BATCH_SIZE, MQTT_TOPIC, MQTT_BROKER_HOST, \
-    MQTT_BROKER_PORT
+    MQTT_BROKER_PORT, BATCH_MAX_LINGER, REDIS_SPILL_KEY, STORE_MAX_IN_FLIGHT, STORE_MAX_RETRIES, STORE_RETRY_BACKOFF, \
+    STORE_TIMEOUT, STORE_GZIP_MIN_SIZE, MQTT_QOS, WORKER_COUNT, WORKER_QUEUE_SIZE, MQTT_AGENT_DATA_TOPIC, \
+    ROAD_WINDOW_SIZE, ROAD_BUMPY_STD, ROAD_POTHOLE_DEVIATION, ROAD_MAX_VEHICLES, SPILL_BACKEND, SPILL_DIR, \
+    SPILL_SEGMENT_SIZE, SPILL_FSYNC_INTERVAL, SPILL_REPLAY_RATE, LOG_SAMPLE_INTERVAL, HUB_GROUP, HUB_ID, \
+    HUB_PARTITIONS, HUB_LEASE_TTL, HUB_REORDER_DELAY, DEDUP_WINDOW, DEDUP_CAPACITY, DEDUP_FALSE_POSITIVE_RATE, \
+    DEDUP_SHARED, REDIS_DEDUP_PREFIX, SPILL_MAX_ATTEMPTS, DEAD_LETTER_DIR, REDIS_DEAD_LETTER_KEY
 
 # Configure logging settings
 logging.basicConfig(
@@ -17,56 +39,255 @@ logging.basicConfig(
         logging.FileHandler("app.log"),  # Save log messages to a file
     ],
 )
+# Per-message and per-batch messages, including uvicorn's access log, are sampled
+log_filter = RateLimitFilter(LOG_SAMPLE_INTERVAL)
+logging.getLogger().addFilter(log_filter)
+logging.getLogger("uvicorn.access").addFilter(log_filter)
 # Create an instance of the Redis using the configuration
 redis_client = Redis(host=REDIS_HOST, port=REDIS_PORT)
-# Create an instance of the StoreApiAdapter using the configuration
-store_adapter = StoreApiAdapter(api_base_url=STORE_API_BASE_URL)
+# Create an instance of the AsyncStoreApiAdapter using the configuration
+store_adapter = AsyncStoreApiAdapter(
+    api_base_url=STORE_API_BASE_URL,
+    max_in_flight=STORE_MAX_IN_FLIGHT,
+    max_retries=STORE_MAX_RETRIES,
+    retry_backoff=STORE_RETRY_BACKOFF,
+    timeout=STORE_TIMEOUT,
+    gzip_min_size=STORE_GZIP_MIN_SIZE,
+)
+# Classifies raw AgentData streams into road states
+road_classifier = RoadStateClassifier(
+    window_size=ROAD_WINDOW_SIZE,
+    bumpy_std=ROAD_BUMPY_STD,
+    pothole_deviation=ROAD_POTHOLE_DEVIATION,
+    max_vehicles=ROAD_MAX_VEHICLES,
+)
+# Readings delivered more than once are dropped before batching
+deduplicator = None
+if DEDUP_WINDOW > 0:
+    deduplicator = Deduplicator(
+        capacity=DEDUP_CAPACITY,
+        false_positive_rate=DEDUP_FALSE_POSITIVE_RATE,
+        window=DEDUP_WINDOW,
+        shared_gateway=RedisDedupAdapter(redis_client, REDIS_DEDUP_PREFIX, DEDUP_WINDOW) if DEDUP_SHARED else None,
+    )
+    DEDUP_ESTIMATED_FALSE_POSITIVE_RATE.set_function(lambda: deduplicator.stats()["estimated_false_positive_rate"])
+    DEDUP_MEMORY_BYTES.set_function(lambda: deduplicator.stats()["memory_bytes"])
+if HUB_GROUP:
+    # Hubs of a group share the MQTT subscriptions; records go to per-vehicle partition logs in Redis,
+    # which also take the place of the spill, and each partition is delivered by one hub at a time
+    partition_adapter = RedisPartitionAdapter(redis_client, prefix=f"hub:{HUB_GROUP}:")
+    dead_letter_adapter = RedisSpillAdapter(redis_client, key=REDIS_DEAD_LETTER_KEY)
+    partitioned_delivery = PartitionedDelivery(
+        gateway=partition_adapter,
+        store_gateway=store_adapter,
+        classifier=road_classifier,
+        member=HUB_ID,
+        partitions=HUB_PARTITIONS,
+        batch_size=BATCH_SIZE,
+        max_linger=BATCH_MAX_LINGER,
+        reorder_delay=HUB_REORDER_DELAY,
+        retry_backoff=STORE_RETRY_BACKOFF,
+        max_attempts=SPILL_MAX_ATTEMPTS,
+        dead_letter_gateway=dead_letter_adapter,
+    )
+    partitioned_delivery.start()
+    partition_coordinator = PartitionCoordinator(
+        gateway=partition_adapter,
+        member=HUB_ID,
+        partitions=HUB_PARTITIONS,
+        lease_ttl=HUB_LEASE_TTL,
+        on_assigned=partitioned_delivery.assign,
+        on_revoked=partitioned_delivery.revoke,
+    )
+    partition_coordinator.start()
+    PARTITIONS_OWNED.set_function(lambda: len(partition_coordinator.owned()))
+    DEAD_LETTER_RECORDS.set_function(dead_letter_adapter.size)
+else:
+    # Batches the store could not accept wait in a local segment log, or in Redis; those it will never
+    # accept are kept next to them
+    if SPILL_BACKEND == "redis":
+        spill_adapter = RedisSpillAdapter(redis_client, key=REDIS_SPILL_KEY)
+        dead_letter_adapter = RedisSpillAdapter(redis_client, key=REDIS_DEAD_LETTER_KEY)
+    else:
+        spill_adapter = FileSpillAdapter(
+            SPILL_DIR, segment_size=SPILL_SEGMENT_SIZE, fsync_interval=SPILL_FSYNC_INTERVAL
+        )
+        dead_letter_adapter = FileSpillAdapter(
+            DEAD_LETTER_DIR, segment_size=SPILL_SEGMENT_SIZE, fsync_interval=SPILL_FSYNC_INTERVAL
+        )
+    # Create the batching buffer
+    batch_buffer = BatchBuffer(
+        store_gateway=store_adapter,
+        spill_gateway=spill_adapter,
+        batch_size=BATCH_SIZE,
+        max_linger=BATCH_MAX_LINGER,
+        replay_rate=SPILL_REPLAY_RATE,
+        max_attempts=SPILL_MAX_ATTEMPTS,
+        dead_letter_gateway=dead_letter_adapter,
+    )
+    batch_buffer.start()
+    BUFFERED_RECORDS.set_function(batch_buffer.pending)
+    SPILLED_RECORDS.set_function(spill_adapter.size)
+    DEAD_LETTER_RECORDS.set_function(dead_letter_adapter.size)
 # Create an instance of the AgentMQTTAdapter using the configuration
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    client.loop_stop()
+    worker_pool.stop()
+    if HUB_GROUP:
+        # Partitions are handed over to the rest of the group while delivery still runs
+        partition_coordinator.stop()
+        partitioned_delivery.stop()
+    else:
+        # Deliver whatever is still buffered before exiting
+        batch_buffer.stop()
+        spill_adapter.close()
+    dead_letter_adapter.close()
+    store_adapter.close()
+
+
 # FastAPI
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+
+
+def accept(kind: str, records: list, on_durable=None):
+    """
+    Hand validated records over for delivery.
+    Parameters:
+        kind (str): "agent_data" for raw AgentData as parsed JSON objects, else ProcessedAgentData JSON documents.
+        records (list): The records of one message or request.
+        on_durable (Optional[Callable[[], None]]): Called once the records are in the store, the spill or
+            a partition log, or were all dropped as duplicates.
+    """
+    if deduplicator is not None:
+        records, keys = deduplicator.claim(records, raw=kind == "agent_data")
+        if not records:
+            if on_durable is not None:
+                on_durable()
+            return
+        try:
+            deliver(kind, records, on_durable)
+        except Exception:
+            # Redelivered copies must not be taken for duplicates of readings that never got through
+            deduplicator.release(keys)
+            raise
+        deduplicator.remember(keys)
+    else:
+        deliver(kind, records, on_durable)
+
+
+def deliver(kind: str, records: list, on_durable=None):
+    if HUB_GROUP:
+        # Raw records are classified by the hub delivering their partition, in timestamp order
+        partitioned_delivery.append(records, raw=kind == "agent_data")
+        if on_durable is not None:
+            on_durable()
+        return
+    if kind == "agent_data":
+        records = road_classifier.classify_records(records)
+    batch_buffer.add_many(records, on_durable=on_durable)
 
 
 @app.post("/processed_agent_data/")
-async def save_processed_agent_data(processed_agent_data: ProcessedAgentData):
-    print(processed_agent_data)
-    redis_client.lpush("processed_agent_data", processed_agent_data.model_dump_json())
-    processed_agent_data_batch: List[ProcessedAgentData] = []
-    if redis_client.llen("processed_agent_data") >= BATCH_SIZE:
-        for _ in range(BATCH_SIZE):
-            processed_agent_data = ProcessedAgentData.model_validate_json(redis_client.lpop("processed_agent_data"))
-            processed_agent_data_batch.append(processed_agent_data)
-    store_adapter.save_data(processed_agent_data_batch=processed_agent_data_batch)
+async def save_processed_agent_data(request: Request):
+    # Accepts a single ProcessedAgentData object or an array of them
+    try:
+        records = validate_payload(await request.body())
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False))
+    # Adding may flush a batch, keep that off the event loop
+    await run_in_threadpool(accept, "processed_agent_data", records)
+    return {"status": "ok"}
+
+
+@app.post("/agent_data/")
+async def classify_agent_data(request: Request):
+    # Accepts a single raw AgentData object or an array of them and classifies the road state
+    try:
+        agent_data = parse_agent_data(await request.body())
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False))
+    await run_in_threadpool(accept, "agent_data", agent_data)
     return {"status": "ok"}
 
 
-# MQTT
-client = mqtt.Client()
+@app.get("/metrics")
+def metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+@app.get("/stats")
+def stats():
+    stats = {
+        "workers": worker_pool.stats(),
+        "classified_vehicles": road_classifier.vehicles(),
+    }
+    if deduplicator is not None:
+        stats["dedup"] = deduplicator.stats()
+    if HUB_GROUP:
+        stats["group"] = {"member": HUB_ID, **partitioned_delivery.stats()}
+    else:
+        stats["buffered"] = batch_buffer.pending()
+    return stats
+
+
+# MQTT, messages are acknowledged by us once they are durably buffered
+if HUB_GROUP:
+    # Shared subscriptions need MQTT v5
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=HUB_ID, protocol=mqtt.MQTTv5, manual_ack=True)
+else:
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, manual_ack=True)
+
+
+def subscription(topic: str) -> str:
+    # The broker hands each message of a shared subscription to one hub of the group
+    return f"$share/{HUB_GROUP}/{topic}" if HUB_GROUP else topic
 
 
-def on_connect(client, userdata, flags, rc):
-    if rc == 0:
+def on_connect(client, userdata, flags, reason_code, properties):
+    if not reason_code.is_failure:
         logging.info("Connected to MQTT broker")
-        client.subscribe(MQTT_TOPIC)
+        client.subscribe([(subscription(MQTT_TOPIC), MQTT_QOS), (subscription(MQTT_AGENT_DATA_TOPIC), MQTT_QOS)])
     else:
-        logging.info(f"Failed to connect to MQTT broker with code: {rc}")
+        logging.info(f"Failed to connect to MQTT broker with code: {reason_code}")
 
 
-def on_message(client, userdata, msg):
+def message_kind(msg) -> str:
+    return "agent_data" if mqtt.topic_matches_sub(MQTT_AGENT_DATA_TOPIC, msg.topic) else "processed_agent_data"
+
+
+def process_message(msg):
+    kind = message_kind(msg)
     try:
-        payload: str = msg.payload.decode("utf-8")
-        # Create ProcessedAgentData instance with the received data
-        processed_agent_data = ProcessedAgentData.model_validate_json(payload, strict=True)
-        redis_client.lpush("processed_agent_data", processed_agent_data.model_dump_json())
-        processed_agent_data_batch: List[ProcessedAgentData] = []
-        if redis_client.llen("processed_agent_data") >= BATCH_SIZE:
-            for _ in range(BATCH_SIZE):
-                processed_agent_data = ProcessedAgentData.model_validate_json(redis_client.lpop("processed_agent_data"))
-                processed_agent_data_batch.append(processed_agent_data)
-        store_adapter.save_data(processed_agent_data_batch=processed_agent_data_batch)
-        return {"status": "ok"}
-    except Exception as e:
-        logging.info(f"Error processing MQTT message: {e}")
+        with VALIDATION_SECONDS.labels(kind).time():
+            if kind == "agent_data":
+                # Raw readings, the road state is classified before delivery
+                records = parse_agent_data(msg.payload)
+            else:
+                # Validate the received record or array of records, keeping their raw JSON
+                records = validate_payload(msg.payload)
+    except Exception:
+        MQTT_MESSAGES_INVALID.labels(kind).inc()
+        # An invalid payload will never become valid, acknowledge it so it is not redelivered
+        client.ack(msg.mid, msg.qos)
+        raise
+    accept(kind, records, on_durable=lambda: client.ack(msg.mid, msg.qos))
+
+
+# Payloads are processed off the paho network thread
+worker_pool = WorkerPool(process_message, worker_count=WORKER_COUNT, queue_size=WORKER_QUEUE_SIZE)
+worker_pool.start()
+WORKER_QUEUE_DEPTH.set_function(lambda: worker_pool.stats()["queue_depth"])
+
+
+def on_message(client, userdata, msg):
+    MQTT_MESSAGES_RECEIVED.labels(message_kind(msg)).inc()
+    # Messages of one vehicle are processed and acknowledged in the order they arrived, all vehicles publish to
+    # the same topics; messages naming no vehicle keep the order of their topic
+    worker_pool.submit(vehicle_key(msg.payload) or msg.topic, msg)
 
 
 # Connect
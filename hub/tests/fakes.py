@@ -0,0 +1,147 @@
+import threading
+from typing import Dict, Iterable, List, Optional
+
+from app.interfaces.dedup_gateway import DedupGateway
+from app.interfaces.partition_gateway import PartitionEntry, PartitionGateway
+from app.interfaces.spill_gateway import SpillGateway
+from app.interfaces.store_api_gateway import SaveResult, StoreGateway
+
+
+class FakeStore(StoreGateway):
+    """
+    Keeps the batches it accepts; while down, it fails every batch.
+    Batches holding a poison record get poison_result, whether the store is up or not.
+    """
+
+    def __init__(self, down: bool = False, poison: Iterable[bytes] = (),
+                 poison_result: SaveResult = SaveResult.REJECTED):
+        self.down = down
+        self.poison = set(poison)
+        self.poison_result = poison_result
+        self.batches: List[List[bytes]] = []
+        self.attempts = 0
+        self.lock = threading.Lock()
+
+    def save_data(self, processed_agent_data_batch: List[bytes]) -> SaveResult:
+        with self.lock:
+            self.attempts += 1
+            if self.poison.intersection(processed_agent_data_batch):
+                return self.poison_result
+            if self.down:
+                return SaveResult.FAILED
+            self.batches.append(list(processed_agent_data_batch))
+            return SaveResult.SAVED
+
+    def records(self) -> List[bytes]:
+        with self.lock:
+            return [record for batch in self.batches for record in batch]
+
+
+class MemorySpill(SpillGateway):
+    def __init__(self):
+        self.items: List[bytes] = []
+
+    def append(self, processed_agent_data_batch: List[bytes]) -> None:
+        self.items.extend(processed_agent_data_batch)
+
+    def peek(self, count: int) -> List[bytes]:
+        return self.items[:count]
+
+    def ack(self, count: int) -> None:
+        del self.items[:count]
+
+    def size(self) -> int:
+        return len(self.items)
+
+
+class MemoryDedup(DedupGateway):
+    """Shared dedup set in memory; while down, every call fails like an unreachable Redis."""
+
+    def __init__(self, down: bool = False):
+        self.down = down
+        self.keys = set()
+        self.lock = threading.Lock()
+
+    def claim(self, keys: List[bytes]) -> List[bool]:
+        with self.lock:
+            if self.down:
+                raise ConnectionError("shared set unreachable")
+            claimed = [key not in self.keys for key in keys]
+            self.keys.update(keys)
+            return claimed
+
+    def release(self, keys: List[bytes]) -> None:
+        with self.lock:
+            if self.down:
+                raise ConnectionError("shared set unreachable")
+            self.keys.difference_update(keys)
+
+
+class MemoryPartitions(PartitionGateway):
+    """Storage of a hub group in memory, on a clock the tests move forward."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.members: Dict[str, float] = {}
+        # Holder and expiry of every lease
+        self.leases: Dict[int, tuple] = {}
+        self.logs: Dict[int, List[PartitionEntry]] = {}
+        self.sequence = 0
+
+    def time(self) -> float:
+        return self.now
+
+    def heartbeat(self, member: str, ttl: float) -> int:
+        self.members[member] = self.now + ttl
+        self.members = {name: expiry for name, expiry in self.members.items() if expiry > self.now}
+        return len(self.members)
+
+    def leave(self, member: str) -> None:
+        self.members.pop(member, None)
+
+    def holder(self, partition: int) -> Optional[str]:
+        member, expiry = self.leases.get(partition, (None, 0.0))
+        return member if expiry > self.now else None
+
+    def acquire(self, partition: int, member: str, ttl: float) -> bool:
+        if self.holder(partition) is not None:
+            return False
+        self.leases[partition] = (member, self.now + ttl)
+        return True
+
+    def renew(self, partition: int, member: str, ttl: float) -> bool:
+        if self.holder(partition) != member:
+            return False
+        self.leases[partition] = (member, self.now + ttl)
+        return True
+
+    def release(self, partition: int, member: str) -> None:
+        if self.holder(partition) == member:
+            del self.leases[partition]
+
+    def append(self, entries: Dict[int, List[PartitionEntry]]) -> None:
+        for partition, partition_entries in entries.items():
+            for entry in partition_entries:
+                self.sequence += 1
+                self.logs.setdefault(partition, []).append(PartitionEntry(
+                    entry.record, entry.raw, entry.time, entry_id=b"%d" % self.sequence, added=self.now,
+                ))
+
+    def read(self, partitions: Dict[int, Optional[bytes]], count: int,
+             before: float) -> Dict[int, List[PartitionEntry]]:
+        result = {}
+        for partition, last_id in partitions.items():
+            entries = [entry for entry in self.logs.get(partition, [])
+                       if (last_id is None or int(entry.entry_id) > int(last_id)) and entry.added <= before]
+            if entries:
+                result[partition] = entries[:count]
+        return result
+
+    def remove(self, partition: int, member: str, entry_ids: List[bytes]) -> bool:
+        if self.holder(partition) != member:
+            return False
+        self.logs[partition] = [entry for entry in self.logs[partition] if entry.entry_id not in entry_ids]
+        return True
+
+    def size(self, partition: int) -> int:
+        return len(self.logs.get(partition, []))
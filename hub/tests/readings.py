@@ -0,0 +1,18 @@
+"""Readings as agents publish them and the hub hands them to the store, for the tests to send."""
+
+from datetime import datetime, timedelta
+
+START = datetime(2024, 5, 1, 12, 0, 0)
+
+
+def agent_data(sequence: int, user_id: int = 1, z: float = 16384.0) -> dict:
+    return {
+        "user_id": user_id,
+        "accelerometer": {"x": sequence, "y": 2.0, "z": z},
+        "gps": {"latitude": 50.45, "longitude": 30.52 + sequence * 1e-4},
+        "timestamp": (START + timedelta(seconds=sequence)).isoformat(),
+    }
+
+
+def processed(sequence: int, road_state: str = "good", user_id: int = 1) -> dict:
+    return {"road_state": road_state, "agent_data": agent_data(sequence, user_id)}
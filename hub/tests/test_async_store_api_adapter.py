@@ -0,0 +1,97 @@
+import gzip
+import json
+import threading
+
+import httpx
+import pytest
+
+from app.adapters.async_store_api_adapter import AsyncStoreApiAdapter
+from app.interfaces.store_api_gateway import SaveResult
+
+BATCH = [b'{"sequence": 0}', b'{"sequence": 1}']
+
+
+@pytest.fixture
+def store():
+    """Adapter whose requests go to responses, a list of status codes or exceptions answered in turn."""
+    adapters = []
+
+    def connect(responses, gzip_min_size=0, max_retries=2):
+        requests = []
+
+        def handle(request: httpx.Request) -> httpx.Response:
+            body = request.content
+            if request.headers.get("Content-Encoding") == "gzip":
+                body = gzip.decompress(body)
+            requests.append((request, json.loads(body)))
+            response = responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return httpx.Response(response, json={})
+
+        adapter = AsyncStoreApiAdapter("http://store", max_in_flight=2, max_retries=max_retries,
+                                       retry_backoff=0.001, timeout=1.0, gzip_min_size=gzip_min_size)
+        adapter._client = httpx.AsyncClient(base_url="http://store", transport=httpx.MockTransport(handle))
+        adapters.append(adapter)
+        return adapter, requests
+
+    yield connect
+    for adapter in adapters:
+        adapter.close()
+
+
+def test_batch_is_posted_as_one_array(store):
+    adapter, requests = store([200])
+    assert adapter.save_data(BATCH) is SaveResult.SAVED
+    (request, body), = requests
+    assert request.method == "POST" and request.url.path == "/processed_agent_data/"
+    assert body == [{"sequence": 0}, {"sequence": 1}]
+    assert "Content-Encoding" not in request.headers
+
+
+def test_large_batches_are_compressed(store):
+    adapter, requests = store([200], gzip_min_size=10)
+    assert adapter.save_data(BATCH)
+    (request, body), = requests
+    assert request.headers["Content-Encoding"] == "gzip"
+    assert body == [{"sequence": 0}, {"sequence": 1}]
+
+
+def test_transient_failures_are_retried(store):
+    adapter, requests = store([503, httpx.ConnectError("refused"), 200])
+    assert adapter.save_data(BATCH)
+    assert len(requests) == 3
+
+
+def test_gives_up_after_max_retries(store):
+    adapter, requests = store([503, 503, 503, 200], max_retries=2)
+    assert adapter.save_data(BATCH) is SaveResult.FAILED
+    assert len(requests) == 3
+
+
+@pytest.mark.parametrize("status", [400, 413, 422])
+def test_rejected_batch_is_not_retried(store, status):
+    adapter, requests = store([status, 200])
+    assert adapter.save_data(BATCH) is SaveResult.REJECTED
+    assert len(requests) == 1
+
+
+def test_throttled_batch_is_retried(store):
+    adapter, requests = store([429, 200])
+    assert adapter.save_data(BATCH) is SaveResult.SAVED
+    assert len(requests) == 2
+
+
+def test_submit_reports_the_outcome(store):
+    adapter, _ = store([200, 422, httpx.ConnectError("refused")], max_retries=0)
+    outcomes, done = [], threading.Event()
+
+    def on_done(saved):
+        outcomes.append(saved)
+        if len(outcomes) == 3:
+            done.set()
+
+    for _ in range(3):
+        adapter.submit(BATCH, on_done)
+    assert done.wait(2.0)
+    assert set(outcomes) == {SaveResult.SAVED, SaveResult.REJECTED, SaveResult.FAILED}
@@ -0,0 +1,149 @@
+import time
+
+from app.interfaces.store_api_gateway import SaveResult
+from app.usecases.batch_buffer import BatchBuffer
+from fakes import FakeStore, MemorySpill
+
+
+def records(*sequences) -> list:
+    return [f'{{"sequence": {sequence}}}'.encode() for sequence in sequences]
+
+
+def wait_for(condition, timeout: float = 2.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_full_batch_is_delivered_at_once():
+    store = FakeStore()
+    buffer = BatchBuffer(store, MemorySpill(), batch_size=3, max_linger=60)
+    durable = []
+    for record in records(0, 1, 2, 3):
+        buffer.add(record, lambda record=record: durable.append(record))
+    assert store.batches == [records(0, 1, 2)]
+    assert durable == records(0, 1, 2)
+    assert buffer.pending() == 1
+
+
+def test_lingering_records_are_flushed():
+    store = FakeStore()
+    buffer = BatchBuffer(store, MemorySpill(), batch_size=100, max_linger=0.05)
+    buffer.start()
+    try:
+        buffer.add_many(records(0, 1))
+        assert wait_for(lambda: store.batches == [records(0, 1)])
+    finally:
+        buffer.stop()
+
+
+def test_callback_of_a_message_fires_once_all_its_records_are_durable():
+    store = FakeStore()
+    buffer = BatchBuffer(store, MemorySpill(), batch_size=2, max_linger=60)
+    calls = []
+    buffer.add_many(records(0, 1, 2), lambda: calls.append("durable"))
+    assert calls == []
+    buffer.flush()
+    assert calls == ["durable"]
+
+
+def test_rejected_batches_are_spilled_and_replayed_in_order():
+    store, spill = FakeStore(down=True), MemorySpill()
+    buffer = BatchBuffer(store, spill, batch_size=2, max_linger=0.05)
+    buffer.start()
+    try:
+        durable = []
+        buffer.add_many(records(0, 1), lambda: durable.append(0))
+        # Newer batches queue behind the failed one instead of overtaking it
+        buffer.add_many(records(2, 3), lambda: durable.append(1))
+        assert wait_for(lambda: spill.size() == 4)
+        assert durable == [0, 1]
+        store.down = False
+        assert wait_for(lambda: spill.size() == 0)
+        buffer.add_many(records(4, 5))
+        assert wait_for(lambda: len(store.records()) == 6)
+        assert store.records() == records(0, 1, 2, 3, 4, 5)
+    finally:
+        buffer.stop()
+
+
+def test_permanently_rejected_batches_go_to_the_dead_letter_sink():
+    store, spill, dead_letter = FakeStore(poison=records(1)), MemorySpill(), MemorySpill()
+    buffer = BatchBuffer(store, spill, batch_size=2, max_linger=0.05, dead_letter_gateway=dead_letter)
+    buffer.start()
+    try:
+        durable = []
+        buffer.add_many(records(0, 1), lambda: durable.append(0))
+        # The rejection does not make newer batches queue behind it
+        buffer.add_many(records(2, 3), lambda: durable.append(1))
+        assert wait_for(lambda: dead_letter.size() == 2)
+        assert dead_letter.items == records(0, 1)
+        assert store.records() == records(2, 3)
+        assert spill.size() == 0
+        assert wait_for(lambda: sorted(durable) == [0, 1])
+    finally:
+        buffer.stop()
+
+
+def test_rejected_batches_are_dropped_without_a_dead_letter_sink():
+    store = FakeStore(poison=records(0))
+    buffer = BatchBuffer(store, MemorySpill(), batch_size=1, max_linger=60)
+    buffer.add(records(0)[0])
+    buffer.add(records(1)[0])
+    buffer.stop()
+    assert store.records() == records(1)
+
+
+def test_stuck_head_is_bypassed_and_dead_lettered_after_max_attempts():
+    store = FakeStore(down=True, poison=records(0), poison_result=SaveResult.FAILED)
+    spill, dead_letter = MemorySpill(), MemorySpill()
+    buffer = BatchBuffer(store, spill, batch_size=1, max_linger=0.02, max_attempts=3,
+                         dead_letter_gateway=dead_letter)
+    buffer.start()
+    try:
+        buffer.add_many(records(0))
+        buffer.add_many(records(1))
+        assert wait_for(lambda: spill.size() == 2)
+        store.down = False
+        # The head keeps failing while batches behind it and new ones get through
+        assert wait_for(lambda: store.attempts > 5)
+        sequence = 2
+        while dead_letter.size() == 0 and sequence < 200:
+            buffer.add_many(records(sequence))
+            sequence += 1
+            time.sleep(0.01)
+        assert dead_letter.items == records(0)
+        assert wait_for(lambda: spill.size() == 0)
+        assert sorted(store.records()) == sorted(records(*range(1, sequence)))
+    finally:
+        buffer.stop()
+
+
+def test_head_is_not_dead_lettered_while_the_store_is_down():
+    store, spill, dead_letter = FakeStore(down=True), MemorySpill(), MemorySpill()
+    buffer = BatchBuffer(store, spill, batch_size=1, max_linger=0.02, max_attempts=1,
+                         dead_letter_gateway=dead_letter)
+    buffer.start()
+    try:
+        for sequence in range(5):
+            buffer.add_many(records(sequence))
+            time.sleep(0.02)
+        assert wait_for(lambda: store.attempts > 10)
+        assert dead_letter.size() == 0
+        store.down = False
+        assert wait_for(lambda: spill.size() == 0)
+        assert store.records() == records(0, 1, 2, 3, 4)
+    finally:
+        buffer.stop()
+
+
+def test_stop_flushes_what_is_left():
+    store = FakeStore()
+    buffer = BatchBuffer(store, MemorySpill(), batch_size=100, max_linger=60)
+    buffer.start()
+    buffer.add(records(0)[0])
+    buffer.stop()
+    assert store.records() == records(0)
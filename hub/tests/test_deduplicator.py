@@ -0,0 +1,149 @@
+import threading
+
+import numpy as np
+import orjson
+import pytest
+
+from app.usecases import deduplicator as dedup_module
+from app.usecases.deduplicator import Deduplicator, RotatingBloomFilter, reading_key
+from fakes import MemoryDedup
+from readings import agent_data, processed
+
+WINDOW = 60.0
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(dedup_module.time, "monotonic", clock)
+    return clock
+
+
+def digests(start: int, count: int) -> np.ndarray:
+    keys = b"".join(reading_key(agent_data(sequence)) for sequence in range(start, start + count))
+    return np.frombuffer(keys, dtype=np.uint64).reshape(-1, 2)
+
+
+def sequences(records: list) -> list:
+    return [record["accelerometer"]["x"] for record in records]
+
+
+def accept(deduplicator: Deduplicator, records: list) -> list:
+    fresh, keys = deduplicator.claim(records, raw=True)
+    deduplicator.remember(keys)
+    return sequences(fresh)
+
+
+def test_false_positive_rate_must_be_a_fraction():
+    with pytest.raises(ValueError):
+        RotatingBloomFilter(100, 1.5, WINDOW)
+
+
+def test_filter_keeps_its_false_positive_rate(clock):
+    bloom = RotatingBloomFilter(5000, 0.01, WINDOW)
+    bloom.add(digests(0, 5000))
+    # No false negatives, and false positives at most at the configured rate
+    assert bloom.contains(digests(0, 5000)).all()
+    assert bloom.contains(digests(5000, 20000)).mean() <= 0.01
+    assert bloom.estimated_false_positive_rate() <= 0.01
+
+
+def test_keys_are_kept_for_one_to_two_windows(clock):
+    bloom = RotatingBloomFilter(1000, 0.01, WINDOW)
+    bloom.add(digests(0, 10))
+    clock.now = WINDOW
+    assert bloom.contains(digests(0, 10)).all()
+    clock.now = 2 * WINDOW
+    assert not bloom.contains(digests(0, 10)).any()
+    assert bloom.rotations == 2
+
+
+def test_full_generation_rotates_early(clock):
+    bloom = RotatingBloomFilter(100, 0.01, WINDOW)
+    bloom.add(digests(0, 80))
+    bloom.add(digests(80, 80))
+    assert bloom.rotations == 1
+    # The older generation is still looked up
+    assert bloom.contains(digests(0, 160)).all()
+
+
+def test_repeated_readings_are_dropped(clock):
+    deduplicator = Deduplicator(1000, 0.01, WINDOW)
+    # Copies within one message count as well
+    assert accept(deduplicator, [agent_data(0), agent_data(1), agent_data(0)]) == [0, 1]
+    assert accept(deduplicator, [agent_data(1), agent_data(2)]) == [2]
+    assert deduplicator.stats()["dropped_local"] == 2
+
+
+def test_processed_records_are_known_by_their_agent_data(clock):
+    deduplicator = Deduplicator(1000, 0.01, WINDOW)
+    accept(deduplicator, [agent_data(0)])
+    records = [orjson.dumps(processed(0, road_state="bumpy")), orjson.dumps(processed(1))]
+    fresh, _ = deduplicator.claim(records, raw=False)
+    assert fresh == records[1:]
+
+
+@pytest.mark.parametrize("timestamp", [
+    "2024-05-01T12:00:00Z", "2024-05-01T12:00:00+00:00", "2024-05-01T14:00:00+02:00", "2024-05-01T12:00:00.000000",
+])
+def test_one_instant_written_differently_is_one_key(timestamp):
+    reading = agent_data(0)
+    assert reading["timestamp"] == "2024-05-01T12:00:00"
+    assert reading_key({**reading, "timestamp": timestamp}) == reading_key(reading)
+
+
+def test_key_is_the_vehicle_and_instant():
+    assert reading_key(agent_data(0, z=1.0)) == reading_key(agent_data(0, z=2.0))
+    assert reading_key(agent_data(0, user_id=1)) != reading_key(agent_data(0, user_id=2))
+
+
+def test_released_readings_are_not_taken_as_seen(clock):
+    deduplicator = Deduplicator(1000, 0.01, WINDOW)
+    _, keys = deduplicator.claim([agent_data(0)], raw=True)
+    # A redelivered copy is dropped while the first one is still pending
+    assert deduplicator.claim([agent_data(0)], raw=True)[0] == []
+    deduplicator.release(keys)
+    assert accept(deduplicator, [agent_data(0)]) == [0]
+
+
+def test_copies_claimed_concurrently_pass_once(clock):
+    deduplicator = Deduplicator(10000, 0.01, WINDOW)
+    records = [agent_data(sequence) for sequence in range(200)]
+    passed, barrier = [], threading.Barrier(8)
+
+    def handle():
+        barrier.wait()
+        passed.extend(accept(deduplicator, records))
+
+    threads = [threading.Thread(target=handle) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(passed) == list(range(200))
+
+
+def test_hubs_of_a_group_drop_each_others_readings(clock):
+    shared = MemoryDedup()
+    first, second = Deduplicator(1000, 0.01, WINDOW, shared), Deduplicator(1000, 0.01, WINDOW, shared)
+    assert accept(first, [agent_data(0), agent_data(1)]) == [0, 1]
+    assert accept(second, [agent_data(1), agent_data(2)]) == [2]
+    assert second.stats()["dropped_shared"] == 1
+    # Released keys can be claimed again by any hub
+    _, keys = first.claim([agent_data(3)], raw=True)
+    first.release(keys)
+    assert accept(second, [agent_data(3)]) == [3]
+
+
+def test_hub_passes_readings_while_the_shared_set_is_down(clock):
+    deduplicator = Deduplicator(1000, 0.01, WINDOW, MemoryDedup(down=True))
+    assert accept(deduplicator, [agent_data(0), agent_data(0)]) == [0]
+    assert accept(deduplicator, [agent_data(0)]) == []
@@ -0,0 +1,109 @@
+import os
+
+from app.adapters.file_spill_adapter import FileSpillAdapter, RECORD_HEADER, SEGMENT_PREFIX
+
+
+def records(*sequences) -> list:
+    return [f'{{"sequence": {sequence}}}'.encode() for sequence in sequences]
+
+
+def segments(directory) -> list:
+    return sorted(name for name in os.listdir(directory) if name.startswith(SEGMENT_PREFIX))
+
+
+def spill(directory, segment_size: int = 4096) -> FileSpillAdapter:
+    return FileSpillAdapter(str(directory), segment_size=segment_size, fsync_interval=0)
+
+
+def test_items_are_peeked_and_acked_in_order(tmp_path):
+    adapter = spill(tmp_path)
+    adapter.append(records(0, 1, 2))
+    adapter.append(records(3))
+    assert adapter.size() == 4
+    assert adapter.peek(2) == records(0, 1)
+    assert adapter.peek(10) == records(0, 1, 2, 3)
+    adapter.ack(3)
+    assert adapter.size() == 1
+    assert adapter.peek(10) == records(3)
+    adapter.close()
+
+
+def test_log_rotates_and_deletes_delivered_segments(tmp_path):
+    # Room for two records per segment
+    size = 2 * (RECORD_HEADER.size + len(records(0)[0]))
+    adapter = spill(tmp_path, segment_size=size)
+    adapter.append(records(0, 1, 2, 3, 4))
+    assert len(segments(tmp_path)) == 3
+    assert adapter.peek(10) == records(0, 1, 2, 3, 4)
+    # The head moves past the first segment once a record of the next one is acknowledged
+    adapter.ack(2)
+    assert len(segments(tmp_path)) == 3
+    adapter.ack(1)
+    assert len(segments(tmp_path)) == 2
+    assert adapter.peek(10) == records(3, 4)
+    adapter.ack(2)
+    # Everything was delivered, only a fresh segment is left
+    assert len(segments(tmp_path)) == 1
+    assert adapter.size() == 0
+    adapter.append(records(5))
+    assert adapter.peek(10) == records(5)
+    adapter.close()
+
+
+def test_oversized_records_get_a_segment_of_their_own(tmp_path):
+    adapter = spill(tmp_path, segment_size=64)
+    large = b"x" * 500
+    adapter.append(records(0) + [large] + records(1))
+    assert adapter.peek(10) == records(0) + [large] + records(1)
+    adapter.close()
+
+
+def test_unacknowledged_items_survive_a_restart(tmp_path):
+    size = 2 * (RECORD_HEADER.size + len(records(0)[0]))
+    adapter = spill(tmp_path, segment_size=size)
+    adapter.append(records(0, 1, 2, 3, 4))
+    adapter.ack(3)
+    adapter.close()
+
+    adapter = spill(tmp_path, segment_size=size)
+    assert adapter.size() == 2
+    assert adapter.peek(10) == records(3, 4)
+    adapter.append(records(5))
+    assert adapter.peek(10) == records(3, 4, 5)
+    adapter.close()
+
+
+def test_recovery_stops_at_a_torn_record(tmp_path):
+    adapter = spill(tmp_path)
+    adapter.append(records(0, 1, 2))
+    adapter.close()
+    # Corrupt the payload of the last record, as a crash in the middle of writing it would
+    path = os.path.join(tmp_path, segments(tmp_path)[0])
+    offset = 2 * (RECORD_HEADER.size + len(records(0)[0])) + RECORD_HEADER.size
+    with open(path, "r+b") as file:
+        file.seek(offset)
+        file.write(b"#")
+
+    adapter = spill(tmp_path)
+    assert adapter.size() == 2
+    assert adapter.peek(10) == records(0, 1)
+    # The torn record is overwritten by the next one
+    adapter.append(records(3))
+    assert adapter.peek(10) == records(0, 1, 3)
+    adapter.close()
+
+
+def test_unflushed_head_replays_acknowledged_items(tmp_path):
+    adapter = FileSpillAdapter(str(tmp_path), segment_size=4096, fsync_interval=3600)
+    adapter.append(records(0, 1, 2))
+    adapter._sync()
+    adapter.ack(1)
+    # The machine crashes before the head is flushed: nothing is lost, item 0 comes again
+    adapter._closed.set()
+    adapter._sync_thread.join()
+    for segment in adapter._segments.values():
+        segment.close()
+
+    adapter = spill(tmp_path)
+    assert adapter.peek(10) == records(0, 1, 2)
+    adapter.close()
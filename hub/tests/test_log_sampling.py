@@ -0,0 +1,57 @@
+import logging
+
+import pytest
+
+from app import log_sampling
+from app.log_sampling import RateLimitFilter
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(log_sampling.time, "monotonic", clock)
+    return clock
+
+
+def record(line: int, msg: str = "Received message") -> logging.LogRecord:
+    return logging.LogRecord("hub", logging.INFO, "main.py", line, msg, None, None)
+
+
+def test_one_record_per_interval_and_call_site(clock):
+    sampler = RateLimitFilter(10)
+    assert sampler.filter(record(1))
+    assert not sampler.filter(record(1))
+    # Other call sites have their own interval
+    assert sampler.filter(record(2))
+    clock.now = 9.9
+    assert not sampler.filter(record(1))
+    clock.now = 10
+    assert sampler.filter(record(1))
+
+
+def test_next_record_reports_the_suppressed_ones(clock):
+    sampler = RateLimitFilter(10)
+    sampler.filter(record(1))
+    for _ in range(3):
+        sampler.filter(record(1))
+    clock.now = 10
+    passed = record(1)
+    assert sampler.filter(passed)
+    assert passed.getMessage() == "Received message (3 similar messages suppressed)"
+    clock.now = 20
+    passed = record(1)
+    assert sampler.filter(passed)
+    assert passed.getMessage() == "Received message"
+
+
+def test_zero_interval_lets_everything_through(clock):
+    sampler = RateLimitFilter(0)
+    assert all(sampler.filter(record(1)) for _ in range(5))
@@ -0,0 +1,83 @@
+from app.usecases.partition_coordinator import PartitionCoordinator
+from fakes import MemoryPartitions
+
+PARTITIONS, LEASE_TTL = 8, 3.0
+
+
+class Member:
+    """A coordinator with the calls it made."""
+
+    def __init__(self, gateway: MemoryPartitions, name: str):
+        self.events = []
+        self.coordinator = PartitionCoordinator(
+            gateway, name, PARTITIONS, LEASE_TTL,
+            on_assigned=lambda partition: self.events.append(("assigned", partition)),
+            on_revoked=lambda partition: self.events.append(("revoked", partition)),
+        )
+
+
+def rounds(*members: Member, count: int = 3):
+    for _ in range(count):
+        for member in members:
+            member.coordinator.rebalance()
+
+
+def test_single_member_takes_every_partition():
+    gateway = MemoryPartitions()
+    member = Member(gateway, "hub-a")
+    rounds(member, count=1)
+    assert member.coordinator.owned() == set(range(PARTITIONS))
+    assert sorted(partition for _, partition in member.events) == list(range(PARTITIONS))
+    assert all(gateway.holder(partition) == "hub-a" for partition in range(PARTITIONS))
+
+
+def test_partitions_are_shared_once_another_member_joins():
+    gateway = MemoryPartitions()
+    first, second = Member(gateway, "hub-a"), Member(gateway, "hub-b")
+    rounds(first, count=1)
+    first.events.clear()
+    rounds(second, first, second)
+    owned_first, owned_second = first.coordinator.owned(), second.coordinator.owned()
+    assert len(owned_first) == len(owned_second) == PARTITIONS // 2
+    assert owned_first | owned_second == set(range(PARTITIONS))
+    # The surplus was revoked and handed over, never assigned to both
+    assert {partition for event, partition in first.events if event == "revoked"} == owned_second
+
+
+def test_partitions_of_a_dead_member_move_once_its_leases_expire():
+    gateway = MemoryPartitions()
+    first, second = Member(gateway, "hub-a"), Member(gateway, "hub-b")
+    rounds(first, second)
+    gateway.now += LEASE_TTL / 3
+    rounds(second, count=1)
+    # hub-a's leases still hold
+    assert len(second.coordinator.owned()) == PARTITIONS // 2
+    gateway.now += LEASE_TTL
+    rounds(second, count=1)
+    assert second.coordinator.owned() == set(range(PARTITIONS))
+
+
+def test_lost_leases_are_revoked():
+    gateway = MemoryPartitions()
+    member = Member(gateway, "hub-a")
+    rounds(member, count=1)
+    member.events.clear()
+    # The hub stalled past its leases and another one took a partition
+    gateway.now += LEASE_TTL + 1
+    gateway.acquire(5, "hub-b", LEASE_TTL)
+    gateway.heartbeat("hub-b", LEASE_TTL)
+    member.coordinator.rebalance()
+    assert ("revoked", 5) in member.events
+    assert 5 not in member.coordinator.owned()
+    assert gateway.holder(5) == "hub-b"
+
+
+def test_stop_hands_every_partition_over():
+    gateway = MemoryPartitions()
+    member = Member(gateway, "hub-a")
+    rounds(member, count=1)
+    member.events.clear()
+    member.coordinator.stop()
+    assert sorted(partition for event, partition in member.events if event == "revoked") == list(range(PARTITIONS))
+    assert all(gateway.holder(partition) is None for partition in range(PARTITIONS))
+    assert "hub-a" not in gateway.members
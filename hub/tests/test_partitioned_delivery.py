@@ -0,0 +1,188 @@
+from typing import Optional
+
+import orjson
+
+from app.interfaces.spill_gateway import SpillGateway
+from app.interfaces.store_api_gateway import SaveResult
+from app.usecases.partitioned_delivery import PartitionedDelivery
+from app.usecases.road_classifier import RoadStateClassifier
+from fakes import FakeStore, MemoryPartitions, MemorySpill
+from readings import agent_data, processed
+
+PARTITIONS, REORDER_DELAY, MAX_LINGER = 4, 1.0, 2.0
+
+
+def delivery(gateway: MemoryPartitions, store: FakeStore, batch_size: int = 3,
+             retry_backoff: float = 60.0, max_attempts: int = 0,
+             dead_letter_gateway: Optional[SpillGateway] = None) -> PartitionedDelivery:
+    return PartitionedDelivery(
+        gateway, store, RoadStateClassifier(5, 100.0, 900.0), member="hub-a", partitions=PARTITIONS,
+        batch_size=batch_size, max_linger=MAX_LINGER, reorder_delay=REORDER_DELAY, retry_backoff=retry_backoff,
+        max_attempts=max_attempts, dead_letter_gateway=dead_letter_gateway,
+    )
+
+
+def owned(gateway: MemoryPartitions, hub: PartitionedDelivery, *partitions: int):
+    for partition in partitions:
+        gateway.acquire(partition, "hub-a", 60)
+        hub.assign(partition)
+
+
+def deliver(hub: PartitionedDelivery):
+    # One round of the delivery thread, the fake store answers right away
+    hub._fill()
+    hub._submit()
+    hub._collect()
+
+
+def sequences(store: FakeStore) -> list:
+    return [orjson.loads(record)["agent_data"]["accelerometer"]["x"] for record in store.records()]
+
+
+def test_records_go_to_the_partition_of_their_vehicle():
+    gateway = MemoryPartitions()
+    hub = delivery(gateway, FakeStore())
+    hub.append([agent_data(0, user_id=1), agent_data(1, user_id=6)], raw=True)
+    hub.append([orjson.dumps(processed(2, user_id=5))], raw=False)
+    assert {partition: gateway.size(partition) for partition in gateway.logs} == {1: 2, 2: 1}
+
+
+def test_entries_are_delivered_after_the_reorder_delay_in_timestamp_order():
+    gateway, store = MemoryPartitions(), FakeStore()
+    hub = delivery(gateway, store)
+    owned(gateway, hub, 1)
+    # Records of one vehicle that reached the group out of order
+    hub.append([agent_data(2), agent_data(0)], raw=True)
+    hub.append([agent_data(1)], raw=True)
+    deliver(hub)
+    assert store.batches == []
+    gateway.now += REORDER_DELAY
+    deliver(hub)
+    assert sequences(store) == [0, 1, 2]
+    # Raw records were classified, delivered entries left the log
+    assert {orjson.loads(record)["road_state"] for record in store.records()} == {"smooth"}
+    assert gateway.size(1) == 0
+
+
+def test_partial_batches_linger():
+    gateway, store = MemoryPartitions(), FakeStore()
+    hub = delivery(gateway, store)
+    owned(gateway, hub, 1)
+    hub.append([agent_data(0)], raw=True)
+    gateway.now += REORDER_DELAY
+    deliver(hub)
+    assert store.batches == []
+    gateway.now += MAX_LINGER
+    deliver(hub)
+    assert sequences(store) == [0]
+
+
+def test_only_assigned_partitions_are_delivered():
+    gateway, store = MemoryPartitions(), FakeStore()
+    hub = delivery(gateway, store)
+    owned(gateway, hub, 1)
+    hub.append([agent_data(0, user_id=1), agent_data(1, user_id=2), agent_data(2, user_id=1)], raw=True)
+    gateway.now += REORDER_DELAY + MAX_LINGER
+    deliver(hub)
+    assert sequences(store) == [0, 2]
+    assert gateway.size(2) == 1
+
+
+def test_rejected_batches_stay_in_the_log_and_are_retried():
+    gateway, store = MemoryPartitions(), FakeStore(down=True)
+    hub = delivery(gateway, store, retry_backoff=0)
+    owned(gateway, hub, 1)
+    hub.append([agent_data(sequence) for sequence in range(4)], raw=True)
+    gateway.now += REORDER_DELAY + MAX_LINGER
+    deliver(hub)
+    assert gateway.size(1) == 4
+    assert hub.stats()["queued_batches"] == 2
+    store.down = False
+    deliver(hub)
+    # One batch in flight at a time keeps the vehicle's order
+    assert sequences(store) == [0, 1, 2]
+    deliver(hub)
+    assert sequences(store) == [0, 1, 2, 3]
+    assert gateway.size(1) == 0
+
+
+def test_batches_of_a_lost_lease_stay_in_the_log():
+    gateway, store = MemoryPartitions(), FakeStore()
+    hub = delivery(gateway, store)
+    owned(gateway, hub, 1)
+    hub.append([agent_data(sequence) for sequence in range(3)], raw=True)
+    gateway.now += REORDER_DELAY
+    # The lease moved to another hub before the delivered batch could be removed
+    gateway.leases[1] = ("hub-b", gateway.now + 60)
+    deliver(hub)
+    assert sequences(store) == [0, 1, 2]
+    assert gateway.size(1) == 3
+
+
+def test_revoked_partitions_are_dropped():
+    gateway, store = MemoryPartitions(), FakeStore()
+    hub = delivery(gateway, store)
+    owned(gateway, hub, 1, 2)
+    hub.revoke(2)
+    assert hub.stats()["partitions"] == [1]
+    hub.append([agent_data(0, user_id=2)], raw=True)
+    gateway.now += REORDER_DELAY + MAX_LINGER
+    deliver(hub)
+    assert store.batches == []
+
+
+def test_records_without_a_vehicle_are_spread_over_the_partitions():
+    gateway = MemoryPartitions()
+    hub = delivery(gateway, FakeStore())
+    readings = [agent_data(sequence) for sequence in range(16)]
+    for reading in readings:
+        del reading["user_id"]
+    hub.append(readings, raw=True)
+    assert len(gateway.logs) > 1
+    assert sum(gateway.size(partition) for partition in gateway.logs) == 16
+
+
+def test_batches_the_store_refuses_are_dead_lettered():
+    records = [orjson.dumps(processed(sequence)) for sequence in range(6)]
+    gateway, store, dead_letter = MemoryPartitions(), FakeStore(poison=records[:1]), MemorySpill()
+    hub = delivery(gateway, store, retry_backoff=0, dead_letter_gateway=dead_letter)
+    owned(gateway, hub, 1)
+    hub.append(records, raw=False)
+    gateway.now += REORDER_DELAY
+    deliver(hub)
+    deliver(hub)
+    assert dead_letter.items == records[:3]
+    # The partition goes on with the next batch
+    assert sequences(store) == [3, 4, 5]
+    assert gateway.size(1) == 0
+
+
+def test_batches_failing_while_others_are_saved_are_dead_lettered_after_max_attempts():
+    poison = orjson.dumps(processed(0, user_id=1))
+    records = [poison] + [orjson.dumps(processed(sequence, user_id=2)) for sequence in range(1, 7)]
+    gateway, store = MemoryPartitions(), FakeStore(poison=[poison], poison_result=SaveResult.FAILED)
+    hub = delivery(gateway, store, batch_size=1, retry_backoff=0, max_attempts=3)
+    owned(gateway, hub, 1, 2)
+    hub.append(records, raw=False)
+    gateway.now += REORDER_DELAY
+    for _ in range(3):
+        deliver(hub)
+    assert gateway.size(1) == 1
+    deliver(hub)
+    # Dropped without a dead-letter sink
+    assert gateway.size(1) == 0
+    assert sequences(store) == [1, 2, 3, 4]
+
+
+def test_batches_are_not_dead_lettered_while_the_store_is_down():
+    gateway, store, dead_letter = MemoryPartitions(), FakeStore(down=True), MemorySpill()
+    hub = delivery(gateway, store, retry_backoff=0, max_attempts=1, dead_letter_gateway=dead_letter)
+    owned(gateway, hub, 1)
+    hub.append([agent_data(sequence) for sequence in range(3)], raw=True)
+    gateway.now += REORDER_DELAY
+    for _ in range(5):
+        deliver(hub)
+    assert dead_letter.items == []
+    store.down = False
+    deliver(hub)
+    assert sequences(store) == [0, 1, 2]
@@ -0,0 +1,64 @@
+import random
+
+import numpy as np
+import orjson
+import pytest
+
+from app.usecases.road_classifier import BUMPY, POTHOLE, SMOOTH, RoadStateClassifier
+from readings import agent_data
+
+WINDOW_SIZE, BUMPY_STD, POTHOLE_DEVIATION = 5, 100.0, 900.0
+
+
+def reference(history: list, z: float) -> str:
+    # One sample at a time, over plain lists
+    history.append(z)
+    window = np.array(history[-WINDOW_SIZE:])
+    if abs(z - window.mean()) > POTHOLE_DEVIATION:
+        return POTHOLE
+    return BUMPY if window.std() > BUMPY_STD else SMOOTH
+
+
+def classifier(max_vehicles: int = 10000) -> RoadStateClassifier:
+    return RoadStateClassifier(WINDOW_SIZE, BUMPY_STD, POTHOLE_DEVIATION, max_vehicles)
+
+
+def test_window_must_hold_two_samples():
+    with pytest.raises(ValueError):
+        RoadStateClassifier(1, BUMPY_STD, POTHOLE_DEVIATION)
+
+
+def test_matches_sample_by_sample_classification():
+    rng = random.Random(3)
+    engine, histories = classifier(), {}
+    for _ in range(30):
+        # Micro-batches mixing vehicles, with windows spanning batches
+        size = rng.randrange(0, 12)
+        vehicle_ids = [rng.randrange(5) for _ in range(size)]
+        z = [16384 + rng.choice((rng.gauss(0, 20), rng.gauss(0, 300), rng.choice((-1, 1)) * 2500))
+             for _ in range(size)]
+        expected = [reference(histories.setdefault(vehicle, []), value) for vehicle, value in zip(vehicle_ids, z)]
+        assert engine.classify(np.array(vehicle_ids, dtype=np.int64), np.array(z)).tolist() == expected
+    assert engine.vehicles() == 5
+
+
+def test_states():
+    engine = classifier()
+    states = engine.classify(np.zeros(6, dtype=np.int64), np.array([16384, 16390, 16380, 16384, 18000, 16384.0]))
+    assert states.tolist() == [SMOOTH, SMOOTH, SMOOTH, SMOOTH, POTHOLE, BUMPY]
+
+
+def test_least_recently_seen_vehicle_is_forgotten():
+    engine = classifier(max_vehicles=2)
+    engine.classify(np.array([1, 1, 2]), np.array([16384.0, 17000.0, 16384.0]))
+    engine.classify(np.array([2, 3]), np.array([16384.0, 16384.0]))
+    assert engine.vehicles() == 2
+    # Vehicle 1 starts over with an empty window, its first sample cannot deviate from itself
+    assert engine.classify(np.array([1]), np.array([17000.0])).tolist() == [SMOOTH]
+
+
+def test_records_become_processed_documents():
+    records = [agent_data(0), agent_data(1, user_id=2)]
+    documents = [orjson.loads(document) for document in classifier().classify_records(records)]
+    assert documents == [{"road_state": SMOOTH, "agent_data": record} for record in records]
+    assert classifier().classify_records([]) == []
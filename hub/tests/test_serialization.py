@@ -0,0 +1,55 @@
+import orjson
+import pytest
+from pydantic import ValidationError
+
+from app.entities.serialization import encode_batch, parse_agent_data, validate_payload, vehicle_key
+from readings import agent_data, processed
+
+
+def test_single_record_is_passed_on_as_received():
+    payload = orjson.dumps(processed(0))
+    assert validate_payload(b"  " + payload + b"\n") == [payload]
+
+
+def test_array_is_split_into_records_as_received():
+    first, second = orjson.dumps(processed(0)), orjson.dumps(processed(1, road_state="bad"))
+    assert validate_payload(b"[ " + first + b" ,\n" + second + b"\n]") == [first, second]
+    assert validate_payload(b"[]") == []
+
+
+def test_array_with_separators_inside_records_is_split_into_records():
+    records = [processed(0, road_state="},{"), {**processed(1), "extra": [{}, {}]}]
+    assert [orjson.loads(record) for record in validate_payload(orjson.dumps(records))] == records
+
+
+@pytest.mark.parametrize("payload", [
+    {"road_state": "good"},
+    {"road_state": "good", "agent_data": {**agent_data(0), "timestamp": "yesterday"}},
+    {"road_state": "good", "agent_data": {**agent_data(0), "accelerometer": {"x": "1", "y": 2, "z": 3}}},
+    [processed(0), {"road_state": 1, "agent_data": agent_data(1)}],
+])
+def test_invalid_payload_is_rejected_whole(payload):
+    with pytest.raises(ValidationError):
+        validate_payload(orjson.dumps(payload))
+
+
+def test_raw_agent_data_is_parsed():
+    assert parse_agent_data(orjson.dumps(agent_data(0))) == [agent_data(0)]
+    assert parse_agent_data(orjson.dumps([agent_data(0), agent_data(1)])) == [agent_data(0), agent_data(1)]
+    with pytest.raises(ValidationError):
+        parse_agent_data(orjson.dumps([agent_data(0), {"gps": {"latitude": 1, "longitude": 2}}]))
+
+
+def test_encoded_batch_is_a_json_array_of_the_records():
+    records = validate_payload(orjson.dumps([processed(0), processed(1)]))
+    assert orjson.loads(encode_batch(records)) == [processed(0), processed(1)]
+    assert encode_batch([]) == b"[]"
+
+
+def test_vehicle_key_is_found_without_parsing():
+    assert vehicle_key(orjson.dumps(agent_data(0, user_id=17))) == "17"
+    assert vehicle_key(orjson.dumps([processed(0, user_id=3), processed(1, user_id=4)])) == "3"
+    assert vehicle_key(b'{"user_id" : 5, "gps": {}}') == "5"
+    reading = agent_data(0)
+    del reading["user_id"]
+    assert vehicle_key(orjson.dumps(reading)) is None
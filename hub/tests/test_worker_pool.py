@@ -0,0 +1,72 @@
+import random
+import threading
+import time
+
+from app.usecases.worker_pool import WorkerPool
+
+
+def test_items_of_one_key_are_handled_in_order():
+    handled = {}
+    lock = threading.Lock()
+
+    def handle(topic, sequence):
+        # Uneven handling times would reorder items of one key spread over several workers
+        time.sleep(random.random() / 1000)
+        with lock:
+            handled.setdefault(topic, []).append(sequence)
+
+    pool = WorkerPool(handle, worker_count=4, queue_size=64)
+    pool.start()
+    for sequence in range(50):
+        for topic in ("vehicle/1", "vehicle/2", "vehicle/3"):
+            pool.submit(topic, topic, sequence)
+    pool.stop()
+    assert handled == {topic: list(range(50)) for topic in ("vehicle/1", "vehicle/2", "vehicle/3")}
+
+
+def test_work_is_spread_over_the_workers():
+    threads = set()
+    pool = WorkerPool(lambda: threads.add(threading.current_thread().name), worker_count=4, queue_size=64)
+    pool.start()
+    for number in range(64):
+        pool.submit(f"vehicle/{number}")
+    pool.stop()
+    assert len(threads) > 1
+
+
+def test_failures_are_counted_and_do_not_stop_the_worker():
+    def handle(fail):
+        if fail:
+            raise ValueError("bad payload")
+
+    pool = WorkerPool(handle, worker_count=1, queue_size=8)
+    pool.start()
+    for fail in (True, False, True, False):
+        pool.submit("topic", fail)
+    pool.stop()
+    stats = pool.stats()
+    assert stats["processed"] == 2 and stats["failed"] == 2
+    assert stats["latency_ms_p50"] is not None
+
+
+def test_full_queue_blocks_the_producer():
+    release = threading.Event()
+    pool = WorkerPool(lambda: release.wait(), worker_count=2, queue_size=2)
+    assert pool.stats()["queue_capacity"] == 2
+    pool.start()
+    # Every key routes to the same worker, whose queue holds one item
+    submitted = []
+
+    def produce():
+        for _ in range(3):
+            pool.submit("topic")
+            submitted.append(1)
+
+    producer = threading.Thread(target=produce)
+    producer.start()
+    time.sleep(0.1)
+    assert len(submitted) == 2 and pool.stats()["queue_depth"] == 1
+    release.set()
+    producer.join(1.0)
+    pool.stop()
+    assert len(submitted) == 3 and pool.stats()["processed"] == 3
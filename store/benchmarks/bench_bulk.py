@@ -0,0 +1,110 @@
+"""
+Compare the per-id PUT and DELETE handlers with the set-based bulk endpoints on a local Postgres.
+
+Every size relabels a day of rows one request at a time and with one PATCH,
+deletes them the same two ways, and replays an already stored batch through
+the idempotent upsert.
+
+Run from the store directory with the database from docker/docker-compose.yaml up:
+    python -m benchmarks.bench_bulk --sizes 100 1000 10000
+"""
+import argparse
+import asyncio
+import random
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select
+
+from database import engine, processed_agent_data
+from main import bulk_updates, delete_processed_agent_data, ingest_engine, update_processed_agent_data
+from models import AccelerometerData, AgentData, GpsData, ProcessedAgentData
+
+ROAD_STATES = ("smooth", "bumpy", "pothole")
+
+
+def make_items(count: int, day: datetime):
+    return [ProcessedAgentData(
+        road_state=random.choice(ROAD_STATES),
+        agent_data=AgentData(
+            user_id=1,
+            accelerometer=AccelerometerData(x=random.uniform(-100, 100), y=random.uniform(-100, 100),
+                                            z=random.uniform(16000, 17000)),
+            gps=GpsData(latitude=30.52 + random.uniform(-0.01, 0.01), longitude=50.45 + random.uniform(-0.01, 0.01)),
+            timestamp=day + timedelta(seconds=i * 86400 / count),
+        ),
+    ) for i in range(count)]
+
+
+async def ids_of(day: datetime):
+    async with engine.connect() as conn:
+        result = await conn.execute(select(processed_agent_data.c.id).where(
+            processed_agent_data.c.timestamp >= day, processed_agent_data.c.timestamp < day + timedelta(days=1)
+        ))
+        return result.scalars().all()
+
+
+async def timed(coroutine) -> float:
+    started = time.perf_counter()
+    await coroutine
+    return time.perf_counter() - started
+
+
+async def per_id_relabel(items, ids):
+    # What reprocessing looked like before: one PUT per record
+    for item, record_id in zip(items, ids):
+        await update_processed_agent_data(record_id, item.model_copy(update={"road_state": "pothole"}))
+
+
+async def per_id_delete(ids):
+    for record_id in ids:
+        await delete_processed_agent_data(record_id)
+
+
+async def run(args):
+    day = datetime(2000, 1, 1)
+    async with engine.connect() as conn:
+        before = await conn.scalar(select(func.count()).select_from(processed_agent_data))
+    if before and not args.force:
+        raise SystemExit("processed_agent_data is not empty, pass --force to run against it anyway")
+
+    print(f"{'rows':>8} {'operation':>10} {'per-id rows/s':>14} {'bulk rows/s':>12} {'speedup':>8}")
+    try:
+        for size in args.sizes:
+            items = make_items(size, day)
+            conditions = [processed_agent_data.c.timestamp >= day,
+                          processed_agent_data.c.timestamp < day + timedelta(days=1)]
+
+            await ingest_engine.ingest([item.to_row() for item in items])
+            ids = sorted(await ids_of(day))
+            loop_time = await timed(per_id_relabel(items, ids))
+            bulk_time = await timed(bulk_updates.relabel("smooth", conditions))
+            print(f"{size:>8} {'relabel':>10} {size / loop_time:>14.0f} {size / bulk_time:>12.0f} "
+                  f"{loop_time / bulk_time:>7.1f}x")
+
+            loop_time = await timed(per_id_delete(ids))
+            await ingest_engine.ingest([item.to_row() for item in items])
+            bulk_time = await timed(bulk_updates.delete(conditions))
+            print(f"{size:>8} {'delete':>10} {size / loop_time:>14.0f} {size / bulk_time:>12.0f} "
+                  f"{loop_time / bulk_time:>7.1f}x")
+
+            # A hub retry of a batch that was already written
+            rows = [item.to_row() for item in items]
+            await ingest_engine.ingest(rows)
+            replay_time = await timed(bulk_updates.upsert(rows))
+            print(f"{size:>8} {'replay':>10} {'':>14} {size / replay_time:>12.0f}")
+            await bulk_updates.delete(conditions)
+    finally:
+        await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--force", action="store_true", help="Run even if the table already holds data")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
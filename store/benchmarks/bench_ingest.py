@@ -0,0 +1,88 @@
+"""
+Compare the per-row insert loop with the bulk ingest engine on a local Postgres.
+
+Run from the store directory with the database from docker/docker-compose.yaml up:
+    python -m benchmarks.bench_ingest --batch-sizes 20 500 5000 --repeat 5
+"""
+import argparse
+import asyncio
+import random
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select
+
+from bulk_ingest import BulkIngestEngine
+from config import INGEST_COPY_THRESHOLD
+from database import engine, processed_agent_data
+from spatial import cell_of
+
+ROAD_STATES = ("smooth", "bumpy", "pothole")
+
+
+def make_rows(count: int):
+    start = datetime.now()
+    rows = [{
+        "user_id": 0,
+        "road_state": random.choice(ROAD_STATES),
+        "x": random.uniform(-100, 100),
+        "y": random.uniform(-100, 100),
+        "z": random.uniform(16000, 17000),
+        "latitude": 30.52 + random.uniform(-0.01, 0.01),
+        "longitude": 50.45 + random.uniform(-0.01, 0.01),
+        "timestamp": start + timedelta(milliseconds=i),
+    } for i in range(count)]
+    for row in rows:
+        row["cell_lat"], row["cell_lon"] = cell_of(row["latitude"], row["longitude"])
+    return rows
+
+
+async def per_row_loop(rows):
+    # The original create_processed_agent_data behaviour: one INSERT per item
+    async with engine.begin() as conn:
+        for row in rows:
+            await conn.execute(processed_agent_data.insert().values(**row))
+
+
+async def measure(fn, size: int, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        # Fresh readings every time, stored ones would violate the reading key
+        rows = make_rows(size)
+        started = time.perf_counter()
+        await fn(rows)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+async def run(args):
+    ingest_engine = BulkIngestEngine(engine, processed_agent_data, copy_threshold=args.copy_threshold)
+    async with engine.begin() as conn:
+        max_id = (await conn.execute(select(func.max(processed_agent_data.c.id)))).scalar() or 0
+
+    print(f"{'batch':>8} {'strategy':>12} {'per-row rows/s':>16} {'bulk rows/s':>14} {'speedup':>8}")
+    try:
+        for size in args.batch_sizes:
+            loop_time = await measure(per_row_loop, size, args.repeat)
+            bulk_time = await measure(ingest_engine.ingest, size, args.repeat)
+            print(f"{size:>8} {ingest_engine.choose_strategy(size):>12} {size / loop_time:>16.0f} "
+                  f"{size / bulk_time:>14.0f} {loop_time / bulk_time:>7.1f}x")
+    finally:
+        if not args.keep:
+            async with engine.begin() as conn:
+                await conn.execute(processed_agent_data.delete().where(processed_agent_data.c.id > max_id))
+        await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[20, 200, 2000, 20000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--copy-threshold", type=int, default=INGEST_COPY_THRESHOLD)
+    parser.add_argument("--keep", action="store_true", help="Keep the inserted rows instead of cleaning up")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+import asyncio
+import json
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import WebSocket
+
+from models import ProcessedAgentData
+from subscriptions import SubscriptionIndex, SubscriptionRequest
+
+DROP_OLDEST = "drop_oldest"
+DISCONNECT = "disconnect"
+OVERFLOW_POLICIES = (DROP_OLDEST, DISCONNECT)
+
+# Close code sent to clients that cannot keep up under the disconnect policy
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+# road_state, latitude and longitude of a record, all subscriptions filter on
+Point = Tuple[str, float, float]
+
+
+class Subscriber:
+    """
+    A single WebSocket client with its own bounded outbound queue.
+    A background task drains the queue, so a slow client only ever
+    delays itself. Queue items are comma-joined JSON records of one batch.
+    """
+
+    def __init__(self, websocket: WebSocket, queue_size: int):
+        self.websocket = websocket
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.request: Optional[SubscriptionRequest] = None
+        self.sent = 0
+        self.dropped = 0
+        self.task = None
+
+    def offer(self, message: str, policy: str) -> bool:
+        """
+        Enqueue a batch of records without waiting.
+        Returns:
+            bool: False if the queue is full and the client must be disconnected.
+        """
+        try:
+            self.queue.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            if policy != DROP_OLDEST:
+                return False
+        self.queue.get_nowait()
+        self.dropped += 1
+        self.queue.put_nowait(message)
+        return True
+
+    async def run(self):
+        while True:
+            chunks = [await self.queue.get()]
+            max_rate = self.request.max_rate if self.request else None
+            if max_rate:
+                # Coalesce everything queued since the last send into one message
+                while not self.queue.empty():
+                    chunks.append(self.queue.get_nowait())
+            await self.websocket.send_text("[" + ",".join(chunks) + "]")
+            self.sent += 1
+            if max_rate:
+                await asyncio.sleep(1 / max_rate)
+
+
+class Broadcaster:
+    """
+    Fans batches out to connected WebSocket clients. Clients that sent a
+    SubscriptionRequest only receive the records matching it, located
+    through a grid index over their bounding boxes.
+    """
+
+    def __init__(self, queue_size: int, policy: str, index: SubscriptionIndex):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {policy}")
+        self.queue_size = queue_size
+        self.policy = policy
+        self.index = index
+        self.subscribers: Dict[WebSocket, Subscriber] = {}
+        self.dropped = 0
+        self.disconnected = 0
+        # Close tasks of disconnected slow clients, referenced until done so they are not garbage collected
+        self._closing = set()
+
+    def subscribe(self, websocket: WebSocket) -> Subscriber:
+        subscriber = Subscriber(websocket, self.queue_size)
+        subscriber.task = asyncio.create_task(self._send_loop(subscriber))
+        self.subscribers[websocket] = subscriber
+        return subscriber
+
+    def update_subscription(self, websocket: WebSocket, request: SubscriptionRequest):
+        subscriber = self.subscribers.get(websocket)
+        if subscriber is None:
+            return
+        subscriber.request = request
+        self.index.add(websocket, request)
+
+    def unsubscribe(self, websocket: WebSocket):
+        subscriber = self.subscribers.pop(websocket, None)
+        if subscriber is None:
+            return
+        self.index.remove(websocket)
+        self.dropped += subscriber.dropped
+        if subscriber.task is not asyncio.current_task():
+            subscriber.task.cancel()
+
+    def publish(self, batch: List[ProcessedAgentData]):
+        """
+        Queue a batch for every interested subscriber.
+        Each record is serialized once no matter how many clients receive it.
+        Never waits on a client; full queues are handled by the overflow policy.
+        """
+        if not self.subscribers:
+            return
+        self.publish_serialized(
+            [item.model_dump_json() for item in batch],
+            [(item.road_state, item.agent_data.gps.latitude, item.agent_data.gps.longitude) for item in batch],
+        )
+
+    def publish_serialized(self, fragments: List[str], points: Optional[List[Point]] = None):
+        """
+        Queue a batch already serialized, one JSON record per fragment, e.g. relayed from another process.
+        Parameters:
+            fragments (List[str]): The records as JSON.
+            points (Optional[List[Point]]): Road state and position of every record; read from the fragments
+                when not given and a subscriber filters.
+        """
+        if not self.subscribers:
+            return
+        shared = ",".join(fragments)
+        routed = self._route(fragments, points)
+        # Iterate over a snapshot, subscribers may leave while we fan out
+        for websocket, subscriber in list(self.subscribers.items()):
+            if subscriber.request is None:
+                message = shared
+            elif websocket in routed:
+                message = ",".join(fragments[i] for i in routed[websocket])
+            else:
+                continue
+            if not subscriber.offer(message, self.policy):
+                self.disconnected += 1
+                self.unsubscribe(websocket)
+                task = asyncio.create_task(self._close(websocket))
+                self._closing.add(task)
+                task.add_done_callback(self._closing.discard)
+
+    def _route(self, fragments: List[str], points: Optional[List[Point]]) -> Dict[WebSocket, List[int]]:
+        # Map filtered subscribers to the positions of the records they match
+        routed: Dict[WebSocket, List[int]] = {}
+        if not self.index.unbounded and not self.index.cells:
+            return routed
+        if points is None:
+            points = [_point(json.loads(fragment)) for fragment in fragments]
+        for position, (road_state, latitude, longitude) in enumerate(points):
+            for websocket in self.index.candidates(latitude, longitude):
+                if self.subscribers[websocket].request.matches(road_state, latitude, longitude):
+                    routed.setdefault(websocket, []).append(position)
+        return routed
+
+    async def _send_loop(self, subscriber: Subscriber):
+        try:
+            await subscriber.run()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.info(f"WebSocket send failed, dropping subscriber: {e}")
+            self.unsubscribe(subscriber.websocket)
+
+    @staticmethod
+    async def _close(websocket: WebSocket):
+        try:
+            await websocket.close(code=SLOW_CONSUMER_CLOSE_CODE)
+        except Exception:
+            pass
+
+    def close(self):
+        for websocket in list(self.subscribers):
+            self.unsubscribe(websocket)
+
+    def stats(self) -> dict:
+        return {
+            "subscribers": len(self.subscribers),
+            "filtered_subscribers": sum(1 for s in self.subscribers.values() if s.request is not None),
+            "queue_depth": sum(s.queue.qsize() for s in self.subscribers.values()),
+            "max_queue_depth": max((s.queue.qsize() for s in self.subscribers.values()), default=0),
+            "dropped": self.dropped + sum(s.dropped for s in self.subscribers.values()),
+            "disconnected": self.disconnected,
+        }
+
+
+def _point(record: dict) -> Point:
+    gps = record["agent_data"]["gps"]
+    return record["road_state"], gps["latitude"], gps["longitude"]
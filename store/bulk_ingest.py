@@ -0,0 +1,125 @@
+import time
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from sqlalchemy import Table, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from bulk_update import READING_KEY, READING_KEY_WHERE, identified, reading_key
+from rollups import RollupManager
+from spatial import CellAggregates
+
+# Columns written by the ingest path, in COPY order
+INGEST_COLUMNS = ("user_id", "road_state", "x", "y", "z", "latitude", "longitude", "timestamp", "cell_lat", "cell_lon")
+# Temporary table COPY writes to, per connection and transaction
+STAGING_TABLE = "processed_agent_data_staging"
+
+
+@dataclass
+class IngestResult:
+    rows: int
+    strategy: str
+    elapsed: float
+    # Readings of the batch that were already stored, or sent twice in it, and skipped
+    duplicates: int = 0
+    # The rows actually inserted
+    written: List[dict] = field(default_factory=list)
+
+    @property
+    def rows_per_sec(self) -> float:
+        return self.rows / self.elapsed if self.elapsed > 0 else float("inf")
+
+
+class BulkIngestEngine:
+    """
+    Writes a whole batch of processed agent data in a single pass.
+    Small batches go through one multi-row INSERT (executemany, which
+    SQLAlchemy turns into insertmanyvalues), large batches are streamed
+    through COPY ... FROM STDIN in asyncpg's binary format into a staging
+    table and moved over with one INSERT ... SELECT. Readings already
+    stored, by READING_KEY, are skipped with ON CONFLICT DO NOTHING, so a
+    batch delivered twice is written once; readings without a vehicle have
+    no identity to check and are always written.
+    When given, the cell aggregates are updated in the same transaction,
+    and so are the rollup buckets of late rows the rollups already cover,
+    e.g. spilled batches replayed after an outage.
+    """
+
+    def __init__(self, engine: AsyncEngine, table: Table, copy_threshold: int,
+                 aggregates: Optional[CellAggregates] = None, rollups: Optional[RollupManager] = None):
+        self.engine = engine
+        self.table = table
+        self.copy_threshold = copy_threshold
+        self.aggregates = aggregates
+        self.rollups = rollups
+
+    def choose_strategy(self, count: int) -> str:
+        return "copy" if count >= self.copy_threshold else "executemany"
+
+    async def ingest(self, rows: List[dict]) -> IngestResult:
+        """
+        Insert the new readings of a batch in one transaction.
+        Parameters:
+            rows (List[dict]): Column dicts as produced by ProcessedAgentData.to_row().
+        Returns:
+            IngestResult: Inserted and skipped row counts, the inserted rows, strategy used and elapsed time.
+        Raises:
+            IntegrityError: If a row violates another constraint, e.g. no partition holds its timestamp.
+        """
+        strategy = self.choose_strategy(len(rows))
+        started = time.perf_counter()
+        # The first row of a reading sent twice in the batch is the one kept
+        readings = {}
+        for row in rows:
+            if identified(row):
+                readings.setdefault(reading_key(row), row)
+        unique = [row for row in rows if not identified(row) or readings[reading_key(row)] is row]
+        written = []
+        if unique:
+            async with self.engine.begin() as conn:
+                if strategy == "copy":
+                    keys = await self._copy(conn, unique)
+                else:
+                    statement = insert(self.table).on_conflict_do_nothing(
+                        index_elements=list(READING_KEY), index_where=text(READING_KEY_WHERE)
+                    )
+                    result = await conn.execute(
+                        statement.returning(*(self.table.c[column] for column in READING_KEY)), unique
+                    )
+                    keys = result.fetchall()
+                # Readings without a vehicle never conflict, so they were all inserted
+                inserted = {tuple(key) for key in keys}
+                written = [row for row in unique if not identified(row) or reading_key(row) in inserted]
+                if self.aggregates is not None:
+                    await self.aggregates.apply(conn, written)
+                if self.rollups is not None and written:
+                    timestamps = [row["timestamp"] for row in written]
+                    await self.rollups.rebuild(conn, min(timestamps), max(timestamps))
+        return IngestResult(
+            rows=len(written),
+            strategy=strategy,
+            elapsed=time.perf_counter() - started,
+            duplicates=len(rows) - len(written),
+            written=written,
+        )
+
+    async def _copy(self, conn: AsyncConnection, rows: List[dict]) -> list:
+        # COPY cannot skip conflicts, stage the rows in a temporary table dropped at commit
+        columns = ", ".join(f'"{column}"' for column in INGEST_COLUMNS)
+        key = ", ".join(f'"{column}"' for column in READING_KEY)
+        await conn.execute(text(
+            f"CREATE TEMPORARY TABLE {STAGING_TABLE} ON COMMIT DROP AS "
+            f"SELECT {columns} FROM {self.table.name} WITH NO DATA"
+        ))
+        raw_connection = await conn.get_raw_connection()
+        await raw_connection.driver_connection.copy_records_to_table(
+            STAGING_TABLE,
+            records=(tuple(row[column] for column in INGEST_COLUMNS) for row in rows),
+            columns=INGEST_COLUMNS,
+        )
+        result = await conn.execute(text(
+            f"INSERT INTO {self.table.name} ({columns}) SELECT {columns} FROM {STAGING_TABLE} "
+            f"ON CONFLICT ({key}) WHERE {READING_KEY_WHERE} DO NOTHING RETURNING {key}"
+        ))
+        return result.fetchall()
@@ -0,0 +1,177 @@
+import time
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from sqlalchemy import Table, and_, or_, select, text, tuple_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from rollups import RollupManager
+from spatial import CellAggregates
+
+# Identity of a reading, a vehicle and its timestamp, see processed_agent_data_reading_idx in docker/db/structure.sql
+READING_KEY = ("user_id", "timestamp")
+# Readings without a vehicle, user_id 0, cannot be told apart; the index leaves them out and they are never merged
+READING_KEY_WHERE = "user_id <> 0"
+# Columns an upsert overwrites on readings already stored
+UPSERT_COLUMNS = ("road_state", "x", "y", "z", "latitude", "longitude", "cell_lat", "cell_lon")
+# Columns of changed rows the aggregates, rollups and cache invalidation need
+CHANGE_COLUMNS = ("id", "road_state", "z", "timestamp", "cell_lat", "cell_lon")
+# Readings looked up per statement, asyncpg takes at most 32767 parameters
+KEY_CHUNK_SIZE = 4000
+
+
+@dataclass
+class ChangeResult:
+    inserted: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    deleted: int = 0
+    elapsed: float = 0.0
+    # Ids of the changed records, and their old and new versions
+    ids: List[int] = field(default_factory=list)
+    rows: List[dict] = field(default_factory=list)
+    # The rows of the batch actually inserted or updated
+    written: List[dict] = field(default_factory=list)
+
+
+def reading_key(row: dict) -> tuple:
+    return tuple(row[column] for column in READING_KEY)
+
+
+def identified(row: dict) -> bool:
+    return row["user_id"] != 0
+
+
+class BulkUpdateEngine:
+    """
+    Set-based changes of processed_agent_data: relabelling or deleting every
+    row matching a filter in one statement, and upserting batches keyed by
+    vehicle and timestamp, so a batch sent twice overwrites instead of
+    duplicating rows.
+    The statements RETURN what the cell aggregates and the rollups need to
+    follow the change in the same transaction.
+    """
+
+    def __init__(self, engine: AsyncEngine, table: Table, aggregates: CellAggregates,
+                 rollups: Optional[RollupManager] = None):
+        self.engine = engine
+        self.table = table
+        self.aggregates = aggregates
+        self.rollups = rollups
+
+    async def relabel(self, road_state: str, conditions: list) -> ChangeResult:
+        """
+        Set the road_state of every row matching the conditions.
+        Parameters:
+            road_state (str): The new label.
+            conditions (list): SQLAlchemy conditions on the table, as built by ProcessedAgentDataFilter.
+        Returns:
+            ChangeResult: The number of updated rows; rows that already had the label are not counted.
+        """
+        table = self.table
+        started = time.perf_counter()
+        # Lock the matching rows and keep their old label
+        previous = select(table.c.id, table.c.timestamp, table.c.road_state).where(
+            and_(*conditions, table.c.road_state != road_state)
+        ).with_for_update().subquery("previous")
+        query = table.update().where(
+            table.c.id == previous.c.id,
+            table.c.timestamp == previous.c.timestamp,
+        ).values(road_state=road_state).returning(
+            *(table.c[column] for column in CHANGE_COLUMNS),
+            previous.c.road_state.label("previous_road_state"),
+        )
+        async with self.engine.begin() as conn:
+            updated = [row._asdict() for row in await conn.execute(query)]
+            replaced = [{**row, "road_state": row["previous_road_state"]} for row in updated]
+            await self._follow(conn, replaced, updated)
+        return ChangeResult(
+            updated=len(updated),
+            elapsed=time.perf_counter() - started,
+            ids=[row["id"] for row in updated],
+            rows=replaced + updated,
+        )
+
+    async def delete(self, conditions: list) -> ChangeResult:
+        """
+        Delete every row matching the conditions.
+        Parameters:
+            conditions (list): SQLAlchemy conditions on the table, as built by ProcessedAgentDataFilter.
+        Returns:
+            ChangeResult: The number of deleted rows.
+        """
+        table = self.table
+        started = time.perf_counter()
+        query = table.delete().where(and_(*conditions)).returning(*(table.c[column] for column in CHANGE_COLUMNS))
+        async with self.engine.begin() as conn:
+            deleted = [row._asdict() for row in await conn.execute(query)]
+            await self._follow(conn, deleted, [])
+        return ChangeResult(
+            deleted=len(deleted),
+            elapsed=time.perf_counter() - started,
+            ids=[row["id"] for row in deleted],
+            rows=deleted,
+        )
+
+    async def upsert(self, rows: List[dict]) -> ChangeResult:
+        """
+        Insert new readings and overwrite the ones already stored.
+        Readings are identified by READING_KEY; within the batch, the last row of a reading wins.
+        Readings without a vehicle are always inserted.
+        Parameters:
+            rows (List[dict]): Column dicts as produced by ProcessedAgentData.to_row().
+        Returns:
+            ChangeResult: The number of inserted, updated and unchanged readings.
+        """
+        table = self.table
+        started = time.perf_counter()
+        # Sorted, so concurrent upserts of overlapping batches lock rows in the same order
+        readings = {reading_key(row): row for row in rows if identified(row)}
+        keyed = [readings[key] for key in sorted(readings)]
+        rows = keyed + [row for row in rows if not identified(row)]
+        if not rows:
+            return ChangeResult()
+        statement = insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=list(READING_KEY),
+            index_where=text(READING_KEY_WHERE),
+            set_={column: statement.excluded[column] for column in UPSERT_COLUMNS},
+            # Resent readings with the same values are left untouched
+            where=or_(*(table.c[column].is_distinct_from(statement.excluded[column]) for column in UPSERT_COLUMNS)),
+        ).returning(table.c.id)
+        async with self.engine.begin() as conn:
+            previous = await self._lock_readings(conn, keyed)
+            changed_ids = set((await conn.execute(statement, rows)).scalars())
+            replaced = [row for row in previous if row["id"] in changed_ids]
+            unchanged = {reading_key(row) for row in previous if row["id"] not in changed_ids}
+            written = [row for row in rows if reading_key(row) not in unchanged]
+            await self._follow(conn, replaced, written)
+        return ChangeResult(
+            inserted=len(changed_ids) - len(replaced),
+            updated=len(replaced),
+            unchanged=len(unchanged),
+            elapsed=time.perf_counter() - started,
+            ids=sorted(changed_ids),
+            rows=replaced + written,
+            written=written,
+        )
+
+    async def _lock_readings(self, conn: AsyncConnection, rows: List[dict]) -> List[dict]:
+        # Stored versions of the readings, locked until the upsert commits
+        table = self.table
+        columns = [table.c[column] for column in dict.fromkeys(CHANGE_COLUMNS + READING_KEY)]
+        key = tuple_(*(table.c[column] for column in READING_KEY))
+        previous = []
+        for offset in range(0, len(rows), KEY_CHUNK_SIZE):
+            keys = [reading_key(row) for row in rows[offset:offset + KEY_CHUNK_SIZE]]
+            result = await conn.execute(select(*columns).where(key.in_(keys)).with_for_update())
+            previous.extend(row._asdict() for row in result)
+        return previous
+
+    async def _follow(self, conn: AsyncConnection, removed: List[dict], added: List[dict]):
+        # Move the changed rows between cell aggregates and recompute their rolled up buckets
+        await self.aggregates.replace(conn, removed, added)
+        timestamps = [row["timestamp"] for row in removed + added]
+        if self.rollups is not None and timestamps:
+            await self.rollups.rebuild(conn, min(timestamps), max(timestamps))
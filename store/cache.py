@@ -0,0 +1,475 @@
+import asyncio
+import json
+import logging
+import time
+import uuid
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Deque, Dict, Iterable, List, Optional, Set, Tuple
+
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from spatial import cell_of
+
+# Sentinel for "no cached value", None is a valid cached value
+MISSING = object()
+
+# Shared scopes are indexed in Redis by hour of their time range and by block of CELL_BLOCK x CELL_BLOCK grid
+# cells; a range spanning more than MAX_INDEX_BUCKETS of either is indexed as unbounded in it
+INDEX_BUCKET = timedelta(hours=1)
+CELL_BLOCK = 64
+MAX_INDEX_BUCKETS = 256
+# Index bucket of scopes that are unbounded in time or area
+UNBOUNDED = "*"
+# Recent invalidations kept to check fills against, older fills are not cached
+INVALIDATION_LOG_SIZE = 1024
+# Seconds between attempts to resubscribe to invalidations after the Redis connection dropped
+RESUBSCRIBE_DELAY = 1.0
+EPOCH = datetime(1970, 1, 1)
+
+
+@dataclass(frozen=True)
+class CacheScope:
+    """
+    The rows a cached query result was computed from: a timestamp range and
+    a range of grid cells. Unset bounds are unbounded.
+    """
+    start: Optional[datetime] = None
+    end: Optional[datetime] = None
+    min_cell_lat: Optional[int] = None
+    max_cell_lat: Optional[int] = None
+    min_cell_lon: Optional[int] = None
+    max_cell_lon: Optional[int] = None
+
+    @classmethod
+    def for_area(cls, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                 min_latitude: Optional[float] = None, min_longitude: Optional[float] = None,
+                 max_latitude: Optional[float] = None, max_longitude: Optional[float] = None) -> "CacheScope":
+        min_cell_lat, min_cell_lon = cell_of(min_latitude or 0.0, min_longitude or 0.0)
+        max_cell_lat, max_cell_lon = cell_of(max_latitude or 0.0, max_longitude or 0.0)
+        return cls(
+            start=start,
+            end=end,
+            min_cell_lat=min_cell_lat if min_latitude is not None else None,
+            max_cell_lat=max_cell_lat if max_latitude is not None else None,
+            min_cell_lon=min_cell_lon if min_longitude is not None else None,
+            max_cell_lon=max_cell_lon if max_longitude is not None else None,
+        )
+
+    def touches(self, change: "CacheChange") -> bool:
+        if self.start is not None and change.last_timestamp < self.start:
+            return False
+        if self.end is not None and change.first_timestamp >= self.end:
+            return False
+        if self.min_cell_lat is not None and change.max_cell_lat < self.min_cell_lat:
+            return False
+        if self.max_cell_lat is not None and change.min_cell_lat > self.max_cell_lat:
+            return False
+        if self.min_cell_lon is not None and change.max_cell_lon < self.min_cell_lon:
+            return False
+        if self.max_cell_lon is not None and change.min_cell_lon > self.max_cell_lon:
+            return False
+        return True
+
+    def time_buckets(self) -> List[str]:
+        if self.start is None or self.end is None:
+            return [UNBOUNDED]
+        return _time_buckets(self.start, self.end) or [UNBOUNDED]
+
+    def cell_buckets(self) -> List[str]:
+        if None in (self.min_cell_lat, self.max_cell_lat, self.min_cell_lon, self.max_cell_lon):
+            return [UNBOUNDED]
+        return _cell_buckets(self.min_cell_lat, self.max_cell_lat, self.min_cell_lon, self.max_cell_lon) \
+            or [UNBOUNDED]
+
+    def to_json(self) -> str:
+        return json.dumps([
+            self.start.isoformat() if self.start else None, self.end.isoformat() if self.end else None,
+            self.min_cell_lat, self.max_cell_lat, self.min_cell_lon, self.max_cell_lon,
+        ])
+
+    @classmethod
+    def from_json(cls, raw) -> "CacheScope":
+        start, end, *cells = json.loads(raw)
+        return cls(datetime.fromisoformat(start) if start else None, datetime.fromisoformat(end) if end else None,
+                   *cells)
+
+
+@dataclass(frozen=True)
+class CacheChange:
+    """Bounding timestamp range and grid cell range of a set of written rows."""
+    first_timestamp: datetime
+    last_timestamp: datetime
+    min_cell_lat: int
+    max_cell_lat: int
+    min_cell_lon: int
+    max_cell_lon: int
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[dict]) -> Optional["CacheChange"]:
+        rows = list(rows)
+        if not rows:
+            return None
+        timestamps = [row["timestamp"] for row in rows]
+        cell_lats = [row["cell_lat"] for row in rows if row["cell_lat"] is not None] or [0]
+        cell_lons = [row["cell_lon"] for row in rows if row["cell_lon"] is not None] or [0]
+        return cls(min(timestamps), max(timestamps), min(cell_lats), max(cell_lats), min(cell_lons), max(cell_lons))
+
+    def time_buckets(self) -> Optional[List[str]]:
+        """Index buckets of the timestamp range, None if there are too many to look up"""
+        return _time_buckets(self.first_timestamp, self.last_timestamp + timedelta(microseconds=1))
+
+    def cell_buckets(self) -> Optional[List[str]]:
+        """Index buckets of the cell range, None if there are too many to look up"""
+        return _cell_buckets(self.min_cell_lat, self.max_cell_lat, self.min_cell_lon, self.max_cell_lon)
+
+    def to_json(self) -> list:
+        return [self.first_timestamp.isoformat(), self.last_timestamp.isoformat(),
+                self.min_cell_lat, self.max_cell_lat, self.min_cell_lon, self.max_cell_lon]
+
+    @classmethod
+    def from_json(cls, raw: list) -> "CacheChange":
+        first, last, *cells = raw
+        return cls(datetime.fromisoformat(first), datetime.fromisoformat(last), *cells)
+
+
+def _time_buckets(start: datetime, end: datetime) -> Optional[List[str]]:
+    # Hours since the epoch overlapping [start, end)
+    first, last = (start - EPOCH) // INDEX_BUCKET, (end - EPOCH) // INDEX_BUCKET
+    if last - first >= MAX_INDEX_BUCKETS:
+        return None
+    return [str(bucket) for bucket in range(first, last + 1)]
+
+
+def _cell_buckets(min_cell_lat: int, max_cell_lat: int, min_cell_lon: int, max_cell_lon: int) -> Optional[List[str]]:
+    lat_blocks = range(min_cell_lat // CELL_BLOCK, max_cell_lat // CELL_BLOCK + 1)
+    lon_blocks = range(min_cell_lon // CELL_BLOCK, max_cell_lon // CELL_BLOCK + 1)
+    if len(lat_blocks) * len(lon_blocks) > MAX_INDEX_BUCKETS:
+        return None
+    return [f"{lat}:{lon}" for lat in lat_blocks for lon in lon_blocks]
+
+
+class LRUCache:
+    """In-process least recently used cache whose entries expire after ttl seconds."""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            return MISSING
+        expires, value = entry
+        if expires < time.monotonic():
+            del self._entries[key]
+            self.expirations += 1
+            return MISSING
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def delete(self, key: str):
+        self._entries.pop(key, None)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class ReadCache:
+    """
+    Read-through cache of single records and list/aggregate query results.
+    Records are keyed by id and dropped when that id is updated or deleted.
+    Query results are keyed by their normalized parameters and remember the
+    CacheScope they were computed from; any write whose rows fall into that
+    scope drops them. Values must be JSON-compatible, so they can also live
+    in the optional Redis tier shared by all store processes. There, scopes
+    are indexed by hour and block of grid cells, so a write only looks at
+    the scopes of the buckets it falls into, and every invalidation is
+    published to the other processes, which drop the entries from their
+    in-process tier as soon as it arrives.
+    A fill passes the generation read before its query; results that an
+    invalidation since then touches are not cached, so a slow query cannot
+    put back data a write has just invalidated.
+    """
+
+    def __init__(self, max_entries: int, ttl: float, redis: Optional[Redis] = None,
+                 redis_ttl: Optional[float] = None, prefix: str = "store:cache:"):
+        self.local = LRUCache(max_entries, ttl)
+        self.redis = redis
+        self.redis_ttl = redis_ttl or ttl
+        self.prefix = prefix
+        self.channel = prefix + "invalidations"
+        self._scopes: Dict[str, CacheScope] = {}
+        # Recent invalidations as (generation, keys, change), a change of None drops everything
+        self._log: Deque[Tuple[int, Set[str], Optional[CacheChange]]] = deque(maxlen=INVALIDATION_LOG_SIZE)
+        self.generation = 0
+        # Tells this process' own published invalidations apart from those of the others
+        self._origin = uuid.uuid4().hex
+        self._task = None
+        self.hits = 0
+        self.misses = 0
+        self.redis_hits = 0
+        self.invalidations = 0
+        self.remote_invalidations = 0
+        self.stale_fills = 0
+
+    def start(self):
+        if self.redis is not None:
+            self._task = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    @staticmethod
+    def record_key(record_id: int) -> str:
+        return f"record:{record_id}"
+
+    @staticmethod
+    def query_key(name: str, **params) -> str:
+        # Unset parameters do not change the result, leave them out of the key
+        normalized = {key: value for key, value in params.items() if value is not None}
+        return f"{name}:{json.dumps(normalized, sort_keys=True, default=str)}"
+
+    async def get(self, key: str) -> Any:
+        value = self.local.get(key)
+        if value is not MISSING:
+            self.hits += 1
+            return value
+        if self.redis is not None:
+            generation = self.generation
+            try:
+                raw = await self.redis.get(self.prefix + key)
+            except RedisError as e:
+                logging.error(f"Cache Redis tier unavailable: {e!r}")
+                raw = None
+            if raw is not None:
+                self.hits += 1
+                self.redis_hits += 1
+                value = json.loads(raw)
+                # An invalidation that arrived while reading may have missed this copy
+                if not self._stale(key, None, generation):
+                    self.local.set(key, value)
+                return value
+        self.misses += 1
+        return MISSING
+
+    async def set(self, key: str, value: Any, scope: Optional[CacheScope] = None, generation: Optional[int] = None):
+        """
+        Cache a value read through.
+        Parameters:
+            key (str): Record or query key.
+            value (Any): JSON-compatible value.
+            scope (Optional[CacheScope]): Rows a query result was computed from, None for a record.
+            generation (Optional[int]): The cache's generation read before the value was; when given,
+                the value is dropped if an invalidation since then touches it.
+        """
+        if generation is not None and self._stale(key, scope, generation):
+            self.stale_fills += 1
+            return
+        self.local.set(key, value)
+        if scope is not None:
+            self._scopes[key] = scope
+            if len(self._scopes) > 2 * self.local.max_entries:
+                # Forget scopes of entries that already left the local tier
+                self._scopes = {key: scope for key, scope in self._scopes.items() if key in self.local}
+        if self.redis is None:
+            return
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.set(self.prefix + key, json.dumps(value, default=str), px=int(self.redis_ttl * 1000))
+                if scope is not None:
+                    # Index entries carry their entry's expiry as score, so lookups skip and prune expired ones
+                    expires = time.time() + self.redis_ttl
+                    pipe.set(self._scope_key(key), scope.to_json(), px=int(self.redis_ttl * 1000))
+                    for index in self._index_keys(scope.time_buckets(), scope.cell_buckets()):
+                        pipe.zadd(index, {key: expires})
+                        pipe.pexpire(index, int(self.redis_ttl * 1000))
+                await pipe.execute()
+            if generation is not None and self._stale(key, scope, generation):
+                # Invalidated while being written, the invalidation may have looked before it got there
+                self.stale_fills += 1
+                await self.redis.delete(self.prefix + key, self._scope_key(key))
+        except RedisError as e:
+            logging.error(f"Cache Redis tier unavailable: {e!r}")
+
+    async def invalidate(self, record_ids: Iterable[int] = (), rows: Iterable[dict] = ()):
+        """
+        Drop the records with the given ids and every query result whose scope the written rows touch,
+        in every store process.
+        Parameters:
+            record_ids (Iterable[int]): Ids of updated or deleted records.
+            rows (Iterable[dict]): Written rows, old and new versions, in the table's column layout.
+        """
+        keys = {self.record_key(record_id) for record_id in record_ids}
+        change = CacheChange.from_rows(rows)
+        keys.update(self._drop(keys, change))
+        if self.redis is not None:
+            try:
+                if change is not None:
+                    # The logged keys grow with these too, for copies read from Redis meanwhile
+                    keys.update(await self._shared_scopes(change))
+                message = json.dumps({
+                    "origin": self._origin, "keys": sorted(keys), "change": change.to_json() if change else None,
+                })
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    if keys:
+                        pipe.delete(*(self.prefix + key for key in keys), *(self._scope_key(key) for key in keys))
+                    pipe.publish(self.channel, message)
+                    await pipe.execute()
+            except RedisError as e:
+                logging.error(f"Cache Redis tier unavailable: {e!r}")
+        # Entries promoted from the Redis tier are only matched through their shared scope
+        for key in keys:
+            self.local.delete(key)
+        self.invalidations += len(keys)
+
+    async def clear(self):
+        self._clear_local()
+        if self.redis is not None:
+            try:
+                keys = [key async for key in self.redis.scan_iter(match=self.prefix + "*")]
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    if keys:
+                        pipe.delete(*keys)
+                    pipe.publish(self.channel, json.dumps({"origin": self._origin, "clear": True}))
+                    await pipe.execute()
+            except RedisError as e:
+                logging.error(f"Cache Redis tier unavailable: {e!r}")
+
+    def _clear_local(self):
+        self.generation += 1
+        self._log.append((self.generation, set(), None))
+        self.local.clear()
+        self._scopes.clear()
+
+    def _drop(self, keys: Set[str], change: Optional[CacheChange]) -> List[str]:
+        # Log the invalidation, keeping the set, and drop what it touches from the local tier;
+        # returns the keys of the scoped entries it touched
+        self.generation += 1
+        self._log.append((self.generation, keys, change))
+        touched = [key for key, scope in self._scopes.items() if scope.touches(change)] if change else []
+        for key in [*keys, *touched]:
+            self.local.delete(key)
+            self._scopes.pop(key, None)
+        return touched
+
+    def _stale(self, key: str, scope: Optional[CacheScope], generation: int) -> bool:
+        if generation == self.generation:
+            return False
+        if not self._log or self._log[0][0] > generation + 1:
+            # Invalidations since then were forgotten, assume the worst
+            return True
+        for logged, keys, change in reversed(self._log):
+            if logged <= generation:
+                break
+            if change is None and not keys:
+                return True
+            if key in keys or (scope is not None and change is not None and scope.touches(change)):
+                return True
+        return False
+
+    def _scope_key(self, key: str) -> str:
+        return f"{self.prefix}scope:{key}"
+
+    def _index_keys(self, time_buckets: List[str], cell_buckets: List[str]) -> List[str]:
+        return [f"{self.prefix}scopes:t:{bucket}" for bucket in time_buckets] + \
+            [f"{self.prefix}scopes:c:{bucket}" for bucket in cell_buckets]
+
+    async def _shared_scopes(self, change: CacheChange) -> List[str]:
+        # Keys of the shared query results the change touches
+        time_buckets, cell_buckets = change.time_buckets(), change.cell_buckets()
+        now = time.time()
+        if time_buckets is None or cell_buckets is None:
+            # Changes spanning too many buckets, e.g. bulk updates of long ranges, check every scope
+            prefix = self._scope_key("").encode()
+            candidates = [key[len(prefix):].decode() async for key in self.redis.scan_iter(match=self._scope_key("*"))]
+        else:
+            time_indexes = self._index_keys(time_buckets + [UNBOUNDED], [])
+            cell_indexes = self._index_keys([], cell_buckets + [UNBOUNDED])
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for index in time_indexes + cell_indexes:
+                    pipe.zremrangebyscore(index, "-inf", now)
+                    pipe.zrange(index, 0, -1)
+                results = (await pipe.execute())[1::2]
+            in_time = set().union(*results[:len(time_indexes)])
+            in_area = set().union(*results[len(time_indexes):])
+            # A scope touches a change only if it overlaps it in time and in area
+            candidates = [key.decode() for key in in_time & in_area]
+        if not candidates:
+            return []
+        scopes = await self.redis.mget([self._scope_key(key) for key in candidates])
+        return [key for key, scope in zip(candidates, scopes)
+                if scope is not None and CacheScope.from_json(scope).touches(change)]
+
+    async def _listen(self):
+        # Applies invalidations published by the other processes to the local tier
+        while True:
+            pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(self.channel)
+                # Invalidations published while not subscribed are lost, start over
+                self._clear_local()
+                async for message in pubsub.listen():
+                    try:
+                        await self._apply(json.loads(message["data"]))
+                    except (ValueError, KeyError, TypeError) as e:
+                        logging.error(f"Ignoring malformed cache invalidation: {e!r}")
+            except Exception as e:
+                logging.error(f"Cache invalidation subscription lost: {e!r}")
+            finally:
+                await pubsub.reset()
+            await asyncio.sleep(RESUBSCRIBE_DELAY)
+
+    async def _apply(self, message: dict):
+        if message["origin"] == self._origin:
+            return
+        self.remote_invalidations += 1
+        if message.get("clear"):
+            self._clear_local()
+            return
+        change = CacheChange.from_json(message["change"]) if message["change"] else None
+        touched = self._drop(set(message["keys"]), change)
+        if touched:
+            # Results this process filled may have reached Redis after the publisher looked there
+            try:
+                await self.redis.delete(*(self.prefix + key for key in touched),
+                                        *(self._scope_key(key) for key in touched))
+            except RedisError as e:
+                logging.error(f"Cache Redis tier unavailable: {e!r}")
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self.local),
+            "generation": self.generation,
+            "hits": self.hits,
+            "misses": self.misses,
+            "redis_hits": self.redis_hits,
+            "evictions": self.local.evictions,
+            "expirations": self.local.expirations,
+            "invalidations": self.invalidations,
+            "remote_invalidations": self.remote_invalidations,
+            "stale_fills": self.stale_fills,
+        }
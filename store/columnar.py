@@ -0,0 +1,234 @@
+import asyncio
+import io
+import time
+from dataclasses import dataclass, field
+from typing import AsyncIterator, BinaryIO, Iterator, List, Optional
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+from asyncpg.exceptions import IntegrityConstraintViolationError
+from sqlalchemy import Select, Table
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from bulk_ingest import INGEST_COLUMNS
+from config import GRID_CELL_SIZE, AGGREGATE_Z_BASELINE
+from rollups import RollupManager
+from spatial import CellAggregates
+
+# Schema of exported files, in LIST_COLUMNS order
+EXPORT_SCHEMA = pa.schema([
+    ("id", pa.int64()),
+    ("user_id", pa.int32()),
+    ("road_state", pa.string()),
+    ("x", pa.float64()),
+    ("y", pa.float64()),
+    ("z", pa.float64()),
+    ("latitude", pa.float64()),
+    ("longitude", pa.float64()),
+    ("timestamp", pa.timestamp("us")),
+])
+# Columns an imported file must have; user_id defaults to 0 and ids are always assigned by the database
+IMPORT_SCHEMA = pa.schema([
+    ("user_id", pa.int32()),
+    ("road_state", pa.string()),
+    ("x", pa.float64()),
+    ("y", pa.float64()),
+    ("z", pa.float64()),
+    ("latitude", pa.float64()),
+    ("longitude", pa.float64()),
+    ("timestamp", pa.timestamp("us")),
+])
+# Columns whose range a cached query result is checked against
+BOUND_COLUMNS = ("timestamp", "cell_lat", "cell_lon")
+COLUMNAR_MEDIA_TYPES = {"arrow": "application/vnd.apache.arrow.stream", "parquet": "application/vnd.apache.parquet"}
+
+
+class _ChunkSink:
+    """Write-only file object collecting what a writer produced since the last take()."""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self) -> bytes:
+        data, self._chunks = b"".join(self._chunks), []
+        return data
+
+
+def _record_batch(rows) -> pa.RecordBatch:
+    columns = list(zip(*rows))
+    return pa.RecordBatch.from_arrays(
+        [pa.array(values, type=column.type) for values, column in zip(columns, EXPORT_SCHEMA)],
+        schema=EXPORT_SCHEMA,
+    )
+
+
+async def stream_columnar(engine: AsyncEngine, query: Select, media_format: str,
+                          fetch_size: int) -> AsyncIterator[bytes]:
+    """
+    Stream query results as an Arrow IPC stream or a Parquet file from a server-side cursor.
+    Every fetch_size partition of rows becomes one record batch, or one Parquet row group.
+    """
+    sink = _ChunkSink()
+    output = pa.PythonFile(sink, mode="w")
+    if media_format == "arrow":
+        writer = pa.ipc.new_stream(output, EXPORT_SCHEMA)
+    else:
+        writer = pq.ParquetWriter(output, EXPORT_SCHEMA, compression="zstd")
+    async with engine.connect() as conn:
+        result = await conn.stream(query.execution_options(yield_per=fetch_size))
+        async for partition in result.partitions():
+            writer.write_batch(_record_batch(partition))
+            yield sink.take()
+    # Parquet's footer, or the end of stream marker
+    writer.close()
+    yield sink.take()
+
+
+@dataclass
+class ImportResult:
+    rows: int = 0
+    elapsed: float = 0.0
+    # Rows spanning the time and cell range of every imported batch, for cache invalidation
+    bounds: List[dict] = field(default_factory=list)
+
+
+def _prepare(batch: pa.RecordBatch) -> pa.Table:
+    """
+    Bring a Parquet record batch into the INGEST_COLUMNS layout.
+    Raises:
+        ValueError: If a column is missing, has an incompatible type or holds nulls.
+    """
+    table = pa.Table.from_batches([batch])
+    columns = {}
+    for column in IMPORT_SCHEMA:
+        if column.name not in table.column_names:
+            if column.name != "user_id":
+                raise ValueError(f"Missing column {column.name}")
+            columns[column.name] = pa.nulls(len(table), column.type).fill_null(0)
+            continue
+        values = table[column.name]
+        if values.null_count:
+            raise ValueError(f"Column {column.name} holds nulls")
+        try:
+            # Zoned timestamps become naive UTC
+            columns[column.name] = values.cast(column.type)
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError) as e:
+            raise ValueError(f"Column {column.name}: {e}") from e
+    # Grid cells as in spatial.cell_of
+    for cell, coordinate in (("cell_lat", "latitude"), ("cell_lon", "longitude")):
+        columns[cell] = pc.floor(pc.divide(columns[coordinate], GRID_CELL_SIZE)).cast(pa.int32())
+    return pa.table([columns[column] for column in INGEST_COLUMNS], names=list(INGEST_COLUMNS))
+
+
+def _deltas(table: pa.Table) -> List[dict]:
+    # Cell aggregate deltas of the rows, see CellAggregates.summarize
+    keys = ["cell_lat", "cell_lon", "road_state"]
+    deviation = pc.abs(pc.subtract(table["z"], AGGREGATE_Z_BASELINE))
+    grouped = table.select(keys).append_column("deviation", deviation).group_by(keys).aggregate(
+        [("deviation", "count"), ("deviation", "sum")]
+    )
+    deltas = [{
+        "cell_lat": row["cell_lat"],
+        "cell_lon": row["cell_lon"],
+        "road_state": row["road_state"],
+        "count": row["deviation_count"],
+        "z_deviation_sum": row["deviation_sum"],
+    } for row in grouped.to_pylist()]
+    # Sorted like summarize's deltas, so concurrent upserts lock rows in the same order
+    return sorted(deltas, key=lambda delta: (delta["cell_lat"], delta["cell_lon"], delta["road_state"]))
+
+
+def _bounds(table: pa.Table) -> List[dict]:
+    # Two rows spanning the table's time and cell range
+    ranges = {column: pc.min_max(table[column]) for column in BOUND_COLUMNS}
+    return [{column: bound[end].as_py() for column, bound in ranges.items()} for end in ("min", "max")]
+
+
+def _csv(table: pa.Table) -> bytes:
+    sink = pa.BufferOutputStream()
+    pa_csv.write_csv(table, sink, pa_csv.WriteOptions(include_header=False))
+    return sink.getvalue().to_pybytes()
+
+
+class ParquetImporter:
+    """
+    Loads Parquet files into processed_agent_data in one transaction. Record
+    batches are converted column-wise with Arrow compute, including grid cells
+    and aggregate deltas, and streamed to COPY ... FROM STDIN as CSV, so no
+    per-row Python objects are created. The cell aggregates and the rollups
+    follow in the same transaction.
+    """
+
+    def __init__(self, engine: AsyncEngine, table: Table, aggregates: CellAggregates,
+                 rollups: Optional[RollupManager] = None, batch_size: int = 65536):
+        self.engine = engine
+        self.table = table
+        self.aggregates = aggregates
+        self.rollups = rollups
+        self.batch_size = batch_size
+
+    def _batches(self, file: BinaryIO) -> Iterator[pa.Table]:
+        try:
+            parquet = pq.ParquetFile(file)
+        except pa.ArrowException as e:
+            raise ValueError(f"Not a Parquet file: {e}") from e
+        for batch in parquet.iter_batches(batch_size=self.batch_size):
+            yield _prepare(batch)
+
+    async def load(self, file: BinaryIO) -> ImportResult:
+        """
+        Import every row of a Parquet file.
+        Parameters:
+            file (BinaryIO): Seekable file holding the Parquet data.
+        Returns:
+            ImportResult: Row count, elapsed time and bounds of the imported rows.
+        Raises:
+            ValueError: If the file is not Parquet or does not match IMPORT_SCHEMA.
+            IntegrityError: If a reading of the file is already stored.
+        """
+        started = time.perf_counter()
+        batches = self._batches(file)
+        result = ImportResult()
+        async with self.engine.begin() as conn:
+            raw_connection = (await conn.get_raw_connection()).driver_connection
+            while True:
+                # Decoding and conversion are CPU bound, keep them off the event loop
+                table = await asyncio.to_thread(next, batches, None)
+                if table is None:
+                    break
+                if not len(table):
+                    continue
+                data, deltas = await asyncio.to_thread(lambda: (_csv(table), _deltas(table)))
+                try:
+                    await raw_connection.copy_to_table(
+                        self.table.name, source=io.BytesIO(data), columns=INGEST_COLUMNS, format="csv"
+                    )
+                except IntegrityConstraintViolationError as e:
+                    raise IntegrityError(f"COPY {self.table.name}", None, e) from e
+                await self.aggregates.apply_deltas(conn, deltas)
+                result.rows += len(table)
+                result.bounds.extend(_bounds(table))
+            if result.bounds and self.rollups is not None:
+                timestamps = [bound["timestamp"] for bound in result.bounds]
+                await self.rollups.rebuild(conn, min(timestamps), max(timestamps))
+        result.elapsed = time.perf_counter() - started
+        return result
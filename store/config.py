@@ -14,3 +14,68 @@ POSTGRES_PORT = try_parse(int, os.environ.get("POSTGRES_PORT")) or 5432
 POSTGRES_USER = os.environ.get("POSTGRES_USER") or "user"
 POSTGRES_PASSWORD = os.environ.get("POSTGRES_PASS") or "pass"
 POSTGRES_DB = os.environ.get("POSTGRES_DB") or "test_db"
+# Configuration for bulk ingest
+# Batches with at least this many rows are streamed through COPY instead of a multi-row INSERT
+INGEST_COPY_THRESHOLD = try_parse(int, os.environ.get("INGEST_COPY_THRESHOLD")) or 500
+# Configuration for the async database pool
+DB_POOL_SIZE = try_parse(int, os.environ.get("DB_POOL_SIZE")) or 10
+DB_MAX_OVERFLOW = try_parse(int, os.environ.get("DB_MAX_OVERFLOW")) or 20
+DB_POOL_PRE_PING = (os.environ.get("DB_POOL_PRE_PING") or "true").lower() in ("1", "true", "yes")
+# Seconds to wait for a free pooled connection before failing the request
+DB_POOL_TIMEOUT = try_parse(float, os.environ.get("DB_POOL_TIMEOUT")) or 5.0
+# Seconds after which pooled connections are recycled
+DB_POOL_RECYCLE = try_parse(int, os.environ.get("DB_POOL_RECYCLE")) or 1800
+# Seconds a single statement may run before asyncpg cancels it
+DB_COMMAND_TIMEOUT = try_parse(float, os.environ.get("DB_COMMAND_TIMEOUT")) or 30.0
+# Configuration for road quality aggregates
+# Edge length in degrees of the grid cells rows are bucketed into; changing it requires rebuilding
+# the cell columns and road_cell_aggregates
+GRID_CELL_SIZE = try_parse(float, os.environ.get("GRID_CELL_SIZE")) or 0.001
+# Accelerometer z reading at rest, aggregates track the mean |z| deviation from it
+AGGREGATE_Z_BASELINE = try_parse(float, os.environ.get("AGGREGATE_Z_BASELINE")) or 16384.0
+# Bounding box queries covering more cells than this are answered with merged blocks of cells
+AGGREGATE_MAX_CELLS = try_parse(int, os.environ.get("AGGREGATE_MAX_CELLS")) or 2500
+# Configuration for partitioning, retention and rollups
+# Daily partitions created ahead of time
+PARTITION_PREMAKE_DAYS = try_parse(int, os.environ.get("PARTITION_PREMAKE_DAYS")) or 7
+# Partitions older than this many days are dropped, 0 keeps all data
+RETENTION_DAYS = try_parse(int, os.environ.get("RETENTION_DAYS")) or 0
+# Seconds between maintenance rounds creating partitions, applying retention and refreshing rollups
+MAINTENANCE_INTERVAL = try_parse(float, os.environ.get("MAINTENANCE_INTERVAL")) or 300.0
+# Hours of already rolled up data recomputed on each refresh to include late rows, keep well below retention
+ROLLUP_LOOKBACK_HOURS = try_parse(float, os.environ.get("ROLLUP_LOOKBACK_HOURS")) or 2.0
+# Configuration for the read cache
+# Records and query results kept in process, and seconds before they expire
+CACHE_MAX_ENTRIES = try_parse(int, os.environ.get("CACHE_MAX_ENTRIES")) or 1000
+CACHE_TTL = try_parse(float, os.environ.get("CACHE_TTL")) or 5.0
+# Redis URL of the cache tier shared by all store processes, which also carries invalidations to all of them;
+# without it a process only sees its own writes until CACHE_TTL ran out
+CACHE_REDIS_URL = os.environ.get("CACHE_REDIS_URL") or ""
+CACHE_REDIS_TTL = try_parse(float, os.environ.get("CACHE_REDIS_TTL")) or 30.0
+# Configuration for listing and export
+LIST_PAGE_SIZE = try_parse(int, os.environ.get("LIST_PAGE_SIZE")) or 100
+LIST_MAX_PAGE_SIZE = try_parse(int, os.environ.get("LIST_MAX_PAGE_SIZE")) or 1000
+# Rows fetched per round trip by the server-side cursor of streaming responses
+STREAM_FETCH_SIZE = try_parse(int, os.environ.get("STREAM_FETCH_SIZE")) or 1000
+# Rows per Arrow record batch or Parquet row group of columnar exports and imports
+COLUMNAR_BATCH_SIZE = try_parse(int, os.environ.get("COLUMNAR_BATCH_SIZE")) or 65536
+# Bytes of an uploaded Parquet file kept in memory before it is spooled to a temporary file
+IMPORT_SPOOL_SIZE = try_parse(int, os.environ.get("IMPORT_SPOOL_SIZE")) or 64 * 1024 * 1024
+# Configuration for WebSocket fan-out
+# Messages buffered per client before the overflow policy kicks in
+WS_QUEUE_SIZE = try_parse(int, os.environ.get("WS_QUEUE_SIZE")) or 100
+# "drop_oldest" discards the oldest queued message, "disconnect" closes the slow client
+WS_OVERFLOW_POLICY = os.environ.get("WS_OVERFLOW_POLICY") or "drop_oldest"
+# Grid cell size in degrees of the index over subscriber bounding boxes
+WS_INDEX_CELL_SIZE = try_parse(float, os.environ.get("WS_INDEX_CELL_SIZE")) or 0.01
+# Bounding boxes covering more cells than this are checked against every record instead
+WS_INDEX_MAX_CELLS = try_parse(int, os.environ.get("WS_INDEX_MAX_CELLS")) or 10000
+# Redis URL of the pub/sub channel relaying written batches to the clients of every store process,
+# needed when running several uvicorn workers; unset serves each process's own writes only
+WS_FANOUT_REDIS_URL = os.environ.get("WS_FANOUT_REDIS_URL") or ""
+WS_FANOUT_CHANNEL = os.environ.get("WS_FANOUT_CHANNEL") or "store:ws"
+# Configuration for logging
+# Seconds between log lines from the same place in the code, repeats in between are counted; 0 logs everything
+LOG_SAMPLE_INTERVAL = try_parse(float, os.environ.get("LOG_SAMPLE_INTERVAL"))
+if LOG_SAMPLE_INTERVAL is None:
+    LOG_SAMPLE_INTERVAL = 10.0
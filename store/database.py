@@ -0,0 +1,80 @@
+from sqlalchemy import MetaData, Table, Column, Integer, BigInteger, String, Float, DateTime, Index, text
+from sqlalchemy.ext.asyncio import create_async_engine
+from config import POSTGRES_USER, POSTGRES_PASSWORD, POSTGRES_HOST, POSTGRES_PORT, POSTGRES_DB, DB_POOL_SIZE, \
+    DB_MAX_OVERFLOW, DB_POOL_PRE_PING, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_COMMAND_TIMEOUT
+
+# SQLAlchemy setup
+DATABASE_URL = \
+    f"postgresql+asyncpg://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
+engine = create_async_engine(
+    DATABASE_URL,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_pre_ping=DB_POOL_PRE_PING,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE,
+    connect_args={"command_timeout": DB_COMMAND_TIMEOUT},
+)
+metadata = MetaData()
+# Define the ProcessedAgentData table
+processed_agent_data = Table(
+    "processed_agent_data",
+    metadata,
+    # Partitioned by timestamp, which is therefore part of the primary key
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("user_id", Integer, nullable=False),
+    Column("road_state", String),
+    Column("x", Float),
+    Column("y", Float),
+    Column("z", Float),
+    Column("latitude", Float),
+    Column("longitude", Float),
+    Column("timestamp", DateTime, primary_key=True),
+    # Grid cell of the GPS position, see spatial.cell_of
+    Column("cell_lat", Integer),
+    Column("cell_lon", Integer),
+    # Mirrors the indexes in docker/db/structure.sql
+    Index("processed_agent_data_timestamp_id_idx", "timestamp", "id"),
+    Index("processed_agent_data_road_state_timestamp_idx", "road_state", "timestamp"),
+    Index("processed_agent_data_latitude_longitude_idx", "latitude", "longitude"),
+    Index("processed_agent_data_cell_idx", "cell_lat", "cell_lon"),
+    Index("processed_agent_data_reading_idx", "user_id", "timestamp", unique=True,
+          postgresql_where=text("user_id <> 0")),
+)
+# Per grid cell and road_state aggregates, maintained on every write
+road_cell_aggregates = Table(
+    "road_cell_aggregates",
+    metadata,
+    Column("cell_lat", Integer, primary_key=True),
+    Column("cell_lon", Integer, primary_key=True),
+    Column("road_state", String, primary_key=True),
+    Column("count", BigInteger, nullable=False),
+    Column("z_deviation_sum", Float, nullable=False),
+)
+
+
+def rollup_table(name: str) -> Table:
+    # Per time bucket and road_state statistics of processed_agent_data
+    return Table(
+        name,
+        metadata,
+        Column("bucket", DateTime, primary_key=True),
+        Column("road_state", String, primary_key=True),
+        Column("count", BigInteger, nullable=False),
+        Column("sum_x", Float),
+        Column("sum_y", Float),
+        Column("sum_z", Float),
+        Column("min_z", Float),
+        Column("max_z", Float),
+    )
+
+
+processed_agent_data_hourly = rollup_table("processed_agent_data_hourly")
+processed_agent_data_daily = rollup_table("processed_agent_data_daily")
+# End of the last complete bucket of each rollup
+rollup_watermarks = Table(
+    "rollup_watermarks",
+    metadata,
+    Column("name", String, primary_key=True),
+    Column("until", DateTime, nullable=False),
+)
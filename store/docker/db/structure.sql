@@ -1,10 +1,65 @@
+-- Range partitioned by day on timestamp; the store creates upcoming daily partitions
+-- (processed_agent_data_pYYYYMMDD) and drops expired ones, see partitions.py
 CREATE TABLE processed_agent_data (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
+    -- Vehicle the readings come from, 0 when the agent does not send one
+    user_id INTEGER NOT NULL DEFAULT 0,
     road_state VARCHAR(255) NOT NULL,
     x FLOAT,
     y FLOAT,
     z FLOAT,
     latitude FLOAT,
     longitude FLOAT,
-    timestamp TIMESTAMP
-);
\ No newline at end of file
+    timestamp TIMESTAMP NOT NULL,
+    -- Grid cell of the GPS position, floor(coordinate / GRID_CELL_SIZE)
+    cell_lat INTEGER,
+    cell_lon INTEGER,
+    PRIMARY KEY (id, timestamp)
+) PARTITION BY RANGE (timestamp);
+
+-- Rows outside every daily partition, e.g. replayed historical data
+CREATE TABLE processed_agent_data_default PARTITION OF processed_agent_data DEFAULT;
+
+-- Keyset pagination and time range filters
+CREATE INDEX processed_agent_data_timestamp_id_idx ON processed_agent_data (timestamp, id);
+-- road_state filters within a time range
+CREATE INDEX processed_agent_data_road_state_timestamp_idx ON processed_agent_data (road_state, timestamp);
+-- GPS bounding box filters
+CREATE INDEX processed_agent_data_latitude_longitude_idx ON processed_agent_data (latitude, longitude);
+-- Raw rows of a grid cell
+CREATE INDEX processed_agent_data_cell_idx ON processed_agent_data (cell_lat, cell_lon);
+-- Identity of a reading for idempotent writes: a vehicle has one reading per timestamp;
+-- readings without a vehicle cannot be told apart and are left out
+CREATE UNIQUE INDEX processed_agent_data_reading_idx ON processed_agent_data (user_id, timestamp) WHERE user_id <> 0;
+
+-- Per grid cell and road_state aggregates, kept up to date by the store on every write
+CREATE TABLE road_cell_aggregates (
+    cell_lat INTEGER NOT NULL,
+    cell_lon INTEGER NOT NULL,
+    road_state VARCHAR(255) NOT NULL,
+    count BIGINT NOT NULL,
+    -- Sum of |z - AGGREGATE_Z_BASELINE| over the cell's rows
+    z_deviation_sum FLOAT NOT NULL,
+    PRIMARY KEY (cell_lat, cell_lon, road_state)
+);
+
+-- Hourly and daily rollups per road_state, refreshed by the store, see rollups.py
+CREATE TABLE processed_agent_data_hourly (
+    bucket TIMESTAMP NOT NULL,
+    road_state VARCHAR(255) NOT NULL,
+    count BIGINT NOT NULL,
+    sum_x FLOAT,
+    sum_y FLOAT,
+    sum_z FLOAT,
+    min_z FLOAT,
+    max_z FLOAT,
+    PRIMARY KEY (bucket, road_state)
+);
+
+CREATE TABLE processed_agent_data_daily (LIKE processed_agent_data_hourly INCLUDING ALL);
+
+-- End of the last complete bucket of each rollup
+CREATE TABLE rollup_watermarks (
+    name VARCHAR(255) PRIMARY KEY,
+    until TIMESTAMP NOT NULL
+);
@@ -0,0 +1,81 @@
+import asyncio
+import logging
+from typing import List, Optional
+
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from broadcaster import Broadcaster
+from models import ProcessedAgentData
+
+# Seconds between attempts to resubscribe after the Redis connection dropped
+RESUBSCRIBE_DELAY = 1.0
+
+
+class FanoutBus:
+    """
+    Relays written batches to the WebSocket clients of every store process.
+    With Redis, the process that handled a write publishes the batch once on
+    a pub/sub channel, one JSON record per line, and every process, itself
+    included, hands what it receives to its own broadcaster. Without Redis
+    batches go straight to the local broadcaster, as with a single process.
+    Like the WebSocket queues, pub/sub is at most once: batches published
+    while a process is not subscribed never reach its clients.
+    """
+
+    def __init__(self, broadcaster: Broadcaster, redis: Optional[Redis] = None, channel: str = "store:ws"):
+        self.broadcaster = broadcaster
+        self.redis = redis
+        self.channel = channel
+        self.published = 0
+        self.relayed = 0
+        self._task = None
+
+    def start(self):
+        if self.redis is not None:
+            self._task = asyncio.create_task(self._relay())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def publish(self, batch: List[ProcessedAgentData]):
+        if not batch:
+            return
+        if self.redis is None:
+            self.broadcaster.publish(batch)
+            return
+        fragments = [item.model_dump_json() for item in batch]
+        try:
+            await self.redis.publish(self.channel, "\n".join(fragments))
+            self.published += 1
+        except RedisError as e:
+            logging.error(f"WebSocket fan-out unavailable, serving local clients only: {e!r}")
+            self.broadcaster.publish_serialized(fragments)
+
+    async def _relay(self):
+        while True:
+            pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(self.channel)
+                async for message in pubsub.listen():
+                    self.relayed += 1
+                    if not message["data"]:
+                        continue
+                    # A malformed batch only loses itself, not the subscription
+                    try:
+                        self.broadcaster.publish_serialized(message["data"].decode().split("\n"))
+                    except (ValueError, KeyError, TypeError) as e:
+                        logging.error(f"Dropping malformed WebSocket fan-out batch: {e!r}")
+            except Exception as e:
+                logging.error(f"WebSocket fan-out subscription lost: {e!r}")
+            finally:
+                await pubsub.reset()
+            await asyncio.sleep(RESUBSCRIBE_DELAY)
+
+    def stats(self) -> dict:
+        return {"shared": self.redis is not None, "published": self.published, "relayed": self.relayed}
@@ -0,0 +1,28 @@
+from fastapi import Response
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+# Batch sizes of the hub are 20 by default, backfills reach tens of thousands
+BATCH_SIZE_BUCKETS = (1, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 50000)
+
+# Ingest, POSTed batches by strategy and PUT batches as "upsert"
+INGEST_ROWS = Counter("store_ingest_rows", "Rows written by POST and PUT /processed_agent_data/", ["strategy"])
+INGEST_BATCH_SIZE = Histogram(
+    "store_ingest_batch_size", "Rows per POST or PUT /processed_agent_data/ batch", buckets=BATCH_SIZE_BUCKETS
+)
+INGEST_SECONDS = Histogram("store_ingest_seconds", "Time spent writing one batch to Postgres", ["strategy"])
+INGEST_DUPLICATES = Counter("store_ingest_duplicates", "POSTed rows skipped because the reading was already stored")
+# Connection pool, set to read the pool of the engine in main.py
+DB_POOL_SIZE = Gauge("store_db_pool_size", "Connections the pool keeps open")
+DB_POOL_CHECKED_OUT = Gauge("store_db_pool_checked_out", "Pooled connections in use")
+DB_POOL_OVERFLOW = Gauge("store_db_pool_overflow", "Connections open beyond the pool size")
+# WebSocket fan-out, set to read the broadcaster in main.py
+WS_SUBSCRIBERS = Gauge("store_ws_subscribers", "Connected WebSocket subscribers")
+WS_QUEUE_DEPTH = Gauge("store_ws_queue_depth", "Batches queued for all WebSocket subscribers")
+WS_MAX_QUEUE_DEPTH = Gauge("store_ws_max_queue_depth", "Batches queued for the slowest WebSocket subscriber")
+WS_DROPPED = Gauge("store_ws_dropped", "Batches dropped for slow WebSocket subscribers so far")
+
+
+def metrics_response() -> Response:
+    """Render every registered metric in the Prometheus text format."""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
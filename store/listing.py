@@ -0,0 +1,114 @@
+import base64
+import csv
+import io
+import json
+from dataclasses import dataclass
+from datetime import datetime
+from typing import AsyncIterator, List, Optional, Tuple
+
+from fastapi import Query
+from sqlalchemy import Select, and_, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from database import processed_agent_data
+from models import naive_utc
+
+LIST_COLUMNS = ("id", "user_id", "road_state", "x", "y", "z", "latitude", "longitude", "timestamp")
+
+
+@dataclass
+class ProcessedAgentDataFilter:
+    """
+    Query parameters shared by the listing and export endpoints.
+    Every field is optional; unset fields do not constrain the query.
+    """
+    start: Optional[datetime] = None
+    end: Optional[datetime] = None
+    road_state: Optional[List[str]] = Query(None)
+    min_latitude: Optional[float] = None
+    max_latitude: Optional[float] = None
+    min_longitude: Optional[float] = None
+    max_longitude: Optional[float] = None
+
+    def conditions(self, table=processed_agent_data) -> list:
+        conditions = []
+        if self.start is not None:
+            conditions.append(table.c.timestamp >= naive_utc(self.start))
+        if self.end is not None:
+            conditions.append(table.c.timestamp < naive_utc(self.end))
+        if self.road_state:
+            conditions.append(table.c.road_state.in_(self.road_state))
+        if self.min_latitude is not None:
+            conditions.append(table.c.latitude >= self.min_latitude)
+        if self.max_latitude is not None:
+            conditions.append(table.c.latitude <= self.max_latitude)
+        if self.min_longitude is not None:
+            conditions.append(table.c.longitude >= self.min_longitude)
+        if self.max_longitude is not None:
+            conditions.append(table.c.longitude <= self.max_longitude)
+        return conditions
+
+    def apply(self, query: Select) -> Select:
+        conditions = self.conditions()
+        return query.where(and_(*conditions)) if conditions else query
+
+
+def encode_cursor(timestamp: datetime, row_id: int) -> str:
+    raw = json.dumps([timestamp.isoformat(), row_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """
+    Parse a cursor produced by encode_cursor.
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        timestamp, row_id = json.loads(raw)
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except (TypeError, ValueError, json.JSONDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+def keyset_query(filters: ProcessedAgentDataFilter, cursor: Optional[str] = None) -> Select:
+    """
+    Build the filtered listing query ordered by the (timestamp, id) keyset.
+    Rows strictly after the cursor position are returned, so pages never
+    require an OFFSET scan.
+    """
+    table = processed_agent_data
+    query = filters.apply(select(*(table.c[column] for column in LIST_COLUMNS))).order_by(table.c.timestamp, table.c.id)
+    if cursor:
+        timestamp, row_id = decode_cursor(cursor)
+        query = query.where(tuple_(table.c.timestamp, table.c.id) > tuple_(timestamp, row_id))
+    return query
+
+
+def _ndjson_line(row) -> str:
+    record = dict(row._mapping)
+    record["timestamp"] = record["timestamp"].isoformat() if record["timestamp"] else None
+    return json.dumps(record) + "\n"
+
+
+async def stream_rows(engine: AsyncEngine, query: Select, media_format: str, fetch_size: int) -> AsyncIterator[str]:
+    """
+    Stream query results as NDJSON or CSV from a server-side cursor.
+    Only one fetch_size partition of rows is held in memory at a time.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    if media_format == "csv":
+        writer.writerow(LIST_COLUMNS)
+        yield buffer.getvalue()
+    async with engine.connect() as conn:
+        result = await conn.stream(query.execution_options(yield_per=fetch_size))
+        async for partition in result.partitions():
+            if media_format == "csv":
+                buffer.seek(0)
+                buffer.truncate()
+                writer.writerows(partition)
+                yield buffer.getvalue()
+            else:
+                yield "".join(_ndjson_line(row) for row in partition)
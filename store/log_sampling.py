@@ -0,0 +1,36 @@
+# Copy of hub/app/log_sampling.py, whose tests cover it; the services are built as separate images
+import logging
+import threading
+import time
+from typing import Dict, Tuple
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets through at most one record per interval seconds from each logging
+    call site. The next record let through reports how many were suppressed
+    in between, so per-message and per-request logging cost one line per interval.
+    """
+
+    def __init__(self, interval: float):
+        super().__init__()
+        self.interval = interval
+        # Time of the last record let through and records suppressed since, by call site
+        self._sites: Dict[Tuple[str, int], Tuple[float, int]] = {}
+        # Records may come from several threads, e.g. the hub's MQTT, worker and store threads
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.interval <= 0:
+            return True
+        site = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            last, suppressed = self._sites.get(site, (float("-inf"), 0))
+            if now - last < self.interval:
+                self._sites[site] = (last, suppressed + 1)
+                return False
+            self._sites[site] = (now, 0)
+        if suppressed:
+            record.msg = f"{record.msg} ({suppressed} similar messages suppressed)"
+        return True
@@ -1,177 +1,442 @@
-from datetime import datetime
-from typing import Set, List
-import json
-
-from pydantic import BaseModel, field_validator
-from sqlalchemy import create_engine, MetaData, Table, Column, Integer, String, Float, DateTime, select
-from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
-from fastapi.responses import JSONResponse
-from config import POSTGRES_USER, POSTGRES_PASSWORD, POSTGRES_HOST, POSTGRES_PORT, POSTGRES_DB
-
-# SQLAlchemy setup
-DATABASE_URL = \
-    f"postgresql+psycopg2://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
-engine = create_engine(DATABASE_URL)
-metadata = MetaData()
-# Define the ProcessedAgentData table
-processed_agent_data = Table(
-    "processed_agent_data",
-    metadata,
-    Column("id", Integer, primary_key=True, index=True),
-    Column("road_state", String),
-    Column("x", Float),
-    Column("y", Float),
-    Column("z", Float),
-    Column("latitude", Float),
-    Column("longitude", Float),
-    Column("timestamp", DateTime),
+import tempfile
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from typing import List, Optional
+import logging
+
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect, Depends, Path, Query, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import ValidationError
+from redis.asyncio import Redis
+from sqlalchemy.exc import IntegrityError
+from broadcaster import Broadcaster
+from bulk_ingest import BulkIngestEngine
+from bulk_update import BulkUpdateEngine
+from cache import MISSING, CacheScope, ReadCache
+from columnar import COLUMNAR_MEDIA_TYPES, ParquetImporter, stream_columnar
+from config import INGEST_COPY_THRESHOLD, LIST_PAGE_SIZE, LIST_MAX_PAGE_SIZE, STREAM_FETCH_SIZE, WS_QUEUE_SIZE, \
+    WS_OVERFLOW_POLICY, WS_INDEX_CELL_SIZE, WS_INDEX_MAX_CELLS, GRID_CELL_SIZE, AGGREGATE_MAX_CELLS, \
+    PARTITION_PREMAKE_DAYS, RETENTION_DAYS, MAINTENANCE_INTERVAL, ROLLUP_LOOKBACK_HOURS, CACHE_MAX_ENTRIES, CACHE_TTL, \
+    CACHE_REDIS_URL, CACHE_REDIS_TTL, COLUMNAR_BATCH_SIZE, IMPORT_SPOOL_SIZE, LOG_SAMPLE_INTERVAL, \
+    WS_FANOUT_REDIS_URL, WS_FANOUT_CHANNEL
+from database import engine, processed_agent_data, road_cell_aggregates, processed_agent_data_hourly, \
+    processed_agent_data_daily, rollup_watermarks
+from fanout import FanoutBus
+from listing import ProcessedAgentDataFilter, keyset_query, encode_cursor, stream_rows
+from instrumentation import INGEST_ROWS, INGEST_BATCH_SIZE, INGEST_SECONDS, INGEST_DUPLICATES, DB_POOL_SIZE, \
+    DB_POOL_CHECKED_OUT, DB_POOL_OVERFLOW, WS_SUBSCRIBERS, WS_QUEUE_DEPTH, WS_MAX_QUEUE_DEPTH, WS_DROPPED, \
+    metrics_response
+from log_sampling import RateLimitFilter
+from maintenance import MaintenanceTask
+from middleware import GzipRequestMiddleware
+from models import ProcessedAgentData, ProcessedAgentDataInDB, ProcessedAgentDataRelabel, RoadQuality, \
+    RoadStateBucket, naive_utc
+from partitions import PartitionManager
+from rollups import ROLLUP_INTERVALS, RollupManager, truncate
+from spatial import CellAggregates, cell_of, coarsening_factor, collect_cells, tile_bounds
+from subscriptions import SubscriptionIndex, SubscriptionRequest
+
+# Configure logging settings
+logging.basicConfig(
+    level=logging.INFO,
+    format="[%(asctime)s] [%(levelname)s] [%(module)s] %(message)s",
 )
+# Per-request messages, including uvicorn's access log, are sampled
+log_filter = RateLimitFilter(LOG_SAMPLE_INTERVAL)
+logging.getLogger().addFilter(log_filter)
+logging.getLogger("uvicorn.access").addFilter(log_filter)
+# Media types of the streaming listing formats
+STREAM_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+# Columns of the replaced row an update needs for the aggregates and cache invalidation
+PREVIOUS_COLUMNS = ("road_state", "z", "timestamp", "cell_lat", "cell_lon")
+# Per grid cell road quality aggregates, updated with every write
+cell_aggregates = CellAggregates(road_cell_aggregates)
+
+# Read-through cache of records and query results, optionally shared through Redis
+cache_redis = Redis.from_url(CACHE_REDIS_URL) if CACHE_REDIS_URL else None
+cache = ReadCache(max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL, redis=cache_redis, redis_ttl=CACHE_REDIS_TTL)
+# Hourly and daily rollups read by the analytics endpoint
+rollups = RollupManager(
+    engine,
+    processed_agent_data,
+    rollups={"hour": processed_agent_data_hourly, "day": processed_agent_data_daily},
+    watermarks=rollup_watermarks,
+    lookback=timedelta(hours=ROLLUP_LOOKBACK_HOURS),
+    retention=timedelta(days=RETENTION_DAYS),
+)
+# Bulk ingest engine used by the POST endpoint
+ingest_engine = BulkIngestEngine(
+    engine, processed_agent_data, copy_threshold=INGEST_COPY_THRESHOLD, aggregates=cell_aggregates, rollups=rollups
+)
+# Set-based relabel, delete and upsert, keeping the aggregates and rollups in step
+bulk_updates = BulkUpdateEngine(engine, processed_agent_data, cell_aggregates, rollups)
+# Parquet backfills through COPY
+parquet_importer = ParquetImporter(
+    engine, processed_agent_data, cell_aggregates, rollups, batch_size=COLUMNAR_BATCH_SIZE
+)
+# Partition creation, retention and rollup refresh in the background
+maintenance = MaintenanceTask(
+    engine,
+    PartitionManager(
+        engine,
+        processed_agent_data.name,
+        premake_days=PARTITION_PREMAKE_DAYS,
+        retention_days=RETENTION_DAYS,
+        aggregates_table_name=road_cell_aggregates.name,
+    ),
+    rollups,
+    interval=MAINTENANCE_INTERVAL,
+    cache=cache,
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    maintenance.start()
+    fanout.start()
+    cache.start()
+    yield
+    await maintenance.stop()
+    await fanout.stop()
+    await cache.stop()
+    broadcaster.close()
+    if cache_redis is not None:
+        await cache_redis.close()
+    if fanout_redis is not None:
+        await fanout_redis.close()
+    # Close pooled connections on shutdown
+    await engine.dispose()
+
 
 # FastAPI app setup
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+# Accept gzip-compressed batches from the hub
+app.add_middleware(GzipRequestMiddleware)
 
 # WebSocket subscriptions
-subscriptions: Set[WebSocket] = set()
+broadcaster = Broadcaster(
+    queue_size=WS_QUEUE_SIZE,
+    policy=WS_OVERFLOW_POLICY,
+    index=SubscriptionIndex(cell_size=WS_INDEX_CELL_SIZE, max_cells=WS_INDEX_MAX_CELLS),
+)
+# Writes reach the clients of every worker process through Redis pub/sub
+fanout_redis = Redis.from_url(WS_FANOUT_REDIS_URL) if WS_FANOUT_REDIS_URL else None
+fanout = FanoutBus(broadcaster, redis=fanout_redis, channel=WS_FANOUT_CHANNEL)
+# Gauges read the pool and the broadcaster when scraped
+DB_POOL_SIZE.set_function(lambda: engine.pool.size())
+DB_POOL_CHECKED_OUT.set_function(lambda: engine.pool.checkedout())
+DB_POOL_OVERFLOW.set_function(lambda: max(engine.pool.overflow(), 0))
+WS_SUBSCRIBERS.set_function(lambda: len(broadcaster.subscribers))
+WS_QUEUE_DEPTH.set_function(lambda: broadcaster.stats()["queue_depth"])
+WS_MAX_QUEUE_DEPTH.set_function(lambda: broadcaster.stats()["max_queue_depth"])
+WS_DROPPED.set_function(lambda: broadcaster.stats()["dropped"])
 
 
 # FastAPI WebSocket endpoint
 @app.websocket("/ws/")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
-    subscriptions.add(websocket)
+    broadcaster.subscribe(websocket)
     try:
         while True:
-            await websocket.receive_text()
+            # Clients may (re)send a subscription message at any time
+            message = await websocket.receive_text()
+            try:
+                broadcaster.update_subscription(websocket, SubscriptionRequest.model_validate_json(message))
+            except ValidationError as e:
+                await websocket.close(code=1008, reason=str(e.errors()[0]["msg"])[:120])
+                break
     except WebSocketDisconnect:
-        subscriptions.remove(websocket)
+        pass
+    finally:
+        broadcaster.unsubscribe(websocket)
 
 
-# Function to send data to subscribed users
-async def send_data_to_subscribers(data):
-    for websocket in subscriptions:
-        await websocket.send_json(json.dumps(data))
+@app.get("/metrics")
+def metrics():
+    return metrics_response()
 
 
-# FastAPI models
-class AccelerometerData(BaseModel):
-    x: float
-    y: float
-    z: float
+@app.get("/cache/stats")
+def cache_stats():
+    return cache.stats()
 
 
-class GpsData(BaseModel):
-    latitude: float
-    longitude: float
+@app.get("/ws/stats")
+def websocket_stats():
+    return {**broadcaster.stats(), "fanout": fanout.stats()}
 
 
-class AgentData(BaseModel):
-    accelerometer: AccelerometerData
-    gps: GpsData
-    timestamp: datetime
-
-    @classmethod
-    @field_validator('timestamp', mode='before')
-    def check_timestamp(cls, value):
-        if isinstance(value, datetime):
-            return value
-        try:
-            return datetime.fromisoformat(value)
-        except (TypeError, ValueError):
-            raise ValueError(
-                "Invalid timestamp format. Expected ISO 8601 format (YYYY-MM-DDTHH:MM:SSZ).")
-
-
-class ProcessedAgentData(BaseModel):
-    road_state: str
-    agent_data: AgentData
-
-
-# Database model
-class ProcessedAgentDataInDB(BaseModel):
-    id: int
-    road_state: str
-    x: float
-    y: float
-    z: float
-    latitude: float
-    longitude: float
-    timestamp: datetime
+# Function to send data to subscribed users, of this and every other store process
+async def send_data_to_subscribers(data: List[ProcessedAgentData]):
+    await fanout.publish(data)
 
 
 # FastAPI CRUD endpoints
 @app.post("/processed_agent_data/")
 async def create_processed_agent_data(data: List[ProcessedAgentData]):
-    # Insert data to database
-    with engine.begin() as conn:
-        for item in data:
-            conn.execute(processed_agent_data.insert().values(
-                road_state=item.road_state,
-                x=item.agent_data.accelerometer.x,
-                y=item.agent_data.accelerometer.y,
-                z=item.agent_data.accelerometer.z,
-                latitude=item.agent_data.gps.latitude,
-                longitude=item.agent_data.gps.longitude,
-                timestamp=item.agent_data.timestamp
-            ))
-    # Send data to subscribers
-    await send_data_to_subscribers(data)
-    return {"message": "Data successfully created"}
+    # Insert the whole batch in a single pass, readings already stored are skipped
+    rows = [item.to_row() for item in data]
+    result = await ingest_engine.ingest(rows)
+    INGEST_ROWS.labels(result.strategy).inc(result.rows)
+    INGEST_BATCH_SIZE.observe(len(rows))
+    INGEST_SECONDS.labels(result.strategy).observe(result.elapsed)
+    if result.duplicates:
+        INGEST_DUPLICATES.inc(result.duplicates)
+    logging.info(f"Ingested {result.rows} rows via {result.strategy} ({result.rows_per_sec:.0f} rows/sec), "
+                 f"skipped {result.duplicates} already stored")
+    # Drop cached query results covering the new rows
+    await cache.invalidate(rows=result.written)
+    # Send the new data to subscribers
+    if result.duplicates:
+        written = {id(row) for row in result.written}
+        data = [item for item, row in zip(data, rows) if id(row) in written]
+    if data:
+        await send_data_to_subscribers(data)
+    return {"message": "Data successfully created", "inserted": result.rows, "duplicates": result.duplicates}
+
+
+@app.post("/processed_agent_data/import")
+async def import_processed_agent_data(request: Request):
+    # Backfill from a Parquet file sent as the request body, all rows or none
+    with tempfile.SpooledTemporaryFile(max_size=IMPORT_SPOOL_SIZE) as file:
+        async for chunk in request.stream():
+            file.write(chunk)
+        file.seek(0)
+        try:
+            result = await parquet_importer.load(file)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except IntegrityError:
+            raise HTTPException(status_code=409, detail="Readings already stored, nothing was imported")
+    logging.info(f"Imported {result.rows} rows ({result.rows / result.elapsed if result.elapsed else 0:.0f} rows/sec)")
+    await cache.invalidate(rows=result.bounds)
+    return {"imported": result.rows}
+
+
+@app.put("/processed_agent_data/")
+async def upsert_processed_agent_data(data: List[ProcessedAgentData]):
+    # Idempotent batch write: readings already stored only take the new road_state
+    rows = [item.to_row() for item in data]
+    result = await bulk_updates.upsert(rows)
+    INGEST_ROWS.labels("upsert").inc(len(rows))
+    INGEST_BATCH_SIZE.observe(len(rows))
+    INGEST_SECONDS.labels("upsert").observe(result.elapsed)
+    logging.info(f"Upserted {len(rows)} rows: {result.inserted} inserted, {result.updated} updated")
+    await cache.invalidate(record_ids=result.ids, rows=result.rows)
+    # Send the inserted and updated readings to subscribers
+    written = {id(row) for row in result.written}
+    data = [item for item, row in zip(data, rows) if id(row) in written]
+    if data:
+        await send_data_to_subscribers(data)
+    return {"inserted": result.inserted, "updated": result.updated, "unchanged": result.unchanged}
+
+
+@app.patch("/processed_agent_data/")
+async def relabel_processed_agent_data(data: ProcessedAgentDataRelabel,
+                                       filters: ProcessedAgentDataFilter = Depends()):
+    # Relabel the listed records and/or every record matching the filters in one statement
+    conditions = bulk_conditions(filters, data.ids)
+    result = await bulk_updates.relabel(data.road_state, conditions)
+    await cache.invalidate(record_ids=result.ids, rows=result.rows)
+    return {"updated": result.updated}
+
+
+@app.delete("/processed_agent_data/")
+async def bulk_delete_processed_agent_data(filters: ProcessedAgentDataFilter = Depends()):
+    # Delete every record in a time range and/or bounding box in one statement
+    result = await bulk_updates.delete(bulk_conditions(filters))
+    await cache.invalidate(record_ids=result.ids, rows=result.rows)
+    return {"deleted": result.deleted}
+
+
+def bulk_conditions(filters: ProcessedAgentDataFilter, ids: Optional[List[int]] = None) -> list:
+    conditions = filters.conditions()
+    if ids is not None:
+        conditions.append(processed_agent_data.c.id.in_(ids))
+    if not conditions:
+        # Never change the whole table by accident
+        raise HTTPException(status_code=400, detail="Give ids or at least one filter")
+    return conditions
 
 
 @app.get("/processed_agent_data/{processed_agent_data_id}", response_model=ProcessedAgentDataInDB)
-def read_processed_agent_data(processed_agent_data_id: int):
+async def read_processed_agent_data(processed_agent_data_id: int):
     # Get data by id
+    key = cache.record_key(processed_agent_data_id)
+    generation = cache.generation
+    cached = await cache.get(key)
+    if cached is not MISSING:
+        return cached
     query = processed_agent_data.select().where(processed_agent_data.c.id == processed_agent_data_id)
-    with engine.begin() as conn:
-        result = conn.execute(query)
+    async with engine.connect() as conn:
+        result = await conn.execute(query)
         data = result.fetchone()
     if not data:
         raise HTTPException(status_code=404, detail="Item not found")
-    return data
+    record = ProcessedAgentDataInDB.model_validate(data._mapping).model_dump(mode="json")
+    await cache.set(key, record, generation=generation)
+    return record
 
 
 @app.get("/processed_agent_data/", response_model=list[ProcessedAgentDataInDB])
-def list_processed_agent_data():
-    # Get list of data
-    query = processed_agent_data.select()
-    with engine.begin() as conn:
-        result = conn.execute(query)
-        columns = result.keys()
-        return [ProcessedAgentDataInDB(**dict(zip(columns, row))) for row in result]
+async def list_processed_agent_data(
+        response: Response,
+        filters: ProcessedAgentDataFilter = Depends(),
+        cursor: Optional[str] = None,
+        limit: int = Query(LIST_PAGE_SIZE, ge=1, le=LIST_MAX_PAGE_SIZE),
+        format: str = Query("json", pattern="^(json|ndjson|csv|arrow|parquet)$"),
+):
+    # Get a filtered page of data, ordered by (timestamp, id)
+    try:
+        query = keyset_query(filters, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if format in COLUMNAR_MEDIA_TYPES:
+        # Stream the whole filtered range as Arrow record batches
+        return StreamingResponse(
+            stream_columnar(engine, query, format, COLUMNAR_BATCH_SIZE),
+            media_type=COLUMNAR_MEDIA_TYPES[format],
+            headers={"Content-Disposition": f'attachment; filename="processed_agent_data.{format}"'},
+        )
+    if format != "json":
+        # Stream the whole filtered range from a server-side cursor
+        return StreamingResponse(
+            stream_rows(engine, query, format, STREAM_FETCH_SIZE),
+            media_type=STREAM_MEDIA_TYPES[format],
+        )
+    key = cache.query_key("list", **vars(filters), cursor=cursor, limit=limit)
+    generation = cache.generation
+    page = await cache.get(key)
+    if page is MISSING:
+        async with engine.connect() as conn:
+            result = await conn.execute(query.limit(limit))
+            rows = [ProcessedAgentDataInDB(**row._mapping) for row in result]
+        # Pass the position of the last row back for the next page
+        next_cursor = encode_cursor(rows[-1].timestamp, rows[-1].id) if len(rows) == limit else None
+        page = {"rows": [row.model_dump(mode="json") for row in rows], "next_cursor": next_cursor}
+        await cache.set(key, page, CacheScope.for_area(
+            naive_utc(filters.start) if filters.start else None, naive_utc(filters.end) if filters.end else None,
+            filters.min_latitude, filters.min_longitude, filters.max_latitude, filters.max_longitude,
+        ), generation)
+    if page["next_cursor"]:
+        response.headers["X-Next-Cursor"] = page["next_cursor"]
+    return page["rows"]
+
+
+@app.get("/road_quality/", response_model=RoadQuality)
+async def read_road_quality(
+        min_latitude: float = Query(..., ge=-90, le=90),
+        min_longitude: float = Query(..., ge=-180, le=180),
+        max_latitude: float = Query(..., ge=-90, le=90),
+        max_longitude: float = Query(..., ge=-180, le=180),
+):
+    # Road state counts and mean |z| deviation per grid cell within a bounding box
+    if min_latitude > max_latitude or min_longitude > max_longitude:
+        raise HTTPException(status_code=400, detail="Empty bounding box")
+    return await query_road_quality(min_latitude, min_longitude, max_latitude, max_longitude)
+
+
+@app.get("/road_quality/tiles/{zoom}/{x}/{y}", response_model=RoadQuality)
+async def read_road_quality_tile(zoom: int = Path(..., ge=0, le=24), x: int = Path(..., ge=0),
+                                 y: int = Path(..., ge=0)):
+    # The same aggregates for a Web Mercator map tile
+    try:
+        bounds = tile_bounds(zoom, x, y)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return await query_road_quality(*bounds)
+
+
+async def query_road_quality(min_latitude: float, min_longitude: float, max_latitude: float,
+                             max_longitude: float) -> RoadQuality:
+    key = cache.query_key("road_quality", bbox=[min_latitude, min_longitude, max_latitude, max_longitude])
+    generation = cache.generation
+    cached = await cache.get(key)
+    if cached is not MISSING:
+        return cached
+    # Large areas are answered in blocks of cells so responses stay small
+    factor = coarsening_factor(min_latitude, min_longitude, max_latitude, max_longitude, AGGREGATE_MAX_CELLS)
+    query = cell_aggregates.bbox_query(min_latitude, min_longitude, max_latitude, max_longitude, factor)
+    async with engine.connect() as conn:
+        result = await conn.execute(query)
+        cells = collect_cells(result, GRID_CELL_SIZE * factor)
+    road_quality = RoadQuality(cell_size=GRID_CELL_SIZE * factor, cells=cells).model_dump(mode="json")
+    # Blocks extend past the bounding box, any row in one of them changes the result
+    min_cell_lat, min_cell_lon = cell_of(min_latitude, min_longitude)
+    max_cell_lat, max_cell_lon = cell_of(max_latitude, max_longitude)
+    await cache.set(key, road_quality, CacheScope(
+        min_cell_lat=min_cell_lat // factor * factor,
+        max_cell_lat=(max_cell_lat // factor + 1) * factor - 1,
+        min_cell_lon=min_cell_lon // factor * factor,
+        max_cell_lon=(max_cell_lon // factor + 1) * factor - 1,
+    ), generation)
+    return road_quality
+
+
+@app.get("/analytics/road_states/", response_model=list[RoadStateBucket])
+async def read_road_state_series(
+        start: datetime,
+        end: datetime,
+        interval: str = Query("hour", pattern="^(hour|day)$"),
+        road_state: Optional[List[str]] = Query(None),
+):
+    # Road state counts and accelerometer statistics per hour or day, served from the rollups
+    start, end = naive_utc(start), naive_utc(end)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    key = cache.query_key("road_states", start=start, end=end, interval=interval, road_state=road_state)
+    generation = cache.generation
+    series = await cache.get(key)
+    if series is MISSING:
+        series = [RoadStateBucket(**bucket).model_dump(mode="json")
+                  for bucket in await rollups.series(interval, start, end, road_state)]
+        # The series covers whole buckets around the requested range
+        await cache.set(key, series, CacheScope(truncate(start, interval), end + ROLLUP_INTERVALS[interval]),
+                        generation)
+    return series
 
 
 @app.put("/processed_agent_data/{processed_agent_data_id}", response_model=ProcessedAgentDataInDB)
-def update_processed_agent_data(processed_agent_data_id: int, data: ProcessedAgentData):
-    # Update data
-    query = processed_agent_data.update().where(processed_agent_data.c.id == processed_agent_data_id).values(
-        road_state=data.road_state,
-        x=data.agent_data.accelerometer.x,
-        y=data.agent_data.accelerometer.y,
-        z=data.agent_data.accelerometer.z,
-        latitude=data.agent_data.gps.latitude,
-        longitude=data.agent_data.gps.longitude,
-        timestamp=data.agent_data.timestamp
+async def update_processed_agent_data(processed_agent_data_id: int, data: ProcessedAgentData):
+    # Update data and return both versions in one statement, the old one moves out of its cell aggregate
+    row = data.to_row()
+    previous = processed_agent_data.select().where(
+        processed_agent_data.c.id == processed_agent_data_id
+    ).with_for_update().subquery("previous")
+    query = processed_agent_data.update().where(
+        processed_agent_data.c.id == previous.c.id,
+        processed_agent_data.c.timestamp == previous.c.timestamp,
+    ).values(**row).returning(
+        *processed_agent_data.c,
+        *(previous.c[column].label(f"previous_{column}") for column in PREVIOUS_COLUMNS),
     )
-    with engine.begin() as conn:
-        conn.execute(query)
-    updated_data = read_processed_agent_data(processed_agent_data_id)
-    if updated_data:
-        return updated_data
-    else:
-        raise HTTPException(status_code=404, detail="Item not found")
+    async with engine.begin() as conn:
+        updated_data = (await conn.execute(query)).fetchone()
+        if updated_data is None:
+            raise HTTPException(status_code=404, detail="Item not found")
+        previous_row = {column: getattr(updated_data, f"previous_{column}") for column in PREVIOUS_COLUMNS}
+        await cell_aggregates.replace(conn, [previous_row], [row])
+        # The row leaves the rolled up buckets of its old timestamp and joins those of the new one
+        for timestamp in {previous_row["timestamp"], row["timestamp"]}:
+            await rollups.rebuild(conn, timestamp, timestamp)
+    await cache.invalidate(record_ids=[processed_agent_data_id], rows=[previous_row, row])
+    return updated_data
 
 
 @app.delete("/processed_agent_data/{processed_agent_data_id}", response_model=ProcessedAgentDataInDB)
-def delete_processed_agent_data(processed_agent_data_id: int):
-    # Get data by id before deleting
-    query = processed_agent_data.select().where(processed_agent_data.c.id == processed_agent_data_id)
-    with engine.begin() as conn:
-        result = conn.execute(query)
-        deleted_data = result.fetchone()
+async def delete_processed_agent_data(processed_agent_data_id: int):
+    # Delete data by id, RETURNING hands back the deleted row
+    query = processed_agent_data.delete().where(
+        processed_agent_data.c.id == processed_agent_data_id
+    ).returning(*processed_agent_data.c)
+    async with engine.begin() as conn:
+        deleted_data = (await conn.execute(query)).fetchone()
         if deleted_data is None:
             return JSONResponse(status_code=404, content={"message": "Item not found"})
-        delete_query = processed_agent_data.delete().where(processed_agent_data.c.id == processed_agent_data_id)
-        conn.execute(delete_query)
+        await cell_aggregates.apply(conn, [deleted_data._mapping], sign=-1)
+        await rollups.rebuild(conn, deleted_data.timestamp, deleted_data.timestamp)
+    await cache.invalidate(record_ids=[processed_agent_data_id], rows=[deleted_data._mapping])
     # Return the deleted item
     return deleted_data
 
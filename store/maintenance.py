@@ -0,0 +1,75 @@
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from cache import ReadCache
+from partitions import PartitionManager
+from rollups import RollupManager
+
+# pg_advisory_lock key, so only one store worker runs maintenance at a time
+MAINTENANCE_LOCK_KEY = 0x524f4144
+
+
+class MaintenanceTask:
+    """
+    Periodically creates upcoming partitions, drops expired ones and refreshes
+    the rollups. Several store processes may run it, a Postgres advisory lock
+    lets only one of them do the work per round.
+    """
+
+    def __init__(self, engine: AsyncEngine, partitions: PartitionManager, rollups: RollupManager, interval: float,
+                 cache: Optional[ReadCache] = None):
+        self.engine = engine
+        self.partitions = partitions
+        self.rollups = rollups
+        self.interval = interval
+        self.cache = cache
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def run_once(self) -> bool:
+        """
+        Run one maintenance round unless another process is running one.
+        Returns:
+            bool: True if this process ran the round.
+        """
+        async with self.engine.connect() as lock_conn:
+            if not await lock_conn.scalar(text("SELECT pg_try_advisory_lock(:key)"), {"key": MAINTENANCE_LOCK_KEY}):
+                return False
+            try:
+                # Partitions and rollups are bucketed in naive UTC like the timestamp column
+                now = datetime.now(timezone.utc).replace(tzinfo=None)
+                created = await self.partitions.ensure_partitions(now)
+                dropped = await self.partitions.drop_expired(now)
+                await self.rollups.refresh(now)
+                if created or dropped:
+                    logging.info(f"Created partitions {created}, dropped partitions {dropped}")
+                if dropped and self.cache is not None:
+                    # Cached results may include the dropped rows
+                    await self.cache.clear()
+            finally:
+                await lock_conn.scalar(text("SELECT pg_advisory_unlock(:key)"), {"key": MAINTENANCE_LOCK_KEY})
+                await lock_conn.commit()
+        return True
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception:
+                logging.exception("Storage maintenance failed")
+            await asyncio.sleep(self.interval)
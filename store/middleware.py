@@ -0,0 +1,48 @@
+import gzip
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+class GzipRequestMiddleware:
+    """
+    Transparently inflates request bodies sent with Content-Encoding: gzip,
+    so endpoints see plain JSON whether or not the hub compressed the batch.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or (b"content-encoding", b"gzip") not in scope["headers"]:
+            await self.app(scope, receive, send)
+            return
+
+        chunks = []
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            chunks.append(message.get("body", b""))
+            more_body = message.get("more_body", False)
+        try:
+            body = gzip.decompress(b"".join(chunks))
+        except (OSError, EOFError):
+            await send({"type": "http.response.start", "status": 400,
+                        "headers": [(b"content-type", b"text/plain")]})
+            await send({"type": "http.response.body", "body": b"Invalid gzip request body"})
+            return
+
+        headers = [(name, value) for name, value in scope["headers"]
+                   if name not in (b"content-encoding", b"content-length")]
+        headers.append((b"content-length", str(len(body)).encode()))
+        sent = False
+
+        async def inflated_receive() -> Message:
+            nonlocal sent
+            if sent:
+                return await receive()
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        await self.app(dict(scope, headers=headers), inflated_receive, send)
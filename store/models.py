@@ -0,0 +1,113 @@
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from pydantic import BaseModel, field_validator
+
+from spatial import cell_of
+
+
+def naive_utc(value: datetime) -> datetime:
+    # The timestamp column is naive UTC, asyncpg refuses aware datetimes for it
+    if value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+# FastAPI models
+class AccelerometerData(BaseModel):
+    x: float
+    y: float
+    z: float
+
+
+class GpsData(BaseModel):
+    latitude: float
+    longitude: float
+
+
+class AgentData(BaseModel):
+    # Vehicle the readings come from, see the hub's AgentData
+    user_id: int = 0
+    accelerometer: AccelerometerData
+    gps: GpsData
+    timestamp: datetime
+
+    @classmethod
+    @field_validator('timestamp', mode='before')
+    def check_timestamp(cls, value):
+        if isinstance(value, datetime):
+            return value
+        try:
+            return datetime.fromisoformat(value)
+        except (TypeError, ValueError):
+            raise ValueError(
+                "Invalid timestamp format. Expected ISO 8601 format (YYYY-MM-DDTHH:MM:SSZ).")
+
+
+class ProcessedAgentData(BaseModel):
+    road_state: str
+    agent_data: AgentData
+
+    def to_row(self) -> dict:
+        # Flatten into the column layout of the processed_agent_data table
+        cell_lat, cell_lon = cell_of(self.agent_data.gps.latitude, self.agent_data.gps.longitude)
+        return {
+            "user_id": self.agent_data.user_id,
+            "road_state": self.road_state,
+            "x": self.agent_data.accelerometer.x,
+            "y": self.agent_data.accelerometer.y,
+            "z": self.agent_data.accelerometer.z,
+            "latitude": self.agent_data.gps.latitude,
+            "longitude": self.agent_data.gps.longitude,
+            "timestamp": naive_utc(self.agent_data.timestamp),
+            "cell_lat": cell_lat,
+            "cell_lon": cell_lon,
+        }
+
+
+# Database model
+class ProcessedAgentDataInDB(BaseModel):
+    id: int
+    user_id: int
+    road_state: str
+    x: float
+    y: float
+    z: float
+    latitude: float
+    longitude: float
+    timestamp: datetime
+
+
+class ProcessedAgentDataRelabel(BaseModel):
+    road_state: str
+    # Only relabel these records, on top of the query filters
+    ids: Optional[List[int]] = None
+
+
+class RoadStateBucket(BaseModel):
+    bucket: datetime
+    road_state: str
+    count: int
+    mean_x: Optional[float]
+    mean_y: Optional[float]
+    mean_z: Optional[float]
+    min_z: Optional[float]
+    max_z: Optional[float]
+
+
+class RoadQualityCell(BaseModel):
+    cell_lat: int
+    cell_lon: int
+    min_latitude: float
+    min_longitude: float
+    max_latitude: float
+    max_longitude: float
+    total: int
+    road_states: Dict[str, int]
+    mean_z_deviation: float
+
+
+class RoadQuality(BaseModel):
+    # Edge length in degrees of the returned cells, a multiple of GRID_CELL_SIZE for large areas
+    cell_size: float
+    cells: List[RoadQualityCell]
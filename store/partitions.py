@@ -0,0 +1,116 @@
+import logging
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from config import AGGREGATE_Z_BASELINE
+
+# Daily partitions are named <table>_pYYYYMMDD and cover [day, day + 1)
+PARTITION_SUFFIX_FORMAT = "%Y%m%d"
+
+
+def partition_name(table_name: str, day: datetime) -> str:
+    return f"{table_name}_p{day.strftime(PARTITION_SUFFIX_FORMAT)}"
+
+
+def partition_day(table_name: str, name: str) -> Optional[datetime]:
+    """Day covered by a partition created by PartitionManager, None for any other child table."""
+    prefix = f"{table_name}_p"
+    if not name.startswith(prefix):
+        return None
+    try:
+        return datetime.strptime(name[len(prefix):], PARTITION_SUFFIX_FORMAT)
+    except ValueError:
+        return None
+
+
+class PartitionManager:
+    """
+    Maintains the daily range partitions of a table partitioned by timestamp.
+    Partitions are created premake_days ahead of time; rows outside every
+    partition land in the default partition. With retention_days set,
+    partitions whose whole day is older than that are dropped instead of
+    deleting their rows, after their rows were subtracted from the cell
+    aggregates.
+    """
+
+    def __init__(self, engine: AsyncEngine, table_name: str, premake_days: int, retention_days: int = 0,
+                 aggregates_table_name: Optional[str] = None):
+        self.engine = engine
+        self.table_name = table_name
+        self.premake_days = premake_days
+        self.retention_days = retention_days
+        self.aggregates_table_name = aggregates_table_name
+
+    async def partitions(self, conn: AsyncConnection) -> List[str]:
+        result = await conn.execute(text(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class parent ON pg_inherits.inhparent = parent.oid "
+            "JOIN pg_class child ON pg_inherits.inhrelid = child.oid "
+            "WHERE parent.relname = :table_name ORDER BY child.relname"
+        ), {"table_name": self.table_name})
+        return [row[0] for row in result]
+
+    async def ensure_partitions(self, now: datetime) -> List[str]:
+        """
+        Create the partitions of today and the next premake_days days.
+        Returns:
+            List[str]: Names of the partitions that were created.
+        """
+        today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        created = []
+        async with self.engine.connect() as conn:
+            existing = set(await self.partitions(conn))
+        for offset in range(self.premake_days + 1):
+            day = today + timedelta(days=offset)
+            name = partition_name(self.table_name, day)
+            if name in existing:
+                continue
+            try:
+                async with self.engine.begin() as conn:
+                    await conn.execute(text(
+                        f'CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF "{self.table_name}" '
+                        f"FOR VALUES FROM ('{day.isoformat()}') TO ('{(day + timedelta(days=1)).isoformat()}')"
+                    ))
+                created.append(name)
+            except DBAPIError as e:
+                # Typically rows for that day already sit in the default partition
+                logging.error(f"Could not create partition {name}: {e.orig}")
+        return created
+
+    async def drop_expired(self, now: datetime) -> List[str]:
+        """
+        Drop the partitions lying entirely before now - retention_days.
+        Returns:
+            List[str]: Names of the dropped partitions.
+        """
+        if self.retention_days <= 0:
+            return []
+        cutoff = now - timedelta(days=self.retention_days)
+        async with self.engine.connect() as conn:
+            names = await self.partitions(conn)
+        dropped = []
+        for name in names:
+            day = partition_day(self.table_name, name)
+            if day is None or day + timedelta(days=1) > cutoff:
+                continue
+            async with self.engine.begin() as conn:
+                if self.aggregates_table_name:
+                    await self._subtract_aggregates(conn, name)
+                await conn.execute(text(f'DROP TABLE "{name}"'))
+            dropped.append(name)
+        return dropped
+
+    async def _subtract_aggregates(self, conn: AsyncConnection, name: str):
+        await conn.execute(text(
+            f'INSERT INTO "{self.aggregates_table_name}" (cell_lat, cell_lon, road_state, count, z_deviation_sum) '
+            f"SELECT cell_lat, cell_lon, road_state, -count(*), -coalesce(sum(abs(z - :baseline)), 0) "
+            f'FROM "{name}" WHERE cell_lat IS NOT NULL AND cell_lon IS NOT NULL '
+            f"GROUP BY cell_lat, cell_lon, road_state ORDER BY cell_lat, cell_lon, road_state "
+            f"ON CONFLICT (cell_lat, cell_lon, road_state) DO UPDATE SET "
+            f"count = {self.aggregates_table_name}.count + excluded.count, "
+            f"z_deviation_sum = {self.aggregates_table_name}.z_deviation_sum + excluded.z_deviation_sum"
+        ), {"baseline": AGGREGATE_Z_BASELINE})
@@ -0,0 +1,158 @@
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+from sqlalchemy import Select, Table, and_, func, select, text, union_all
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+ROLLUP_INTERVALS = {"hour": timedelta(hours=1), "day": timedelta(days=1)}
+
+
+def truncate(value: datetime, interval: str) -> datetime:
+    value = value.replace(minute=0, second=0, microsecond=0)
+    return value.replace(hour=0) if interval == "day" else value
+
+
+class RollupManager:
+    """
+    Keeps hourly and daily per road_state rollups of processed_agent_data.
+    Each refresh recomputes the complete buckets since the last refresh,
+    going lookback further back to pick up late rows, and moves the
+    rollup's watermark forward. Queries read the rollups up to the watermark
+    and aggregate only the raw rows after it, so coarse time ranges never
+    scan raw data and keep working after retention dropped it. With
+    retention set, buckets whose raw rows it may have dropped are never
+    recomputed.
+    """
+
+    def __init__(self, engine: AsyncEngine, source: Table, rollups: Dict[str, Table], watermarks: Table,
+                 lookback: timedelta, retention: Optional[timedelta] = None):
+        self.engine = engine
+        self.source = source
+        self.rollups = rollups
+        self.watermarks = watermarks
+        self.lookback = lookback
+        self.retention = retention
+
+    def _aggregate(self, interval: str, start: Optional[datetime], end: datetime, road_state=None) -> Select:
+        source = self.source
+        bucket = func.date_trunc(interval, source.c.timestamp).label("bucket")
+        conditions = [source.c.timestamp < end]
+        if start is not None:
+            conditions.append(source.c.timestamp >= start)
+        if road_state:
+            conditions.append(source.c.road_state.in_(road_state))
+        return select(
+            bucket,
+            source.c.road_state,
+            func.count().label("count"),
+            func.sum(source.c.x).label("sum_x"),
+            func.sum(source.c.y).label("sum_y"),
+            func.sum(source.c.z).label("sum_z"),
+            func.min(source.c.z).label("min_z"),
+            func.max(source.c.z).label("max_z"),
+        ).where(and_(*conditions)).group_by(bucket, source.c.road_state)
+
+    async def watermark(self, conn: AsyncConnection, interval: str, lock: bool = False) -> Optional[datetime]:
+        query = select(self.watermarks.c.until).where(self.watermarks.c.name == interval)
+        # Locking the watermark row serializes refresh and rebuild of the same rollup
+        return await conn.scalar(query.with_for_update() if lock else query)
+
+    async def _recompute(self, conn: AsyncConnection, interval: str, start: Optional[datetime], end: datetime):
+        table = self.rollups[interval]
+        deleted = table.delete().where(table.c.bucket < end)
+        if start is not None:
+            deleted = deleted.where(table.c.bucket >= start)
+        await conn.execute(deleted)
+        columns = ["bucket", "road_state", "count", "sum_x", "sum_y", "sum_z", "min_z", "max_z"]
+        await conn.execute(table.insert().from_select(columns, self._aggregate(interval, start, end)))
+
+    async def refresh(self, now: datetime) -> Dict[str, datetime]:
+        """
+        Bring every rollup up to the last complete bucket before now.
+        Returns:
+            Dict[str, datetime]: The new watermark of every interval.
+        """
+        watermarks = {}
+        for interval in self.rollups:
+            end = truncate(now, interval)
+            async with self.engine.begin() as conn:
+                watermark = await self.watermark(conn, interval, lock=True)
+                # Start where the previous refresh stopped, or from scratch on the first one
+                start = truncate(min(watermark, now - self.lookback), interval) if watermark else None
+                await self._recompute(conn, interval, start, end)
+                statement = insert(self.watermarks).values(name=interval, until=end)
+                await conn.execute(statement.on_conflict_do_update(
+                    index_elements=["name"], set_={"until": statement.excluded.until}
+                ))
+            watermarks[interval] = end
+        return watermarks
+
+    async def rebuild(self, conn: AsyncConnection, first: datetime, last: datetime):
+        """
+        Recompute the rolled up buckets containing [first, last] after rows there were
+        changed, within the caller's transaction. Buckets after the watermark are read
+        from raw rows anyway and are left alone, and so are the buckets before the
+        retention horizon, whose rollups may be all that is left of their rows.
+        Parameters:
+            conn (AsyncConnection): Connection of the transaction that changed the rows.
+            first (datetime): Timestamp of the earliest changed row, naive UTC.
+            last (datetime): Timestamp of the latest changed row, naive UTC.
+        """
+        if self.retention:
+            # Partitions are dropped a whole day at a time, any day from this one on still has all its rows
+            horizon = truncate(datetime.now(timezone.utc).replace(tzinfo=None) - self.retention, "day")
+            if last < horizon:
+                return
+            first = max(first, horizon)
+        for interval in self.rollups:
+            # Rows at or after the watermark are read raw, and the next refresh goes lookback back should it move
+            # the watermark past them meanwhile; checking without the lock keeps on-time writes from serializing
+            watermark = await self.watermark(conn, interval)
+            if watermark is None or truncate(first, interval) >= watermark:
+                continue
+            watermark = await self.watermark(conn, interval, lock=True)
+            start = truncate(first, interval)
+            end = min(truncate(last, interval) + ROLLUP_INTERVALS[interval], watermark)
+            if start < end:
+                await self._recompute(conn, interval, start, end)
+
+    async def series(self, interval: str, start: datetime, end: datetime, road_state=None) -> List[dict]:
+        """
+        Per bucket and road_state statistics over [start, end), widened to whole buckets.
+        Parameters:
+            interval (str): "hour" or "day".
+            start (datetime): Start of the range, naive UTC.
+            end (datetime): End of the range, naive UTC.
+            road_state (Optional[List[str]]): Only include these road states.
+        """
+        table = self.rollups[interval]
+        start = truncate(start, interval)
+        if truncate(end, interval) != end:
+            end = truncate(end, interval) + ROLLUP_INTERVALS[interval]
+        async with self.engine.connect() as conn:
+            watermark = await self.watermark(conn, interval) or start
+            parts = []
+            if watermark > start:
+                conditions = [table.c.bucket >= start, table.c.bucket < min(end, watermark)]
+                if road_state:
+                    conditions.append(table.c.road_state.in_(road_state))
+                parts.append(select(
+                    table.c.bucket, table.c.road_state, table.c.count, table.c.sum_x, table.c.sum_y,
+                    table.c.sum_z, table.c.min_z, table.c.max_z,
+                ).where(and_(*conditions)))
+            if end > watermark:
+                parts.append(self._aggregate(interval, max(start, watermark), end, road_state))
+            query = union_all(*parts) if len(parts) > 1 else parts[0]
+            result = await conn.execute(query.order_by(text("bucket"), text("road_state")))
+            rows = result.fetchall()
+        return [{
+            "bucket": row.bucket,
+            "road_state": row.road_state,
+            "count": row.count,
+            "mean_x": row.sum_x / row.count if row.count else None,
+            "mean_y": row.sum_y / row.count if row.count else None,
+            "mean_z": row.sum_z / row.count if row.count else None,
+            "min_z": row.min_z,
+            "max_z": row.max_z,
+        } for row in rows]
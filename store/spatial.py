@@ -0,0 +1,168 @@
+import math
+from collections import defaultdict
+from typing import Dict, Iterable, List, Tuple
+
+from sqlalchemy import BigInteger, Integer, Select, Table, and_, cast, func, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from config import GRID_CELL_SIZE, AGGREGATE_Z_BASELINE
+
+
+def cell_of(latitude: float, longitude: float) -> Tuple[int, int]:
+    """
+    Grid cell of a GPS position: cells are GRID_CELL_SIZE degrees square,
+    numbered by floor(coordinate / GRID_CELL_SIZE) on each axis.
+    """
+    return math.floor(latitude / GRID_CELL_SIZE), math.floor(longitude / GRID_CELL_SIZE)
+
+
+def tile_bounds(zoom: int, x: int, y: int) -> Tuple[float, float, float, float]:
+    """
+    Bounding box of a Web Mercator (slippy map) tile.
+    Returns:
+        Tuple[float, float, float, float]: min_latitude, min_longitude, max_latitude, max_longitude.
+    Raises:
+        ValueError: If the tile does not exist at that zoom level.
+    """
+    tiles = 2 ** zoom
+    if not (0 <= x < tiles and 0 <= y < tiles):
+        raise ValueError(f"Tile {x}/{y} does not exist at zoom {zoom}")
+
+    def latitude(row):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / tiles))))
+
+    return latitude(y + 1), x / tiles * 360.0 - 180.0, latitude(y), (x + 1) / tiles * 360.0 - 180.0
+
+
+class CellAggregates:
+    """
+    Per grid cell and road_state counts and summed |z| deviation, kept up to date
+    in the same transaction as every change to processed_agent_data, so road
+    quality queries read a few aggregate rows instead of scanning raw data.
+    """
+
+    def __init__(self, table: Table):
+        self.table = table
+
+    def summarize(self, rows: Iterable[dict], sign: int = 1) -> List[dict]:
+        """
+        Fold rows into aggregate deltas, sign -1 subtracts them.
+        Deltas are sorted by key, so concurrent upserts lock rows in the same order.
+        """
+        deltas: Dict[tuple, List[float]] = defaultdict(lambda: [0, 0.0])
+        for row in rows:
+            if row["cell_lat"] is None or row["cell_lon"] is None:
+                continue
+            delta = deltas[(row["cell_lat"], row["cell_lon"], row["road_state"])]
+            delta[0] += sign
+            delta[1] += sign * abs((row["z"] or 0.0) - AGGREGATE_Z_BASELINE)
+        return [
+            {"cell_lat": cell_lat, "cell_lon": cell_lon, "road_state": road_state,
+             "count": count, "z_deviation_sum": deviation}
+            for (cell_lat, cell_lon, road_state), (count, deviation) in sorted(deltas.items())
+        ]
+
+    async def apply(self, conn: AsyncConnection, rows: Iterable[dict], sign: int = 1):
+        """
+        Add (sign 1) or remove (sign -1) rows from the aggregates within the caller's transaction.
+        Parameters:
+            conn (AsyncConnection): Connection of the transaction that changed the rows.
+            rows (Iterable[dict]): Rows in the processed_agent_data column layout.
+            sign (int): 1 for inserted rows, -1 for deleted ones.
+        """
+        await self.apply_deltas(conn, self.summarize(rows, sign))
+
+    async def replace(self, conn: AsyncConnection, removed: Iterable[dict], added: Iterable[dict]):
+        """
+        Move rows between aggregates within the caller's transaction: subtract the
+        removed versions and add the added ones in a single sorted upsert.
+        """
+        merged: Dict[tuple, dict] = {}
+        for delta in self.summarize(removed, sign=-1) + self.summarize(added):
+            key = (delta["cell_lat"], delta["cell_lon"], delta["road_state"])
+            if key in merged:
+                merged[key]["count"] += delta["count"]
+                merged[key]["z_deviation_sum"] += delta["z_deviation_sum"]
+            else:
+                merged[key] = delta
+        # Rows that did not change cancel out
+        deltas = [merged[key] for key in sorted(merged) if merged[key]["count"] or merged[key]["z_deviation_sum"]]
+        await self.apply_deltas(conn, deltas)
+
+    async def apply_deltas(self, conn: AsyncConnection, deltas: List[dict]):
+        """
+        Add precomputed deltas, in the layout and order summarize produces, within the caller's transaction.
+        """
+        if not deltas:
+            return
+        statement = insert(self.table)
+        await conn.execute(statement.on_conflict_do_update(
+            index_elements=["cell_lat", "cell_lon", "road_state"],
+            set_={
+                "count": self.table.c.count + statement.excluded.count,
+                "z_deviation_sum": self.table.c.z_deviation_sum + statement.excluded.z_deviation_sum,
+            },
+        ), deltas)
+
+    def bbox_query(self, min_latitude: float, min_longitude: float, max_latitude: float, max_longitude: float,
+                   factor: int = 1) -> Select:
+        """
+        Aggregates of the cells overlapping a bounding box, per road_state, merged
+        into blocks of factor x factor cells.
+        """
+        table = self.table
+        min_cell_lat, min_cell_lon = cell_of(min_latitude, min_longitude)
+        max_cell_lat, max_cell_lon = cell_of(max_latitude, max_longitude)
+        if factor > 1:
+            block_lat = cast(func.floor(table.c.cell_lat / float(factor)), Integer)
+            block_lon = cast(func.floor(table.c.cell_lon / float(factor)), Integer)
+        else:
+            block_lat, block_lon = table.c.cell_lat, table.c.cell_lon
+        block_lat, block_lon = block_lat.label("block_lat"), block_lon.label("block_lon")
+        return select(
+            block_lat,
+            block_lon,
+            table.c.road_state,
+            # sum() of a bigint is numeric in Postgres
+            cast(func.sum(table.c.count), BigInteger).label("count"),
+            func.sum(table.c.z_deviation_sum).label("z_deviation_sum"),
+        ).where(and_(
+            table.c.cell_lat.between(min_cell_lat, max_cell_lat),
+            table.c.cell_lon.between(min_cell_lon, max_cell_lon),
+            table.c.count > 0,
+        )).group_by(block_lat, block_lon, table.c.road_state).order_by(block_lat, block_lon)
+
+
+def collect_cells(rows, cell_size: float) -> List[dict]:
+    """Merge per road_state rows of bbox_query into one summary per block."""
+    cells: Dict[tuple, dict] = {}
+    for row in rows:
+        cell = cells.get((row.block_lat, row.block_lon))
+        if cell is None:
+            cell = cells[(row.block_lat, row.block_lon)] = {
+                "cell_lat": row.block_lat,
+                "cell_lon": row.block_lon,
+                "min_latitude": row.block_lat * cell_size,
+                "min_longitude": row.block_lon * cell_size,
+                "max_latitude": (row.block_lat + 1) * cell_size,
+                "max_longitude": (row.block_lon + 1) * cell_size,
+                "total": 0,
+                "road_states": {},
+                "z_deviation_sum": 0.0,
+            }
+        cell["total"] += row.count
+        cell["road_states"][row.road_state] = row.count
+        cell["z_deviation_sum"] += row.z_deviation_sum
+    for cell in cells.values():
+        cell["mean_z_deviation"] = cell.pop("z_deviation_sum") / cell["total"] if cell["total"] else 0.0
+    return list(cells.values())
+
+
+def coarsening_factor(min_latitude: float, min_longitude: float, max_latitude: float, max_longitude: float,
+                      max_cells: int) -> int:
+    """Smallest block size in cells that keeps a bounding box within max_cells blocks."""
+    min_cell_lat, min_cell_lon = cell_of(min_latitude, min_longitude)
+    max_cell_lat, max_cell_lon = cell_of(max_latitude, max_longitude)
+    cells = (max_cell_lat - min_cell_lat + 1) * (max_cell_lon - min_cell_lon + 1)
+    return max(1, math.ceil(math.sqrt(cells / max_cells)))
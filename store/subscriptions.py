@@ -0,0 +1,85 @@
+import math
+from typing import Dict, Optional, Set, Tuple
+
+from pydantic import BaseModel, Field, model_validator
+
+
+class SubscriptionRequest(BaseModel):
+    """
+    Message a /ws/ client sends to narrow down what it receives.
+    bbox is (min_latitude, min_longitude, max_latitude, max_longitude).
+    max_rate caps the number of messages per second; records arriving in
+    between are coalesced into the next message.
+    """
+    bbox: Optional[Tuple[float, float, float, float]] = None
+    road_state: Optional[Set[str]] = None
+    max_rate: Optional[float] = Field(None, gt=0)
+
+    @model_validator(mode="after")
+    def check_bbox(self):
+        if self.bbox is not None:
+            min_latitude, min_longitude, max_latitude, max_longitude = self.bbox
+            if min_latitude > max_latitude or min_longitude > max_longitude:
+                raise ValueError("bbox must be (min_latitude, min_longitude, max_latitude, max_longitude)")
+        return self
+
+    def matches(self, road_state: str, latitude: float, longitude: float) -> bool:
+        if self.road_state is not None and road_state not in self.road_state:
+            return False
+        if self.bbox is not None:
+            min_latitude, min_longitude, max_latitude, max_longitude = self.bbox
+            return min_latitude <= latitude <= max_latitude and min_longitude <= longitude <= max_longitude
+        return True
+
+
+class SubscriptionIndex:
+    """
+    Uniform grid over (latitude, longitude) mapping cells to the subscribers
+    whose bbox overlaps them. Subscribers without a bbox, or with one that
+    spans more than max_cells cells, are kept aside and checked for every record.
+    """
+
+    def __init__(self, cell_size: float, max_cells: int):
+        self.cell_size = cell_size
+        self.max_cells = max_cells
+        self.cells: Dict[Tuple[int, int], Set[object]] = {}
+        self.unbounded: Set[object] = set()
+        self._registered: Dict[object, list] = {}
+
+    def cell_of(self, latitude: float, longitude: float) -> Tuple[int, int]:
+        return math.floor(latitude / self.cell_size), math.floor(longitude / self.cell_size)
+
+    def add(self, key, request: SubscriptionRequest):
+        self.remove(key)
+        if request.bbox is None:
+            self._register_unbounded(key)
+            return
+        min_latitude, min_longitude, max_latitude, max_longitude = request.bbox
+        low = self.cell_of(min_latitude, min_longitude)
+        high = self.cell_of(max_latitude, max_longitude)
+        if (high[0] - low[0] + 1) * (high[1] - low[1] + 1) > self.max_cells:
+            self._register_unbounded(key)
+            return
+        cells = [(i, j) for i in range(low[0], high[0] + 1) for j in range(low[1], high[1] + 1)]
+        for cell in cells:
+            self.cells.setdefault(cell, set()).add(key)
+        self._registered[key] = cells
+
+    def _register_unbounded(self, key):
+        self.unbounded.add(key)
+        self._registered[key] = []
+
+    def remove(self, key):
+        cells = self._registered.pop(key, None)
+        if cells is None:
+            return
+        self.unbounded.discard(key)
+        for cell in cells:
+            members = self.cells[cell]
+            members.discard(key)
+            if not members:
+                del self.cells[cell]
+
+    def candidates(self, latitude: float, longitude: float) -> Set[object]:
+        members = self.cells.get(self.cell_of(latitude, longitude))
+        return self.unbounded | members if members else self.unbounded
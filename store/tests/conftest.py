@@ -0,0 +1,62 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+# The store's modules are imported as top-level modules, as main.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import text  # noqa: E402
+from sqlalchemy.exc import DBAPIError  # noqa: E402
+from sqlalchemy.ext.asyncio import create_async_engine  # noqa: E402
+from sqlalchemy.pool import NullPool  # noqa: E402
+
+from database import DATABASE_URL, metadata  # noqa: E402
+
+# Schema the database tests create the store's tables in, dropped again after every test
+TEST_SCHEMA = "store_tests"
+
+
+@pytest.fixture
+def database():
+    """
+    Async engine whose connections see empty, unpartitioned copies of the store's tables.
+    Tests using it are skipped when the Postgres of config.py cannot be reached.
+    Every asyncio.run opens its own connections, so the engine does not pool them.
+    """
+    engine = create_async_engine(DATABASE_URL, poolclass=NullPool,
+                                 connect_args={"server_settings": {"search_path": TEST_SCHEMA}})
+
+    async def reset(create: bool):
+        async with engine.begin() as conn:
+            await conn.execute(text(f"DROP SCHEMA IF EXISTS {TEST_SCHEMA} CASCADE"))
+            if create:
+                await conn.execute(text(f"CREATE SCHEMA {TEST_SCHEMA}"))
+                await conn.run_sync(metadata.create_all)
+
+    try:
+        asyncio.run(reset(True))
+    except (OSError, DBAPIError) as e:
+        pytest.skip(f"Postgres unavailable: {e!r}")
+    yield engine
+    asyncio.run(reset(False))
+
+
+@pytest.fixture
+def client(database, monkeypatch):
+    """
+    TestClient for main.app on the database fixture's tables, with an empty in-process cache.
+    The lifespan is not run, so there is no maintenance task, fan-out relay or shared cache tier.
+    """
+    from fastapi.testclient import TestClient
+
+    import main
+    from cache import ReadCache
+
+    for value in list(vars(main).values()):
+        if getattr(value, "engine", None) is main.engine:
+            monkeypatch.setattr(value, "engine", database)
+    monkeypatch.setattr(main, "engine", database)
+    monkeypatch.setattr(main, "cache", ReadCache(max_entries=1000, ttl=60.0))
+    return TestClient(main.app)
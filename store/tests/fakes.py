@@ -0,0 +1,29 @@
+import asyncio
+import json
+
+
+class FakeWebSocket:
+    """Records what is sent to it; while blocked, sends wait like those to a client that stopped reading."""
+
+    def __init__(self, blocked: bool = False, fail: bool = False):
+        self.messages = []
+        self.closed_with = None
+        self.fail = fail
+        self.unblocked = asyncio.Event()
+        if not blocked:
+            self.unblocked.set()
+
+    async def send_text(self, text: str):
+        await self.unblocked.wait()
+        if self.fail:
+            raise ConnectionError("client went away")
+        self.messages.append(json.loads(text))
+
+    async def close(self, code: int):
+        self.closed_with = code
+
+
+async def settle():
+    # Let the send loops and close tasks run
+    for _ in range(5):
+        await asyncio.sleep(0)
@@ -0,0 +1,17 @@
+"""Readings as the hub sends them, for the tests to write."""
+
+from datetime import datetime, timedelta
+
+START = datetime(2024, 5, 1, 12, 0, 0)
+
+
+def document(sequence: int, road_state: str = "good", user_id: int = 1) -> dict:
+    return {
+        "road_state": road_state,
+        "agent_data": {
+            "user_id": user_id,
+            "accelerometer": {"x": sequence, "y": 2.0, "z": 16384.0},
+            "gps": {"latitude": 50.45, "longitude": 30.52 + sequence * 1e-4},
+            "timestamp": (START + timedelta(seconds=sequence)).isoformat(),
+        },
+    }
@@ -0,0 +1,64 @@
+import asyncio
+from datetime import timedelta
+
+import main
+from readings import START, document
+
+
+def stored_ids(client) -> list:
+    return [row["id"] for row in client.get("/processed_agent_data/", params={"limit": 1000}).json()]
+
+
+def test_create_and_read_back(client):
+    response = client.post("/processed_agent_data/", json=[document(0), document(1)])
+    assert response.status_code == 200
+    assert response.json()["inserted"] == 2
+    first = stored_ids(client)[0]
+    record = client.get(f"/processed_agent_data/{first}").json()
+    assert record["road_state"] == "good"
+    assert record["x"] == 0
+    assert record["timestamp"] == START.isoformat()
+
+
+def test_create_skips_readings_already_stored(client):
+    client.post("/processed_agent_data/", json=[document(0)])
+    response = client.post("/processed_agent_data/", json=[document(0), document(1)])
+    assert response.status_code == 200
+    assert response.json()["inserted"] == 1 and response.json()["duplicates"] == 1
+    assert len(stored_ids(client)) == 2
+
+
+def test_read_missing_record(client):
+    assert client.get("/processed_agent_data/12345").status_code == 404
+
+
+def test_update_replaces_record(client):
+    client.post("/processed_agent_data/", json=[document(0)])
+    record_id = stored_ids(client)[0]
+    # Read once, so the update has a cached copy to invalidate
+    client.get(f"/processed_agent_data/{record_id}")
+    response = client.put(f"/processed_agent_data/{record_id}", json=document(0, road_state="bad"))
+    assert response.status_code == 200
+    assert client.get(f"/processed_agent_data/{record_id}").json()["road_state"] == "bad"
+    assert client.put("/processed_agent_data/12345", json=document(0)).status_code == 404
+
+
+def test_delete_returns_the_deleted_record(client):
+    client.post("/processed_agent_data/", json=[document(0)])
+    record_id = stored_ids(client)[0]
+    client.get(f"/processed_agent_data/{record_id}")
+    response = client.delete(f"/processed_agent_data/{record_id}")
+    assert response.status_code == 200 and response.json()["id"] == record_id
+    assert client.get(f"/processed_agent_data/{record_id}").status_code == 404
+    assert client.delete(f"/processed_agent_data/{record_id}").status_code == 404
+
+
+def test_single_record_changes_reach_the_rollups(client):
+    client.post("/processed_agent_data/", json=[document(0), document(1)])
+    asyncio.run(main.rollups.refresh(START + timedelta(hours=1)))
+    first, second = stored_ids(client)
+    client.put(f"/processed_agent_data/{first}", json=document(0, road_state="bad"))
+    client.delete(f"/processed_agent_data/{second}")
+    params = {"start": START.isoformat(), "end": (START + timedelta(hours=1)).isoformat()}
+    series = client.get("/analytics/road_states/", params=params).json()
+    assert [(bucket["road_state"], bucket["count"]) for bucket in series] == [("bad", 1)]
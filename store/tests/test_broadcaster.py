@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+
+from broadcaster import DISCONNECT, DROP_OLDEST, SLOW_CONSUMER_CLOSE_CODE, Broadcaster
+from fakes import FakeWebSocket, settle
+from models import ProcessedAgentData
+from readings import document
+from subscriptions import SubscriptionIndex
+
+
+def batch(*sequences) -> list:
+    return [ProcessedAgentData.model_validate(document(sequence)) for sequence in sequences]
+
+
+def broadcaster(queue_size: int = 10, policy: str = DROP_OLDEST) -> Broadcaster:
+    return Broadcaster(queue_size, policy, SubscriptionIndex(cell_size=0.01, max_cells=100))
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        broadcaster(policy="block")
+
+
+def test_every_subscriber_receives_every_batch():
+    async def run():
+        fan_out = broadcaster()
+        clients = [FakeWebSocket(), FakeWebSocket()]
+        for client in clients:
+            fan_out.subscribe(client)
+        fan_out.publish(batch(0, 1))
+        fan_out.publish(batch(2))
+        await settle()
+        fan_out.close()
+        return clients
+
+    for client in asyncio.run(run()):
+        assert [[record["agent_data"]["accelerometer"]["x"] for record in message] for message in client.messages] \
+            == [[0, 1], [2]]
+
+
+def test_slow_client_drops_its_oldest_batches_only():
+    async def run():
+        fan_out = broadcaster(queue_size=2)
+        slow, fast = FakeWebSocket(blocked=True), FakeWebSocket()
+        fan_out.subscribe(slow)
+        fan_out.subscribe(fast)
+        await settle()
+        for sequence in range(5):
+            fan_out.publish(batch(sequence))
+            await settle()
+        stats = fan_out.stats()
+        slow.unblocked.set()
+        await settle()
+        fan_out.close()
+        return slow, fast, stats
+
+    slow, fast, stats = asyncio.run(run())
+    assert len(fast.messages) == 5
+    # The first batch was already being sent when the client stalled, the queue kept the two newest
+    assert [message[0]["agent_data"]["accelerometer"]["x"] for message in slow.messages] == [0, 3, 4]
+    assert stats["dropped"] == 2 and stats["max_queue_depth"] == 2
+
+
+def test_slow_client_is_disconnected_under_disconnect_policy():
+    async def run():
+        fan_out = broadcaster(queue_size=1, policy=DISCONNECT)
+        slow, fast = FakeWebSocket(blocked=True), FakeWebSocket()
+        fan_out.subscribe(slow)
+        fan_out.subscribe(fast)
+        await settle()
+        for sequence in range(3):
+            fan_out.publish(batch(sequence))
+            await settle()
+        stats = fan_out.stats()
+        fan_out.close()
+        return slow, fast, stats
+
+    slow, fast, stats = asyncio.run(run())
+    assert slow.closed_with == SLOW_CONSUMER_CLOSE_CODE
+    assert len(fast.messages) == 3
+    assert stats["subscribers"] == 1 and stats["disconnected"] == 1
+
+
+def test_failed_send_drops_the_subscriber():
+    async def run():
+        fan_out = broadcaster()
+        fan_out.subscribe(FakeWebSocket(fail=True))
+        fan_out.publish(batch(0))
+        await settle()
+        return fan_out.stats()
+
+    assert asyncio.run(run())["subscribers"] == 0
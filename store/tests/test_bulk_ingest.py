@@ -0,0 +1,101 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import func, select
+
+from bulk_ingest import BulkIngestEngine
+from database import processed_agent_data, road_cell_aggregates
+from models import ProcessedAgentData
+from spatial import CellAggregates
+
+START = datetime(2024, 5, 1, 12, 0, 0)
+
+
+def reading(sequence: int, user_id: int = 1, road_state: str = "good") -> dict:
+    return ProcessedAgentData.model_validate({
+        "road_state": road_state,
+        "agent_data": {
+            "user_id": user_id,
+            "accelerometer": {"x": sequence, "y": 2.0, "z": 16384.0 + sequence},
+            "gps": {"latitude": 50.45 + sequence * 1e-4, "longitude": 30.52},
+            "timestamp": (START + timedelta(seconds=sequence)).isoformat(),
+        },
+    }).to_row()
+
+
+def ingest(database, rows, copy_threshold=500):
+    async def run():
+        ingest_engine = BulkIngestEngine(database, processed_agent_data, copy_threshold,
+                                         aggregates=CellAggregates(road_cell_aggregates))
+        result = await ingest_engine.ingest(rows)
+        async with database.connect() as conn:
+            stored = (await conn.execute(select(processed_agent_data).order_by(processed_agent_data.c.timestamp))).all()
+            aggregated = await conn.scalar(select(func.sum(road_cell_aggregates.c.count)))
+        return result, stored, aggregated
+
+    return asyncio.run(run())
+
+
+def test_choose_strategy_switches_to_copy_at_threshold():
+    ingest_engine = BulkIngestEngine(None, processed_agent_data, copy_threshold=3)
+    assert ingest_engine.choose_strategy(2) == "executemany"
+    assert ingest_engine.choose_strategy(3) == "copy"
+
+
+def test_empty_batch_touches_nothing():
+    result = asyncio.run(BulkIngestEngine(None, processed_agent_data, copy_threshold=3).ingest([]))
+    assert (result.rows, result.duplicates, result.written) == (0, 0, [])
+
+
+def test_executemany_inserts_every_row(database):
+    rows = [reading(sequence) for sequence in range(5)]
+    result, stored, aggregated = ingest(database, rows)
+    assert result.strategy == "executemany"
+    assert result.rows == 5 and result.duplicates == 0
+    assert [row.x for row in stored] == [0, 1, 2, 3, 4]
+    assert aggregated == 5
+
+
+def test_copy_inserts_every_row(database):
+    rows = [reading(sequence) for sequence in range(20)]
+    result, stored, aggregated = ingest(database, rows, copy_threshold=10)
+    assert result.strategy == "copy"
+    assert result.rows == 20
+    assert [row.timestamp for row in stored] == [row["timestamp"] for row in rows]
+    assert aggregated == 20
+
+
+def test_redelivered_batch_is_written_once(database):
+    for copy_threshold in (500, 1):
+        rows = [reading(sequence) for sequence in range(4)]
+        ingest(database, rows, copy_threshold)
+        result, stored, aggregated = ingest(database, rows, copy_threshold)
+        assert result.rows == 0 and result.duplicates == 4 and result.written == []
+        assert len(stored) == 4
+        assert aggregated == 4
+
+
+def test_first_copy_within_a_batch_wins(database):
+    first, second = reading(0, road_state="good"), reading(0, road_state="bad")
+    result, stored, _ = ingest(database, [first, second, reading(1)])
+    assert result.rows == 2 and result.duplicates == 1
+    assert result.written[0] is first
+    assert [row.road_state for row in stored] == ["good", "good"]
+
+
+def test_same_timestamp_of_another_vehicle_is_not_a_duplicate(database):
+    result, stored, _ = ingest(database, [reading(0, user_id=1), reading(0, user_id=2)])
+    assert result.rows == 2 and len(stored) == 2
+
+
+@pytest.mark.parametrize("copy_threshold", [500, 1])
+def test_readings_without_a_vehicle_at_the_same_timestamp_are_all_written(database, copy_threshold):
+    rows = [reading(0, user_id=0), reading(0, user_id=0, road_state="bad"), reading(0, user_id=1)]
+    result, stored, _ = ingest(database, rows, copy_threshold)
+    assert result.rows == 3 and result.duplicates == 0
+    assert result.written == rows
+    result, stored, _ = ingest(database, rows, copy_threshold)
+    # Only the reading of a known vehicle is recognised when sent again
+    assert result.rows == 2 and result.duplicates == 1
+    assert len(stored) == 5
@@ -0,0 +1,82 @@
+from collections import Counter
+from datetime import timedelta
+
+import main
+from readings import START, document
+
+
+def listed(client) -> list:
+    return client.get("/processed_agent_data/", params={"limit": 1000}).json()
+
+
+def road_states(client) -> Counter:
+    # Road state counts of the cell aggregates around the readings
+    params = {"min_latitude": 50.44, "min_longitude": 30.51, "max_latitude": 50.46, "max_longitude": 30.53}
+    cells = client.get("/road_quality/", params=params).json()["cells"]
+    return sum((Counter(cell["road_states"]) for cell in cells), Counter())
+
+
+def test_upsert_inserts_updates_and_skips_unchanged(client):
+    assert client.put("/processed_agent_data/", json=[document(0), document(1)]).json() \
+        == {"inserted": 2, "updated": 0, "unchanged": 0}
+    response = client.put("/processed_agent_data/", json=[document(0), document(1, road_state="bad"), document(2)])
+    assert response.json() == {"inserted": 1, "updated": 1, "unchanged": 1}
+    assert [row["road_state"] for row in listed(client)] == ["good", "bad", "good"]
+    assert road_states(client) == {"good": 2, "bad": 1}
+
+
+def test_upsert_keeps_the_last_copy_of_a_reading_in_a_batch(client):
+    client.put("/processed_agent_data/", json=[document(0), document(0, road_state="bad")])
+    assert [row["road_state"] for row in listed(client)] == ["bad"]
+
+
+def test_upsert_matches_readings_of_the_same_vehicle_only(client):
+    client.put("/processed_agent_data/", json=[document(0, user_id=1)])
+    assert client.put("/processed_agent_data/", json=[document(0, user_id=2)]).json()["inserted"] == 1
+
+
+def test_upsert_keeps_readings_without_a_vehicle_apart(client):
+    readings = [document(0), document(0, road_state="bad")]
+    for reading in readings:
+        del reading["agent_data"]["user_id"]
+    assert client.put("/processed_agent_data/", json=readings).json()["inserted"] == 2
+    assert sorted(row["road_state"] for row in listed(client)) == ["bad", "good"]
+
+
+def test_upsert_sends_only_the_written_readings(client, monkeypatch):
+    sent = []
+
+    async def send(data):
+        sent.extend(item.road_state for item in data)
+
+    monkeypatch.setattr(main, "send_data_to_subscribers", send)
+    client.put("/processed_agent_data/", json=[document(0), document(1)])
+    client.put("/processed_agent_data/", json=[document(0), document(1, road_state="bad"), document(2)])
+    assert sent == ["good", "good", "bad", "good"]
+
+
+def test_relabel_by_filter_and_ids(client):
+    client.post("/processed_agent_data/", json=[document(sequence) for sequence in range(4)])
+    response = client.patch("/processed_agent_data/", json={"road_state": "bad"},
+                            params={"end": (START + timedelta(seconds=2)).isoformat()})
+    assert response.json() == {"updated": 2}
+    last = listed(client)[-1]["id"]
+    assert client.patch("/processed_agent_data/", json={"road_state": "pothole", "ids": [last]}).json() \
+        == {"updated": 1}
+    assert [row["road_state"] for row in listed(client)] == ["bad", "bad", "good", "pothole"]
+    assert road_states(client) == {"bad": 2, "good": 1, "pothole": 1}
+
+
+def test_bulk_delete_by_filter(client):
+    client.post("/processed_agent_data/", json=[document(sequence) for sequence in range(4)])
+    response = client.delete("/processed_agent_data/", params={"start": (START + timedelta(seconds=1)).isoformat()})
+    assert response.json() == {"deleted": 3}
+    assert [row["x"] for row in listed(client)] == [0]
+    assert road_states(client) == {"good": 1}
+
+
+def test_bulk_change_needs_a_filter(client):
+    client.post("/processed_agent_data/", json=[document(0)])
+    assert client.delete("/processed_agent_data/").status_code == 400
+    assert client.patch("/processed_agent_data/", json={"road_state": "bad"}).status_code == 400
+    assert len(listed(client)) == 1
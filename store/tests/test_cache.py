@@ -0,0 +1,222 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from cache import CELL_BLOCK, INVALIDATION_LOG_SIZE, MAX_INDEX_BUCKETS, MISSING, UNBOUNDED, CacheChange, CacheScope, \
+    LRUCache, ReadCache
+from readings import START, document
+from spatial import cell_of
+
+HOUR = timedelta(hours=1)
+
+
+def change(first: datetime, last: datetime = None, cell_lat: int = 100, cell_lon: int = 200, **bounds):
+    return CacheChange(first, last or first, bounds.get("min_cell_lat", cell_lat), bounds.get("max_cell_lat", cell_lat),
+                       bounds.get("min_cell_lon", cell_lon), bounds.get("max_cell_lon", cell_lon))
+
+
+def row(timestamp: datetime, cell_lat: int = 100, cell_lon: int = 200) -> dict:
+    return {"timestamp": timestamp, "cell_lat": cell_lat, "cell_lon": cell_lon}
+
+
+@pytest.mark.parametrize("scope, touched", [
+    (CacheScope(), True),
+    (CacheScope(start=START, end=START + HOUR), True),
+    (CacheScope(start=START + HOUR), False),
+    (CacheScope(end=START), False),
+    (CacheScope(min_cell_lat=100, max_cell_lat=100, min_cell_lon=200, max_cell_lon=200), True),
+    (CacheScope(min_cell_lat=101), False),
+    (CacheScope(max_cell_lat=99), False),
+    (CacheScope(min_cell_lon=201), False),
+    (CacheScope(max_cell_lon=199), False),
+    (CacheScope(start=START, min_cell_lat=101), False),
+])
+def test_scope_touches(scope, touched):
+    assert scope.touches(change(START, START + timedelta(minutes=5))) == touched
+
+
+def test_scope_for_area_leaves_unset_bounds_open():
+    scope = CacheScope.for_area(start=START, min_latitude=50.45, max_longitude=30.52)
+    assert scope == CacheScope(start=START, min_cell_lat=cell_of(50.45, 0.0)[0], max_cell_lon=cell_of(0.0, 30.52)[1])
+
+
+def test_scope_and_change_survive_serialization():
+    scope = CacheScope(start=START, min_cell_lat=1, max_cell_lat=2)
+    assert CacheScope.from_json(scope.to_json()) == scope
+    assert CacheScope.from_json(CacheScope().to_json()) == CacheScope()
+    written = change(START, START + HOUR, min_cell_lat=1, max_cell_lat=3)
+    assert CacheChange.from_json(written.to_json()) == written
+
+
+def test_change_bounds_its_rows():
+    assert CacheChange.from_rows([]) is None
+    assert CacheChange.from_rows([row(START + HOUR, 5, 9), row(START, 7, 8), row(START, None, None)]) \
+        == CacheChange(START, START + HOUR, 5, 7, 8, 9)
+
+
+def test_index_buckets():
+    assert len(CacheScope(start=START, end=START + 2 * HOUR).time_buckets()) == 3
+    assert CacheScope(start=START).time_buckets() == [UNBOUNDED]
+    assert CacheScope(start=START, end=START + HOUR * (MAX_INDEX_BUCKETS + 1)).time_buckets() == [UNBOUNDED]
+    assert CacheScope(min_cell_lat=0, max_cell_lat=CELL_BLOCK, min_cell_lon=0, max_cell_lon=0).cell_buckets() \
+        == ["0:0", "1:0"]
+    # Too wide to look up per bucket
+    assert change(START, START + HOUR * MAX_INDEX_BUCKETS).time_buckets() is None
+    assert change(START, min_cell_lat=0, max_cell_lat=CELL_BLOCK * MAX_INDEX_BUCKETS).cell_buckets() is None
+
+
+def test_lru_evicts_least_recently_used_and_expires():
+    lru = LRUCache(max_entries=2, ttl=60)
+    lru.set("a", 1)
+    lru.set("b", 2)
+    lru.get("a")
+    lru.set("c", 3)
+    assert lru.get("b") is MISSING and lru.get("a") == 1 and lru.evictions == 1
+    expiring = LRUCache(max_entries=2, ttl=0.01)
+    expiring.set("a", None)
+    assert expiring.get("a") is None
+    time.sleep(0.02)
+    assert expiring.get("a") is MISSING and expiring.expirations == 1
+
+
+def test_query_key_ignores_unset_parameters():
+    assert ReadCache.query_key("list", b=1, a=None, c=[1]) == ReadCache.query_key("list", c=[1], b=1)
+
+
+def test_local_invalidation():
+    async def run():
+        cache = ReadCache(max_entries=10, ttl=60)
+        await cache.set(cache.record_key(1), {"id": 1})
+        await cache.set("this hour", [1], CacheScope(start=START, end=START + HOUR))
+        await cache.set("next hour", [2], CacheScope(start=START + HOUR, end=START + 2 * HOUR))
+        await cache.invalidate(record_ids=[1], rows=[row(START + timedelta(minutes=5))])
+        return [await cache.get(key) for key in (cache.record_key(1), "this hour", "next hour")]
+
+    assert asyncio.run(run()) == [MISSING, MISSING, [2]]
+
+
+def test_fill_invalidated_while_querying_is_not_cached():
+    async def run():
+        cache = ReadCache(max_entries=10, ttl=60)
+        scope = CacheScope(start=START, end=START + HOUR)
+        generation = cache.generation
+        # A write lands while the query runs
+        await cache.invalidate(rows=[row(START)])
+        await cache.set("stale", [1], scope, generation)
+        # Writes elsewhere do not spoil a fill
+        generation = cache.generation
+        await cache.invalidate(rows=[row(START + 3 * HOUR)])
+        await cache.set("fresh", [2], scope, generation)
+        return await cache.get("stale"), await cache.get("fresh"), cache.stats()["stale_fills"]
+
+    assert asyncio.run(run()) == (MISSING, [2], 1)
+
+
+def test_fill_older_than_the_invalidation_log_is_not_cached():
+    async def run():
+        cache = ReadCache(max_entries=10, ttl=60)
+        generation = cache.generation
+        for _ in range(INVALIDATION_LOG_SIZE + 1):
+            await cache.invalidate(rows=[row(START + 3 * HOUR)])
+        await cache.set("old", [1], CacheScope(start=START, end=START + HOUR), generation)
+        return await cache.get("old")
+
+    assert asyncio.run(run()) is MISSING
+
+
+@pytest.fixture
+def shared_caches():
+    """Two ReadCaches sharing one in-memory Redis, as two store processes would."""
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fakeredis.FakeServer()
+
+    def connect():
+        return [ReadCache(max_entries=10, ttl=60, redis=fakeredis.FakeAsyncRedis(server=server), redis_ttl=60)
+                for _ in range(2)]
+
+    return connect
+
+
+async def started(caches):
+    for cache in caches:
+        cache.start()
+    # Let both subscribe before anything is published
+    await asyncio.sleep(0.1)
+
+
+async def stopped(caches):
+    await asyncio.sleep(0.1)
+    for cache in caches:
+        await cache.stop()
+
+
+def test_values_are_shared_through_redis(shared_caches):
+    async def run():
+        first, second = shared_caches()
+        await first.set("query", {"rows": [1]}, CacheScope(start=START, end=START + HOUR))
+        value = await second.get("query")
+        return value, second.stats()["redis_hits"]
+
+    assert asyncio.run(run()) == ({"rows": [1]}, 1)
+
+
+def test_writes_invalidate_every_process(shared_caches):
+    async def run():
+        caches = shared_caches()
+        first, second = caches
+        await started(caches)
+        await second.set(second.record_key(1), {"id": 1})
+        await second.set("this hour", [1], CacheScope(start=START, end=START + HOUR, min_cell_lat=100,
+                                                      max_cell_lat=100, min_cell_lon=200, max_cell_lon=200))
+        await second.set("elsewhere", [2], CacheScope(start=START, end=START + HOUR, min_cell_lat=900,
+                                                      max_cell_lat=900, min_cell_lon=200, max_cell_lon=200))
+        await first.invalidate(record_ids=[1], rows=[row(START + timedelta(minutes=5))])
+        await asyncio.sleep(0.1)
+        local = [second.local.get(key) for key in (second.record_key(1), "this hour", "elsewhere")]
+        shared = [await first.get(key) for key in ("this hour", "elsewhere")]
+        await stopped(caches)
+        return local, shared, second.stats()["remote_invalidations"]
+
+    local, shared, remote_invalidations = asyncio.run(run())
+    assert local == [MISSING, MISSING, [2]]
+    assert shared == [MISSING, [2]]
+    assert remote_invalidations == 1
+
+
+def test_wide_changes_check_every_shared_scope(shared_caches):
+    async def run():
+        first, second = shared_caches()
+        await second.set("this hour", [1], CacheScope(start=START, end=START + HOUR))
+        await second.set("weeks ago", [2], CacheScope(start=START - 300 * HOUR, end=START - 299 * HOUR))
+        await second.set("tomorrow", [3], CacheScope(start=START + 24 * HOUR, end=START + 25 * HOUR))
+        await first.invalidate(rows=[row(START - HOUR * 2 * MAX_INDEX_BUCKETS), row(START)])
+        return [await first.get(key) for key in ("this hour", "weeks ago", "tomorrow")]
+
+    assert asyncio.run(run()) == [MISSING, MISSING, [3]]
+
+
+def test_clear_reaches_every_process(shared_caches):
+    async def run():
+        caches = shared_caches()
+        first, second = caches
+        await started(caches)
+        await second.set("query", [1])
+        await first.clear()
+        await asyncio.sleep(0.1)
+        value = second.local.get("query"), await second.get("query")
+        await stopped(caches)
+        return value
+
+    assert asyncio.run(run()) == (MISSING, MISSING)
+
+
+def test_listing_is_served_from_the_cache_until_a_write(client):
+    client.post("/processed_agent_data/", json=[document(0)])
+    assert len(client.get("/processed_agent_data/").json()) == 1
+    client.post("/processed_agent_data/", json=[document(1)])
+    assert len(client.get("/processed_agent_data/").json()) == 2
+    hits = client.get("/cache/stats").json()["hits"]
+    client.get("/processed_agent_data/")
+    assert client.get("/cache/stats").json()["hits"] == hits + 1
@@ -0,0 +1,118 @@
+import io
+from datetime import timedelta
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from columnar import EXPORT_SCHEMA, IMPORT_SCHEMA, _ChunkSink, _prepare
+from readings import START, document
+
+
+def parquet(table: pa.Table) -> bytes:
+    sink = io.BytesIO()
+    pq.write_table(table, sink)
+    return sink.getvalue()
+
+
+def readings(count: int, start: int = 0) -> pa.Table:
+    sequences = range(start, start + count)
+    return pa.table({
+        "user_id": pa.array([2] * count, pa.int32()),
+        "road_state": ["bumpy"] * count,
+        "x": [float(sequence) for sequence in sequences],
+        "y": [2.0] * count,
+        "z": [16384.0] * count,
+        "latitude": [50.45] * count,
+        "longitude": [30.52 + sequence * 1e-4 for sequence in sequences],
+        "timestamp": pa.array([START + timedelta(seconds=sequence) for sequence in sequences], pa.timestamp("us")),
+    }, schema=IMPORT_SCHEMA)
+
+
+def test_chunk_sink_hands_out_what_was_written_since_the_last_take():
+    sink = _ChunkSink()
+    sink.write(b"ab")
+    sink.write(memoryview(b"c"))
+    assert sink.tell() == 3
+    assert sink.take() == b"abc"
+    assert sink.take() == b""
+    sink.write(b"d")
+    assert sink.tell() == 4
+    assert sink.take() == b"d"
+
+
+def test_prepare_defaults_user_id_and_computes_cells():
+    batch = readings(2).drop_columns(["user_id"]).to_batches()[0]
+    table = _prepare(batch)
+    assert table["user_id"].to_pylist() == [0, 0]
+    assert table["cell_lat"].to_pylist()[0] is not None
+
+
+def test_prepare_casts_zoned_timestamps_to_naive_utc():
+    table = readings(1)
+    zoned = table.set_column(
+        table.schema.get_field_index("timestamp"), "timestamp", table["timestamp"].cast(pa.timestamp("us", "UTC"))
+    )
+    prepared = _prepare(zoned.to_batches()[0])
+    assert prepared["timestamp"].to_pylist() == [START]
+
+
+@pytest.mark.parametrize("change", [
+    lambda table: table.drop_columns(["z"]),
+    lambda table: table.set_column(2, "x", pa.array(["a", "b"])),
+    lambda table: table.set_column(2, "x", pa.array([1.0, None])),
+])
+def test_prepare_rejects_files_not_matching_the_schema(change):
+    with pytest.raises(ValueError):
+        _prepare(change(readings(2)).to_batches()[0])
+
+
+@pytest.mark.parametrize("media_format", ["arrow", "parquet"])
+def test_export_holds_every_filtered_row(client, media_format):
+    client.post("/processed_agent_data/", json=[document(sequence) for sequence in range(5)])
+    client.post("/processed_agent_data/", json=[document(5, road_state="bumpy")])
+    response = client.get("/processed_agent_data/", params={"format": media_format, "road_state": "good"})
+    assert response.status_code == 200
+    if media_format == "arrow":
+        table = pa.ipc.open_stream(response.content).read_all()
+    else:
+        table = pq.read_table(io.BytesIO(response.content))
+    assert table.schema == EXPORT_SCHEMA
+    assert table["x"].to_pylist() == [0.0, 1.0, 2.0, 3.0, 4.0]
+    assert table["timestamp"].to_pylist()[0] == START
+
+
+def test_empty_export_is_a_valid_file(client):
+    response = client.get("/processed_agent_data/", params={"format": "parquet"})
+    assert pq.read_table(io.BytesIO(response.content)).num_rows == 0
+
+
+def test_import_loads_rows_and_cell_aggregates(client):
+    response = client.post("/processed_agent_data/import", content=parquet(readings(4)))
+    assert response.json() == {"imported": 4}
+    rows = client.get("/processed_agent_data/", params={"road_state": "bumpy"}).json()
+    assert [row["x"] for row in rows] == [0.0, 1.0, 2.0, 3.0]
+    assert {row["user_id"] for row in rows} == {2}
+    params = {"min_latitude": 50.44, "min_longitude": 30.51, "max_latitude": 50.46, "max_longitude": 30.53}
+    cells = client.get("/road_quality/", params=params).json()["cells"]
+    assert sum(cell["road_states"].get("bumpy", 0) for cell in cells) == 4
+
+
+def test_import_round_trips_an_export(client):
+    client.post("/processed_agent_data/import", content=parquet(readings(3)))
+    exported = client.get("/processed_agent_data/", params={"format": "parquet"}).content
+    client.delete("/processed_agent_data/", params={"road_state": "bumpy"})
+    # The exported id column is ignored, the database assigns new ones
+    assert client.post("/processed_agent_data/import", content=exported).json() == {"imported": 3}
+
+
+def test_import_is_all_or_nothing(client):
+    client.post("/processed_agent_data/import", content=parquet(readings(2, start=3)))
+    response = client.post("/processed_agent_data/import", content=parquet(readings(5)))
+    assert response.status_code == 409
+    assert len(client.get("/processed_agent_data/").json()) == 2
+
+
+def test_import_rejects_other_files(client):
+    assert client.post("/processed_agent_data/import", content=b"x,y\n1,2\n").status_code == 400
+    assert client.post("/processed_agent_data/import", content=parquet(readings(1).drop_columns(["x"]))).status_code == 400
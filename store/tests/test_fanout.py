@@ -0,0 +1,123 @@
+import asyncio
+
+import pytest
+
+from broadcaster import DROP_OLDEST, Broadcaster
+from fakes import FakeWebSocket, settle
+from fanout import FanoutBus
+from models import ProcessedAgentData
+from readings import document
+from subscriptions import SubscriptionIndex, SubscriptionRequest
+
+
+def batch(*sequences) -> list:
+    return [ProcessedAgentData.model_validate(document(sequence)) for sequence in sequences]
+
+
+def broadcaster() -> Broadcaster:
+    return Broadcaster(10, DROP_OLDEST, SubscriptionIndex(cell_size=0.01, max_cells=100))
+
+
+def received(client: FakeWebSocket) -> list:
+    return [[record["agent_data"]["accelerometer"]["x"] for record in message] for message in client.messages]
+
+
+@pytest.fixture
+def shared_buses():
+    """Two FanoutBuses sharing one in-memory Redis, as two store processes would, each with a client."""
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fakeredis.FakeServer()
+
+    def connect():
+        buses, clients = [], []
+        for _ in range(2):
+            local, client = broadcaster(), FakeWebSocket()
+            local.subscribe(client)
+            buses.append(FanoutBus(local, fakeredis.FakeAsyncRedis(server=server)))
+            clients.append(client)
+        return server, buses, clients
+
+    return connect
+
+
+async def started(buses):
+    for bus in buses:
+        bus.start()
+    # Let both subscribe before anything is published
+    await asyncio.sleep(0.1)
+
+
+async def stopped(buses):
+    await asyncio.sleep(0.1)
+    for bus in buses:
+        await bus.stop()
+        bus.broadcaster.close()
+
+
+def test_without_redis_batches_go_to_the_local_clients():
+    async def run():
+        bus, client = FanoutBus(broadcaster()), FakeWebSocket()
+        bus.broadcaster.subscribe(client)
+        bus.start()
+        await bus.publish(batch(0, 1))
+        await bus.publish([])
+        await settle()
+        await bus.stop()
+        bus.broadcaster.close()
+        return client, bus.stats()
+
+    client, stats = asyncio.run(run())
+    assert received(client) == [[0, 1]]
+    assert stats == {"shared": False, "published": 0, "relayed": 0}
+
+
+def test_batches_reach_the_clients_of_every_process(shared_buses):
+    async def run():
+        _, buses, clients = shared_buses()
+        await started(buses)
+        await buses[0].publish(batch(0, 1))
+        await buses[1].publish(batch(2))
+        await stopped(buses)
+        return buses, clients
+
+    buses, clients = asyncio.run(run())
+    for client in clients:
+        assert sorted(received(client)) == [[0, 1], [2]]
+    assert [bus.stats()["published"] for bus in buses] == [1, 1]
+    assert [bus.stats()["relayed"] for bus in buses] == [2, 2]
+
+
+def test_empty_and_malformed_batches_do_not_end_the_relay(shared_buses):
+    async def run():
+        _, buses, clients = shared_buses()
+        # Relayed records are only parsed for clients that filter
+        for bus, client in zip(buses, clients):
+            bus.broadcaster.update_subscription(client, SubscriptionRequest(bbox=(50.4, 30.5, 50.5, 30.6)))
+        await started(buses)
+        await buses[0].publish([])
+        await buses[0].redis.publish(buses[0].channel, "")
+        await buses[0].redis.publish(buses[0].channel, "{not json")
+        await buses[0].publish(batch(3))
+        await stopped(buses)
+        return buses, clients
+
+    buses, clients = asyncio.run(run())
+    for client in clients:
+        assert received(client) == [[3]]
+    # The empty batch was never published
+    assert buses[0].stats()["published"] == 1
+
+
+def test_local_clients_are_served_while_redis_is_down(shared_buses):
+    async def run():
+        server, buses, clients = shared_buses()
+        await started(buses)
+        server.connected = False
+        await buses[0].publish(batch(4))
+        await settle()
+        await stopped(buses)
+        return clients
+
+    first, second = asyncio.run(run())
+    assert received(first) == [[4]]
+    assert received(second) == []
@@ -0,0 +1,72 @@
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from listing import ProcessedAgentDataFilter, decode_cursor, encode_cursor, keyset_query
+from readings import START, document
+
+
+def test_cursor_round_trip():
+    timestamp = datetime(2024, 5, 1, 12, 0, 0, 123456)
+    assert decode_cursor(encode_cursor(timestamp, 42)) == (timestamp, 42)
+    assert "=" not in encode_cursor(timestamp, 42)
+
+
+@pytest.mark.parametrize("cursor", ["", "not a cursor", "WzFd", "WyJub3QgYSB0aW1lIiwgMV0"])
+def test_malformed_cursor(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+
+def test_filter_without_fields_has_no_conditions():
+    assert ProcessedAgentDataFilter(road_state=None).conditions() == []
+
+
+def test_filter_compares_timestamps_as_naive_utc():
+    start = datetime(2024, 5, 1, 14, 0, tzinfo=timezone(timedelta(hours=2)))
+    condition, = ProcessedAgentDataFilter(start=start, road_state=None).conditions()
+    assert condition.right.value == datetime(2024, 5, 1, 12, 0)
+
+
+def test_keyset_query_starts_after_the_cursor():
+    query = str(keyset_query(ProcessedAgentDataFilter(road_state=None), encode_cursor(START, 7)))
+    assert "(processed_agent_data.timestamp, processed_agent_data.id) >" in query
+    assert "ORDER BY processed_agent_data.timestamp, processed_agent_data.id" in query
+
+
+def test_pages_cover_every_row_once(client):
+    client.post("/processed_agent_data/", json=[document(sequence) for sequence in range(7)])
+    seen, cursor = [], None
+    while True:
+        response = client.get("/processed_agent_data/", params={"limit": 3, **({"cursor": cursor} if cursor else {})})
+        seen += [row["x"] for row in response.json()]
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+    assert seen == list(range(7))
+
+
+def test_listing_filters(client):
+    client.post("/processed_agent_data/", json=[
+        document(0), document(1, road_state="bad"), document(2, road_state="bad"), document(3),
+    ])
+    bad = client.get("/processed_agent_data/", params={"road_state": "bad"}).json()
+    assert [row["x"] for row in bad] == [1, 2]
+    ranged = client.get("/processed_agent_data/", params={
+        "start": (START + timedelta(seconds=1)).isoformat(), "end": (START + timedelta(seconds=3)).isoformat(),
+    }).json()
+    assert [row["x"] for row in ranged] == [1, 2]
+
+
+def test_invalid_cursor_is_a_bad_request(client):
+    assert client.get("/processed_agent_data/", params={"cursor": "not a cursor"}).status_code == 400
+
+
+def test_streamed_formats(client):
+    client.post("/processed_agent_data/", json=[document(sequence) for sequence in range(3)])
+    lines = client.get("/processed_agent_data/", params={"format": "ndjson"}).text.splitlines()
+    assert [json.loads(line)["x"] for line in lines] == [0, 1, 2]
+    csv_lines = client.get("/processed_agent_data/", params={"format": "csv"}).text.splitlines()
+    assert csv_lines[0] == "id,user_id,road_state,x,y,z,latitude,longitude,timestamp"
+    assert len(csv_lines) == 4
@@ -0,0 +1,16 @@
+import os
+
+import pytest
+
+import log_sampling
+
+# The module log_sampling.py copies, tested with the hub
+HUB_MODULE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "hub", "app", "log_sampling.py")
+
+
+def test_module_is_a_copy_of_the_hubs():
+    if not os.path.exists(HUB_MODULE):
+        pytest.skip("The hub's sources are not next to the store's")
+    with open(HUB_MODULE) as hub, open(log_sampling.__file__) as store:
+        # Everything but the comment naming the original
+        assert store.read().split("\n", 1)[1] == hub.read()
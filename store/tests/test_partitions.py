@@ -0,0 +1,53 @@
+import asyncio
+from datetime import datetime
+
+from sqlalchemy import select, text
+
+from database import road_cell_aggregates
+from partitions import PartitionManager, partition_day, partition_name
+
+TABLE = "partitioned_readings"
+
+
+def test_partition_names_round_trip():
+    name = partition_name(TABLE, datetime(2024, 5, 1))
+    assert name == "partitioned_readings_p20240501"
+    assert partition_day(TABLE, name) == datetime(2024, 5, 1)
+    assert partition_day(TABLE, "partitioned_readings_default") is None
+    assert partition_day(TABLE, "other_p20240501") is None
+
+
+def test_partitions_are_created_ahead_and_dropped_after_retention(database):
+    async def run():
+        async with database.begin() as conn:
+            await conn.execute(text(
+                f"CREATE TABLE {TABLE} (timestamp timestamp NOT NULL, road_state varchar, z float, "
+                f"cell_lat integer, cell_lon integer) PARTITION BY RANGE (timestamp)"
+            ))
+            await conn.execute(text(f"CREATE TABLE {TABLE}_default PARTITION OF {TABLE} DEFAULT"))
+        partitions = PartitionManager(database, TABLE, premake_days=2, retention_days=3,
+                                      aggregates_table_name=road_cell_aggregates.name)
+        created = await partitions.ensure_partitions(datetime(2024, 5, 1, 9))
+        again = await partitions.ensure_partitions(datetime(2024, 5, 1, 10))
+        async with database.begin() as conn:
+            await conn.execute(text(
+                f"INSERT INTO {TABLE} VALUES ('2024-05-01 10:00', 'good', 16400, 1, 2), "
+                f"('2024-05-02 10:00', 'good', 16384, 1, 2)"
+            ))
+            await conn.execute(road_cell_aggregates.insert().values(
+                cell_lat=1, cell_lon=2, road_state="good", count=2, z_deviation_sum=16.0
+            ))
+        dropped = await partitions.drop_expired(datetime(2024, 5, 6))
+        async with database.connect() as conn:
+            remaining = await partitions.partitions(conn)
+            aggregate = (await conn.execute(select(road_cell_aggregates.c.count,
+                                                   road_cell_aggregates.c.z_deviation_sum))).one()
+        return created, again, dropped, remaining, aggregate
+
+    created, again, dropped, remaining, aggregate = asyncio.run(run())
+    assert created == [f"{TABLE}_p20240501", f"{TABLE}_p20240502", f"{TABLE}_p20240503"]
+    assert again == []
+    # May 2 ends exactly at the cutoff, later days are kept
+    assert dropped == [f"{TABLE}_p20240501", f"{TABLE}_p20240502"]
+    assert remaining == [f"{TABLE}_default", f"{TABLE}_p20240503"]
+    assert tuple(aggregate) == (0, 0.0)
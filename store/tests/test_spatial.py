@@ -0,0 +1,73 @@
+from collections import namedtuple
+
+import pytest
+
+from config import AGGREGATE_Z_BASELINE, GRID_CELL_SIZE
+from database import road_cell_aggregates
+from readings import document
+from spatial import CellAggregates, cell_of, coarsening_factor, collect_cells, tile_bounds
+
+# Around the readings of tests/readings.py, small enough to be answered per cell
+AREA = {"min_latitude": 50.44, "min_longitude": 30.51, "max_latitude": 50.46, "max_longitude": 30.53}
+
+
+def test_cell_of_floors_both_axes():
+    assert cell_of(GRID_CELL_SIZE * 2.5, -GRID_CELL_SIZE * 0.5) == (2, -1)
+
+
+def test_tile_bounds():
+    assert tile_bounds(0, 0, 0) == pytest.approx((-85.0511, -180.0, 85.0511, 180.0), abs=1e-4)
+    min_latitude, min_longitude, max_latitude, max_longitude = tile_bounds(1, 1, 0)
+    assert (min_latitude, min_longitude, max_longitude) == pytest.approx((0.0, 0.0, 180.0))
+    with pytest.raises(ValueError):
+        tile_bounds(1, 2, 0)
+
+
+def test_summarize_folds_rows_into_sorted_deltas():
+    rows = [
+        {"cell_lat": 2, "cell_lon": 1, "road_state": "good", "z": AGGREGATE_Z_BASELINE + 10},
+        {"cell_lat": 1, "cell_lon": 1, "road_state": "bad", "z": AGGREGATE_Z_BASELINE - 30},
+        {"cell_lat": 2, "cell_lon": 1, "road_state": "good", "z": AGGREGATE_Z_BASELINE},
+        {"cell_lat": None, "cell_lon": None, "road_state": "good", "z": 0.0},
+    ]
+    assert CellAggregates(road_cell_aggregates).summarize(rows, sign=-1) == [
+        {"cell_lat": 1, "cell_lon": 1, "road_state": "bad", "count": -1, "z_deviation_sum": -30.0},
+        {"cell_lat": 2, "cell_lon": 1, "road_state": "good", "count": -2, "z_deviation_sum": -10.0},
+    ]
+
+
+def test_collect_cells_merges_road_states_per_block():
+    Row = namedtuple("Row", "block_lat block_lon road_state count z_deviation_sum")
+    cells = collect_cells([Row(1, 2, "good", 3, 30.0), Row(1, 2, "bad", 1, 50.0), Row(1, 3, "good", 0, 0.0)], 0.5)
+    assert cells[0] == {
+        "cell_lat": 1, "cell_lon": 2, "min_latitude": 0.5, "min_longitude": 1.0, "max_latitude": 1.0,
+        "max_longitude": 1.5, "total": 4, "road_states": {"good": 3, "bad": 1}, "mean_z_deviation": 20.0,
+    }
+    assert cells[1]["mean_z_deviation"] == 0.0
+
+
+def test_coarsening_factor_keeps_blocks_under_the_limit():
+    assert coarsening_factor(0.0, 0.0, GRID_CELL_SIZE * 9.5, GRID_CELL_SIZE * 9.5, max_cells=100) == 1
+    assert coarsening_factor(0.0, 0.0, GRID_CELL_SIZE * 99.5, GRID_CELL_SIZE * 99.5, max_cells=100) == 10
+
+
+def cell_totals(client, **params) -> dict:
+    cells = client.get("/road_quality/", params={**AREA, **params}).json()["cells"]
+    return {(cell["cell_lat"], cell["cell_lon"]): cell["road_states"] for cell in cells}
+
+
+def test_road_quality_follows_writes(client):
+    assert cell_totals(client) == {}
+    client.post("/processed_agent_data/", json=[document(0), document(1, road_state="bad"), document(30)])
+    assert cell_totals(client) == {cell_of(50.45, 30.52): {"good": 1, "bad": 1}, cell_of(50.45, 30.523): {"good": 1}}
+    record_id = client.get("/processed_agent_data/").json()[0]["id"]
+    client.put(f"/processed_agent_data/{record_id}", json=document(0, road_state="bad"))
+    assert cell_totals(client)[cell_of(50.45, 30.52)] == {"bad": 2}
+    client.delete(f"/processed_agent_data/{record_id}")
+    assert cell_totals(client)[cell_of(50.45, 30.52)] == {"bad": 1}
+
+
+def test_road_quality_requests(client):
+    assert client.get("/road_quality/", params={**AREA, "min_latitude": 51.0}).status_code == 400
+    assert client.get("/road_quality/tiles/2/3/1").status_code == 200
+    assert client.get("/road_quality/tiles/2/4/1").status_code == 404
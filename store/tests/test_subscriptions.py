@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+from pydantic import ValidationError
+
+from broadcaster import DROP_OLDEST, Broadcaster
+from fakes import FakeWebSocket, settle
+from models import ProcessedAgentData
+from readings import document
+from subscriptions import SubscriptionIndex, SubscriptionRequest
+
+# Around the readings of tests/readings.py, at latitude 50.45 and longitude 30.52 and up
+AREA = (50.4, 30.5, 50.5, 30.6)
+
+
+def test_request_matches_bbox_and_road_state():
+    request = SubscriptionRequest(bbox=AREA, road_state={"bad"})
+    assert request.matches("bad", 50.45, 30.55)
+    assert not request.matches("good", 50.45, 30.55)
+    assert not request.matches("bad", 51.0, 30.55)
+    assert SubscriptionRequest().matches("good", -10.0, 100.0)
+
+
+@pytest.mark.parametrize("fields", [{"bbox": (50.5, 30.5, 50.4, 30.6)}, {"max_rate": 0}])
+def test_invalid_request(fields):
+    with pytest.raises(ValidationError):
+        SubscriptionRequest(**fields)
+
+
+def test_index_finds_subscribers_by_cell():
+    index = SubscriptionIndex(cell_size=0.1, max_cells=100)
+    index.add("near", SubscriptionRequest(bbox=AREA))
+    index.add("everywhere", SubscriptionRequest())
+    assert index.candidates(50.45, 30.55) == {"near", "everywhere"}
+    assert index.candidates(10.0, 10.0) == {"everywhere"}
+    index.remove("near")
+    assert index.candidates(50.45, 30.55) == {"everywhere"}
+    assert index.cells == {}
+
+
+def test_index_keeps_wide_boxes_aside():
+    index = SubscriptionIndex(cell_size=0.01, max_cells=4)
+    index.add("wide", SubscriptionRequest(bbox=AREA))
+    assert index.unbounded == {"wide"} and index.cells == {}
+    # Re-subscribing with a narrow box moves it into the grid
+    index.add("wide", SubscriptionRequest(bbox=(50.45, 30.52, 50.451, 30.521)))
+    assert index.unbounded == set() and index.candidates(50.45, 30.52) == {"wide"}
+
+
+def test_filtered_subscribers_only_get_matching_records():
+    async def run():
+        fan_out = Broadcaster(10, DROP_OLDEST, SubscriptionIndex(cell_size=0.01, max_cells=100))
+        everything, bad_only, elsewhere = FakeWebSocket(), FakeWebSocket(), FakeWebSocket()
+        for websocket in (everything, bad_only, elsewhere):
+            fan_out.subscribe(websocket)
+        fan_out.update_subscription(bad_only, SubscriptionRequest(bbox=AREA, road_state={"bad"}))
+        fan_out.update_subscription(elsewhere, SubscriptionRequest(bbox=(10.0, 10.0, 11.0, 11.0)))
+        fan_out.publish([ProcessedAgentData.model_validate(document(0)),
+                         ProcessedAgentData.model_validate(document(1, road_state="bad"))])
+        await settle()
+        fan_out.close()
+        return everything, bad_only, elsewhere
+
+    everything, bad_only, elsewhere = asyncio.run(run())
+    assert [len(message) for message in everything.messages] == [2]
+    assert [[record["road_state"] for record in message] for message in bad_only.messages] == [["bad"]]
+    assert elsewhere.messages == []
+
+
+def test_relayed_fragments_are_routed_by_their_content():
+    async def run():
+        fan_out = Broadcaster(10, DROP_OLDEST, SubscriptionIndex(cell_size=0.01, max_cells=100))
+        bad_only = FakeWebSocket()
+        fan_out.subscribe(bad_only)
+        fan_out.update_subscription(bad_only, SubscriptionRequest(road_state={"bad"}))
+        fan_out.publish_serialized([ProcessedAgentData.model_validate(document(0, road_state=state)).model_dump_json()
+                                    for state in ("good", "bad")])
+        await settle()
+        fan_out.close()
+        return bad_only
+
+    assert [[record["road_state"] for record in message] for message in asyncio.run(run()).messages] == [["bad"]]
+
+
+def test_rate_limited_subscriber_gets_coalesced_batches():
+    async def run():
+        fan_out = Broadcaster(10, DROP_OLDEST, SubscriptionIndex(cell_size=0.01, max_cells=100))
+        client = FakeWebSocket()
+        fan_out.subscribe(client)
+        fan_out.update_subscription(client, SubscriptionRequest(max_rate=5))
+        for sequence in range(4):
+            fan_out.publish([ProcessedAgentData.model_validate(document(sequence))])
+            await settle()
+        await asyncio.sleep(0.3)
+        fan_out.close()
+        return client
+
+    messages = asyncio.run(run()).messages
+    # The first batch goes out at once, the rest waited for the next slot together
+    assert [len(message) for message in messages] == [1, 3]